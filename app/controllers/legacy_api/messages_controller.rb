@@ -3,6 +3,8 @@
 module LegacyAPI
   class MessagesController < BaseController
 
+    MAX_PER_PAGE = 100
+
     # Returns details about a given message
     #
     #   URL:            /api/v1/messages/message
@@ -101,6 +103,55 @@ module LegacyAPI
                    id: api_params["id"]
     end
 
+    # Returns a page of messages, newest first. Further pages are requested by providing
+    # the cursor returned with the previous page.
+    #
+    #   URL:            /api/v1/messages/list
+    #
+    #   Parameters:     direction       => incoming or outgoing (default: outgoing)
+    #                   to              => Only return messages sent to this address
+    #                   from            => Only return messages sent from this address
+    #                   status          => Only return messages with this status
+    #                   tag             => Only return messages with this tag
+    #                   cursor          => The next_cursor returned with a previous page
+    #                   per_page        => The number of messages to return (maximum 100)
+    #
+    #                   A % at the end of `to`, `from` or `tag` matches any values which
+    #                   start with the value provided.
+    #
+    #   Response:       A hash containing an array of messages, the total number of
+    #                   messages (which may be capped), and the cursors for the next and
+    #                   previous pages (if there are any).
+    #
+    def list
+      direction = api_params["direction"].presence || "outgoing"
+      unless %w[incoming outgoing].include?(direction)
+        render_parameter_error "`direction` parameter must be incoming or outgoing"
+        return
+      end
+
+      where = { scope: direction, spam: false }
+      where[:rcpt_to] = { search: api_params["to"] } if api_params["to"].present?
+      where[:mail_from] = { search: api_params["from"] } if api_params["from"].present?
+      where[:status] = api_params["status"] if api_params["status"].present?
+      where[:tag] = { search: api_params["tag"] } if api_params["tag"].present?
+
+      per_page = api_params["per_page"].to_i
+      per_page = 30 unless per_page.positive?
+      per_page = [per_page, MAX_PER_PAGE].min
+
+      result = @current_credential.server.message_db.messages_with_pagination(nil, where: where,
+                                                                                   order: :timestamp,
+                                                                                   direction: "desc",
+                                                                                   per_page: per_page,
+                                                                                   cursor: api_params["cursor"])
+      render_success messages: result[:records].map { |m| list_item(m) },
+                      total: result[:total],
+                      total_capped: result[:total_capped],
+                      next_cursor: result[:next_cursor],
+                      previous_cursor: result[:previous_cursor]
+    end
+
     # Returns all the deliveries for a given message
     #
     #   URL:            /api/v1/messages/deliveries
@@ -136,5 +187,21 @@ module LegacyAPI
                    id: api_params["id"]
     end
 
+    private
+
+    def list_item(message)
+      {
+        id: message.id,
+        token: message.token,
+        status: message.status,
+        rcpt_to: message.rcpt_to,
+        mail_from: message.mail_from,
+        subject: message.subject,
+        message_id: message.message_id,
+        timestamp: message.timestamp.to_f,
+        tag: message.tag
+      }
+    end
+
   end
 end
@@ -12,7 +12,12 @@ module LegacyAPI
       "FromAddressMissing" => "The From address is missing and is required",
       "UnauthenticatedFromAddress" => "The From address is not authorised to send mail from this server",
       "AttachmentMissingName" => "An attachment is missing a name",
-      "AttachmentMissingData" => "An attachment is missing data"
+      "AttachmentMissingData" => "An attachment is missing data",
+      "AttachmentNotFound" => "An attachment refers to a shared attachment which has not been provided",
+      "InvalidAttachment" => "A shared attachment must have an ID, a name and data",
+      "InvalidJSON" => "The line could not be parsed as a JSON object",
+      "TooManyMessages" => "The maximum number of messages in a single request has been reached",
+      "InternalError" => "An internal error occurred while creating the message"
     }.freeze
 
     # Send a message with the given options
@@ -37,29 +42,7 @@ module LegacyAPI
     #                   OR an error if there is an issue sending the message
     #
     def message
-      attributes = {}
-      attributes[:to] = api_params["to"]
-      attributes[:cc] = api_params["cc"]
-      attributes[:bcc] = api_params["bcc"]
-      attributes[:from] = api_params["from"]
-      attributes[:sender] = api_params["sender"]
-      attributes[:subject] = api_params["subject"]
-      attributes[:reply_to] = api_params["reply_to"]
-      attributes[:plain_body] = api_params["plain_body"]
-      attributes[:html_body] = api_params["html_body"]
-      attributes[:bounce] = api_params["bounce"] ? true : false
-      attributes[:tag] = api_params["tag"]
-      attributes[:custom_headers] = api_params["headers"] if api_params["headers"]
-      attributes[:attachments] = []
-
-      (api_params["attachments"] || []).each do |attachment|
-        next unless attachment.is_a?(Hash)
-
-        attributes[:attachments] << { name: attachment["name"], content_type: attachment["content_type"], data: attachment["data"], base64: true }
-      end
-
-      message = OutgoingMessagePrototype.new(@current_credential.server, request.ip, "api", attributes)
-      message.credential = @current_credential
+      message = build_prototype(api_params)
       if message.valid?
         result = message.create_messages
         render_success message_id: message.message_id, messages: result
@@ -68,6 +51,63 @@ module LegacyAPI
       end
     end
 
+    # Send many messages in a single request. The body of the request should contain one
+    # JSON object per line (NDJSON) and is processed as it is read. Each line is either a
+    # message, which accepts the same parameters as /api/v1/send/message, or an attachment
+    # which can then be used by any of the messages which follow it. Shared attachments are
+    # only sent and decoded once, whichever messages use them.
+    #
+    #   {"attachment": {"id": "logo", "name": "logo.png", "content_type": "image/png", "data": "..."}}
+    #   {"to": ["a@example.com"], "from": "...", "attachments": [{"attachment_id": "logo"}]}
+    #
+    #   URL:            /api/v1/send/bulk
+    #
+    #   Response:       An array of results, one for each line, containing the line
+    #                   number and either the message information or an error
+    #
+    def bulk
+      results = []
+      attachments = {}
+      messages = 0
+      batch = OutgoingMessageBatch.new(@current_credential.server)
+
+      request.body.each_line.with_index(1) do |line, line_number|
+        next if line.blank?
+
+        result = { line: line_number }
+        results << result
+
+        item = parse_bulk_line(line)
+        if item.nil?
+          result.merge!(bulk_error("InvalidJSON"))
+        elsif item.key?("attachment")
+          result.merge!(add_shared_attachment(attachments, item["attachment"]))
+        elsif messages >= Postal::Config.postal.bulk_send_max_messages
+          result.merge!(bulk_error("TooManyMessages"))
+        elsif missing_id = missing_shared_attachment_id(item, attachments)
+          result.merge!(bulk_error("AttachmentNotFound", attachment_id: missing_id))
+        else
+          messages += 1
+          prototype = build_prototype(item, attachments)
+          unless prototype.valid?
+            result.merge!(bulk_error(prototype.errors.first))
+            next
+          end
+
+          batch.add(prototype) do |created, exception|
+            if exception
+              result.merge!(bulk_error("InternalError"))
+            else
+              result.merge!(status: "success", message_id: prototype.message_id, messages: created)
+            end
+          end
+        end
+      end
+      batch.flush
+
+      render_success results: results
+    end
+
     # Send a message by providing a raw message
     #
     #   URL:            /api/v1/send/raw
@@ -131,5 +171,97 @@ module LegacyAPI
       render_success result
     end
 
+    private
+
+    # Build a message prototype from the parameters for a single message. Attachments which
+    # refer to a shared attachment (see #bulk) use the shared attachment's data.
+    #
+    # @param [Hash] params
+    # @param [Hash{String => Hash}] shared_attachments
+    # @return [OutgoingMessagePrototype]
+    def build_prototype(params, shared_attachments = {})
+      attributes = {}
+      attributes[:to] = params["to"]
+      attributes[:cc] = params["cc"]
+      attributes[:bcc] = params["bcc"]
+      attributes[:from] = params["from"]
+      attributes[:sender] = params["sender"]
+      attributes[:subject] = params["subject"]
+      attributes[:reply_to] = params["reply_to"]
+      attributes[:plain_body] = params["plain_body"]
+      attributes[:html_body] = params["html_body"]
+      attributes[:bounce] = params["bounce"] ? true : false
+      attributes[:tag] = params["tag"]
+      attributes[:custom_headers] = params["headers"] if params["headers"]
+      attributes[:attachments] = []
+
+      (params["attachments"] || []).each do |attachment|
+        next unless attachment.is_a?(Hash)
+
+        if attachment["attachment_id"]
+          attributes[:attachments] << shared_attachments.fetch(attachment["attachment_id"].to_s)
+          next
+        end
+
+        attributes[:attachments] << { name: attachment["name"], content_type: attachment["content_type"], data: attachment["data"], base64: true }
+      end
+
+      message = OutgoingMessagePrototype.new(@current_credential.server, request.ip, "api", attributes)
+      message.credential = @current_credential
+      message
+    end
+
+    # Parse a line from the body of a bulk request
+    #
+    # @param [String] line
+    # @return [Hash, nil] nil if the line isn't a JSON object
+    def parse_bulk_line(line)
+      item = JSON.parse(line)
+      item.is_a?(Hash) ? item : nil
+    rescue JSON::ParserError
+      nil
+    end
+
+    # Decode a shared attachment from a bulk request and remember it so that it can be used
+    # by the messages which follow it
+    #
+    # @param [Hash{String => Hash}] attachments
+    # @param [Hash] attachment
+    # @return [Hash] the result for the line
+    def add_shared_attachment(attachments, attachment)
+      unless attachment.is_a?(Hash) && attachment["id"].present? && attachment["name"].present? && attachment["data"].present?
+        return bulk_error("InvalidAttachment")
+      end
+
+      attachments[attachment["id"].to_s] = {
+        name: attachment["name"],
+        content_type: attachment["content_type"],
+        data: Base64.decode64(attachment["data"])
+      }
+      { status: "success", attachment_id: attachment["id"].to_s }
+    end
+
+    # Return the ID of the first shared attachment used by a message which hasn't been provided
+    #
+    # @param [Hash] item
+    # @param [Hash{String => Hash}] attachments
+    # @return [String, nil]
+    def missing_shared_attachment_id(item, attachments)
+      Array(item["attachments"]).each do |attachment|
+        next unless attachment.is_a?(Hash) && attachment["attachment_id"]
+        return attachment["attachment_id"].to_s unless attachments.key?(attachment["attachment_id"].to_s)
+      end
+      nil
+    end
+
+    # Return the result for a line in a bulk request which couldn't be processed
+    #
+    # @param [String] code
+    # @param [Hash] data
+    # @return [Hash]
+    def bulk_error(code, data = {})
+      { status: "error", code: code, message: ERROR_MESSAGES[code] }.merge(data)
+    end
+
   end
 end
@@ -155,7 +155,7 @@ class MessagesController < ApplicationController
 
   def get_messages(scope)
     if scope == "held"
-      options = { where: { held: true } }
+      options = { where: { held: true }, order: :id }
     else
       options = { where: { scope: scope, spam: false }, order: :timestamp, direction: "desc" }
 
@@ -170,8 +170,8 @@ class MessagesController < ApplicationController
             options[:direction] = "asc"
           end
 
-          options[:where][:rcpt_to] = qs[:to] if qs[:to]
-          options[:where][:mail_from] = qs[:from] if qs[:from]
+          options[:where][:rcpt_to] = { search: qs[:to] } if qs[:to]
+          options[:where][:mail_from] = { search: qs[:from] } if qs[:from]
           options[:where][:status] = qs[:status] if qs[:status]
           options[:where][:token] = qs[:token] if qs[:token]
 
@@ -181,18 +181,9 @@ class MessagesController < ApplicationController
             options[:where].delete(:scope)
           end
           if qs[:subject]
-            options[:where][:subject] = {}
-            options[:where][:subject][:like] = qs[:subject]
+            options[:where][:subject] = qs[:subject].to_s.include?("%") ? { search: qs[:subject] } : { contains_words: qs[:subject] }
           end
-          if qs[:to]
-            options[:where][:rcpt_to] = {}
-            options[:where][:rcpt_to][:like] = qs[:to]
-          end
-          if qs[:from]
-            options[:where][:mail_from] = {}
-            options[:where][:mail_from][:like] = qs[:from]
-          end
-          options[:where][:tag] = qs[:tag] if qs[:tag]
+          options[:where][:tag] = { search: qs[:tag] } if qs[:tag]
           options[:where][:id] = qs[:id] if qs[:id]
           options[:where][:spam] = true if qs[:spam] == "yes" || qs[:spam] == "y"
           if qs[:before] || qs[:after]
@@ -219,7 +210,7 @@ class MessagesController < ApplicationController
       end
     end
 
-    @messages = @server.message_db.messages_with_pagination(params[:page], options)
+    @messages = @server.message_db.messages_with_pagination(nil, options.merge(cursor: params[:cursor]))
   end
 
   class TimeUndetermined < Postal::Error; end
@@ -0,0 +1,312 @@
+# frozen_string_literal: true
+
+# Decides which queued messages a worker should claim so that deliveries are shared fairly
+# between destination domains. Each process has a single scheduler which is shared by all of
+# its worker threads.
+#
+# Claimable messages are offered to the scheduler in priority order. Messages for destinations
+# which can't take any more are left out before they are offered. Within each server
+# priority, messages are taken from each destination in turn (oldest first) so a large
+# backlog for one domain can't use every claim. No more than a destination's current
+# concurrency limit will be in flight at once, and no more than the configured maximum will
+# be sent from one source IP address.
+#
+# A destination's limit starts at the configured maximum. Each deferral (a soft fail or a
+# connection error) halves it and backs the destination off for an increasing period, during
+# which none of its messages will be claimed. Each successful delivery raises it again a
+# little at a time. Once a destination has nothing in flight, isn't backing off and is back
+# at the maximum, it is forgotten so that only destinations being delivered to are kept.
+#
+# Series can't be removed from the Prometheus client so, to keep the number of them bounded,
+# only the first METRIC_DESTINATIONS destinations seen are given their own label. The rest
+# are reported together under OTHER_DESTINATIONS_LABEL.
+class DeliveryScheduler
+
+  extend HasPrometheusMetrics
+  include HasPrometheusMetrics
+
+  METRIC_DESTINATIONS = 100
+  OTHER_DESTINATIONS_LABEL = "(other)"
+
+  Candidate = Struct.new(:id, :domain, :ip_address_id, :priority)
+
+  # The state of a destination domain (or source IP address)
+  class Target
+
+    attr_accessor :in_flight
+    attr_accessor :limit
+    attr_accessor :deferrals
+    attr_accessor :backoff_until
+    attr_accessor :latency
+
+    def initialize(limit)
+      @in_flight = 0
+      @limit = limit.to_f
+      @deferrals = 0
+      @backoff_until = nil
+      @latency = nil
+    end
+
+    # Record the time taken by a delivery as an exponentially weighted moving average
+    #
+    # @param [Float] duration
+    # @return [void]
+    def observe(duration)
+      @latency = @latency ? (@latency * 0.8) + (duration * 0.2) : duration
+    end
+
+  end
+
+  attr_reader :max_concurrency_per_destination
+  attr_reader :max_concurrency_per_ip_address
+  attr_reader :backoff
+  attr_reader :max_backoff
+
+  # @param [Integer] max_concurrency_per_destination The maximum number of deliveries to one domain at once
+  # @param [Integer] max_concurrency_per_ip_address The maximum number of deliveries from one IP address at once
+  # @param [Integer] backoff The number of seconds to back off a destination for after its first deferral
+  # @param [Integer] max_backoff The maximum number of seconds to back off a destination for
+  def initialize(max_concurrency_per_destination:, max_concurrency_per_ip_address:, backoff:, max_backoff:)
+    @max_concurrency_per_destination = max_concurrency_per_destination
+    @max_concurrency_per_ip_address = max_concurrency_per_ip_address
+    @backoff = backoff
+    @max_backoff = max_backoff
+    @destinations = {}
+    @ip_addresses = {}
+    @queue_depths = {}
+    @metric_destinations = Set.new
+    @mutex = Mutex.new
+  end
+
+  # Choose up to limit of the given candidates to claim and mark them as in flight. Candidates
+  # must be in the order they would be claimed without the scheduler.
+  #
+  # @param [Array<DeliveryScheduler::Candidate>] candidates
+  # @param [Integer] limit
+  # @return [Array<DeliveryScheduler::Candidate>]
+  def reserve(candidates, limit)
+    @mutex.synchronize do
+      update_queue_depths(candidates)
+
+      chosen = []
+      candidates.group_by(&:priority).sort_by { |priority, _| -priority.to_i }.each do |_, group|
+        queues = group.group_by { |candidate| destination_key(candidate.domain) }.values
+        until chosen.size >= limit || queues.empty?
+          queues.each do |queue|
+            break if chosen.size >= limit
+
+            index = queue.index { |candidate| available?(candidate) }
+            if index.nil?
+              queue.clear
+              next
+            end
+
+            candidate = queue.delete_at(index)
+            acquire(candidate)
+            chosen << candidate
+          end
+          queues.reject!(&:empty?)
+        end
+      end
+      chosen
+    end
+  end
+
+  # Return the destination domains which can't have any more messages claimed at the moment
+  # because they are backing off or already have as many messages in flight as they are
+  # allowed. Their messages can be left out when looking for candidates so that a large
+  # backlog for one of them can't fill every candidate window.
+  #
+  # @return [Array<String>]
+  def unavailable_destinations
+    @mutex.synchronize do
+      @destinations.reject { |_, destination| destination_available?(destination) }.keys
+    end
+  end
+
+  # Mark a delivery to the given destination as no longer in flight. The destination and IP
+  # address are forgotten if they have returned to their initial state.
+  #
+  # @param [String] domain
+  # @param [Integer, nil] ip_address_id
+  # @return [void]
+  def release(domain, ip_address_id)
+    @mutex.synchronize do
+      key = destination_key(domain)
+      destination = destination(domain)
+      destination.in_flight -= 1 if destination.in_flight.positive?
+      @destinations.delete(key) if idle?(destination, @max_concurrency_per_destination)
+      update_in_flight_gauge(key)
+
+      if ip_address_id
+        ip_address = ip_address(ip_address_id)
+        ip_address.in_flight -= 1 if ip_address.in_flight.positive?
+        @ip_addresses.delete(ip_address_id) if idle?(ip_address, @max_concurrency_per_ip_address)
+      end
+    end
+  end
+
+  # Return the number of destinations and IP addresses the scheduler currently holds state for
+  #
+  # @return [Integer]
+  def size
+    @mutex.synchronize { @destinations.size + @ip_addresses.size }
+  end
+
+  # Record the outcome of a delivery attempt and adjust the destination's limit
+  #
+  # @param [String] domain
+  # @param [Integer, nil] ip_address_id
+  # @param [Symbol] outcome :success, :deferral or :failure
+  # @param [Float] duration The number of seconds the attempt took
+  # @return [void]
+  def record(domain, ip_address_id, outcome, duration)
+    @mutex.synchronize do
+      destination = destination(domain)
+      destination.observe(duration)
+      ip_address(ip_address_id).observe(duration) if ip_address_id
+
+      case outcome
+      when :success
+        destination.deferrals = 0
+        destination.backoff_until = nil
+        destination.limit = [destination.limit + (1 / destination.limit), @max_concurrency_per_destination].min
+      when :deferral
+        destination.deferrals += 1
+        destination.limit = [destination.limit / 2, 1].max
+        destination.backoff_until = now + [@backoff * (2**(destination.deferrals - 1)), @max_backoff].min
+      end
+
+      label = metric_label(destination_key(domain))
+      unless label == OTHER_DESTINATIONS_LABEL
+        set_prometheus_gauge :postal_delivery_scheduler_concurrency_limit, destination.limit.floor, labels: { destination: label }
+      end
+      increment_prometheus_counter :postal_delivery_scheduler_outcomes, labels: { outcome: outcome.to_s }
+    end
+  end
+
+  # Return the current state of the given destination
+  #
+  # @param [String] domain
+  # @return [DeliveryScheduler::Target]
+  def destination(domain)
+    @destinations[destination_key(domain)] ||= Target.new(@max_concurrency_per_destination)
+  end
+
+  private
+
+  def ip_address(id)
+    @ip_addresses[id] ||= Target.new(@max_concurrency_per_ip_address)
+  end
+
+  def destination_key(domain)
+    domain.to_s.downcase
+  end
+
+  def available?(candidate)
+    return false unless destination_available?(destination(candidate.domain))
+    return true if candidate.ip_address_id.nil?
+
+    ip_address(candidate.ip_address_id).in_flight < @max_concurrency_per_ip_address
+  end
+
+  def destination_available?(destination)
+    return false if destination.backoff_until && destination.backoff_until > now
+
+    destination.in_flight < destination.limit.floor
+  end
+
+  # Is the target back in the state it would be created in? Targets which backed off are kept
+  # until they could have backed off for the maximum time again so that repeated deferrals
+  # still increase the backoff.
+  def idle?(target, max_limit)
+    return false if target.in_flight.positive?
+    return false if target.limit < max_limit
+    return true if target.backoff_until.nil?
+
+    target.backoff_until + @max_backoff <= now
+  end
+
+  # Return the label to use for the given destination key in metrics
+  def metric_label(key)
+    return key if @metric_destinations.include?(key)
+    return OTHER_DESTINATIONS_LABEL if @metric_destinations.size >= METRIC_DESTINATIONS
+
+    @metric_destinations << key
+    key
+  end
+
+  def update_in_flight_gauge(key)
+    label = metric_label(key)
+    in_flight = if label == OTHER_DESTINATIONS_LABEL
+                  @destinations.sum { |k, destination| @metric_destinations.include?(k) ? 0 : destination.in_flight }
+                else
+                  @destinations[key]&.in_flight || 0
+                end
+    set_prometheus_gauge :postal_delivery_scheduler_in_flight, in_flight, labels: { destination: label }
+  end
+
+  def acquire(candidate)
+    destination = destination(candidate.domain)
+    destination.in_flight += 1
+    update_in_flight_gauge(destination_key(candidate.domain))
+    ip_address(candidate.ip_address_id).in_flight += 1 if candidate.ip_address_id
+  end
+
+  # Record the number of claimable messages for each destination that were offered to the
+  # scheduler. Destinations which are no longer offered are reset to zero.
+  def update_queue_depths(candidates)
+    depths = candidates.group_by { |candidate| metric_label(destination_key(candidate.domain)) }.transform_values(&:size)
+    (@queue_depths.keys - depths.keys).each do |key|
+      set_prometheus_gauge :postal_delivery_scheduler_queue_depth, 0, labels: { destination: key }
+    end
+    depths.each do |key, depth|
+      set_prometheus_gauge :postal_delivery_scheduler_queue_depth, depth, labels: { destination: key }
+    end
+    @queue_depths = depths
+  end
+
+  def now
+    Process.clock_gettime(Process::CLOCK_MONOTONIC)
+  end
+
+  class << self
+
+    # Return the scheduler for this process
+    #
+    # @return [DeliveryScheduler]
+    def instance
+      @instance ||= new(max_concurrency_per_destination: Postal::Config.postal.delivery_max_concurrency_per_destination,
+                        max_concurrency_per_ip_address: Postal::Config.postal.delivery_max_concurrency_per_ip_address,
+                        backoff: Postal::Config.postal.delivery_destination_backoff,
+                        max_backoff: Postal::Config.postal.delivery_destination_max_backoff)
+    end
+
+    # Is fair delivery scheduling enabled?
+    #
+    # @return [Boolean]
+    def enabled?
+      Postal::Config.postal.batch_claim_queued_messages? && Postal::Config.postal.fair_delivery_scheduling?
+    end
+
+    def register_prometheus_metrics
+      register_prometheus_gauge :postal_delivery_scheduler_queue_depth,
+                                docstring: "The number of claimable queued messages for each destination domain seen at the last claim (up to the candidate limit)",
+                                labels: [:destination]
+
+      register_prometheus_gauge :postal_delivery_scheduler_in_flight,
+                                docstring: "The number of messages to each destination domain which have been claimed by this process and not yet processed",
+                                labels: [:destination]
+
+      register_prometheus_gauge :postal_delivery_scheduler_concurrency_limit,
+                                docstring: "The current maximum number of messages to each destination domain which will be in flight at once",
+                                labels: [:destination]
+
+      register_prometheus_counter :postal_delivery_scheduler_outcomes,
+                                  docstring: "The number of delivery attempts recorded by the scheduler by outcome",
+                                  labels: [:outcome]
+    end
+
+  end
+
+end
@@ -2,7 +2,36 @@
 
 class DKIMHeader
 
-  def initialize(domain, message)
+  # Parsed private keys keyed by their owner and a fingerprint of the PEM they were parsed from
+  KEY_CACHE = LRUCache.new(max_size: 1000)
+
+  # Body hashes keyed by a caller-provided key which identifies the body
+  BODY_HASH_CACHE = LRUCache.new(max_size: 1000)
+
+  # The number of bytes of the body to canonicalize at a time
+  BODY_CHUNK_SIZE = 64 * 1024
+
+  class << self
+
+    # Return a parsed private key. Keys are parsed once per process and shared by all callers
+    # which provide the same owner and PEM. Changing the PEM for an owner (e.g. when a key is
+    # rotated) results in a new key being parsed.
+    #
+    # @param [Object] owner Something which identifies the owner of the key (such as a domain ID)
+    # @param [String] pem
+    # @return [OpenSSL::PKey::RSA]
+    def private_key(owner, pem)
+      KEY_CACHE.fetch([owner, Digest::SHA256.hexdigest(pem)]) { OpenSSL::PKey::RSA.new(pem) }
+    end
+
+  end
+
+  # @param [Domain, nil] domain
+  # @param [String] message The raw message to sign
+  # @param [HeaderIndex, nil] header_index An existing index of the message's headers
+  # @param [Object, nil] body_hash_key A key which uniquely identifies the body of this message. If
+  #   provided, the body hash will be shared with other messages signed with the same key.
+  def initialize(domain, message, header_index: nil, body_hash_key: nil)
     if domain && domain.dkim_status == "OK"
       @domain_name = domain.name
       @dkim_key = domain.dkim_key
@@ -14,7 +43,9 @@ class DKIMHeader
     end
     @domain = domain
     @message = message
-    @raw_headers, @raw_body = @message.gsub(/\r?\n/, "\r\n").split(/\r\n\r\n/, 2)
+    @header_index = header_index || HeaderIndex.new(message)
+    @body_offset = header_index ? message.match(/\r?\n\r?\n/)&.byteoffset(0)&.last : @header_index.body_offset
+    @body_hash_key = body_hash_key
   end
 
   def dkim_header
@@ -24,7 +55,7 @@ class DKIMHeader
   private
 
   def headers
-    @headers ||= @raw_headers.to_s.gsub(/\r?\n\s/, " ").split(/\r?\n/)
+    @headers ||= @header_index.fields.map { |field| @header_index.raw_field(field).gsub(/\r?\n\s/, " ") }
   end
 
   def header_names
@@ -76,32 +107,62 @@ class DKIMHeader
     key + ":" + value
   end
 
-  def normalized_body
-    @normalized_body ||= begin
-      content = @raw_body.dup
+  def body_hash
+    @body_hash ||= if @body_hash_key
+                     BODY_HASH_CACHE.fetch(@body_hash_key) { compute_body_hash }
+                   else
+                     compute_body_hash
+                   end
+  end
+
+  def compute_body_hash
+    Base64.encode64(relaxed_body_digest.digest).strip
+  end
 
-      # From the DKIM RFC6376
-      # https://datatracker.ietf.org/doc/html/rfc6376#section-3.4.4
+  # Canonicalize the body with the relaxed algorithm and add it to a digest. The body is
+  # worked through in chunks which end on line boundaries rather than making copies of the
+  # whole message.
+  #
+  # From the DKIM RFC6376
+  # https://datatracker.ietf.org/doc/html/rfc6376#section-3.4.4
+  def relaxed_body_digest
+    digest = Digest::SHA256.new
+    # Whitespace and empty lines at the end of each chunk are held back until we know that
+    # they are not at the end of the body
+    pending = String.new
+    position = @body_offset || @message.bytesize
+    size = @message.bytesize
+    while position < size
+      chunk_end = @message.byteindex("\n", [position + BODY_CHUNK_SIZE, size].min - 1)
+      chunk_end = chunk_end ? chunk_end + 1 : size
+      chunk = @message.byteslice(position, chunk_end - position)
+      position = chunk_end
+
+      # Ensure all lines end with CRLF
+      chunk.gsub!(/\r?\n/, "\r\n")
 
       # a. Reduce whitespace
       #
       # * Reduce all sequences of WSP within a line to a single SP character.
-      content.gsub!(/[ \t]+/, " ")
+      chunk.gsub!(/[ \t]+/, " ")
 
       # * Ignore all whitespace at the end of lines.  Implementations MUST NOT
       #   remove the CRLF at the end of the line.
-      content.gsub!(/ \r\n/, "\r\n")
+      chunk.gsub!(/ \r\n/, "\r\n")
 
       # b. Ignore all empty lines at the end of the message body.
-      content.gsub!(/[ \r\n]*\z/, "")
+      content_end = chunk.bytesize
+      content_end -= 1 while content_end.positive? && [32, 13, 10].include?(chunk.getbyte(content_end - 1))
+      if content_end.zero?
+        pending << chunk
+        next
+      end
 
-      content += "\r\n"
-      content
+      digest << pending
+      digest << chunk.byteslice(0, content_end)
+      pending = chunk.byteslice(content_end, chunk.bytesize - content_end)
     end
-  end
-
-  def body_hash
-    @body_hash ||= Base64.encode64(Digest::SHA256.digest(normalized_body)).strip
+    digest << "\r\n"
   end
 
   def dkim_properties
@@ -10,8 +10,12 @@ class DNSResolver
   attr_reader :nameservers
   attr_reader :timeout
 
-  def initialize(nameservers)
+  # @param [Array<String>] nameservers
+  # @param [DNSResolver::Cache, Symbol, nil] cache The cache to use for lookups. Pass :process
+  #   to use the process-wide cache or nil to always query the nameservers.
+  def initialize(nameservers, cache: nil)
     @nameservers = nameservers
+    @cache = cache
   end
 
   # Return all A records for the given name
@@ -120,31 +124,68 @@ class DNSResolver
     end
   end
 
-  def get_resources(name, type, **options)
+  def get_resources(name, type, raise_timeout_errors: false)
     encoded_name = DomainName::Punycode.encode_hostname(name)
-    dns(**options) do |dns|
-      dns.getresources(encoded_name, type)
+    cache = @cache == :process ? self.class.cache : @cache
+    if cache.nil?
+      return dns(raise_timeout_errors: raise_timeout_errors) do |dns|
+        dns.getresources(encoded_name, type)
+      end
+    end
+
+    # Lookups for the cache always raise timeout errors so that a timeout is never
+    # mistaken for (and cached as) an empty result.
+    key = [@nameservers, encoded_name.downcase, type]
+    cache.fetch(key, type: type.name.split("::").last) do
+      dns(raise_timeout_errors: true) do |dns|
+        dns.getresources(encoded_name, type)
+      end
     end
+  rescue Resolv::ResolvError => e
+    raise if raise_timeout_errors || e.message !~ /timeout/
+
+    []
   end
 
   class << self
 
-    # Return a resolver which will use the nameservers for the given domain
+    # Return a resolver which will use the nameservers for the given domain. These resolvers
+    # are used to verify and check domains so they don't use the process-wide cache (which
+    # would hide records which have just been changed) unless a cache is given.
     #
     # @param [String] name
+    # @param [DNSResolver::Cache, nil] cache A cache to use for all the lookups
     # @return [DNSResolver]
-    def for_domain(name)
-      nameservers = local.effective_ns(name)
+    def for_domain(name, cache: nil)
+      resolver = local(cache: cache)
+      nameservers = resolver.effective_ns(name)
       ips = nameservers.map do |ns|
-        local.a(ns)
+        resolver.a(ns)
       end.flatten.uniq
-      new(ips)
+      new(ips, cache: cache)
+    end
+
+    # Return the process-wide cache used for all lookups. Returns nil if caching has
+    # been disabled.
+    #
+    # @return [DNSResolver::Cache, nil]
+    def cache
+      return nil unless Postal::Config.dns.cache_enabled?
+
+      @cache ||= Cache.new(max_entries: Postal::Config.dns.cache_max_entries,
+                           negative_ttl: Postal::Config.dns.cache_negative_ttl,
+                           max_ttl: Postal::Config.dns.cache_max_ttl)
     end
 
-    # Return a local resolver to use for lookups
+    # Return a local resolver to use for lookups. By default this uses the process-wide
+    # cache (which is what message delivery needs). Pass a different cache, or nil for
+    # lookups which must not be cached.
     #
+    # @param [DNSResolver::Cache, Symbol, nil] cache The cache to use for lookups
     # @return [DNSResolver]
-    def local
+    def local(cache: :process)
+      return new(local.nameservers, cache: cache) unless cache == :process
+
       @local ||= begin
         resolv_conf_path = Postal::Config.dns.resolv_conf_path
         raise LocalResolversUnavailableError, "No resolver config found at #{resolv_conf_path}" unless File.file?(resolv_conf_path)
@@ -154,7 +195,7 @@ class DNSResolver
           raise LocalResolversUnavailableError, "Could not find nameservers in #{resolv_conf_path}"
         end
 
-        new(resolv_conf[:nameserver])
+        new(resolv_conf[:nameserver], cache: :process)
       end
     end
 
@@ -0,0 +1,152 @@
+# frozen_string_literal: true
+
+class DNSResolver
+  # A thread-safe, process-wide cache of DNS lookup results. Results are kept for the TTL of the
+  # records returned (capped at a configurable maximum) and empty results (NXDOMAIN or no data)
+  # are cached for a shorter, configurable period. The cache has a maximum number of entries
+  # and evicts the least recently used entry when full (see LRUCache).
+  #
+  # If several threads ask for the same name at the same time, only the first will query the
+  # nameservers and the others will wait for its result.
+  class Cache
+
+    extend HasPrometheusMetrics
+    include HasPrometheusMetrics
+
+    # A lookup which is currently in progress. Other threads looking up the same key can wait
+    # for the result rather than making their own query.
+    class Lookup
+
+      def initialize
+        @mutex = Mutex.new
+        @condition = ConditionVariable.new
+        @complete = false
+      end
+
+      def resolve(resources)
+        complete(resources: resources)
+      end
+
+      def reject(error)
+        complete(error: error)
+      end
+
+      def value
+        @mutex.synchronize do
+          @condition.wait(@mutex) until @complete
+        end
+        raise @error if @error
+
+        @resources
+      end
+
+      private
+
+      def complete(resources: nil, error: nil)
+        @mutex.synchronize do
+          @resources = resources
+          @error = error
+          @complete = true
+          @condition.broadcast
+        end
+      end
+
+    end
+
+    attr_reader :max_entries
+    attr_reader :negative_ttl
+    attr_reader :max_ttl
+
+    # @param [Integer] max_entries The maximum number of entries to hold
+    # @param [Integer] negative_ttl The number of seconds to cache empty results for
+    # @param [Integer] max_ttl The maximum number of seconds to cache any result for
+    def initialize(max_entries:, negative_ttl:, max_ttl:)
+      @max_entries = max_entries
+      @negative_ttl = negative_ttl
+      @max_ttl = max_ttl
+      @entries = LRUCache.new(max_size: max_entries, on_evict: ->(_key) { increment_prometheus_counter :postal_dns_cache_evictions })
+      @lookups = {}
+      @mutex = Mutex.new
+    end
+
+    # Return the resources for the given key from the cache. If they are not cached, the block
+    # will be called to look them up and the result will be cached. Errors raised by the block
+    # are passed to all waiting threads and are not cached.
+    #
+    # @param [Array] key
+    # @param [String] type A label to use for metrics
+    # @yieldreturn [Array<Resolv::DNS::Resource>]
+    # @return [Array<Resolv::DNS::Resource>]
+    def fetch(key, type: "unknown")
+      lookup, leader = @mutex.synchronize do
+        found, resources = @entries.lookup(key)
+        if found
+          increment_prometheus_counter :postal_dns_cache_hits, labels: { type: type }
+          return resources
+        end
+
+        if @lookups[key]
+          increment_prometheus_counter :postal_dns_cache_hits, labels: { type: type }
+          [@lookups[key], false]
+        else
+          increment_prometheus_counter :postal_dns_cache_misses, labels: { type: type }
+          [@lookups[key] = Lookup.new, true]
+        end
+      end
+
+      return lookup.value unless leader
+
+      begin
+        resources = yield
+        write(key, resources)
+        lookup.resolve(resources)
+        resources
+      rescue StandardError => e
+        lookup.reject(e)
+        raise
+      ensure
+        @mutex.synchronize { @lookups.delete(key) }
+      end
+    end
+
+    # Return the number of entries currently in the cache
+    #
+    # @return [Integer]
+    def size
+      @entries.size
+    end
+
+    # Remove all entries from the cache
+    #
+    # @return [void]
+    def clear
+      @entries.clear
+    end
+
+    private
+
+    # Add the resources to the cache for the lowest TTL of the records returned
+    def write(key, resources)
+      ttl = resources.empty? ? @negative_ttl : [resources.map(&:ttl).compact.min || 0, @max_ttl].min
+      @entries.write(key, resources, ttl: ttl)
+    end
+
+    class << self
+
+      def register_prometheus_metrics
+        register_prometheus_counter :postal_dns_cache_hits,
+                                    docstring: "The number of DNS lookups answered from the cache (or by joining an in-flight lookup)",
+                                    labels: [:type]
+
+        register_prometheus_counter :postal_dns_cache_misses,
+                                    docstring: "The number of DNS lookups which were not in the cache",
+                                    labels: [:type]
+
+        register_prometheus_counter :postal_dns_cache_evictions,
+                                    docstring: "The number of DNS cache entries evicted because the cache was full"
+      end
+
+    end
+
+  end
+end
@@ -0,0 +1,123 @@
+# frozen_string_literal: true
+
+# An index of the header fields in a raw message. The raw message (or just its headers) is
+# scanned once and the position of each field is recorded as byte offsets into the original
+# buffer. Values are only sliced out, unfolded and decoded when they are asked for.
+#
+# This is much cheaper than building a Mail object when all that is needed are the values of
+# a few headers. The full MIME parse should only be used when the body content is required.
+class HeaderIndex
+
+  Field = Struct.new(:name, :offset, :length, :value_offset)
+
+  attr_reader :raw
+  attr_reader :fields
+  attr_reader :headers_length
+  attr_reader :body_offset
+
+  # @param [String] raw The raw message or raw headers. Lines can end with CRLF or LF.
+  def initialize(raw)
+    @raw = raw || ""
+    @fields = []
+    @fields_by_name = {}
+    @decoded_values = {}
+    parse
+  end
+
+  # Return the decoded values of all fields with the given name
+  #
+  # @param [String] name
+  # @return [Array<String>, nil]
+  def [](name)
+    name = name.to_s.downcase
+    return nil unless @fields_by_name.key?(name)
+
+    @decoded_values[name] ||= @fields_by_name[name].map { |field| decode(unfolded_value(field)) }
+  end
+
+  # Return the raw (still folded) text of the given field including its name
+  #
+  # @param [HeaderIndex::Field] field
+  # @return [String]
+  def raw_field(field)
+    @raw.byteslice(field.offset, field.length)
+  end
+
+  # Return the unfolded, but not decoded, value of the given field
+  #
+  # @param [HeaderIndex::Field] field
+  # @return [String]
+  def unfolded_value(field)
+    @raw.byteslice(field.value_offset, field.offset + field.length - field.value_offset).gsub(/\r?\n(?=[ \t])/, "").strip
+  end
+
+  # Return the raw headers without the blank line which separates them from the body
+  #
+  # @return [String]
+  def raw_headers
+    @raw.byteslice(0, @headers_length)
+  end
+
+  # Return the raw body or nil if the buffer does not contain a body
+  #
+  # @return [String, nil]
+  def raw_body
+    return nil if @body_offset.nil?
+
+    @raw.byteslice(@body_offset, @raw.bytesize - @body_offset)
+  end
+
+  # Return a hash of all decoded header values keyed by their lowercase names
+  #
+  # @return [Hash{String => Array<String>}]
+  def to_h
+    @fields_by_name.keys.each_with_object({}) do |name, hash|
+      hash[name] = self[name]
+    end
+  end
+
+  private
+
+  def parse
+    position = 0
+    size = @raw.bytesize
+    while position < size
+      line_end = @raw.byteindex("\n", position) || size
+      content_end = line_end > position && @raw.getbyte(line_end - 1) == 13 ? line_end - 1 : line_end
+
+      if content_end == position
+        # A blank line marks the end of the headers
+        @headers_length = position
+        @body_offset = [line_end + 1, size].min
+        return
+      end
+
+      first_byte = @raw.getbyte(position)
+      if first_byte == 32 || first_byte == 9
+        # This is a continuation of the previous field
+        @fields.last.length = content_end - @fields.last.offset if @fields.last
+      elsif (colon = @raw.byteindex(":", position)) && colon < content_end
+        name = @raw.byteslice(position, colon - position).strip.downcase
+        field = Field.new(name, position, content_end - position, colon + 1)
+        @fields << field
+        (@fields_by_name[name] ||= []) << field
+      end
+
+      position = line_end + 1
+    end
+
+    @headers_length = size
+    @body_offset = nil
+  end
+
+  def decode(value)
+    value = value.force_encoding(Encoding::UTF_8)
+    value = value.scrub unless value.valid_encoding?
+    return value unless value.include?("=?")
+
+    Mail::Encodings.value_decode(value)
+  rescue StandardError
+    value
+  end
+
+end
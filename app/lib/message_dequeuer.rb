@@ -4,8 +4,8 @@ module MessageDequeuer
 
   class << self
 
-    def process(message, logger:)
-      processor = InitialProcessor.new(message, logger: logger)
+    def process(message, logger:, batch: nil)
+      processor = InitialProcessor.new(message, logger: logger, batch: batch)
       processor.process
     end
 
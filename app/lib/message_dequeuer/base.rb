@@ -34,6 +34,22 @@ module MessageDequeuer
       raise StopProcessing
     end
 
+    # Run the named step, recording how long it takes and how many queries it makes when stage
+    # timings are enabled
+    def stage(name)
+      return send(name) unless StageTimings.enabled?
+
+      stage_timings.measure(name) { send(name) }
+    end
+
+    def stage_timings
+      @stage_timings ||= StageTimings.new(self.class.name.demodulize.delete_suffix("MessageProcessor").underscore)
+    end
+
+    def finish_stage_timings
+      @stage_timings&.finish(queued_message, logger: logger)
+    end
+
     def catch_stops
       yield if block_given?
       true
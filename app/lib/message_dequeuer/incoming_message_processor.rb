@@ -9,23 +9,25 @@ module MessageDequeuer
       log "message is incoming"
 
       catch_stops do
-        handle_bounces
-        increment_live_stats
-        inspect_message
-        fail_if_spam
-        hold_if_server_development_mode
-        find_route
-        hold_or_reject_spam
-        accept_mail_without_endpoints
-        hold_messages
-        bounce_messages
-        send_message_to_sender
-        send_bounce_on_hard_fail
-        log_sender_result
-        finish_processing
+        stage :handle_bounces
+        stage :increment_live_stats
+        stage :inspect_message
+        stage :fail_if_spam
+        stage :hold_if_server_development_mode
+        stage :find_route
+        stage :hold_or_reject_spam
+        stage :accept_mail_without_endpoints
+        stage :hold_messages
+        stage :bounce_messages
+        stage :send_message_to_sender
+        stage :send_bounce_on_hard_fail
+        stage :log_sender_result
+        stage :finish_processing
       end
     rescue StandardError => e
       handle_exception(e)
+    ensure
+      finish_stage_timings
     end
 
     private
@@ -7,6 +7,14 @@ module MessageDequeuer
 
     attr_accessor :send_result
 
+    # @param [QueuedMessage] queued_message The message to process
+    # @param [Array<QueuedMessage>] batch Other messages which have already been locked by the
+    #   caller and should be processed alongside the initial message
+    def initialize(queued_message, batch: nil, **kwargs)
+      super(queued_message, **kwargs)
+      @batch = batch || []
+    end
+
     def process
       logger.tagged(original_queued_message: @queued_message.id) do
         logger.info "starting message unqueue"
@@ -23,6 +31,7 @@ module MessageDequeuer
             @other_messages&.each { |message| process_message(message) }
           end
         ensure
+          release_unprocessed_batch_messages
           @state.finished
         end
         logger.info "finished message unqueue"
@@ -55,19 +64,40 @@ module MessageDequeuer
     end
 
     def find_other_messages_for_batch
+      @other_messages = @batch.dup
       return unless Postal::Config.postal.batch_queued_messages?
 
-      @other_messages = @queued_message.batchable_messages(Postal::Config.postal.batch_queued_messages_limit)
+      limit = Postal::Config.postal.batch_queued_messages_limit - @batch.size
+      @other_messages += @queued_message.batchable_messages(limit).to_a if limit.positive?
       log "found #{@other_messages.size} associated messages to process at the same time", batch_key: @queued_message.batch_key
     rescue StandardError
       @queued_message.unlock
       raise
     end
 
+    # Any messages which were passed in as part of a pre-claimed batch but which have not been
+    # processed (because processing stopped early) must be unlocked so that they can be picked
+    # up again by another worker.
+    #
+    # @return [void]
+    def release_unprocessed_batch_messages
+      @batch.each do |queued_message|
+        next if @processed_messages&.include?(queued_message.id)
+        next if queued_message.destroyed?
+
+        queued_message.unlock
+      end
+    end
+
     def process_message(queued_message)
+      @processed_messages ||= Set.new
+      @processed_messages << queued_message.id
+
       logger.tagged(queued_message: queued_message.id) do
         SingleMessageProcessor.process(queued_message, logger: @logger, state: @state)
       end
+    ensure
+      @state.release_pooled_senders
     end
 
   end
@@ -5,26 +5,28 @@ module MessageDequeuer
 
     def process
       catch_stops do
-        check_domain
-        check_rcpt_to
-        add_tag
-        hold_if_credential_is_set_to_hold
-        hold_if_recipient_on_suppression_list
-        parse_content
-        inspect_message
-        fail_if_spam
-        add_outgoing_headers
-        check_send_limits
-        increment_live_stats
-        hold_if_server_development_mode
-        send_message_to_sender
-        add_recipient_to_suppression_list_on_too_many_hard_fails
-        remove_recipient_from_suppression_list_on_success
-        log_sender_result
-        finish_processing
+        stage :check_domain
+        stage :check_rcpt_to
+        stage :add_tag
+        stage :hold_if_credential_is_set_to_hold
+        stage :hold_if_recipient_on_suppression_list
+        stage :parse_content
+        stage :inspect_message
+        stage :fail_if_spam
+        stage :add_outgoing_headers
+        stage :check_send_limits
+        stage :increment_live_stats
+        stage :hold_if_server_development_mode
+        stage :send_message_to_sender
+        stage :add_recipient_to_suppression_list_on_too_many_hard_fails
+        stage :remove_recipient_from_suppression_list_on_success
+        stage :log_sender_result
+        stage :finish_processing
       end
     rescue StandardError => e
       handle_exception(e)
+    ensure
+      finish_stage_timings
     end
 
     private
@@ -134,15 +136,15 @@ module MessageDequeuer
       if queued_message.server.send_limit_exceeded?
         # If we're over the limit, we're going to be holding this message
         log "server send limit has been exceeded, holding", send_limit: queued_message.server.send_limit
-        queued_message.server.update_columns(send_limit_exceeded_at: Time.now, send_limit_approaching_at: nil)
+        queued_message.server.record_send_limit_status(:exceeded)
         create_delivery "Held", details: "Message held because send limit (#{queued_message.server.send_limit}) has been reached."
         remove_from_queue
         stop_processing
       elsif queued_message.server.send_limit_approaching?
         # If we're approaching the limit, just say we are but continue to process the message
-        queued_message.server.update_columns(send_limit_approaching_at: Time.now, send_limit_exceeded_at: nil)
+        queued_message.server.record_send_limit_status(:approaching)
       else
-        queued_message.server.update_columns(send_limit_approaching_at: nil, send_limit_exceeded_at: nil)
+        queued_message.server.record_send_limit_status(nil)
       end
     end
 
@@ -154,12 +156,29 @@ module MessageDequeuer
                                  queued_message.message.recipient_domain,
                                  queued_message.ip_address)
 
+      started_at = Process.clock_gettime(Process::CLOCK_MONOTONIC)
       @result = sender.send_message(queued_message.message)
+      record_delivery_outcome(Process.clock_gettime(Process::CLOCK_MONOTONIC) - started_at)
       return unless @result.connect_error
 
       @state.send_result = @result
     end
 
+    # Tell the delivery scheduler how this attempt went so it can adjust how many messages
+    # it allows to be in flight to this destination
+    def record_delivery_outcome(duration)
+      return unless DeliveryScheduler.enabled?
+
+      outcome = if @result.type == "Sent"
+                  :success
+                elsif @result.connect_error || @result.type == "SoftFail"
+                  :deferral
+                else
+                  :failure
+                end
+      DeliveryScheduler.instance.record(queued_message.domain, queued_message.ip_address_id, outcome, duration)
+    end
+
     def add_recipient_to_suppression_list_on_too_many_hard_fails
       return unless @result.type == "HardFail"
 
@@ -0,0 +1,193 @@
+# frozen_string_literal: true
+
+module MessageDequeuer
+  # Records how long each step of processing a queued message takes and how many queries it
+  # makes to the main database and the message database. Each step is recorded in a
+  # histogram (by scope and step) as it finishes.
+  #
+  # When processing has finished, messages which took longer than the slow message threshold
+  # are logged with a breakdown of each step. The slowest messages processed in the last hour
+  # are also kept so they can be shown by the worker's health server.
+  class StageTimings
+
+    extend HasPrometheusMetrics
+    include HasPrometheusMetrics
+
+    Stage = Struct.new(:name, :duration, :main_db_queries, :message_db_queries)
+
+    RECENT_PERIOD = 3600
+
+    @slow_messages = []
+    @slow_messages_mutex = Mutex.new
+    @subscription_mutex = Mutex.new
+
+    attr_reader :scope
+    attr_reader :stages
+
+    # @param [String] scope The type of message being processed (incoming or outgoing)
+    def initialize(scope)
+      @scope = scope
+      @stages = []
+    end
+
+    # Run the given block and record it as the named step
+    #
+    # @param [Symbol] name
+    # @return [Object] the result of the block
+    def measure(name)
+      counts = self.class.query_counts
+      main_db_queries = counts[:main_db]
+      message_db_queries = counts[:message_db]
+      started_at = Process.clock_gettime(Process::CLOCK_MONOTONIC)
+      yield
+    ensure
+      stage = Stage.new(name,
+                        Process.clock_gettime(Process::CLOCK_MONOTONIC) - started_at,
+                        counts[:main_db] - main_db_queries,
+                        counts[:message_db] - message_db_queries)
+      @stages << stage
+      record(stage)
+    end
+
+    # Return the total time taken by all steps
+    #
+    # @return [Float]
+    def duration
+      @stages.sum(&:duration)
+    end
+
+    # Return a description of each step suitable for a log line
+    #
+    # @return [String]
+    def breakdown
+      @stages.map do |stage|
+        format("%s=%.1fms/%dq", stage.name, stage.duration * 1000, stage.main_db_queries + stage.message_db_queries)
+      end.join(" ")
+    end
+
+    # Log the message if it was slow and remember it if it is one of the slowest recent messages
+    #
+    # @param [QueuedMessage] queued_message
+    # @param [Klogger::Logger] logger
+    # @return [void]
+    def finish(queued_message, logger:)
+      return if @stages.empty?
+      return if duration * 1000 < Postal::Config.worker.slow_message_threshold
+
+      logger.warn "slow message processing (#{(duration * 1000).round}ms): #{breakdown}"
+      self.class.add_slow_message(
+        server_id: queued_message.server_id,
+        message_id: queued_message.message_id,
+        scope: @scope,
+        time: Time.now.utc.iso8601,
+        duration_ms: (duration * 1000).round(1),
+        stages: @stages.map do |stage|
+          {
+            name: stage.name,
+            duration_ms: (stage.duration * 1000).round(1),
+            main_db_queries: stage.main_db_queries,
+            message_db_queries: stage.message_db_queries
+          }
+        end
+      )
+    end
+
+    private
+
+    def record(stage)
+      labels = { scope: @scope, stage: stage.name.to_s }
+      observe_prometheus_histogram :postal_message_dequeuer_stage_runtime, stage.duration, labels: labels
+      if stage.main_db_queries.positive?
+        increment_prometheus_counter :postal_message_dequeuer_stage_queries, by: stage.main_db_queries, labels: labels.merge(database: "main")
+      end
+      return unless stage.message_db_queries.positive?
+
+      increment_prometheus_counter :postal_message_dequeuer_stage_queries, by: stage.message_db_queries, labels: labels.merge(database: "message")
+    end
+
+    class << self
+
+      # Are stage timings enabled?
+      #
+      # @return [Boolean]
+      def enabled?
+        Postal::Config.worker.stage_timings?
+      end
+
+      # Return the number of queries made by the current thread. Queries are only counted once
+      # this has been called on a thread.
+      #
+      # @return [Hash{Symbol => Integer}]
+      def query_counts
+        subscribe
+        Thread.current[:postal_stage_timings_query_counts] ||= { main_db: 0, message_db: 0 }
+      end
+
+      # Remember a slow message, keeping only the slowest messages from the last hour
+      #
+      # @param [Hash] message
+      # @return [void]
+      def add_slow_message(message)
+        @slow_messages_mutex.synchronize do
+          @slow_messages = recent_slow_messages
+          @slow_messages << message.merge(recorded_at: Process.clock_gettime(Process::CLOCK_MONOTONIC))
+          @slow_messages = @slow_messages.max_by(Postal::Config.worker.slow_message_log_size) { |m| m[:duration_ms] }
+        end
+      end
+
+      # Return the slowest messages from the last hour, slowest first
+      #
+      # @return [Array<Hash>]
+      def slow_messages
+        @slow_messages_mutex.synchronize do
+          recent_slow_messages.sort_by { |m| -m[:duration_ms] }.map { |m| m.except(:recorded_at) }
+        end
+      end
+
+      def register_prometheus_metrics
+        register_prometheus_histogram :postal_message_dequeuer_stage_runtime,
+                                      docstring: "The time taken by each step of processing a queued message (in seconds)",
+                                      labels: [:scope, :stage],
+                                      buckets: [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+        register_prometheus_counter :postal_message_dequeuer_stage_queries,
+                                    docstring: "The number of database queries made by each step of processing a queued message",
+                                    labels: [:scope, :stage, :database]
+      end
+
+      private
+
+      # Count queries on threads which are recording stage timings. Subscriptions are only
+      # added the first time timings are recorded.
+      def subscribe
+        return if @subscribed
+
+        @subscription_mutex.synchronize do
+          return if @subscribed
+
+          ActiveSupport::Notifications.subscribe("sql.active_record") do |*, payload|
+            next if payload[:name] == "SCHEMA" || payload[:cached]
+            next unless counts = Thread.current[:postal_stage_timings_query_counts]
+
+            counts[:main_db] += 1
+          end
+
+          ActiveSupport::Notifications.subscribe("query.message_db") do
+            next unless counts = Thread.current[:postal_stage_timings_query_counts]
+
+            counts[:message_db] += 1
+          end
+
+          @subscribed = true
+        end
+      end
+
+      def recent_slow_messages
+        cutoff = Process.clock_gettime(Process::CLOCK_MONOTONIC) - RECENT_PERIOD
+        @slow_messages.select { |m| m[:recorded_at] >= cutoff }
+      end
+
+    end
+
+  end
+end
@@ -8,18 +8,78 @@ module MessageDequeuer
     def sender_for(klass, *args, **kwargs)
       @cached_senders ||= {}
       @cached_senders[[klass, args, kwargs]] ||= begin
-        klass_instance = klass.new(*args, **kwargs)
-        klass_instance.start
-        klass_instance
+        if pool_key = pool_key_for(klass, args, kwargs)
+          checkout_pooled_sender(pool_key, klass, args, kwargs)
+        else
+          create_sender(klass, args, kwargs)
+        end
+      end
+    end
+
+    # Return any pooled senders to the pool so that other threads can use their sessions
+    # while this state moves on to its next message. They will be checked out again when
+    # they are next needed.
+    def release_pooled_senders
+      return if @pooled_senders.blank?
+
+      @cached_senders.delete_if do |_, sender|
+        next false unless pool_key = @pooled_senders.delete(sender)
+
+        begin
+          SMTPSender.pool.checkin(pool_key, sender)
+        rescue StandardError
+          nil
+        end
+        true
       end
     end
 
     def finished
       @cached_senders&.each_value do |sender|
-        sender.finish
+        if pool_key = @pooled_senders&.[](sender)
+          SMTPSender.pool.checkin(pool_key, sender)
+        else
+          sender.finish
+        end
       rescue StandardError
         false
       end
+
+      SMTPSender.pool&.reap
+    end
+
+    private
+
+    # Check out a sender from the pool. If every pooled session for the destination is in use
+    # by other threads, a sender which isn't pooled is used straight away rather than waiting
+    # for one to be checked in.
+    def checkout_pooled_sender(pool_key, klass, args, kwargs)
+      sender = SMTPSender.pool.checkout(pool_key) { create_sender(klass, args, kwargs) }
+      @pooled_senders ||= {}
+      @pooled_senders[sender] = pool_key
+      sender
+    rescue SMTPSender::Pool::ConnectionLimitReachedError
+      create_sender(klass, args, kwargs)
+    end
+
+    def create_sender(klass, args, kwargs)
+      klass_instance = klass.new(*args, **kwargs)
+      klass_instance.start
+      klass_instance
+    end
+
+    # Return the key which should be used to store the sender in the SMTP sender pool. Only
+    # senders for outgoing messages (which are identified only by their destination domain
+    # and source IP address) are pooled. Returns nil if the sender should not be pooled.
+    #
+    # @return [Array, nil]
+    def pool_key_for(klass, args, kwargs)
+      return nil unless klass == SMTPSender
+      return nil unless kwargs.empty?
+      return nil if SMTPSender.pool.nil?
+
+      domain, source_ip_address = args
+      [domain.to_s.downcase, source_ip_address&.id]
     end
 
   end
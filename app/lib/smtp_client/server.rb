@@ -1,5 +1,7 @@
 # frozen_string_literal: true
 
+require "resolv"
+
 module SMTPClient
   class Server
 
@@ -14,10 +16,15 @@ module SMTPClient
     end
 
     # Return all IP addresses for this server by resolving its hostname.
-    # IPv6 addresses will be returned first.
+    # IPv6 addresses will be returned first. If the hostname is an IP address, an endpoint
+    # for just that address is returned.
     #
     # @return [Array<SMTPClient::Endpoint>]
     def endpoints
+      if @hostname =~ Resolv::IPv4::Regex || @hostname =~ Resolv::IPv6::Regex
+        return [Endpoint.new(self, @hostname)]
+      end
+
       ips = []
 
       DNSResolver.local.aaaa(@hostname).each do |ip|
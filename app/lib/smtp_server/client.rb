@@ -44,6 +44,7 @@ module SMTPServer
     def transaction_reset
       @recipients = []
       @mail_from = nil
+      @data&.close
       @data = nil
       @headers = nil
     end
@@ -412,7 +413,8 @@ module SMTPServer
         return "503 HELO/EHLO, MAIL FROM and RCPT TO before sending data"
       end
 
-      @data = String.new.force_encoding("BINARY")
+      @data = DataSink.new(spill_threshold: Postal::Config.smtp_server.data_spill_threshold.kilobytes.to_i,
+                           limit: Postal::Config.smtp_server.max_message_size.megabytes.to_i)
       @headers = {}
       @receiving_headers = true
 
@@ -462,7 +464,7 @@ module SMTPServer
     end
 
     def finished
-      if @data.bytesize > Postal::Config.smtp_server.max_message_size.megabytes.to_i
+      if @data.overflowed?
         transaction_reset
         @state = :welcomed
         increment_error_count("message-too-large")
@@ -487,6 +489,7 @@ module SMTPServer
         end
       end
 
+      outgoing_messages = []
       @recipients.each do |recipient|
         type, rcpt_to, server, options = recipient
 
@@ -494,7 +497,7 @@ module SMTPServer
         when :credential
           increment_message_count("outgoing")
 
-          # Outgoing messages are just inserted
+          # Outgoing messages are just inserted (all together once every recipient has been seen)
           message = server.message_db.new_message
           message.rcpt_to = rcpt_to
           message.mail_from = @mail_from
@@ -503,7 +506,7 @@ module SMTPServer
           message.scope = "outgoing"
           message.domain_id = authenticated_domain&.id
           message.credential_id = @credential.id
-          message.save
+          outgoing_messages << message
 
         when :bounce
           increment_message_count("bounce")
@@ -538,6 +541,10 @@ module SMTPServer
           end
         end
       end
+      # The raw message is stored once for all of the recipients rather than for each of them
+      outgoing_messages.group_by(&:database).each do |database, messages|
+        Postal::MessageDB::Message.create_all(database, messages)
+      end
       transaction_reset
       @state = :welcomed
       "250 OK"
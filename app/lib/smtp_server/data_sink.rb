@@ -0,0 +1,99 @@
+# frozen_string_literal: true
+
+require "tempfile"
+
+module SMTPServer
+  # Collects the message data received after a DATA command. Data is held in memory until it
+  # grows beyond the spill threshold at which point it is moved into a temporary file and any
+  # further data is appended to the file. This keeps memory use bounded regardless of the size
+  # of the messages being received or the number of clients sending them.
+  #
+  # Once the limit has been reached, no more data is stored but the total size continues to be
+  # counted so that the message can be rejected as too large.
+  class DataSink
+
+    attr_reader :bytesize
+
+    # @param [Integer] spill_threshold The size (in bytes) above which data will be written to a file
+    # @param [Integer, nil] limit The maximum number of bytes to store
+    def initialize(spill_threshold:, limit: nil)
+      @spill_threshold = spill_threshold
+      @limit = limit
+      @buffer = String.new.force_encoding("BINARY")
+      @file = nil
+      @data = nil
+      @bytesize = 0
+    end
+
+    # Add data to the sink
+    #
+    # @param [String] data
+    # @return [SMTPServer::DataSink]
+    def <<(data)
+      stored = @bytesize
+      @bytesize += data.bytesize
+      return self if @limit && stored >= @limit
+
+      data = data.byteslice(0, @limit - stored) if @limit && @bytesize > @limit
+
+      if @file
+        @file.write(data)
+        @data = nil
+      else
+        @buffer << (data.encoding == Encoding::BINARY ? data : data.b)
+        spill if @buffer.bytesize > @spill_threshold
+      end
+      self
+    end
+
+    # Has the data been moved into a temporary file?
+    #
+    # @return [Boolean]
+    def spilled?
+      !@file.nil?
+    end
+
+    # Has more data been added than can be stored?
+    #
+    # @return [Boolean]
+    def overflowed?
+      !@limit.nil? && @bytesize > @limit
+    end
+
+    # Return all the stored data. This can be called more than once and, once data has been
+    # moved into a file, the file is only read once (until more data is added) so a message
+    # saved for each recipient shares the same String.
+    #
+    # @return [String]
+    def read
+      return @buffer if @file.nil?
+      return @data if @data
+
+      @file.flush
+      @file.rewind
+      @data = @file.read
+      @file.seek(0, IO::SEEK_END)
+      @data
+    end
+
+    # Remove the temporary file (if there is one) and discard the data
+    #
+    # @return [void]
+    def close
+      @file&.close!
+      @file = nil
+      @data = nil
+      @buffer = String.new.force_encoding("BINARY")
+    end
+
+    private
+
+    def spill
+      @file = Tempfile.new("postal-smtp-data")
+      @file.binmode
+      @file.write(@buffer)
+      @buffer = nil
+    end
+
+  end
+end
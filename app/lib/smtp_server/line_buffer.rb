@@ -0,0 +1,62 @@
+# frozen_string_literal: true
+
+module SMTPServer
+  # Buffers data received from a client and splits it into lines. Lines are sliced out of the
+  # buffer by offset so that each line only costs the length of the line (rather than copying
+  # everything which remains in the buffer) and the consumed data is only discarded once all
+  # complete lines have been read.
+  class LineBuffer
+
+    def initialize
+      @buffer = String.new.force_encoding("BINARY")
+      @offset = 0
+      @scanned = 0
+    end
+
+    # Add data received from the client to the buffer
+    #
+    # @param [String] data
+    # @return [SMTPServer::LineBuffer]
+    def <<(data)
+      @buffer << (data.encoding == Encoding::BINARY ? data : data.b)
+      self
+    end
+
+    # Return the next complete line (without its trailing LF) or nil if there is no complete
+    # line in the buffer yet
+    #
+    # @return [String, nil]
+    def shift_line
+      newline = @buffer.index("\n", [@offset, @scanned].max)
+      if newline.nil?
+        # Remember how far we have looked so a long line isn't scanned again from the start
+        # each time more data arrives.
+        @scanned = @buffer.bytesize
+        compact
+        return nil
+      end
+
+      line = @buffer.byteslice(@offset, newline - @offset)
+      @offset = newline + 1
+      line
+    end
+
+    # Return the number of bytes which have not been returned as lines yet
+    #
+    # @return [Integer]
+    def bytesize
+      @buffer.bytesize - @offset
+    end
+
+    private
+
+    def compact
+      return if @offset.zero?
+
+      @buffer = @buffer.byteslice(@offset, @buffer.bytesize - @offset)
+      @scanned -= @offset
+      @offset = 0
+    end
+
+  end
+end
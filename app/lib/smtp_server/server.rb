@@ -24,6 +24,42 @@ module SMTPServer
         end
       end
 
+      # Open a socket to listen for SMTP connections on
+      #
+      # @param [Boolean] reuse_port Whether to set SO_REUSEPORT so that other processes can listen on the same port
+      # @return [TCPServer]
+      def open_listener(reuse_port: false)
+        bind_address = ENV.fetch("BIND_ADDRESS", Postal::Config.smtp_server.default_bind_address)
+        port = ENV.fetch("PORT", Postal::Config.smtp_server.default_port)
+
+        if reuse_port
+          address = Addrinfo.tcp(bind_address, port)
+          socket = Socket.new(address.afamily, Socket::SOCK_STREAM)
+          socket.setsockopt(Socket::SOL_SOCKET, Socket::SO_REUSEADDR, true)
+          socket.setsockopt(Socket::SOL_SOCKET, Socket::SO_REUSEPORT, true)
+          socket.bind(address)
+          socket.listen(Socket::SOMAXCONN)
+          server = TCPServer.for_fd(socket.fileno)
+          socket.autoclose = false
+        else
+          server = TCPServer.open(bind_address, port)
+        end
+
+        server.autoclose = false
+        server.close_on_exec = false
+        if defined?(Socket::SOL_SOCKET) && defined?(Socket::SO_KEEPALIVE)
+          server.setsockopt(Socket::SOL_SOCKET, Socket::SO_KEEPALIVE, true)
+        end
+        if defined?(Socket::SOL_TCP) && defined?(Socket::TCP_KEEPIDLE) && defined?(Socket::TCP_KEEPINTVL) && defined?(Socket::TCP_KEEPCNT)
+          server.setsockopt(Socket::SOL_TCP, Socket::TCP_KEEPIDLE, 50)
+          server.setsockopt(Socket::SOL_TCP, Socket::TCP_KEEPINTVL, 10)
+          server.setsockopt(Socket::SOL_TCP, Socket::TCP_KEEPCNT, 5)
+        end
+
+        Postal.logger.info "Listening on #{bind_address}:#{port}"
+        server
+      end
+
     end
 
     def initialize(options = {})
@@ -34,7 +70,9 @@ module SMTPServer
     end
 
     def run
-      logger.tagged(component: "smtp-server") do
+      tags = { component: "smtp-server" }
+      tags[:worker] = @options[:worker] if @options[:worker]
+      logger.tagged(**tags) do
         listen
         run_event_loop
       end
@@ -55,6 +93,8 @@ module SMTPServer
         $stdout.puts "Received INT signal, shutting down."
         unlisten
       end
+
+      SamplingProfiler.install(@options[:worker] ? "smtp-server-worker-#{@options[:worker]}" : "smtp-server")
     end
 
     def ssl_context
@@ -69,23 +109,10 @@ module SMTPServer
       end
     end
 
+    # Start listening for connections. When running as a worker under a supervisor, the listener
+    # may have been opened (and inherited) already.
     def listen
-      bind_address = ENV.fetch("BIND_ADDRESS", Postal::Config.smtp_server.default_bind_address)
-      port = ENV.fetch("PORT", Postal::Config.smtp_server.default_port)
-
-      @server = TCPServer.open(bind_address, port)
-      @server.autoclose = false
-      @server.close_on_exec = false
-      if defined?(Socket::SOL_SOCKET) && defined?(Socket::SO_KEEPALIVE)
-        @server.setsockopt(Socket::SOL_SOCKET, Socket::SO_KEEPALIVE, true)
-      end
-      if defined?(Socket::SOL_TCP) && defined?(Socket::TCP_KEEPIDLE) && defined?(Socket::TCP_KEEPINTVL) && defined?(Socket::TCP_KEEPCNT)
-        @server.setsockopt(Socket::SOL_TCP, Socket::TCP_KEEPIDLE, 50)
-        @server.setsockopt(Socket::SOL_TCP, Socket::TCP_KEEPINTVL, 10)
-        @server.setsockopt(Socket::SOL_TCP, Socket::TCP_KEEPCNT, 5)
-      end
-
-      logger.info "Listening on #{bind_address}:#{port}"
+      @server = @options[:listener] || self.class.open_listener(reuse_port: @options[:reuse_port] || false)
     end
 
     def unlisten
@@ -100,7 +127,7 @@ module SMTPServer
       # Register the SMTP listener
       @io_selector.register(@server, :r)
       # Create a hash to contain a buffer for each client.
-      buffers = Hash.new { |h, k| h[k] = String.new.force_encoding("BINARY") }
+      buffers = Hash.new { |h, k| h[k] = LineBuffer.new }
       loop do
         # Wait for an event to occur
         @io_selector.select do |monitor|
@@ -109,8 +136,12 @@ module SMTPServer
           # Is this event an incoming connection?
           if io.is_a?(TCPServer)
             begin
-              # Accept the connection
-              new_io = io.accept
+              # Accept the connection. When several workers share an inherited listener, they
+              # are all woken for each new connection but only one of them will get it. The
+              # others must not block waiting for the next one.
+              new_io = io.accept_nonblock(exception: false)
+              next if new_io == :wait_readable
+
               increment_prometheus_counter :postal_smtp_server_connections_total
               # Get the client's IP address and strip `::ffff:` for consistency.
               client_ip_address = new_io.remote_address.ip_address.sub(/\A::ffff:/, "")
@@ -195,11 +226,9 @@ module SMTPServer
                   eof = true
                 end
 
-                # We line buffer, so look to see if we have received a newline
+                # We line buffer, so take each complete line from the buffer
                 # and keep doing so until all buffered lines have been processed.
-                while buffers[io].index("\n")
-                  # Extract the line
-                  line, buffers[io] = buffers[io].split("\n", 2)
+                while (line = buffers[io].shift_line)
                   # Send the received line to the client object for processing
                   result = client.handle(line)
                   # If the client object returned some data, write it back to the client
@@ -235,6 +264,8 @@ module SMTPServer
               # Has the client requested we close the connection?
               if client.finished? || eof
                 client.logger&.debug "Connection closed"
+                # Discard any message data which is still being received
+                client.transaction_reset
                 # Deregister the socket and close it
                 @io_selector.deregister(io)
                 buffers.delete(io)
@@ -264,6 +295,11 @@ module SMTPServer
                                            labels: { error: e.class.to_s, type: "data" }
 
               # Close all IO and forget this client
+              begin
+                client&.transaction_reset
+              rescue StandardError
+                nil
+              end
               begin
                 @io_selector.deregister(io)
               rescue StandardError
@@ -311,6 +347,9 @@ module SMTPServer
                                   docstring: "The number of successfuly TLS connections established"
 
       Client.register_prometheus_metrics
+      DNSResolver::Cache.register_prometheus_metrics
+      Postal::MessageDB::StatisticsAggregator.register_prometheus_metrics
+      Postal::MessageDB::ConnectionPool.register_prometheus_metrics
     end
 
   end
@@ -0,0 +1,178 @@
+# frozen_string_literal: true
+
+module SMTPServer
+  # The supervisor runs several SMTP server processes (workers) which all accept connections on the
+  # same port. Each worker runs its own event loop so a slow client or database query in one worker
+  # does not hold up connections being handled by the others, and inbound SMTP can use every core.
+  #
+  # By default the supervisor opens the listening socket and each worker inherits it. If reuse_port
+  # is enabled, each worker instead opens its own socket with SO_REUSEPORT and the kernel balances
+  # new connections between them.
+  #
+  # Workers which exit unexpectedly are restarted. When the supervisor receives a TERM or INT signal,
+  # it passes it on to each worker which stops accepting new connections and exits once its existing
+  # clients have disconnected. Workers which have not exited after the shutdown timeout are killed.
+  class Supervisor
+
+    include HasPrometheusMetrics
+
+    # The number of seconds to wait before restarting a worker which has exited
+    RESTART_DELAY = 1
+
+    attr_reader :worker_count
+
+    # @param [Integer] worker_count The number of worker processes to run
+    # @param [Boolean] reuse_port Whether each worker should open its own socket with SO_REUSEPORT
+    # @param [Integer] shutdown_timeout The number of seconds to wait for workers to exit on shutdown
+    # @param [Hash] server_options Options to pass to each worker's SMTPServer::Server
+    def initialize(worker_count: Postal::Config.smtp_server.workers,
+                   reuse_port: Postal::Config.smtp_server.reuse_port?,
+                   shutdown_timeout: Postal::Config.smtp_server.worker_shutdown_timeout,
+                   server_options: {})
+      @worker_count = worker_count
+      @reuse_port = reuse_port
+      @shutdown_timeout = shutdown_timeout
+      @server_options = server_options
+      @workers = {}
+      @signal_read, @signal_write = IO.pipe
+      register_prometheus_metrics
+    end
+
+    def run
+      logger.tagged(component: "smtp-server-supervisor") do
+        setup_traps
+        @listener = Server.open_listener unless @reuse_port
+        @worker_count.times { |i| start_worker(i + 1) }
+        supervise
+      end
+    end
+
+    private
+
+    def setup_traps
+      trap("TERM") { receive_signal("TERM") }
+      trap("INT") { receive_signal("INT") }
+
+      # Each worker runs its own sampling profiler so the profiler signal is passed on to them
+      profiler_signal = Postal::Config.postal.profiler_signal
+      return if profiler_signal.blank?
+
+      trap(profiler_signal) do
+        @workers.each_key do |pid|
+          Process.kill(profiler_signal, pid)
+        rescue Errno::ESRCH
+          nil
+        end
+      end
+    end
+
+    # Receive a signal and wake the supervisor so that it can stop the workers
+    #
+    # @param [String] signal
+    # @return [void]
+    def receive_signal(signal)
+      $stdout.puts "Received #{signal} signal, stopping workers."
+      @stopping ||= signal
+      @signal_write.write_nonblock(".", exception: false)
+    end
+
+    # Start a new worker process with the given index
+    #
+    # @param [Integer] index
+    # @return [Integer] the PID of the new worker
+    def start_worker(index)
+      pid = fork do
+        @signal_read.close
+        @signal_write.close
+        HasPrometheusMetrics.preset_labels = { worker: index.to_s }
+        HealthServer.start(name: "smtp-server-worker-#{index}",
+                           default_port: Postal::Config.smtp_server.default_health_server_port,
+                           default_bind_address: Postal::Config.smtp_server.default_health_server_bind_address,
+                           port_offset: index)
+        Server.new(@server_options.merge(listener: @listener, reuse_port: @reuse_port, worker: index)).run
+      end
+      logger.info "started worker #{index}", pid: pid
+      @workers[pid] = index
+      pid
+    end
+
+    # Wait for workers to exit, restarting them unless the supervisor is stopping. Returns when
+    # all workers have exited after a shutdown has been requested.
+    #
+    # @return [void]
+    def supervise
+      shutdown_deadline = nil
+      loop do
+        reap_workers
+
+        if @stopping
+          if shutdown_deadline.nil?
+            shutdown_deadline = now + @shutdown_timeout
+            signal_workers("TERM")
+          elsif now > shutdown_deadline && !@workers.empty?
+            logger.warn "workers did not stop within #{@shutdown_timeout} seconds, killing them"
+            signal_workers("KILL")
+          end
+          break if @workers.empty?
+        end
+
+        @signal_read.wait_readable(@stopping ? 1 : 5)
+        drain_signal_pipe
+      end
+      logger.info "all workers have stopped"
+    end
+
+    # Collect any workers which have exited and restart them if needed
+    #
+    # @return [void]
+    def reap_workers
+      loop do
+        pid, status = Process.wait2(-1, Process::WNOHANG)
+        break if pid.nil?
+
+        index = @workers.delete(pid)
+        next if index.nil?
+
+        if @stopping
+          logger.info "worker #{index} has stopped", pid: pid, status: status.exitstatus
+          next
+        end
+
+        logger.warn "worker #{index} exited unexpectedly, restarting", pid: pid, status: status.exitstatus || status.termsig
+        increment_prometheus_counter :postal_smtp_server_worker_restarts_total
+        sleep RESTART_DELAY
+        start_worker(index)
+      end
+    rescue Errno::ECHILD
+      nil
+    end
+
+    def signal_workers(signal)
+      @workers.each_key do |pid|
+        Process.kill(signal, pid)
+      rescue Errno::ESRCH
+        nil
+      end
+    end
+
+    def drain_signal_pipe
+      loop { @signal_read.read_nonblock(64) }
+    rescue IO::WaitReadable, EOFError
+      nil
+    end
+
+    def now
+      Process.clock_gettime(Process::CLOCK_MONOTONIC)
+    end
+
+    def logger
+      Postal.logger
+    end
+
+    def register_prometheus_metrics
+      register_prometheus_counter :postal_smtp_server_worker_restarts_total,
+                                  docstring: "The number of SMTP server workers which have been restarted after exiting unexpectedly"
+    end
+
+  end
+end
@@ -0,0 +1,187 @@
+# frozen_string_literal: true
+
+# Delivers batches of webhook requests concurrently. Each process has a single dispatcher with
+# a fixed number of delivery threads which are shared by every batch dispatched in the process.
+#
+# No more than the configured number of requests will be sent to the same endpoint (URL) at
+# once so that one slow endpoint cannot use every thread. HTTP connections are kept alive and
+# reused for later requests to the same host. Endpoints which keep failing have their circuit
+# opened and requests for them are put back (without using up an attempt) until the cooldown
+# has passed.
+class WebhookDispatcher
+
+  Delivery = Struct.new(:request, :endpoint, :batch)
+
+  # Tracks the number of deliveries in a batch which have not finished yet
+  class Batch
+
+    def initialize(size)
+      @remaining = size
+      @mutex = Mutex.new
+      @condition = ConditionVariable.new
+    end
+
+    def done
+      @mutex.synchronize do
+        @remaining -= 1
+        @condition.broadcast if @remaining <= 0
+      end
+    end
+
+    def wait
+      @mutex.synchronize do
+        @condition.wait(@mutex) while @remaining.positive?
+      end
+    end
+
+  end
+
+  attr_reader :concurrency
+  attr_reader :max_concurrency_per_endpoint
+  attr_reader :circuit_breaker
+  attr_reader :connection_pool
+
+  # @param [Integer] concurrency The number of delivery threads
+  # @param [Integer] max_concurrency_per_endpoint The maximum number of requests to send to one endpoint at once
+  # @param [WebhookDispatcher::CircuitBreaker] circuit_breaker
+  # @param [Postal::HTTP::ConnectionPool] connection_pool
+  # @param [Klogger::Logger] logger
+  def initialize(concurrency:, max_concurrency_per_endpoint:, circuit_breaker:, connection_pool:, logger: Postal.logger)
+    @concurrency = concurrency
+    @max_concurrency_per_endpoint = max_concurrency_per_endpoint
+    @circuit_breaker = circuit_breaker
+    @connection_pool = connection_pool
+    @logger = logger
+    @pending = {}
+    @in_flight = Hash.new(0)
+    @threads = []
+    @mutex = Mutex.new
+    @condition = ConditionVariable.new
+  end
+
+  # Deliver the given (locked) webhook requests and wait for them all to be finished with
+  #
+  # @param [Array<WebhookRequest>] requests
+  # @return [void]
+  def dispatch(requests)
+    return if requests.empty?
+
+    batch = Batch.new(requests.size)
+    @mutex.synchronize do
+      requests.each do |request|
+        endpoint = request.url
+        (@pending[endpoint] ||= []) << Delivery.new(request, endpoint, batch)
+      end
+      @condition.broadcast
+    end
+    start_threads
+    batch.wait
+  end
+
+  # Return the number of deliveries which are waiting for a thread
+  #
+  # @return [Integer]
+  def pending_count
+    @mutex.synchronize { @pending.values.sum(&:size) }
+  end
+
+  private
+
+  def start_threads
+    @mutex.synchronize do
+      @threads = [] unless @threads_pid == Process.pid
+      @threads_pid = Process.pid
+      @threads.select!(&:alive?)
+      (@concurrency - @threads.size).times do
+        @threads << Thread.new { run_delivery_loop }
+      end
+    end
+  end
+
+  def run_delivery_loop
+    loop do
+      delivery = @mutex.synchronize { next_delivery }
+      begin
+        process(delivery)
+      ensure
+        @mutex.synchronize do
+          @in_flight[delivery.endpoint] -= 1
+          @in_flight.delete(delivery.endpoint) if @in_flight[delivery.endpoint] <= 0
+          @condition.broadcast
+        end
+        delivery.batch.done
+      end
+    end
+  end
+
+  # Wait for a delivery to an endpoint which is below its concurrency limit. Endpoints take
+  # turns so that a large backlog for one endpoint doesn't hold up the others. Must be called
+  # while holding the mutex.
+  #
+  # @return [Delivery]
+  def next_delivery
+    loop do
+      endpoint = @pending.each_key.find { |e| @in_flight[e] < @max_concurrency_per_endpoint }
+      if endpoint
+        queue = @pending.delete(endpoint)
+        delivery = queue.shift
+        # Move the endpoint to the back of the line
+        @pending[endpoint] = queue unless queue.empty?
+        @in_flight[endpoint] += 1
+        return delivery
+      end
+
+      @condition.wait(@mutex)
+    end
+  end
+
+  def process(delivery)
+    request = delivery.request
+    unless @circuit_breaker.allow?(delivery.endpoint)
+      defer(request, @circuit_breaker.retry_at(delivery.endpoint))
+      return
+    end
+
+    service = nil
+    ActiveRecord::Base.connection_pool.with_connection do
+      service = WebhookDeliveryService.new(webhook_request: request, http_connection_pool: @connection_pool)
+      service.call
+    end
+  rescue StandardError => e
+    @logger.error "error delivering webhook request #{request.id}: #{e.class} (#{e.message})"
+    Sentry.capture_exception(e) if defined?(Sentry)
+  ensure
+    # Only the endpoint's response counts towards its circuit, not errors of our own
+    @circuit_breaker.record(delivery.endpoint, success: service.success?) if service&.attempted?
+  end
+
+  # Unlock a request without attempting it so that it can be picked up again once the
+  # endpoint's circuit can be tried again
+  def defer(request, retry_after)
+    ActiveRecord::Base.connection_pool.with_connection do
+      request.update_columns(locked_by: nil, locked_at: nil, retry_after: retry_after)
+    end
+    @logger.info "circuit for webhook endpoint is open, deferring request #{request.id} until #{retry_after}"
+  end
+
+  class << self
+
+    # Return the dispatcher for this process
+    #
+    # @return [WebhookDispatcher]
+    def instance
+      @instance ||= begin
+        circuit_breaker = CircuitBreaker.new(threshold: Postal::Config.postal.webhook_circuit_breaker_threshold,
+                                             cooldown: Postal::Config.postal.webhook_circuit_breaker_cooldown)
+        connection_pool = Postal::HTTP::ConnectionPool.new(idle_timeout: Postal::Config.postal.webhook_keep_alive_timeout,
+                                                           max_idle_per_host: Postal::Config.postal.webhook_max_concurrency_per_endpoint)
+        new(concurrency: Postal::Config.postal.webhook_delivery_concurrency,
+            max_concurrency_per_endpoint: Postal::Config.postal.webhook_max_concurrency_per_endpoint,
+            circuit_breaker: circuit_breaker,
+            connection_pool: connection_pool)
+      end
+    end
+
+  end
+
+end
@@ -0,0 +1,74 @@
+# frozen_string_literal: true
+
+class WebhookDispatcher
+  # Tracks consecutive delivery failures for each endpoint. Once an endpoint has failed the
+  # threshold number of times in a row, its circuit is opened and no requests will be sent to
+  # it until the cooldown has passed. After that, a single trial request is allowed through:
+  # if it succeeds the circuit is closed again, otherwise it is re-opened for another cooldown.
+  class CircuitBreaker
+
+    State = Struct.new(:failures, :open_until, :trial_in_progress)
+
+    attr_reader :threshold
+    attr_reader :cooldown
+
+    # @param [Integer] threshold The number of consecutive failures which will open the circuit
+    # @param [Integer] cooldown The number of seconds a circuit will stay open for
+    def initialize(threshold:, cooldown:)
+      @threshold = threshold
+      @cooldown = cooldown
+      @states = {}
+      @mutex = Mutex.new
+    end
+
+    # Can a request be sent to the given endpoint now? When the cooldown of an open circuit
+    # has passed, this will return true once (for the trial request) until a result for that
+    # request has been recorded.
+    #
+    # @param [String] endpoint
+    # @return [Boolean]
+    def allow?(endpoint)
+      @mutex.synchronize do
+        state = @states[endpoint]
+        return true if state.nil? || state.open_until.nil?
+        return false if state.open_until > Time.now || state.trial_in_progress
+
+        state.trial_in_progress = true
+        true
+      end
+    end
+
+    # Return the time after which a request which was not allowed through should be tried
+    # again. This is when the circuit's cooldown ends or, if a trial request is already in
+    # progress, one cooldown from now.
+    #
+    # @param [String] endpoint
+    # @return [Time]
+    def retry_at(endpoint)
+      open_until = @mutex.synchronize { @states[endpoint]&.open_until }
+      return open_until if open_until && open_until > Time.now
+
+      Time.now + @cooldown
+    end
+
+    # Record the result of a request to the given endpoint
+    #
+    # @param [String] endpoint
+    # @param [Boolean] success
+    # @return [void]
+    def record(endpoint, success:)
+      @mutex.synchronize do
+        if success
+          @states.delete(endpoint)
+          return
+        end
+
+        state = (@states[endpoint] ||= State.new(0, nil, false))
+        state.failures += 1
+        state.trial_in_progress = false
+        state.open_until = Time.now + @cooldown if state.failures >= @threshold
+      end
+    end
+
+  end
+end
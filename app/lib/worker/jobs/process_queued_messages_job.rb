@@ -4,17 +4,41 @@ module Worker
   module Jobs
     class ProcessQueuedMessagesJob < BaseJob
 
+      include HasPrometheusMetrics
+
       def call
         @lock_time = Time.current
         @locker = Postal.locker_name_with_suffix(SecureRandom.hex(8))
 
         find_ip_addresses
-        lock_message_for_processing
-        obtain_locked_messages
-        process_messages
+
+        if Postal::Config.postal.batch_claim_queued_messages?
+          claim_messages_for_processing
+          process_claimed_messages
+        else
+          lock_message_for_processing
+          obtain_locked_messages
+          process_messages
+        end
+
         @messages_to_process
       end
 
+      class << self
+
+        # Does the database support non-blocking row locking (SELECT ... FOR UPDATE SKIP LOCKED)?
+        # This is available from MySQL 8.0.1 and MariaDB 10.6.
+        #
+        # @return [Boolean]
+        def skip_locked_supported?
+          return @skip_locked_supported if instance_variable_defined?("@skip_locked_supported")
+
+          connection = ActiveRecord::Base.connection
+          @skip_locked_supported = connection.database_version >= (connection.mariadb? ? "10.6.0" : "8.0.1")
+        end
+
+      end
+
       private
 
       # Returns an array of IP address IDs that are present on the host that is
@@ -72,6 +96,122 @@ module Worker
         end
       end
 
+      # Return a scope containing all queued messages which could be claimed by this
+      # worker, in the order in which they should be processed. The server priority is
+      # looked up with a subquery rather than a join so that a locking read only locks
+      # rows in the queued_messages table and never the servers themselves.
+      #
+      # @return [ActiveRecord::Relation]
+      def claimable_messages
+        QueuedMessage.where(ip_address_id: [nil, @ip_addresses])
+                     .where(locked_by: nil, locked_at: nil)
+                     .ready_with_delayed_retry
+                     .order(Arel.sql("(SELECT servers.priority FROM servers WHERE servers.id = queued_messages.server_id) DESC, " \
+                                     "queued_messages.id ASC"))
+                     .limit(Postal::Config.postal.batch_claim_queued_messages_limit)
+      end
+
+      # Claim a batch of queued messages for processing. Where the database supports it, rows
+      # which are currently being claimed by another worker are skipped rather than waited
+      # for. Otherwise, the batch is claimed with a single UPDATE and then selected back.
+      #
+      # @return [void]
+      def claim_messages_for_processing
+        time = Benchmark.realtime do
+          if DeliveryScheduler.enabled?
+            claim_scheduled_messages
+          elsif self.class.skip_locked_supported?
+            QueuedMessage.transaction do
+              ids = claimable_messages.lock("FOR UPDATE SKIP LOCKED").pluck(:id)
+              QueuedMessage.where(id: ids).update_all(locked_by: @locker, locked_at: @lock_time) if ids.any?
+            end
+          else
+            claimable_messages.update_all(locked_by: @locker, locked_at: @lock_time)
+          end
+
+          @messages_to_process = QueuedMessage.joins(:server)
+                                              .where(locked_by: @locker, locked_at: @lock_time)
+                                              .order("servers.priority DESC, queued_messages.id ASC")
+                                              .to_a
+          release_unclaimed_reservations if DeliveryScheduler.enabled?
+        end
+
+        observe_prometheus_histogram :postal_worker_queued_message_claim_latency, time
+        observe_prometheus_histogram :postal_worker_queued_message_claim_size, @messages_to_process.size
+      end
+
+      # Claim a batch of queued messages chosen by the delivery scheduler. A larger window of
+      # claimable messages is read so that the scheduler can share the batch between
+      # destinations. Messages for destinations which the scheduler wouldn't choose (because
+      # they are backing off or already have as many messages in flight as they are allowed)
+      # are left out of the window, otherwise a large backlog for one slow destination could
+      # fill it and stop messages to every other destination being claimed. The scheduler marks
+      # the messages it chooses as in flight.
+      #
+      # @return [void]
+      def claim_scheduled_messages
+        limit = Postal::Config.postal.batch_claim_queued_messages_limit
+        window = claimable_messages.limit(limit * Postal::Config.postal.fair_delivery_candidate_multiplier)
+        unavailable_destinations = DeliveryScheduler.instance.unavailable_destinations
+        if unavailable_destinations.any?
+          window = window.where("queued_messages.domain IS NULL OR queued_messages.domain NOT IN (?)", unavailable_destinations)
+        end
+        columns = [:id, :domain, :ip_address_id, Arel.sql("(SELECT servers.priority FROM servers WHERE servers.id = queued_messages.server_id)")]
+
+        @reserved_messages = []
+        if self.class.skip_locked_supported?
+          QueuedMessage.transaction do
+            candidates = window.lock("FOR UPDATE SKIP LOCKED").pluck(*columns).map { |row| DeliveryScheduler::Candidate.new(*row) }
+            @reserved_messages = DeliveryScheduler.instance.reserve(candidates, limit)
+            QueuedMessage.where(id: @reserved_messages.map(&:id)).update_all(locked_by: @locker, locked_at: @lock_time) if @reserved_messages.any?
+          end
+        else
+          candidates = window.pluck(*columns).map { |row| DeliveryScheduler::Candidate.new(*row) }
+          @reserved_messages = DeliveryScheduler.instance.reserve(candidates, limit)
+          if @reserved_messages.any?
+            QueuedMessage.where(id: @reserved_messages.map(&:id), locked_by: nil, locked_at: nil)
+                         .update_all(locked_by: @locker, locked_at: @lock_time)
+          end
+        end
+      rescue StandardError
+        release_unclaimed_reservations
+        raise
+      end
+
+      # Release any messages reserved with the scheduler which were not actually claimed
+      # (because another worker claimed them first or the claim failed)
+      #
+      # @return [void]
+      def release_unclaimed_reservations
+        claimed_ids = (@messages_to_process || []).map(&:id)
+        @reserved_messages&.each do |candidate|
+          next if claimed_ids.include?(candidate.id)
+
+          DeliveryScheduler.instance.release(candidate.domain, candidate.ip_address_id)
+        end
+        @reserved_messages = nil
+      end
+
+      # Process the claimed messages. Messages which share a batch key and IP address are
+      # passed to the dequeuer together so they are all delivered by this thread using
+      # the same dequeuer state.
+      #
+      # @return [void]
+      def process_claimed_messages
+        groups = @messages_to_process.group_by do |message|
+          message.batch_key ? [message.batch_key, message.ip_address_id] : [nil, message.id]
+        end
+
+        groups.each_value do |messages|
+          work_completed!
+          MessageDequeuer.process(messages.first, logger: logger, batch: messages.drop(1))
+        ensure
+          if DeliveryScheduler.enabled?
+            messages.each { |message| DeliveryScheduler.instance.release(message.domain, message.ip_address_id) }
+          end
+        end
+      end
+
     end
   end
 end
@@ -8,9 +8,15 @@ module Worker
         @lock_time = Time.current
         @locker = Postal.locker_name_with_suffix(SecureRandom.hex(8))
 
-        lock_request_for_processing
-        obtain_locked_requests
-        process_requests
+        if Postal::Config.postal.concurrent_webhook_delivery?
+          claim_requests_for_processing
+          obtain_locked_requests
+          dispatch_requests
+        else
+          lock_request_for_processing
+          obtain_locked_requests
+          process_requests
+        end
       end
 
       private
@@ -44,6 +50,28 @@ module Worker
         end
       end
 
+      # Obtain a batch of webhook requests from the database for processing
+      #
+      # @return [void]
+      def claim_requests_for_processing
+        WebhookRequest.unlocked
+                      .ready
+                      .order(:id)
+                      .limit(Postal::Config.postal.webhook_delivery_batch_size)
+                      .update_all(locked_by: @locker, locked_at: @lock_time)
+      end
+
+      # Deliver all the requests we obtained concurrently and wait for them to finish
+      #
+      # @return [void]
+      def dispatch_requests
+        requests = @requests_to_process.to_a
+        return if requests.empty?
+
+        work_completed!
+        WebhookDispatcher.instance.dispatch(requests)
+      end
+
     end
   end
 end
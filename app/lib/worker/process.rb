@@ -7,7 +7,8 @@ module Worker
   #
   # The 'Jobs' here allow for the continuous monitoring of a database table (or queue) and processing of any new items
   # which may appear in that. The polling takes place every 5 seconds by default and the work is able to run multiple
-  # threads to look for and process this work.
+  # threads to look for and process this work. When wakeup notifications are enabled, idle work threads are also woken
+  # as soon as another process notifies (through the WorkNotifier) that new work has been created.
   #
   # Scheduled Tasks allow for code to be executed on a ROUGH schedule. This is used for administrative tasks.  A single
   # thread will run within each worker process and attempt to acquire the 'tasks' role. If successful it will run all
@@ -53,6 +54,7 @@ module Worker
       @work_sleep_time = work_sleep_time
       @task_sleep_time = task_sleep_time
       @threads = []
+      @wakeup_pipes = {}
 
       setup_prometheus
     end
@@ -61,20 +63,25 @@ module Worker
       logger.tagged(component: "worker") do
         setup_traps
         ensure_connection_pool_size_is_suitable
+        ensure_message_db_pool_size_is_suitable
         start_work_threads
         start_tasks_thread
+        start_wakeup_listener_thread
         wait_for_threads
+        SMTPSender.pool&.shutdown
+        Postal::MessageDB::Database.statistics_aggregator&.stop
       end
     end
 
     private
 
-    # Install signal traps to allow for graceful shutdown
+    # Install signal traps to allow for graceful shutdown and to start and stop the sampling profiler
     #
     # @return [void]
     def setup_traps
       trap("INT") { receive_signal("INT") }
       trap("TERM") { receive_signal("TERM") }
+      SamplingProfiler.install("worker")
     end
 
     # Receive a signal and set the shutdown flag
@@ -91,10 +98,31 @@ module Worker
     # requested during the wait, it will return immediately otherwise it will return false when it has finished
     # waiting for the period of time.
     #
+    # If a wakeup IO is provided, the wait will also end (returning false) as soon as that IO becomes readable.
+    #
     # @param [Integer] wait_time The time to wait for
+    # @param [IO, nil] wakeup_io An IO which will become readable when the wait should end early
     # @return [Boolean]
-    def shutdown_after_wait?(wait_time)
-      @exit_pipe_read.wait_readable(wait_time) ? true : false
+    def shutdown_after_wait?(wait_time, wakeup_io: nil)
+      return @exit_pipe_read.wait_readable(wait_time) ? true : false if wakeup_io.nil?
+
+      readable, = IO.select([@exit_pipe_read, wakeup_io], nil, nil, wait_time)
+      return false if readable.nil?
+      return true if readable.include?(@exit_pipe_read)
+
+      drain_wakeup_pipe(wakeup_io)
+      false
+    end
+
+    # Read everything that has been written to a wakeup pipe so that it will block again
+    # on the next wait.
+    #
+    # @param [IO] io
+    # @return [void]
+    def drain_wakeup_pipe(io)
+      loop { io.read_nonblock(64) }
+    rescue IO::WaitReadable, EOFError
+      nil
     end
 
     # Ensure that the connection pool is big enough for the number of threads
@@ -104,6 +132,8 @@ module Worker
     def ensure_connection_pool_size_is_suitable
       current_pool_size = ActiveRecord::Base.connection_pool.size
       desired_pool_size = @thread_count + 3
+      # Webhook delivery threads each need their own connection too
+      desired_pool_size += Postal::Config.postal.webhook_delivery_concurrency if Postal::Config.postal.concurrent_webhook_delivery?
 
       return if current_pool_size >= desired_pool_size
 
@@ -114,6 +144,28 @@ module Worker
       Postal.change_database_connection_pool_size(desired_pool_size)
     end
 
+    # Ensure that the message DB connection pool is big enough for all the threads in this
+    # process which may use it at the same time. Otherwise, threads would wait for a connection
+    # and eventually fail with a checkout timeout.
+    #
+    # @return [void]
+    def ensure_message_db_pool_size_is_suitable
+      pool = Postal::MessageDB::Database.connection_pool
+      # The tasks thread and the statistics flushing thread may need connections too
+      desired_pool_size = @thread_count + 2
+      desired_pool_size += Postal::Config.postal.message_retention_concurrency
+      desired_pool_size += Postal::Config.postal.webhook_delivery_concurrency if Postal::Config.postal.concurrent_webhook_delivery?
+      if Postal::Config.postal.parallel_message_inspection?
+        desired_pool_size += @thread_count * Postal::MessageInspector.inspectors.size
+      end
+
+      return if pool.max_size >= desired_pool_size
+
+      logger.warn "message DB connection pool size (#{pool.max_size}) is less than the number of threads which " \
+                  "may use it, increasing message DB connection pool size to #{desired_pool_size}"
+      pool.max_size = desired_pool_size
+    end
+
     # Wait for all threads to complete
     #
     # @return [void]
@@ -135,13 +187,15 @@ module Worker
     #
     # @return [void]
     def start_work_thread(index)
+      wakeup_read, @wakeup_pipes[index] = IO.pipe if WorkNotifier.enabled?
+
       @threads << Thread.new do
         logger.tagged(component: "worker", thread: "work#{index}") do
           logger.info "started work thread #{index}"
           loop do
             work_completed = work(index)
 
-            if shutdown_after_wait?(work_completed ? 0 : @work_sleep_time)
+            if shutdown_after_wait?(work_completed ? 0 : @work_sleep_time, wakeup_io: wakeup_read)
               break
             end
           end
@@ -193,6 +247,7 @@ module Worker
         logger.tagged(component: "worker", thread: "tasks") do
           loop do
             run_tasks
+            Postal::MessageDB::Database.connection_pool.reap
 
             if shutdown_after_wait?(@task_sleep_time)
               break
@@ -209,6 +264,48 @@ module Worker
       end
     end
 
+    # Start a thread which listens for wakeup notifications from other processes and wakes
+    # all the work threads whenever one is received. If notifications are not enabled, the
+    # work threads will continue to poll on their usual schedule.
+    #
+    # @return [void]
+    def start_wakeup_listener_thread
+      return unless WorkNotifier.enabled?
+
+      socket = WorkNotifier.open_listener_socket
+      logger.info "listening for wakeup notifications on port #{socket.local_address.ip_port}"
+
+      @threads << Thread.new do
+        logger.tagged(component: "worker", thread: "wakeup") do
+          loop do
+            readable, = IO.select([socket, @exit_pipe_read])
+            break if readable.include?(@exit_pipe_read)
+
+            next if WorkNotifier.drain(socket).zero?
+
+            increment_prometheus_counter :postal_worker_wakeup_notifications
+            wake_work_threads
+          end
+        ensure
+          socket.close
+        end
+      end
+    rescue StandardError => e
+      logger.error "could not start wakeup listener, work threads will poll only: #{e.class} (#{e.message})"
+    end
+
+    # Wake all work threads which are currently waiting for work
+    #
+    # @return [void]
+    def wake_work_threads
+      @wakeup_pipes.each_value do |pipe|
+        pipe.write_nonblock(".")
+      rescue IO::WaitWritable
+        # The pipe is full which means the thread already has a pending wakeup
+        nil
+      end
+    end
+
     # Run the tasks. This will attempt to acquire the tasks role and if successful it will all the registered
     # tasks if they are due to be run.
     #
@@ -309,8 +406,28 @@ module Worker
                                     docstring: "The time taken to process tasks (in seconds)",
                                     labels: [:task]
 
+      register_prometheus_counter :postal_worker_wakeup_notifications,
+                                  docstring: "The number of wakeup notifications received by the worker"
+
       register_prometheus_histogram :postal_message_queue_latency,
                                     docstring: "The length of time between a message being queued and being dequeued (in seconds)"
+
+      register_prometheus_histogram :postal_worker_queued_message_claim_latency,
+                                    docstring: "The time taken to claim a batch of queued messages (in seconds)"
+
+      register_prometheus_histogram :postal_worker_queued_message_claim_size,
+                                    docstring: "The number of queued messages claimed in a single batch",
+                                    buckets: [0, 1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+      DNSResolver::Cache.register_prometheus_metrics
+      Postal::MessageDB::StatisticsAggregator.register_prometheus_metrics
+      Postal::MessageDB::ConnectionPool.register_prometheus_metrics
+      Postal::MessageInspection::Cache.register_prometheus_metrics
+      Postal::MessageParser::Cache.register_prometheus_metrics
+      ProcessMessageRetentionScheduledTask.register_prometheus_metrics
+      CheckAllDNSScheduledTask.register_prometheus_metrics
+      DeliveryScheduler.register_prometheus_metrics
+      MessageDequeuer::StageTimings.register_prometheus_metrics
     end
 
   end
@@ -13,6 +13,14 @@ module HasDNSChecks
   end
 
   def check_dns(source = :manual)
+    run_dns_checks
+    save!
+    dns_checks_saved(source)
+    dns_ok?
+  end
+
+  # Run all the DNS checks and update the status of each record without saving them.
+  def run_dns_checks
     check_spf_record
     check_dkim_record
     check_mx_records
@@ -21,26 +29,41 @@ module HasDNSChecks
     check_mta_sts_record if respond_to?(:mta_sts_enabled)
     check_tls_rpt_record if respond_to?(:tls_rpt_enabled)
     self.dns_checked_at = Time.now
-    save!
-    if source == :auto && !dns_ok? && owner.is_a?(Server)
-      WebhookRequest.trigger(owner, "DomainDNSError", {
-        server: owner.webhook_hash,
-        domain: name,
-        uuid: uuid,
-        dns_checked_at: dns_checked_at.to_f,
-        spf_status: spf_status,
-        spf_error: spf_error,
-        dkim_status: dkim_status,
-        dkim_error: dkim_error,
-        mx_status: mx_status,
-        mx_error: mx_error,
-        return_path_status: return_path_status,
-        return_path_error: return_path_error,
-        dmarc_status: dmarc_status,
-        dmarc_error: dmarc_error
-      })
-    end
-    dns_ok?
+  end
+
+  # Called once the results of the DNS checks have been saved. If the checks were run
+  # automatically and found a problem, the owner's webhooks are notified.
+  def dns_checks_saved(source)
+    return unless source == :auto && !dns_ok? && owner.is_a?(Server)
+
+    WebhookRequest.trigger(owner, "DomainDNSError", {
+      server: owner.webhook_hash,
+      domain: name,
+      uuid: uuid,
+      dns_checked_at: dns_checked_at.to_f,
+      spf_status: spf_status,
+      spf_error: spf_error,
+      dkim_status: dkim_status,
+      dkim_error: dkim_error,
+      mx_status: mx_status,
+      mx_error: mx_error,
+      return_path_status: return_path_status,
+      return_path_error: return_path_error,
+      dmarc_status: dmarc_status,
+      dmarc_error: dmarc_error
+    })
+  end
+
+  # Return the lookups which the DNS checks will make. These can be made in advance
+  # (and at the same time) so that the checks can use the cached results.
+  #
+  # @return [Array<Array(Symbol, String)>] the resolver method and name for each lookup
+  def dns_check_lookups
+    lookups = [[:txt, name], [:txt, "#{dkim_record_name}.#{name}"], [:mx, name], [:cname, return_path_domain]]
+    lookups << [:txt, "_dmarc.#{name}"] if Postal::Config.dns.dmarc_preferred_dns_entry.present?
+    lookups << [:txt, mta_sts_record_name] if respond_to?(:mta_sts_enabled) && mta_sts_enabled
+    lookups << [:txt, tls_rpt_record_name] if respond_to?(:tls_rpt_enabled) && tls_rpt_enabled
+    lookups
   end
 
   #
@@ -102,7 +102,7 @@ class Domain < ApplicationRecord
   def dkim_key
     return nil unless dkim_private_key
 
-    @dkim_key ||= OpenSSL::PKey::RSA.new(dkim_private_key)
+    @dkim_key ||= DKIMHeader.private_key(id, dkim_private_key)
   end
 
   def to_param
@@ -153,14 +153,21 @@ class Domain < ApplicationRecord
     "_dmarc.#{name}"
   end
 
+  # A cache to use for this domain's DNS lookups. This allows lookups to be shared between
+  # many domains which are being checked together. Without one, lookups are never cached so
+  # that checks always see the current records.
+  #
+  # @return [DNSResolver::Cache, nil]
+  attr_accessor :dns_cache
+
   # Returns a DNSResolver instance that can be used to perform DNS lookups needed for
   # the verification and DNS checking for this domain.
   #
   # @return [DNSResolver]
   def resolver
-    return DNSResolver.local if Postal::Config.postal.use_local_ns_for_domain_verification?
+    return DNSResolver.local(cache: dns_cache) if Postal::Config.postal.use_local_ns_for_domain_verification?
 
-    @resolver ||= DNSResolver.for_domain(name)
+    @resolver ||= DNSResolver.for_domain(name, cache: dns_cache)
   end
 
   def dns_verification_string
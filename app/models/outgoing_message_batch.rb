@@ -0,0 +1,60 @@
+# frozen_string_literal: true
+
+# Creates the messages for many outgoing message prototypes using as few queries as possible.
+# Prototypes are added one at a time and, whenever enough messages are waiting, the messages
+# for all the waiting prototypes are created together in a single transaction (see
+# Postal::MessageDB::Message.create_all).
+class OutgoingMessageBatch
+
+  attr_reader :server
+  attr_reader :batch_size
+
+  # @param [Server] server
+  # @param [Integer] batch_size The number of messages to create in each transaction
+  def initialize(server, batch_size: Postal::Config.postal.bulk_send_batch_size)
+    @server = server
+    @batch_size = batch_size
+    @pending = []
+    @pending_messages = 0
+  end
+
+  # Add a prototype to the batch. Once its messages have been created, the block is called
+  # with a hash of the messages which were created (keyed by address) or, if they couldn't
+  # be created, the exception which was raised.
+  #
+  # @param [OutgoingMessagePrototype] prototype A valid prototype
+  # @yieldparam [Hash{String => Hash}, nil] messages
+  # @yieldparam [StandardError, nil] exception
+  # @return [void]
+  def add(prototype, &block)
+    messages = prototype.build_messages
+    @pending << [messages, block]
+    @pending_messages += messages.size
+    flush if @pending_messages >= @batch_size
+  end
+
+  # Create the messages for all the prototypes which are waiting
+  #
+  # @return [void]
+  def flush
+    return if @pending.empty?
+
+    pending = @pending
+    @pending = []
+    @pending_messages = 0
+
+    begin
+      Postal::MessageDB::Message.create_all(@server.message_db, pending.flat_map { |messages, _| messages.values })
+    rescue StandardError => e
+      Postal.logger.error "failed to create batch of messages: #{e.class} (#{e.message})", server_id: @server.id
+      Sentry.capture_exception(e) if defined?(Sentry)
+      pending.each { |_, block| block.call(nil, e) }
+      return
+    end
+
+    pending.each do |messages, block|
+      block.call(messages.transform_values { |m| { id: m.id, token: m.token } }, nil)
+    end
+  end
+
+end
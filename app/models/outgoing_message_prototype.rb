@@ -183,7 +183,21 @@ class OutgoingMessagePrototype
     end
   end
 
+  def build_messages
+    all_addresses.each_with_object({}) do |address, hash|
+      if address = Postal::Helpers.strip_name_from_address(address)
+        hash[address] = build_message(address)
+      end
+    end
+  end
+
   def create_message(address)
+    message = build_message(address)
+    message.save
+    { id: message.id, token: message.token }
+  end
+
+  def build_message(address)
     message = @server.message_db.new_message
     message.scope = "outgoing"
     message.rcpt_to = address
@@ -194,8 +208,7 @@ class OutgoingMessagePrototype
     message.credential_id = credential&.id
     message.received_with_ssl = true
     message.bounce = @bounce
-    message.save
-    { id: message.id, token: message.token }
+    message
   end
 
 end
@@ -36,6 +36,8 @@ class QueuedMessage < ApplicationRecord
 
   before_create :allocate_ip_address
 
+  after_commit(on: :create) { WorkNotifier.notify }
+
   scope :ready_with_delayed_retry, -> { where("retry_after IS NULL OR retry_after < ?", 30.seconds.ago) }
   scope :with_stale_lock, -> { where("locked_at IS NOT NULL AND locked_at < ?", Postal::Config.postal.queued_message_lock_stale_days.days.ago) }
 
@@ -7,10 +7,16 @@
 #  id             :bigint           not null, primary key
 #  name           :string(255)
 #  next_run_after :datetime
+#  checkpoint     :text(65535)
 #
 # Indexes
 #
 #  index_scheduled_tasks_on_name  (name) UNIQUE
 #
 class ScheduledTask < ApplicationRecord
+
+  # Tasks which can be interrupted part way through can store their progress here so that
+  # they can continue from where they left off when they are next run
+  serialize :checkpoint, type: Hash
+
 end
@@ -6,6 +6,7 @@
 #
 #  id                                 :integer          not null, primary key
 #  allow_sender                       :boolean          default(FALSE)
+#  compress_raw_messages              :boolean          default(FALSE)
 #  deleted_at                         :datetime
 #  domains_not_to_click_track         :text(65535)
 #  log_smtp_data                      :boolean          default(FALSE)
@@ -210,6 +211,24 @@ class Server < ApplicationRecord
     send_volume >= send_limit
   end
 
+  # Record whether the server's send limit is currently being exceeded or approached. The
+  # send_limit_*_at columns are only updated when the status changes or when the recorded
+  # time is more than a minute old (so that recent activity can still be detected when
+  # sending notifications) rather than for every message.
+  #
+  # @param [Symbol, nil] status :exceeded, :approaching or nil
+  # @return [void]
+  def record_send_limit_status(status)
+    attributes = {
+      send_limit_exceeded_at: status == :exceeded ? current_send_limit_time(send_limit_exceeded_at) : nil,
+      send_limit_approaching_at: status == :approaching ? current_send_limit_time(send_limit_approaching_at) : nil
+    }
+    attributes.reject! { |key, value| self[key] == value }
+    return if attributes.empty?
+
+    update_columns(attributes)
+  end
+
   def send_limit_warning(type)
     if organization.notification_addresses.present?
       AppMailer.send("server_send_limit_#{type}", self).deliver
@@ -316,6 +335,12 @@ class Server < ApplicationRecord
     errors.add :ip_pool_id, "must belong to the organization"
   end
 
+  def current_send_limit_time(recorded_time)
+    return recorded_time if recorded_time && recorded_time > 1.minute.ago
+
+    Time.now
+  end
+
   class << self
 
     def triggered_send_limit(type)
@@ -54,6 +54,13 @@ class TrackDomain < ApplicationRecord
   end
 
   def check_dns
+    run_dns_checks
+    save!
+    dns_ok?
+  end
+
+  # Check the CNAME record and update the status without saving it.
+  def run_dns_checks
     records = domain.resolver.cname(full_name)
     if records.empty?
       self.dns_status = "Missing"
@@ -66,8 +73,13 @@ class TrackDomain < ApplicationRecord
       self.dns_error = "There is a CNAME record at #{full_name} but it points to #{records.first} which is incorrect. It should point to #{Postal::Config.dns.track_domain}."
     end
     self.dns_checked_at = Time.now
-    save!
-    dns_ok?
+  end
+
+  # Return the lookups which the DNS checks will make (see HasDNSChecks#dns_check_lookups).
+  #
+  # @return [Array<Array(Symbol, String)>]
+  def dns_check_lookups
+    [[:cname, full_name]]
   end
 
   def use_ssl?
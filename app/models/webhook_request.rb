@@ -37,6 +37,8 @@ class WebhookRequest < ApplicationRecord
 
   serialize :payload, type: Hash
 
+  after_commit(on: :create) { WorkNotifier.notify }
+
   class << self
 
     def trigger(server, event, payload = {})
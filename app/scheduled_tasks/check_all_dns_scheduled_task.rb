@@ -1,17 +1,204 @@
 # frozen_string_literal: true
 
+# Checks the DNS records of every domain and track domain which hasn't been checked in the
+# last hour.
+#
+# Lookups and checks are run by a number of threads. Each domain's lookups are queued
+# separately so they can all be made at the same time and, once they have completed, the
+# domain's checks are queued and run against the cached results. All lookups made during a
+# run share a cache so names which are looked up for many domains (such as nameservers) are
+# only resolved once.
+#
+# Results are passed back to this thread and saved in batches.
 class CheckAllDNSScheduledTask < ApplicationScheduledTask
 
+  extend HasPrometheusMetrics
+  include HasPrometheusMetrics
+
+  # Results are cached for the duration of a run (subject to each record's TTL) so these
+  # limits only need to be large enough that entries aren't evicted mid-run.
+  RUN_CACHE_MAX_ENTRIES = 100_000
+  RUN_CACHE_TTL = 3600
+
   def call
-    Domain.where.not(dns_checked_at: nil).where("dns_checked_at <= ?", 1.hour.ago).each do |domain|
-      logger.info "checking DNS for domain: #{domain.name}"
-      domain.check_dns(:auto)
+    started_at = Process.clock_gettime(Process::CLOCK_MONOTONIC)
+
+    domains = Domain.where.not(dns_checked_at: nil).where("dns_checked_at <= ?", 1.hour.ago)
+    track_domains = TrackDomain.where("dns_checked_at IS NULL OR dns_checked_at <= ?", 1.hour.ago).includes(:domain)
+
+    @total = domains.count + track_domains.count
+    @completed = 0
+    set_prometheus_gauge :postal_dns_checks_remaining, @total
+    logger.info "checking DNS for #{@total} domain(s)"
+
+    records = Enumerator.new do |yielder|
+      domains.find_each { |domain| yielder << domain }
+      track_domains.find_each { |track_domain| yielder << track_domain }
+    end
+    errors = process(records)
+
+    duration = Process.clock_gettime(Process::CLOCK_MONOTONIC) - started_at
+    set_prometheus_gauge :postal_dns_check_run_duration, duration
+    logger.info "checked DNS for #{@completed} domain(s) in #{duration.round(1)}s (#{errors.size} error(s))"
+    raise errors.first if errors.any?
+  end
+
+  private
+
+  # Check the given records using a number of threads. Only a limited number of records are
+  # in progress at once so that they aren't all loaded into memory together.
+  #
+  # @param [Enumerable<Domain, TrackDomain>] records
+  # @return [Array<StandardError>] any errors raised while checking records
+  def process(records)
+    @cache = DNSResolver::Cache.new(max_entries: RUN_CACHE_MAX_ENTRIES, negative_ttl: RUN_CACHE_TTL, max_ttl: RUN_CACHE_TTL)
+    @jobs = Queue.new
+    @progress = Queue.new
+    @pending_lookups = {}.compare_by_identity
+    @mutex = Mutex.new
+    @in_progress = 0
+    @batch = []
+    @errors = []
+
+    concurrency = Postal::Config.dns.check_concurrency
+    threads = Array.new(concurrency) do
+      Thread.new do
+        while job = @jobs.pop
+          run_job(*job)
+        end
+      end
     end
 
-    TrackDomain.where("dns_checked_at IS NULL OR dns_checked_at <= ?", 1.hour.ago).includes(:domain).each do |domain|
-      logger.info "checking DNS for track domain: #{domain.full_name}"
-      domain.check_dns
+    records.each do |record|
+      handle_progress(*@progress.pop) while @in_progress >= concurrency * 2
+      @in_progress += 1
+      @jobs << [:prepare, record]
     end
+    handle_progress(*@progress.pop) while @in_progress.positive?
+    save_batch
+    @errors
+  ensure
+    @jobs&.close
+    threads&.each(&:join)
+  end
+
+  # Run a job in one of the threads.
+  #
+  # * :prepare - find the nameservers for the record's domain and queue its lookups
+  # * :lookup - make a single lookup, queueing the checks once it is the last one
+  # * :check - run the checks (which will use the cached lookups)
+  def run_job(type, record, lookup = nil)
+    case type
+    when :prepare
+      domain = dns_domain(record)
+      domain.dns_cache = @cache
+      domain.resolver
+
+      lookups = record.dns_check_lookups
+      return @jobs << [:check, record] if lookups.empty?
+
+      @mutex.synchronize { @pending_lookups[record] = lookups.size }
+      lookups.each { |l| @jobs << [:lookup, record, l] }
+    when :lookup
+      begin
+        dns_domain(record).resolver.public_send(*lookup)
+      rescue StandardError
+        # The checks will make this lookup again and report the error
+      end
+
+      remaining = @mutex.synchronize { @pending_lookups[record] -= 1 }
+      return unless remaining.zero?
+
+      @mutex.synchronize { @pending_lookups.delete(record) }
+      @jobs << [:check, record]
+    when :check
+      record.run_dns_checks
+      @progress << [:checked, record]
+    end
+  rescue StandardError => e
+    @progress << [:error, record, e]
+  end
+
+  def handle_progress(event, record, error = nil)
+    @in_progress -= 1
+    case event
+    when :checked
+      @batch << record
+      save_batch if @batch.size >= Postal::Config.dns.check_batch_size
+    when :error
+      record_error(record, error)
+    end
+  end
+
+  # Save the results for the records in the current batch in a single transaction. If the
+  # transaction fails, each record is saved on its own so one bad record doesn't lose the
+  # results for the others.
+  def save_batch
+    return if @batch.empty?
+
+    batch = @batch
+    @batch = []
+
+    begin
+      ActiveRecord::Base.transaction { batch.each(&:save!) }
+      saved = batch
+    rescue StandardError
+      saved = batch.select do |record|
+        record.save!
+        true
+      rescue StandardError => e
+        record_error(record, e)
+        false
+      end
+    end
+
+    saved.each do |record|
+      record.dns_checks_saved(:auto) if record.respond_to?(:dns_checks_saved)
+      logger.info "checked DNS for #{description(record)}: #{record.dns_ok? ? 'OK' : 'failing'}"
+      increment_prometheus_counter :postal_dns_checks, labels: { type: metric_type(record), result: record.dns_ok? ? "ok" : "failing" }
+      completed
+    end
+  end
+
+  def record_error(record, error)
+    logger.error "error checking DNS for #{description(record)}: #{error.class} (#{error.message})"
+    increment_prometheus_counter :postal_dns_checks, labels: { type: metric_type(record), result: "error" }
+    @errors << error
+    completed
+  end
+
+  def completed
+    @completed += 1
+    set_prometheus_gauge :postal_dns_checks_remaining, [@total - @completed, 0].max
+  end
+
+  # Track domains are looked up using the resolver for the domain they belong to
+  def dns_domain(record)
+    record.is_a?(TrackDomain) ? record.domain : record
+  end
+
+  def description(record)
+    record.is_a?(TrackDomain) ? "track domain: #{record.full_name}" : "domain: #{record.name}"
+  end
+
+  def metric_type(record)
+    record.is_a?(TrackDomain) ? "track_domain" : "domain"
+  end
+
+  class << self
+
+    def register_prometheus_metrics
+      register_prometheus_counter :postal_dns_checks,
+                                  docstring: "The number of domains whose DNS records have been checked automatically",
+                                  labels: [:type, :result]
+
+      register_prometheus_gauge :postal_dns_checks_remaining,
+                                docstring: "The number of domains still to be checked by the current DNS check run"
+
+      register_prometheus_gauge :postal_dns_check_run_duration,
+                                docstring: "The number of seconds taken by the last DNS check run"
+    end
+
   end
 
 end
@@ -1,29 +1,144 @@
 # frozen_string_literal: true
 
+# Removes messages (and raw message data) which are older than each server's retention
+# settings. Servers are processed several at a time and rows are removed in chunks, at a
+# limited rate, so that no table is locked for long enough to hold up message delivery.
+#
+# Progress is stored in the task's checkpoint as each chunk is removed. If the process is
+# stopped part way through, the next run on the same day will skip the servers which have
+# already been completed and continue after the last message removed for the others.
+# Checkpoints left by a run on an earlier day are ignored.
 class ProcessMessageRetentionScheduledTask < ApplicationScheduledTask
 
+  extend HasPrometheusMetrics
+  include HasPrometheusMetrics
+
   def call
-    Server.all.each do |server|
-      if server.raw_message_retention_days
-        # If the server has a maximum number of retained raw messages, remove any that are older than this
-        logger.info "Tidying raw messages (by days) for #{server.permalink} (ID: #{server.id}). Keeping #{server.raw_message_retention_days} days."
-        server.message_db.provisioner.remove_raw_tables_older_than(server.raw_message_retention_days)
-      end
+    @scheduled_task = ScheduledTask.find_by(name: self.class.name)
+    @checkpoint = @scheduled_task&.checkpoint.presence
+    if @checkpoint.nil? || @checkpoint["date"] != run_date
+      @checkpoint = { "date" => run_date, "completed_server_ids" => [], "last_message_ids" => {} }
+    end
+
+    servers = Server.all.reject { |server| @checkpoint["completed_server_ids"].include?(server.id) }
+    if @checkpoint["completed_server_ids"].any?
+      logger.info "Resuming message retention. #{@checkpoint['completed_server_ids'].size} server(s) already completed, #{servers.size} remaining."
+    end
+
+    set_prometheus_gauge :postal_message_retention_servers_remaining, servers.size
+    errors = process(servers)
+    save_checkpoint(nil)
+    raise errors.first if errors.any?
+  end
+
+  private
 
-      if server.raw_message_retention_size
-        logger.info "Tidying raw messages (by size) for #{server.permalink} (ID: #{server.id}). Keeping #{server.raw_message_retention_size} MB of data."
-        server.message_db.provisioner.remove_raw_tables_until_less_than_size(server.raw_message_retention_size * 1024 * 1024)
+  # Tidy the given servers using a number of threads. Progress is passed back to this thread
+  # so that the checkpoint is only ever saved from here.
+  #
+  # @param [Array<Server>] servers
+  # @return [Array<StandardError>] any errors raised while tidying servers
+  def process(servers)
+    queue = Queue.new
+    servers.each { |server| queue << server }
+    queue.close
+
+    progress = Queue.new
+    thread_count = [Postal::Config.postal.message_retention_concurrency, servers.size].min
+    thread_count.times do
+      Thread.new do
+        while server = queue.pop
+          begin
+            tidy(server) { |last_message_id| progress << [:chunk, server, last_message_id] }
+            progress << [:completed, server]
+          rescue StandardError => e
+            progress << [:error, server, e]
+          end
+        end
+      ensure
+        progress << [:finished]
       end
+    end
 
-      if server.message_retention_days
-        logger.info "Tidying messages for #{server.permalink} (ID: #{server.id}). Keeping #{server.message_retention_days} days."
-        server.message_db.provisioner.remove_messages(server.message_retention_days)
+    errors = []
+    finished_threads = 0
+    while finished_threads < thread_count
+      event, server, value = progress.pop
+      case event
+      when :chunk
+        @checkpoint["last_message_ids"][server.id] = value
+        save_checkpoint(@checkpoint)
+      when :completed
+        @checkpoint["completed_server_ids"] << server.id
+        @checkpoint["last_message_ids"].delete(server.id)
+        save_checkpoint(@checkpoint)
+        set_prometheus_gauge :postal_message_retention_servers_remaining, servers.size - @checkpoint["completed_server_ids"].size
+      when :error
+        logger.error "Error tidying messages for #{server.permalink} (ID: #{server.id}): #{value.class} (#{value.message})"
+        errors << value
+      when :finished
+        finished_threads += 1
       end
     end
+    errors
   end
 
-  def self.next_run_after
-    three_am
+  def tidy(server)
+    options = {
+      chunk_size: Postal::Config.postal.message_retention_chunk_size,
+      rows_per_second: Postal::Config.postal.message_retention_rows_per_second
+    }
+
+    if server.raw_message_retention_days
+      # If the server has a maximum number of retained raw messages, remove any that are older than this
+      logger.info "Tidying raw messages (by days) for #{server.permalink} (ID: #{server.id}). Keeping #{server.raw_message_retention_days} days."
+      server.message_db.provisioner.remove_raw_tables_older_than(server.raw_message_retention_days, **options)
+    end
+
+    if server.raw_message_retention_size
+      logger.info "Tidying raw messages (by size) for #{server.permalink} (ID: #{server.id}). Keeping #{server.raw_message_retention_size} MB of data."
+      server.message_db.provisioner.remove_raw_tables_until_less_than_size(server.raw_message_retention_size * 1024 * 1024, **options)
+    end
+
+    return unless server.message_retention_days
+
+    if last_message_id = @checkpoint["last_message_ids"][server.id]
+      logger.info "Tidying messages for #{server.permalink} (ID: #{server.id}). Keeping #{server.message_retention_days} days. Resuming after message #{last_message_id}."
+    else
+      logger.info "Tidying messages for #{server.permalink} (ID: #{server.id}). Keeping #{server.message_retention_days} days."
+    end
+
+    rows = server.message_db.provisioner.remove_messages_in_chunks(server.message_retention_days, after_id: last_message_id, **options) do |last_id, chunk_rows|
+      increment_prometheus_counter :postal_message_retention_rows_deleted, by: chunk_rows
+      yield last_id
+    end
+    logger.info "Removed #{rows} rows for #{server.permalink} (ID: #{server.id})"
+  end
+
+  # The date (in UTC) of this run. Checkpoints are only used by runs on the same day so that
+  # a checkpoint from an earlier run can never cause servers to be skipped.
+  def run_date
+    @run_date ||= Time.now.utc.to_date.iso8601
+  end
+
+  def save_checkpoint(checkpoint)
+    @scheduled_task&.update!(checkpoint: checkpoint)
+  end
+
+  class << self
+
+    def next_run_after
+      three_am
+    end
+
+    def register_prometheus_metrics
+      register_prometheus_counter :postal_message_retention_rows_deleted,
+                                  docstring: "The number of message rows (including deliveries, clicks, loads and spam checks) removed because they were older than the retention period"
+
+      register_prometheus_gauge :postal_message_retention_servers_remaining,
+                                docstring: "The number of servers still to be tidied by the current message retention run"
+    end
+
   end
 
 end
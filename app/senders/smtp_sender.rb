@@ -3,6 +3,7 @@
 class SMTPSender < BaseSender
 
   attr_reader :endpoints
+  attr_reader :messages_sent
 
   # @param domain [String] the domain to send mesages to
   # @param source_ip_address [IPAddress] the IP address to send messages from
@@ -22,6 +23,8 @@ class SMTPSender < BaseSender
     # Generate a log ID which can be used if none has been provided to trace
     # this SMTP session.
     @log_id = log_id || SecureRandom.alphanumeric(8).upcase
+    # The number of messages which have been sent through this sender's session
+    @messages_sent = 0
   end
 
   def start
@@ -72,6 +75,24 @@ class SMTPSender < BaseSender
     @endpoints.each(&:finish_smtp_session)
   end
 
+  # Is there an SMTP session open which could be used to send further messages?
+  #
+  # @return [Boolean]
+  def connected?
+    @current_endpoint&.smtp_client&.started? ? true : false
+  end
+
+  # Reset the current SMTP session ready for a new transaction and check that the
+  # remote server is still responding. If the session cannot be reset it is closed.
+  #
+  # @return [Boolean] whether the session is still usable
+  def reset
+    return false unless connected?
+
+    @current_endpoint.reset_smtp_session
+    connected?
+  end
+
   private
 
   # Take a message and attempt to send it to the SMTP server that we are
@@ -86,6 +107,7 @@ class SMTPSender < BaseSender
   # @return [SendResult]
   def send_message_to_smtp_client(raw_message, mail_from, rcpt_to, retry_on_connection_error: true)
     start_time = Time.now
+    @messages_sent += 1
     smtp_result = @current_endpoint.send_message(raw_message, mail_from, [rcpt_to])
     logger.info "Accepted by #{@current_endpoint} for #{rcpt_to}"
     create_result("Sent", start_time) do |r|
@@ -235,6 +257,18 @@ class SMTPSender < BaseSender
 
   class << self
 
+    # Return the process-wide pool of SMTP senders which allows sessions to be reused
+    # across batches and threads. Returns nil if pooling has been disabled.
+    #
+    # @return [SMTPSender::Pool, nil]
+    def pool
+      return nil unless Postal::Config.smtp_client.pool_enabled?
+
+      @pool ||= Pool.new(max_connections_per_destination: Postal::Config.smtp_client.pool_max_connections_per_destination,
+                         max_messages_per_session: Postal::Config.smtp_client.pool_max_messages_per_session,
+                         idle_timeout: Postal::Config.smtp_client.pool_idle_timeout)
+    end
+
     # Return an array of SMTP relays as configured. Returns nil
     # if no SMTP relays are configured.
     #
@@ -0,0 +1,188 @@
+# frozen_string_literal: true
+
+class SMTPSender
+  # A process-wide pool of started SMTP senders. Senders are checked out by a single thread,
+  # used to send one or more messages and then checked back in so that their SMTP session
+  # can be reused for later messages to the same destination from the same source IP. This
+  # avoids the TCP connection, EHLO and STARTTLS handshake for every batch of messages.
+  #
+  # Sessions which have been idle for too long or which have sent the maximum number of
+  # messages are closed rather than reused. Idle sessions are reset (with RSET) before
+  # being handed out again which also checks that the remote server is still responding.
+  #
+  # The connection limit only applies to pooled sessions. Checking out a sender never waits:
+  # when every session for a key is in use an error is raised straight away so that the
+  # caller can use a sender which isn't pooled instead.
+  class Pool
+
+    class ConnectionLimitReachedError < StandardError
+    end
+
+    Session = Struct.new(:sender, :checked_in_at)
+
+    attr_reader :max_connections_per_destination
+    attr_reader :max_messages_per_session
+    attr_reader :idle_timeout
+
+    # @param [Integer] max_connections_per_destination The maximum number of sessions (idle or in use) per key
+    # @param [Integer] max_messages_per_session The number of messages after which a session will not be reused
+    # @param [Integer] idle_timeout The number of seconds an idle session will be kept open for
+    def initialize(max_connections_per_destination:, max_messages_per_session:, idle_timeout:)
+      @max_connections_per_destination = max_connections_per_destination
+      @max_messages_per_session = max_messages_per_session
+      @idle_timeout = idle_timeout
+      @idle = {}
+      @open_counts = Hash.new(0)
+      @mutex = Mutex.new
+    end
+
+    # Check out a sender for the given key. An idle sender will be returned if one is available,
+    # otherwise the block will be called to create (and start) a new one.
+    #
+    # @param [Object] key
+    # @yieldreturn [SMTPSender] a new, started, sender
+    # @raise [ConnectionLimitReachedError] if the key already has the maximum number of open
+    #   sessions and none of them are idle
+    # @return [SMTPSender]
+    def checkout(key)
+      loop do
+        session, expired = @mutex.synchronize { take_idle_or_reserve(key) }
+        expired.each { |s| finish(s.sender) }
+
+        if session.nil?
+          # We have reserved a slot for a new session
+          begin
+            return yield
+          rescue StandardError
+            release(key)
+            raise
+          end
+        end
+
+        return session.sender if session.sender.reset
+
+        close(key, session.sender)
+      end
+    end
+
+    # Return a sender to the pool. If the sender is no longer connected or has reached the
+    # message limit, its session will be closed.
+    #
+    # @param [Object] key
+    # @param [SMTPSender] sender
+    # @return [void]
+    def checkin(key, sender)
+      unless sender.connected? && sender.messages_sent < @max_messages_per_session
+        close(key, sender)
+        return
+      end
+
+      @mutex.synchronize do
+        (@idle[key] ||= []) << Session.new(sender, now)
+      end
+    end
+
+    # Close all idle sessions which have been idle for longer than the idle timeout.
+    #
+    # @return [Integer] the number of sessions which were closed
+    def reap
+      expired = @mutex.synchronize do
+        @idle.keys.each_with_object([]) do |key, array|
+          remove_expired(key).each { |session| array << [key, session] }
+        end
+      end
+      expired.each { |_key, session| finish(session.sender) }
+      expired.size
+    end
+
+    # Close all idle sessions. Sessions which are currently checked out will be closed when
+    # they are checked in.
+    #
+    # @return [void]
+    def shutdown
+      sessions = @mutex.synchronize do
+        all = @idle.flat_map { |key, list| list.map { |session| [key, session] } }
+        @idle.clear
+        all
+      end
+      sessions.each { |key, session| close(key, session.sender) }
+    end
+
+    # Return the number of idle sessions in the pool
+    #
+    # @return [Integer]
+    def idle_count
+      @mutex.synchronize { @idle.values.sum(&:size) }
+    end
+
+    # Return the number of open sessions (idle or checked out) for the given key
+    #
+    # @param [Object] key
+    # @return [Integer]
+    def open_count(key)
+      @mutex.synchronize { @open_counts[key] }
+    end
+
+    private
+
+    # Return the most recently used idle session for the key or reserve a slot for a new session
+    # if there is space. Must be called while holding the mutex.
+    #
+    # @return [Array(Session, Array<Session>)] the session (or nil if a slot was reserved) and any
+    #   expired sessions which should be finished by the caller
+    def take_idle_or_reserve(key)
+      expired = remove_expired(key)
+      if session = @idle[key]&.pop
+        @idle.delete(key) if @idle[key].empty?
+        return [session, expired]
+      end
+
+      if @open_counts[key] < @max_connections_per_destination
+        @open_counts[key] += 1
+        return [nil, expired]
+      end
+
+      raise ConnectionLimitReachedError, "All #{@max_connections_per_destination} pooled SMTP sessions to #{key.inspect} are in use"
+    end
+
+    # Remove and return all expired idle sessions for the key. The slots they used are released
+    # immediately and the caller is responsible for finishing them. Must be called while holding
+    # the mutex.
+    def remove_expired(key)
+      return [] unless @idle.key?(key)
+
+      cutoff = now - @idle_timeout
+      expired, @idle[key] = @idle[key].partition { |session| session.checked_in_at < cutoff }
+      @idle.delete(key) if @idle[key].empty?
+      unless expired.empty?
+        @open_counts[key] -= expired.size
+        @open_counts.delete(key) if @open_counts[key] <= 0
+      end
+      expired
+    end
+
+    # Finish a sender and release its slot in the pool
+    def close(key, sender)
+      finish(sender)
+      release(key)
+    end
+
+    def finish(sender)
+      sender.finish
+    rescue StandardError
+      nil
+    end
+
+    def release(key)
+      @mutex.synchronize do
+        @open_counts[key] -= 1
+        @open_counts.delete(key) if @open_counts[key] <= 0
+      end
+    end
+
+    def now
+      Process.clock_gettime(Process::CLOCK_MONOTONIC)
+    end
+
+  end
+end
@@ -4,8 +4,11 @@ class WebhookDeliveryService
 
   RETRIES = { 1 => 2.minutes, 2 => 3.minutes, 3 => 6.minutes, 4 => 10.minutes, 5 => 15.minutes }.freeze
 
-  def initialize(webhook_request:)
+  # @param [WebhookRequest] webhook_request
+  # @param [Postal::HTTP::ConnectionPool, nil] http_connection_pool A pool of kept-alive connections to send the request with
+  def initialize(webhook_request:, http_connection_pool: nil)
     @webhook_request = webhook_request
+    @http_connection_pool = http_connection_pool
   end
 
   def call
@@ -22,6 +25,11 @@ class WebhookDeliveryService
     @success == true
   end
 
+  # Has the request been sent and a result (successful or not) received?
+  def attempted?
+    !@success.nil?
+  end
+
   private
 
   def generate_payload
@@ -37,7 +45,8 @@ class WebhookDeliveryService
     @http_result = Postal::HTTP.post(@webhook_request.url,
                                      sign: true,
                                      json: @payload,
-                                     timeout: 5)
+                                     timeout: 5,
+                                     connection_pool: @http_connection_pool)
 
     @success = (@http_result[:code] >= 200 && @http_result[:code] < 300)
   end
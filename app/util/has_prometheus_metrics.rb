@@ -2,21 +2,40 @@
 
 module HasPrometheusMetrics
 
+  class << self
+
+    # Labels (and their values) which will be added to every metric registered in this process. This
+    # must be set before any metrics are registered, for example, to identify each worker process.
+    #
+    # @return [Hash{Symbol => String}]
+    attr_writer :preset_labels
+
+    def preset_labels
+      @preset_labels ||= {}
+    end
+
+  end
+
   def register_prometheus_counter(name, **kwargs)
-    counter = Prometheus::Client::Counter.new(name, **kwargs)
+    counter = Prometheus::Client::Counter.new(name, **with_preset_labels(kwargs))
     registry.register(counter)
   end
 
   def register_prometheus_histogram(name, **kwargs)
-    histogram = Prometheus::Client::Histogram.new(name, **kwargs)
+    histogram = Prometheus::Client::Histogram.new(name, **with_preset_labels(kwargs))
     registry.register(histogram)
   end
 
-  def increment_prometheus_counter(name, labels: {})
+  def register_prometheus_gauge(name, **kwargs)
+    gauge = Prometheus::Client::Gauge.new(name, **with_preset_labels(kwargs))
+    registry.register(gauge)
+  end
+
+  def increment_prometheus_counter(name, by: 1, labels: {})
     counter = registry.get(name)
     return if counter.nil?
 
-    counter.increment(labels: labels)
+    counter.increment(by: by, labels: labels)
   end
 
   def observe_prometheus_histogram(name, time, labels: {})
@@ -26,8 +45,23 @@ module HasPrometheusMetrics
     histogram.observe(time, labels: labels)
   end
 
+  def set_prometheus_gauge(name, value, labels: {})
+    gauge = registry.get(name)
+    return if gauge.nil?
+
+    gauge.set(value, labels: labels)
+  end
+
   private
 
+  def with_preset_labels(kwargs)
+    preset_labels = HasPrometheusMetrics.preset_labels
+    return kwargs if preset_labels.empty?
+
+    kwargs.merge(labels: (kwargs[:labels] || []) + preset_labels.keys,
+                 preset_labels: preset_labels.merge(kwargs[:preset_labels] || {}))
+  end
+
   def registry
     Prometheus::Client.registry
   end
@@ -16,6 +16,8 @@ class HealthServer
       ok
     when "/metrics"
       metrics
+    when "/debug/slow-messages"
+      slow_messages
     when "/"
       root
     else
@@ -43,6 +45,10 @@ class HealthServer
     [200, { "Content-Type" => "text/plain" }, [body]]
   end
 
+  def slow_messages
+    [200, { "Content-Type" => "application/json" }, [MessageDequeuer::StageTimings.slow_messages.to_json]]
+  end
+
   def hostname
     Socket.gethostname
   rescue StandardError
@@ -51,8 +57,8 @@ class HealthServer
 
   class << self
 
-    def run(default_port:, default_bind_address:, **options)
-      port = ENV.fetch("HEALTH_SERVER_PORT", default_port)
+    def run(default_port:, default_bind_address:, port_offset: 0, **options)
+      port = ENV.fetch("HEALTH_SERVER_PORT", default_port).to_i + port_offset
       bind_address = ENV.fetch("HEALTH_SERVER_BIND_ADDRESS", default_bind_address)
 
       Rackup::Handler::WEBrick.run(new(**options),
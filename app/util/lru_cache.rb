@@ -0,0 +1,118 @@
+# frozen_string_literal: true
+
+# A thread-safe cache which holds a limited number of entries and evicts the least recently
+# used entry when it is full. Entries can be given a TTL after which they will no longer be
+# returned. Unlike most caches, nil and false are valid values and are cached like any other.
+#
+# This is the storage used by the caches of DNS lookups, DKIM keys, message inspections,
+# tracking rewrites and tracking lookups. Each of those wraps it to add its own metrics and
+# rules for how long values are kept.
+class LRUCache
+
+  Entry = Struct.new(:value, :expires_at)
+
+  attr_reader :max_size
+  attr_reader :ttl
+
+  # @param [Integer] max_size The maximum number of entries to hold
+  # @param [Numeric, nil] ttl The default number of seconds to keep each entry for (nil to keep
+  #   entries until they are evicted)
+  # @param [Proc, nil] on_evict Called with the key of each entry evicted because the cache
+  #   was full
+  def initialize(max_size:, ttl: nil, on_evict: nil)
+    @max_size = max_size
+    @ttl = ttl
+    @on_evict = on_evict
+    @entries = {}
+    @mutex = Mutex.new
+  end
+
+  # Return the value for the given key from the cache. If it is not cached, the block will
+  # be called (without holding the lock) and its result will be cached.
+  #
+  # @param [Object] key
+  # @param [Numeric, nil] ttl The number of seconds to keep a new value for
+  # @yieldreturn [Object]
+  # @return [Object]
+  def fetch(key, ttl: @ttl)
+    found, value = lookup(key)
+    return value if found
+
+    value = yield
+    write(key, value, ttl: ttl)
+    value
+  end
+
+  # Return the value for the given key, or nil if it isn't cached or has expired
+  #
+  # @param [Object] key
+  # @return [Object, nil]
+  def read(key)
+    lookup(key)[1]
+  end
+
+  # Return whether the given key is cached and hasn't expired, along with its value. This
+  # marks the entry as the most recently used.
+  #
+  # @param [Object] key
+  # @return [Array(Boolean, Object)]
+  def lookup(key)
+    @mutex.synchronize do
+      entry = @entries.delete(key)
+      return [false, nil] if entry.nil? || (entry.expires_at && entry.expires_at <= now)
+
+      @entries[key] = entry
+      [true, entry.value]
+    end
+  end
+
+  # Add a value to the cache, evicting the least recently used entries if the cache is full.
+  # Nothing is stored if the TTL is zero or less.
+  #
+  # @param [Object] key
+  # @param [Object] value
+  # @param [Numeric, nil] ttl The number of seconds to keep the value for
+  # @return [Object] the value
+  def write(key, value, ttl: @ttl)
+    return value if @max_size <= 0 || (ttl && ttl <= 0)
+
+    evicted = []
+    @mutex.synchronize do
+      @entries.delete(key)
+      @entries[key] = Entry.new(value, ttl && (now + ttl))
+      evicted << @entries.shift[0] while @entries.size > @max_size
+    end
+    evicted.each { |k| @on_evict.call(k) } if @on_evict
+    value
+  end
+
+  # Remove the entry for the given key
+  #
+  # @param [Object] key
+  # @return [void]
+  def delete(key)
+    @mutex.synchronize { @entries.delete(key) }
+    nil
+  end
+
+  # Return the number of entries currently in the cache
+  #
+  # @return [Integer]
+  def size
+    @mutex.synchronize { @entries.size }
+  end
+
+  # Remove all entries from the cache
+  #
+  # @return [void]
+  def clear
+    @mutex.synchronize { @entries.clear }
+  end
+
+  private
+
+  def now
+    Process.clock_gettime(Process::CLOCK_MONOTONIC)
+  end
+
+end
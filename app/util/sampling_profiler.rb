@@ -0,0 +1,173 @@
+# frozen_string_literal: true
+
+require "fileutils"
+
+# A sampling profiler which can be started and stopped in a running process by sending it a
+# signal (USR2 by default). While running, it records the backtrace of every other thread in
+# the process at a regular interval. When it is stopped, a report of the methods which
+# appeared most often is written to the profiler output directory and the path of the report
+# is logged.
+#
+# Samples from threads which are running and threads which are waiting (for example for a
+# database query or a network response) are reported separately. Sampling only happens when
+# the profiler's thread holds the GVL so samples of CPU-bound code are spaced further apart
+# than the configured interval.
+class SamplingProfiler
+
+  MAX_DEPTH = 100
+  REPORT_SIZE = 50
+
+  attr_reader :name
+
+  # @param [String] name The name of the process, used to name reports
+  def initialize(name)
+    @name = name
+    @mutex = Mutex.new
+  end
+
+  # Is the profiler currently collecting samples?
+  #
+  # @return [Boolean]
+  def running?
+    @mutex.synchronize { !@thread.nil? }
+  end
+
+  # Start the profiler if it isn't running, otherwise stop it and write a report
+  #
+  # @return [String, nil] the path of the report if one was written
+  def toggle
+    running? ? stop : start
+  end
+
+  # Start collecting samples
+  #
+  # @return [void]
+  def start
+    @mutex.synchronize do
+      return if @thread
+
+      @samples = { running: Hash.new(0), waiting: Hash.new(0) }
+      @inclusive = { running: Hash.new(0), waiting: Hash.new(0) }
+      @sample_count = 0
+      @started_at = Time.now
+      @stopping = false
+      @thread = Thread.new { collect_samples }
+    end
+    logger.info "sampling profiler started", interval: interval
+  end
+
+  # Stop collecting samples and write a report
+  #
+  # @return [String, nil] the path of the report
+  def stop
+    thread = @mutex.synchronize do
+      @stopping = true
+      @thread
+    end
+    return nil if thread.nil?
+
+    thread.join
+    @mutex.synchronize { @thread = nil }
+
+    path = write_report
+    logger.info "sampling profiler stopped", samples: @sample_count, report: path
+    path
+  end
+
+  # Return a report of the samples collected so far
+  #
+  # @return [String]
+  def report
+    lines = []
+    lines << "Sampling profile for #{@name} (pid: #{Process.pid})"
+    lines << "Started at #{@started_at.utc.iso8601}, #{@sample_count} samples every #{interval}ms"
+
+    [:running, :waiting].each do |state|
+      total = @samples[state].values.sum
+      lines << ""
+      lines << "== #{state.to_s.capitalize} threads (#{total} samples) =="
+      next if total.zero?
+
+      lines << ""
+      lines << format("%8s %7s  %s", "self", "%", "frame")
+      top(@samples[state]).each do |frame, count|
+        lines << format("%8d %6.2f%%  %s", count, count * 100.0 / total, frame)
+      end
+
+      lines << ""
+      lines << format("%8s %7s  %s", "total", "%", "frame")
+      top(@inclusive[state]).each do |frame, count|
+        lines << format("%8d %6.2f%%  %s", count, count * 100.0 / total, frame)
+      end
+    end
+    lines.join("\n") + "\n"
+  end
+
+  private
+
+  def collect_samples
+    until @stopping
+      sample
+      sleep interval / 1000.0
+    end
+  rescue StandardError => e
+    logger.error "sampling profiler failed: #{e.class} (#{e.message})"
+  end
+
+  def sample
+    Thread.list.each do |thread|
+      next if thread == Thread.current
+
+      state = thread.status == "run" ? :running : :waiting
+      locations = thread.backtrace_locations(0, MAX_DEPTH)
+      next if locations.nil? || locations.empty?
+
+      frames = locations.map { |location| "#{location.label} (#{location.path}:#{location.lineno})" }
+      @samples[state][frames.first] += 1
+      frames.uniq.each { |frame| @inclusive[state][frame] += 1 }
+    end
+    @sample_count += 1
+  end
+
+  def top(counts)
+    counts.max_by(REPORT_SIZE) { |_, count| count }
+  end
+
+  def write_report
+    directory = Postal::Config.postal.profiler_output_path
+    FileUtils.mkdir_p(directory)
+    path = File.join(directory, "#{@name}-#{Process.pid}-#{@started_at.utc.strftime('%Y%m%d%H%M%S')}.txt")
+    File.write(path, report)
+    path
+  rescue StandardError => e
+    logger.error "could not write sampling profile: #{e.class} (#{e.message})"
+    nil
+  end
+
+  def interval
+    Postal::Config.postal.profiler_interval
+  end
+
+  def logger
+    Postal.logger
+  end
+
+  class << self
+
+    # Install a signal handler which starts and stops a profiler for this process
+    #
+    # @param [String] name The name of the process, used to name reports
+    # @return [SamplingProfiler, nil]
+    def install(name)
+      signal = Postal::Config.postal.profiler_signal
+      return nil if signal.blank?
+
+      profiler = new(name)
+      # Mutexes can't be used from within a trap handler
+      trap(signal) { Thread.new { profiler.toggle } }
+      profiler
+    end
+
+  end
+
+end
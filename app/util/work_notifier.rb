@@ -0,0 +1,135 @@
+# frozen_string_literal: true
+
+require "socket"
+require "ipaddr"
+
+# The work notifier allows any Postal process which creates new work (queued messages or
+# webhook requests) to wake up idle worker threads immediately rather than waiting for them
+# to next poll the database.
+#
+# Notifications are sent as small UDP datagrams. By default these are sent to a multicast
+# group which means that every worker process on the same host, and on any other host on the
+# same network, will receive them. A unicast address can be configured instead where
+# multicast is not available.
+#
+# Notifications are only ever a hint. If a datagram is lost the worker will still find the
+# work when it next polls the database.
+class WorkNotifier
+
+  PAYLOAD = "postal-wakeup"
+
+  SENDER_SOCKET_MUTEX = Mutex.new
+
+  class << self
+
+    # Is the notifier enabled?
+    #
+    # @return [Boolean]
+    def enabled?
+      Postal::Config.worker.wakeup_notifications_enabled?
+    end
+
+    # Send a notification to all listening workers that new work is available. Any errors
+    # sending the notification are logged and ignored.
+    #
+    # @return [Boolean] whether a notification was sent or not
+    def notify
+      return false unless enabled?
+
+      sender_socket.send(PAYLOAD, 0, group, port)
+      true
+    rescue StandardError => e
+      Postal.logger.debug "could not send work notification: #{e.class} (#{e.message})"
+      false
+    end
+
+    # Open a socket which will receive notifications sent by other processes. The caller
+    # is responsible for reading from (and closing) the socket.
+    #
+    # @return [UDPSocket]
+    def open_listener_socket
+      socket = UDPSocket.new(address_family)
+      socket.setsockopt(Socket::SOL_SOCKET, Socket::SO_REUSEADDR, true)
+      socket.setsockopt(Socket::SOL_SOCKET, Socket::SO_REUSEPORT, true) if defined?(Socket::SO_REUSEPORT)
+
+      if multicast?
+        socket.bind(ipv6? ? "::" : "0.0.0.0", port)
+        join_multicast_group(socket)
+      else
+        socket.bind(group, port)
+      end
+
+      socket
+    end
+
+    # Read all pending notifications from the given listener socket without blocking.
+    #
+    # @param [UDPSocket] socket
+    # @return [Integer] the number of notifications which were read
+    def drain(socket)
+      count = 0
+      loop do
+        payload, = socket.recvfrom_nonblock(64)
+        count += 1 if payload == PAYLOAD
+      end
+    rescue IO::WaitReadable
+      count
+    end
+
+    private
+
+    def group
+      Postal::Config.worker.wakeup_notification_address
+    end
+
+    def port
+      Postal::Config.worker.wakeup_notification_port
+    end
+
+    def ipaddr
+      IPAddr.new(group)
+    end
+
+    def ipv6?
+      ipaddr.ipv6?
+    end
+
+    def multicast?
+      addr = ipaddr
+      addr.ipv6? ? addr.to_s.start_with?("ff") : IPAddr.new("224.0.0.0/4").include?(addr)
+    end
+
+    def address_family
+      ipv6? ? Socket::AF_INET6 : Socket::AF_INET
+    end
+
+    def join_multicast_group(socket)
+      if ipv6?
+        membership = ipaddr.hton + [0].pack("I")
+        socket.setsockopt(Socket::IPPROTO_IPV6, Socket::IPV6_JOIN_GROUP, membership)
+      else
+        membership = ipaddr.hton + IPAddr.new("0.0.0.0").hton
+        socket.setsockopt(Socket::IPPROTO_IP, Socket::IP_ADD_MEMBERSHIP, membership)
+      end
+    end
+
+    def sender_socket
+      SENDER_SOCKET_MUTEX.synchronize do
+        @sender_socket ||= begin
+          socket = UDPSocket.new(address_family)
+          if multicast?
+            ttl = Postal::Config.worker.wakeup_notification_ttl
+            if ipv6?
+              socket.setsockopt(Socket::IPPROTO_IPV6, Socket::IPV6_MULTICAST_HOPS, [ttl].pack("i"))
+            else
+              socket.setsockopt(Socket::IPPROTO_IP, Socket::IP_MULTICAST_TTL, [ttl].pack("i"))
+            end
+          end
+          socket
+        end
+      end
+    end
+
+  end
+
+end
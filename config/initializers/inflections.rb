@@ -27,6 +27,7 @@ ActiveSupport::Inflector.inflections(:en) do |inflect|
 
   inflect.acronym "DB"
   inflect.acronym "IP"
+  inflect.acronym "LRU"
   inflect.acronym "MQ"
   inflect.acronym "MX"
 end
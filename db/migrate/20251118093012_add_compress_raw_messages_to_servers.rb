@@ -0,0 +1,7 @@
+# frozen_string_literal: true
+
+class AddCompressRawMessagesToServers < ActiveRecord::Migration[7.1]
+  def change
+    add_column :servers, :compress_raw_messages, :boolean, default: false
+  end
+end
@@ -0,0 +1,7 @@
+# frozen_string_literal: true
+
+class AddCheckpointToScheduledTasks < ActiveRecord::Migration[7.1]
+  def change
+    add_column :scheduled_tasks, :checkpoint, :text
+  end
+end
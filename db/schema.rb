@@ -10,7 +10,7 @@
 #
 # It's strongly recommended that you check this file into your version control system.
 
-ActiveRecord::Schema[7.1].define(version: 2025_11_09_101656) do
+ActiveRecord::Schema[7.1].define(version: 2025_12_01_090000) do
   create_table "additional_route_endpoints", id: :integer, charset: "utf8mb4", collation: "utf8mb4_general_ci", force: :cascade do |t|
     t.integer "route_id"
     t.string "endpoint_type"
@@ -231,6 +231,7 @@ ActiveRecord::Schema[7.1].define(version: 2025_11_09_101656) do
   create_table "scheduled_tasks", charset: "utf8mb4", collation: "utf8mb4_general_ci", force: :cascade do |t|
     t.string "name"
     t.datetime "next_run_after", precision: nil
+    t.text "checkpoint"
     t.index ["name"], name: "index_scheduled_tasks_on_name", unique: true
   end
 
@@ -265,6 +266,7 @@ ActiveRecord::Schema[7.1].define(version: 2025_11_09_101656) do
     t.boolean "privacy_mode", default: false
     t.boolean "truemail_enabled", default: false
     t.integer "priority", limit: 2, default: 0, unsigned: true
+    t.boolean "compress_raw_messages", default: false
     t.index ["organization_id"], name: "index_servers_on_organization_id"
     t.index ["permalink"], name: "index_servers_on_permalink", length: 6
     t.index ["token"], name: "index_servers_on_token", length: 6
@@ -0,0 +1,144 @@
+# frozen_string_literal: true
+
+require "net/smtp"
+
+module Postal
+  module BenchmarkSuite
+    # Sends synthetic messages to the SMTP server from a number of concurrent clients. Each
+    # client keeps one authenticated connection (for outgoing messages) and one unauthenticated
+    # connection (for incoming messages) open and sends messages until there are none left.
+    #
+    # The type and size of each message is chosen up front using a seeded random number
+    # generator so runs with the same options send the same messages whatever order the
+    # clients happen to send them in.
+    class LoadGenerator
+
+      Submission = Struct.new(:id, :type, :size, :submitted_at, :accepted_at, :error)
+
+      BODY_LINE = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor.\r\n"
+
+      # @param [String] host The SMTP server's address
+      # @param [Integer] port The SMTP server's port
+      # @param [String] credential_key The key of an SMTP credential to send outgoing messages with
+      # @param [String] from_address The address to send outgoing messages from
+      # @param [String] outgoing_recipient The address to send outgoing messages to
+      # @param [String] incoming_recipient The address to send incoming messages to
+      # @param [Integer] concurrency The number of clients
+      # @param [Hash{Integer => Integer}] message_sizes Message sizes (in bytes) and their relative weights
+      # @param [Float] incoming_ratio The proportion of messages which should be incoming
+      # @param [Integer] seed
+      def initialize(host:, port:, credential_key:, from_address:, outgoing_recipient:, incoming_recipient:,
+                     concurrency:, message_sizes:, incoming_ratio:, seed:)
+        @host = host
+        @port = port
+        @credential_key = credential_key
+        @from_address = from_address
+        @outgoing_recipient = outgoing_recipient
+        @incoming_recipient = incoming_recipient
+        @concurrency = concurrency
+        @message_sizes = message_sizes
+        @incoming_ratio = incoming_ratio
+        @random = Random.new(seed)
+      end
+
+      # Send the given number of messages and return a submission for each one
+      #
+      # @param [Integer] count
+      # @param [String] prefix A prefix for the ID of each message
+      # @return [Array<Postal::BenchmarkSuite::LoadGenerator::Submission>]
+      def run(count, prefix:)
+        queue = Queue.new
+        count.times do |index|
+          type = @random.rand < @incoming_ratio ? :incoming : :outgoing
+          queue << Submission.new("#{prefix}-#{index}", type, choose_size)
+        end
+        queue.close
+
+        submissions = Queue.new
+        threads = Array.new([@concurrency, count].min) do
+          Thread.new do
+            connections = {}
+            while submission = queue.pop
+              send_submission(connections, submission)
+              submissions << submission
+            end
+          ensure
+            connections.each_value { |smtp| finish(smtp) }
+          end
+        end
+        threads.each(&:join)
+
+        Array.new(submissions.size) { submissions.pop }
+      end
+
+      # Return the raw data for the given submission
+      #
+      # @param [Postal::BenchmarkSuite::LoadGenerator::Submission] submission
+      # @return [String]
+      def build_message(submission)
+        from = submission.type == :outgoing ? @from_address : "sender@benchmark-client.test"
+        to = submission.type == :outgoing ? @outgoing_recipient : @incoming_recipient
+        headers = "From: #{from}\r\n" \
+                  "To: #{to}\r\n" \
+                  "Subject: Benchmark message #{submission.id}\r\n" \
+                  "Message-ID: <#{submission.id}@benchmark.postal>\r\n" \
+                  "Date: #{Time.now.rfc2822}\r\n" \
+                  "MIME-Version: 1.0\r\n" \
+                  "Content-Type: text/plain; charset=utf-8\r\n" \
+                  "\r\n"
+        lines = [(submission.size - headers.bytesize) / BODY_LINE.bytesize, 1].max
+        headers + (BODY_LINE * lines)
+      end
+
+      private
+
+      def choose_size
+        point = @random.rand(@message_sizes.values.sum)
+        @message_sizes.each do |size, weight|
+          return size if point < weight
+
+          point -= weight
+        end
+        @message_sizes.keys.last
+      end
+
+      def send_submission(connections, submission)
+        data = build_message(submission)
+        mail_from = submission.type == :outgoing ? @from_address : "sender@benchmark-client.test"
+        rcpt_to = submission.type == :outgoing ? @outgoing_recipient : @incoming_recipient
+
+        submission.submitted_at = now
+        smtp = connections[submission.type] ||= connect(authenticate: submission.type == :outgoing)
+        smtp.send_message(data, mail_from, [rcpt_to])
+        submission.accepted_at = now
+      rescue StandardError => e
+        submission.error = "#{e.class}: #{e.message.strip}"
+        finish(connections.delete(submission.type))
+      end
+
+      def connect(authenticate:)
+        smtp = Net::SMTP.new(@host, @port)
+        smtp.disable_starttls
+        smtp.open_timeout = 10
+        smtp.read_timeout = 60
+        if authenticate
+          smtp.start(helo: "benchmark-client.test", user: "benchmark", secret: @credential_key, authtype: :plain)
+        else
+          smtp.start(helo: "benchmark-client.test")
+        end
+        smtp
+      end
+
+      def finish(smtp)
+        smtp&.finish if smtp&.started?
+      rescue StandardError
+        nil
+      end
+
+      def now
+        Process.clock_gettime(Process::CLOCK_MONOTONIC)
+      end
+
+    end
+  end
+end
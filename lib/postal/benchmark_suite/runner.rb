@@ -0,0 +1,314 @@
+# frozen_string_literal: true
+
+require "fileutils"
+require "rbconfig"
+require "socket"
+require "timeout"
+
+module Postal
+  module BenchmarkSuite
+    # Runs an end-to-end benchmark of message ingest and delivery.
+    #
+    # A temporary organization and mail server are created along with an SMTP credential, a
+    # domain and a route which delivers incoming messages to an HTTP endpoint. An SMTP server
+    # and a worker are then started as separate processes (as they would be in production)
+    # with all outgoing mail relayed to a sink SMTP server and all HTTP endpoints and webhooks
+    # pointed at a stub HTTP server, both of which run in this process.
+    #
+    # After a warm up, messages are sent to the SMTP server from a number of concurrent
+    # clients and the time each one arrives at the sink or the stub is recorded. The results
+    # include throughput, ingest and ingest-to-delivery latency percentiles, the number of
+    # database queries per message and the memory used by each process.
+    #
+    # The number of queries comes from MySQL's global "Questions" counter so it includes any
+    # other clients of the same database server. It should be run against a database which
+    # isn't being used for anything else.
+    class Runner
+
+      DEFAULT_OPTIONS = {
+        messages: 1000,
+        concurrency: 10,
+        message_sizes: { 2 * 1024 => 60, 16 * 1024 => 30, 256 * 1024 => 10 },
+        incoming_ratio: 0.1,
+        warmup: 20,
+        timeout: 600,
+        seed: 1234,
+        keep_data: false,
+        log_directory: nil
+      }.freeze
+
+      MESSAGE_ID_REGEX = /bench-[a-z0-9]+-(?:warmup-)?\d+/
+
+      attr_reader :options
+
+      def initialize(**options)
+        @options = DEFAULT_OPTIONS.merge(options)
+        @run_id = "bench-#{SecureRandom.hex(4)}"
+        @log_directory = @options[:log_directory] || Rails.root.join("tmp", "benchmark", @run_id).to_s
+        @deliveries = {}
+        @webhooks = 0
+        @mutex = Mutex.new
+        @condition = ConditionVariable.new
+        @processes = {}
+        @rss = Hash.new { |hash, key| hash[key] = { peak: 0, final: 0 } }
+      end
+
+      # Run the benchmark and return the results
+      #
+      # @return [Hash]
+      def run
+        FileUtils.mkdir_p(@log_directory)
+        start_stubs
+        create_fixtures
+        start_processes
+
+        warmup_submissions = generator.run(@options[:warmup], prefix: "#{@run_id}-warmup")
+        wait_for_deliveries(warmup_submissions)
+
+        @mutex.synchronize do
+          @deliveries.clear
+          @webhooks = 0
+        end
+        sampler = start_rss_sampler
+
+        queries_before = database_questions
+        started_at = now
+        submissions = generator.run(@options[:messages], prefix: @run_id)
+        submitted_at = now
+        delivered = wait_for_deliveries(submissions)
+        finished_at = delivered.values.max || now
+        queries_after = database_questions
+
+        sampler.kill
+        sample_rss(final: true)
+
+        results(submissions, delivered, started_at, submitted_at, finished_at, queries_after - queries_before)
+      ensure
+        stop_processes
+        stop_stubs
+        destroy_fixtures unless @options[:keep_data]
+      end
+
+      private
+
+      def results(submissions, delivered, started_at, submitted_at, finished_at, queries)
+        accepted = submissions.reject(&:error)
+        duration = finished_at - started_at
+
+        {
+          run_id: @run_id,
+          commit: git_commit,
+          time: Time.now.utc.iso8601,
+          options: @options.except(:log_directory),
+          processes: {
+            smtp_server_workers: Postal::Config.smtp_server.workers,
+            worker_threads: Postal::Config.worker.threads
+          },
+          messages: {
+            sent: submissions.size,
+            accepted: accepted.size,
+            rejected: submissions.size - accepted.size,
+            delivered: delivered.size,
+            undelivered: accepted.size - delivered.size,
+            outgoing: accepted.count { |s| s.type == :outgoing },
+            incoming: accepted.count { |s| s.type == :incoming }
+          },
+          errors: submissions.filter_map(&:error).tally,
+          webhooks_received: @mutex.synchronize { @webhooks },
+          duration: duration.round(3),
+          ingest_messages_per_second: rate(accepted.size, submitted_at - started_at),
+          delivered_messages_per_second: rate(delivered.size, duration),
+          ingest_latency_ms: Stats.summarize(accepted.map { |s| s.accepted_at - s.submitted_at }),
+          delivery_latency_ms: Stats.summarize(accepted.filter_map { |s| delivered[s.id] && (delivered[s.id] - s.submitted_at) }),
+          db_queries: queries,
+          db_queries_per_message: accepted.empty? ? nil : (queries.to_f / accepted.size).round(2),
+          rss_mb: @rss.transform_values { |rss| rss.transform_values { |kb| (kb / 1024.0).round(1) } },
+          log_directory: @log_directory
+        }
+      end
+
+      def generator
+        @generator ||= LoadGenerator.new(host: "127.0.0.1",
+                                         port: @smtp_port,
+                                         credential_key: @credential.key,
+                                         from_address: "benchmark@#{@domain.name}",
+                                         outgoing_recipient: "recipient@benchmark-sink.test",
+                                         incoming_recipient: "#{@route.name}@#{@domain.name}",
+                                         concurrency: @options[:concurrency],
+                                         message_sizes: @options[:message_sizes],
+                                         incoming_ratio: @options[:incoming_ratio],
+                                         seed: @options[:seed])
+      end
+
+      def start_stubs
+        @sink = SinkSMTPServer.new { |data| record_delivery(data) }.start
+        @stub = StubHTTPServer.new do |path, body|
+          if path == "/webhook"
+            @mutex.synchronize { @webhooks += 1 }
+          else
+            record_delivery(body)
+          end
+        end.start
+      end
+
+      def stop_stubs
+        @sink&.stop
+        @stub&.stop
+      end
+
+      def record_delivery(data)
+        return unless id = data[MESSAGE_ID_REGEX]
+
+        time = now
+        @mutex.synchronize do
+          @deliveries[id] ||= time
+          @condition.broadcast
+        end
+      end
+
+      # Wait until every accepted submission has been delivered or the timeout is reached and
+      # return the time each one was delivered
+      def wait_for_deliveries(submissions)
+        ids = submissions.reject(&:error).map(&:id)
+        deadline = now + @options[:timeout]
+        @mutex.synchronize do
+          until ids.all? { |id| @deliveries[id] } || now >= deadline
+            @condition.wait(@mutex, [deadline - now, 1].min)
+          end
+          @deliveries.slice(*ids)
+        end
+      end
+
+      def create_fixtures
+        @user = User.create!(first_name: "Benchmark", last_name: "User",
+                             email_address: "#{@run_id}@benchmark.postal",
+                             password: SecureRandom.alphanumeric(24),
+                             email_verified_at: Time.now)
+        @organization = Organization.create!(name: "Benchmark #{@run_id}", permalink: @run_id, owner: @user)
+        @server = @organization.servers.create!(name: "Benchmark", permalink: "benchmark", mode: "Live")
+        @credential = @server.credentials.create!(type: "SMTP", name: "Benchmark")
+        @domain = @server.domains.create!(name: "#{@run_id}.benchmark.postal", verification_method: "DNS", verified_at: Time.now)
+        @http_endpoint = @server.http_endpoints.create!(name: "Benchmark", url: @stub.url("/endpoint"),
+                                                        encoding: "BodyAsJSON", format: "Hash")
+        @route = @server.routes.create!(name: "benchmark", domain: @domain, mode: "Endpoint", spam_mode: "Mark",
+                                        endpoint: @http_endpoint)
+        @server.webhooks.create!(name: "Benchmark", url: @stub.url("/webhook"), all_events: true)
+      end
+
+      def destroy_fixtures
+        @organization&.destroy
+        @user&.destroy
+      end
+
+      def start_processes
+        @smtp_port = free_port
+        env = {
+          "POSTAL_SMTP_RELAYS" => "smtp://127.0.0.1:#{@sink.port}?ssl_mode=None",
+          "SILENCE_POSTAL_CONFIG_MESSAGES" => "true"
+        }
+        spawn_process(:smtp_server, "script/smtp_server.rb", env.merge("PORT" => @smtp_port.to_s,
+                                                                        "BIND_ADDRESS" => "127.0.0.1",
+                                                                        "HEALTH_SERVER_PORT" => free_port.to_s))
+        worker_health_port = free_port
+        spawn_process(:worker, "script/worker.rb", env.merge("HEALTH_SERVER_PORT" => worker_health_port.to_s))
+
+        wait_for_port(@smtp_port, :smtp_server)
+        wait_for_port(worker_health_port, :worker)
+      end
+
+      def spawn_process(name, script, env)
+        log = File.join(@log_directory, "#{name}.log")
+        @processes[name] = Process.spawn(env, RbConfig.ruby, script, chdir: Rails.root.to_s, out: log, err: [:child, :out])
+      end
+
+      def stop_processes
+        @processes.each_value do |pid|
+          Process.kill("TERM", pid)
+        rescue Errno::ESRCH
+          nil
+        end
+
+        @processes.each_value do |pid|
+          Timeout.timeout(30) { Process.wait(pid) }
+        rescue Timeout::Error
+          Process.kill("KILL", pid)
+          Process.wait(pid)
+        rescue Errno::ECHILD
+          nil
+        end
+        @processes.clear
+      end
+
+      def wait_for_port(port, name)
+        deadline = now + 60
+        loop do
+          TCPSocket.new("127.0.0.1", port).close
+          return
+        rescue SystemCallError
+          if Process.waitpid(@processes[name], Process::WNOHANG)
+            raise Postal::Error, "#{name} exited during startup (see #{@log_directory}/#{name}.log)"
+          end
+          raise Postal::Error, "#{name} did not start listening on port #{port} within 60 seconds" if now > deadline
+
+          sleep 0.1
+        end
+      end
+
+      def free_port
+        server = TCPServer.new("127.0.0.1", 0)
+        server.addr[1]
+      ensure
+        server&.close
+      end
+
+      def start_rss_sampler
+        Thread.new do
+          loop do
+            sample_rss
+            sleep 0.5
+          end
+        end
+      end
+
+      # Record the resident set size of each process including any child processes (such as
+      # SMTP server workers)
+      def sample_rss(final: false)
+        table = `ps -A -o pid=,ppid=,rss=`.lines.map { |line| line.split.map(&:to_i) }
+        @processes.each do |name, pid|
+          pids = [pid]
+          pids.each { |parent| table.each { |p, ppid, _| pids << p if ppid == parent && !pids.include?(p) } }
+          total = table.select { |p, _, _| pids.include?(p) }.sum { |_, _, rss| rss }
+          @rss[name][:peak] = [@rss[name][:peak], total].max
+          @rss[name][:final] = total if final
+        end
+      end
+
+      # Return the number of statements executed by the database server(s)
+      def database_questions
+        questions = ActiveRecord::Base.connection.select_one("SHOW GLOBAL STATUS LIKE 'Questions'")["Value"].to_i
+        main_db = Postal::Config.main_db
+        message_db = Postal::Config.message_db
+        unless main_db.host == message_db.host && main_db.port == message_db.port
+          questions += @server.message_db.query("SHOW GLOBAL STATUS LIKE 'Questions'").first["Value"].to_i
+        end
+        questions
+      end
+
+      def git_commit
+        commit = `git -C #{Rails.root} rev-parse HEAD 2>/dev/null`.strip
+        commit.presence || Postal.version
+      end
+
+      def rate(count, duration)
+        return nil unless duration.positive?
+
+        (count / duration).round(2)
+      end
+
+      def now
+        Process.clock_gettime(Process::CLOCK_MONOTONIC)
+      end
+
+    end
+  end
+end
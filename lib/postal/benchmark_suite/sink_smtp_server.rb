@@ -0,0 +1,92 @@
+# frozen_string_literal: true
+
+require "socket"
+
+module Postal
+  module BenchmarkSuite
+    # A minimal SMTP server which accepts every message it is sent. It is used as the relay
+    # for messages delivered by the worker during a benchmark so that delivery times don't
+    # depend on a real mail server. The given block is called with each message's raw data
+    # as soon as it has been received (before it is acknowledged).
+    class SinkSMTPServer
+
+      attr_reader :bind_address
+      attr_reader :port
+
+      # @param [String] bind_address
+      # @param [Integer] port The port to listen on or 0 to choose a free port
+      def initialize(bind_address: "127.0.0.1", port: 0, &on_message)
+        @bind_address = bind_address
+        @port = port
+        @on_message = on_message
+      end
+
+      # Start listening for connections in a background thread
+      #
+      # @return [self]
+      def start
+        @server = TCPServer.new(@bind_address, @port)
+        @port = @server.addr[1]
+        @thread = Thread.new { accept_connections }
+        self
+      end
+
+      # Stop listening for connections
+      #
+      # @return [void]
+      def stop
+        @server&.close
+        @thread&.join(5)
+      end
+
+      private
+
+      def accept_connections
+        loop do
+          Thread.new(@server.accept) { |socket| handle(socket) }
+        end
+      rescue IOError, SystemCallError
+        # The server has been stopped
+      end
+
+      def handle(socket)
+        socket.write "220 benchmark-sink ESMTP\r\n"
+        while line = socket.gets("\r\n")
+          case line
+          when /\AEHLO/i
+            socket.write "250-benchmark-sink\r\n250-8BITMIME\r\n250 SIZE 0\r\n"
+          when /\AHELO/i
+            socket.write "250 benchmark-sink\r\n"
+          when /\A(MAIL|RCPT|RSET|NOOP)/i
+            socket.write "250 OK\r\n"
+          when /\ADATA/i
+            socket.write "354 End data with <CR><LF>.<CR><LF>\r\n"
+            data = read_data(socket)
+            @on_message&.call(data)
+            socket.write "250 OK\r\n"
+          when /\AQUIT/i
+            socket.write "221 Bye\r\n"
+            break
+          else
+            socket.write "502 Command not implemented\r\n"
+          end
+        end
+      rescue IOError, SystemCallError
+        # The client has gone away
+      ensure
+        socket.close
+      end
+
+      def read_data(socket)
+        data = +""
+        while line = socket.gets("\r\n")
+          break if line == ".\r\n"
+
+          data << (line.start_with?("..") ? line[1..] : line)
+        end
+        data
+      end
+
+    end
+  end
+end
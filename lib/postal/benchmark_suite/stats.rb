@@ -0,0 +1,50 @@
+# frozen_string_literal: true
+
+module Postal
+  module BenchmarkSuite
+    module Stats
+
+      class << self
+
+        # Summarise a set of durations (in seconds) as milliseconds
+        #
+        # @param [Array<Float>] values
+        # @return [Hash]
+        def summarize(values)
+          return { count: 0 } if values.empty?
+
+          sorted = values.sort
+          {
+            count: sorted.size,
+            mean: to_ms(sorted.sum / sorted.size),
+            min: to_ms(sorted.first),
+            p50: to_ms(percentile(sorted, 50)),
+            p95: to_ms(percentile(sorted, 95)),
+            p99: to_ms(percentile(sorted, 99)),
+            max: to_ms(sorted.last)
+          }
+        end
+
+        # Return the given percentile of a sorted array using the nearest-rank method
+        #
+        # @param [Array<Float>] sorted
+        # @param [Numeric] percentile
+        # @return [Float, nil]
+        def percentile(sorted, percentile)
+          return nil if sorted.empty?
+
+          rank = ((percentile / 100.0) * sorted.size).ceil
+          sorted[[rank, 1].max - 1]
+        end
+
+        private
+
+        def to_ms(seconds)
+          (seconds * 1000).round(2)
+        end
+
+      end
+
+    end
+  end
+end
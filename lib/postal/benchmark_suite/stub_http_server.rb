@@ -0,0 +1,60 @@
+# frozen_string_literal: true
+
+require "webrick"
+
+module Postal
+  module BenchmarkSuite
+    # An HTTP server which responds to every request with a 200. It is used as the URL for
+    # HTTP endpoints and webhooks during a benchmark. The given block is called with the path
+    # and body of each request.
+    class StubHTTPServer
+
+      attr_reader :bind_address
+      attr_reader :port
+
+      # @param [String] bind_address
+      # @param [Integer] port The port to listen on or 0 to choose a free port
+      def initialize(bind_address: "127.0.0.1", port: 0, &on_request)
+        @bind_address = bind_address
+        @port = port
+        @on_request = on_request
+      end
+
+      # Start listening for requests in a background thread
+      #
+      # @return [self]
+      def start
+        @server = WEBrick::HTTPServer.new(BindAddress: @bind_address,
+                                          Port: @port,
+                                          Logger: WEBrick::Log.new(File::NULL),
+                                          AccessLog: [])
+        @server.mount_proc("/") do |request, response|
+          @on_request&.call(request.path, request.body.to_s)
+          response.status = 200
+          response["Content-Type"] = "text/plain"
+          response.body = "OK"
+        end
+        @port = @server.config[:Port]
+        @thread = Thread.new { @server.start }
+        self
+      end
+
+      # Return the URL for the given path on this server
+      #
+      # @param [String] path
+      # @return [String]
+      def url(path)
+        "http://#{@bind_address}:#{@port}#{path}"
+      end
+
+      # Stop listening for requests
+      #
+      # @return [void]
+      def stop
+        @server&.shutdown
+        @thread&.join(5)
+      end
+
+    end
+  end
+end
@@ -111,6 +111,166 @@ module Postal
         description "When de-queuing in batches, use this limit for the batch size"
         default 100
       end
+
+      boolean :batch_claim_queued_messages do
+        description "When enabled each worker tick will claim a batch of ready queued messages in a single statement rather than one at a time"
+        default false
+      end
+
+      integer :batch_claim_queued_messages_limit do
+        description "When claiming queued messages in batches, the maximum number of messages to claim per worker tick"
+        default 20
+      end
+
+      boolean :fair_delivery_scheduling do
+        description "When enabled (with batch_claim_queued_messages) claimed messages are shared fairly between destination domains and the number in flight to each domain is limited and adjusted based on deferrals"
+        default false
+      end
+
+      integer :fair_delivery_candidate_multiplier do
+        description "When scheduling deliveries fairly, the number of claimable messages to consider (as a multiple of the claim limit) when choosing a batch"
+        default 5
+      end
+
+      integer :delivery_max_concurrency_per_destination do
+        description "When scheduling deliveries fairly, the maximum number of messages to one domain which each worker process will have in flight at once"
+        default 10
+      end
+
+      integer :delivery_max_concurrency_per_ip_address do
+        description "When scheduling deliveries fairly, the maximum number of messages from one IP address which each worker process will have in flight at once"
+        default 50
+      end
+
+      integer :delivery_destination_backoff do
+        description "When scheduling deliveries fairly, the number of seconds to stop claiming messages for a domain after it defers a message (doubled for each further deferral)"
+        default 5
+      end
+
+      integer :delivery_destination_max_backoff do
+        description "When scheduling deliveries fairly, the maximum number of seconds to stop claiming messages for a domain after it defers messages"
+        default 300
+      end
+
+      boolean :concurrent_webhook_delivery do
+        description "When enabled each worker tick will claim a batch of webhook requests and deliver them concurrently using kept-alive connections"
+        default false
+      end
+
+      integer :webhook_delivery_batch_size do
+        description "When delivering webhooks concurrently, the maximum number of webhook requests to claim per worker tick"
+        default 50
+      end
+
+      integer :webhook_delivery_concurrency do
+        description "When delivering webhooks concurrently, the number of delivery threads in each worker process"
+        default 10
+      end
+
+      integer :webhook_max_concurrency_per_endpoint do
+        description "When delivering webhooks concurrently, the maximum number of requests to send to the same webhook URL at once"
+        default 2
+      end
+
+      integer :webhook_circuit_breaker_threshold do
+        description "When delivering webhooks concurrently, the number of consecutive failures after which requests to a webhook URL will be paused"
+        default 5
+      end
+
+      integer :webhook_circuit_breaker_cooldown do
+        description "The number of seconds to pause requests to a webhook URL for after it has failed too many times"
+        default 60
+      end
+
+      integer :webhook_keep_alive_timeout do
+        description "The number of seconds an idle connection to a webhook host will be kept open for"
+        default 30
+      end
+
+      boolean :parallel_message_inspection do
+        description "When enabled the configured message inspectors (rspamd, SpamAssassin, ClamAV and Truemail) will be run at the same time rather than one after another"
+        default false
+      end
+
+      integer :message_inspection_timeout do
+        description "When inspecting messages in parallel, the number of seconds to wait for all inspectors to finish before recording the remaining ones as timed out"
+        default 30
+      end
+
+      boolean :cache_message_inspections do
+        description "When enabled the results of message inspections will be cached and reused for other messages with the same content (outgoing messages are compared as they were before tracking was added, so recipients of the same message share results)"
+        default false
+      end
+
+      integer :message_inspection_cache_ttl do
+        description "The number of seconds to cache message inspection results for"
+        default 300
+      end
+
+      integer :message_inspection_cache_size do
+        description "The maximum number of message inspection results to cache in each worker process"
+        default 1000
+      end
+
+      boolean :cache_tracking_rewrites do
+        description "When enabled track domain lookups and the click and open tracking rewrite of each message's content will be cached and reused for other messages with the same content"
+        default false
+      end
+
+      integer :tracking_rewrite_cache_ttl do
+        description "The number of seconds to cache the tracking rewrite of a message's content for"
+        default 600
+      end
+
+      integer :tracking_rewrite_cache_size do
+        description "The maximum number of tracking rewrites (and track domain lookups) to cache in each worker process"
+        default 100
+      end
+
+      integer :track_domain_cache_ttl do
+        description "The number of seconds to cache each server's track domains for when caching tracking rewrites"
+        default 60
+      end
+
+      integer :message_retention_chunk_size do
+        description "The maximum number of messages to remove in each query when removing messages which are older than a server's retention period"
+        default 1000
+      end
+
+      integer :message_retention_rows_per_second do
+        description "The maximum number of rows to remove per second (for each server) when removing old messages. Set to 0 for no limit."
+        default 10000
+      end
+
+      integer :message_retention_concurrency do
+        description "The number of servers to remove old messages from at the same time"
+        default 2
+      end
+
+      string :profiler_signal do
+        description "The signal which starts and stops the sampling profiler in worker and SMTP server processes. Set to an empty string to disable."
+        default "USR2"
+      end
+
+      integer :profiler_interval do
+        description "The number of milliseconds between each sample taken by the sampling profiler"
+        default 10
+      end
+
+      string :profiler_output_path do
+        description "The directory to write sampling profiler reports to"
+        default "tmp/profiles"
+      end
+
+      integer :bulk_send_batch_size do
+        description "The maximum number of messages to create in each transaction when sending messages with the bulk send API"
+        default 100
+      end
+
+      integer :bulk_send_max_messages do
+        description "The maximum number of messages which can be sent in a single request to the bulk send API"
+        default 10_000
+      end
     end
 
     group :web_server do
@@ -128,6 +288,46 @@ module Postal
         description "The maximum number of threads which can be used by the web server"
         default 5
       end
+
+      boolean :tracking_write_behind do
+        description "When enabled opens and clicks are buffered in memory and written to the message database in batches, and server and link lookups made by the tracking middleware are cached"
+        default false
+      end
+
+      integer :tracking_flush_interval do
+        description "The maximum number of seconds to buffer opens and clicks for before writing them to the message database"
+        default 5
+      end
+
+      integer :tracking_flush_batch_size do
+        description "The number of buffered opens and clicks after which they will be written to the message database straight away"
+        default 500
+      end
+
+      integer :tracking_lookup_cache_ttl do
+        description "The number of seconds to cache server and link lookups made by the tracking middleware for"
+        default 60
+      end
+
+      integer :tracking_lookup_cache_size do
+        description "The maximum number of server and link lookups to cache in each web server process"
+        default 10000
+      end
+
+      boolean :tracking_image_cache do
+        description "When enabled images proxied by the tracking middleware will be cached on disk and revalidated with the origin once they are no longer fresh"
+        default false
+      end
+
+      integer :tracking_image_cache_size do
+        description "The maximum size (in MB) of the proxied image cache in each web server process"
+        default 256
+      end
+
+      integer :tracking_image_cache_ttl do
+        description "The number of seconds to consider a proxied image fresh for if it was not served with a max-age"
+        default 3600
+      end
     end
 
     group :worker do
@@ -145,6 +345,41 @@ module Postal
         description "The number of threads to execute within each worker"
         default 2
       end
+
+      boolean :wakeup_notifications_enabled do
+        description "Wake idle worker threads as soon as new work is created rather than waiting for the next poll"
+        default false
+      end
+
+      string :wakeup_notification_address do
+        description "The address to send worker wakeup notifications to. This should be a multicast group address unless all processes run on a single host."
+        default "239.255.25.25"
+      end
+
+      integer :wakeup_notification_port do
+        description "The UDP port to send and receive worker wakeup notifications on"
+        default 9095
+      end
+
+      integer :wakeup_notification_ttl do
+        description "The multicast TTL for worker wakeup notifications (1 keeps notifications on the local network)"
+        default 1
+      end
+
+      boolean :stage_timings do
+        description "Record the time taken and the number of database queries made by each step of processing a queued message"
+        default true
+      end
+
+      integer :slow_message_threshold do
+        description "The number of milliseconds after which processing a queued message is considered slow. Slow messages are logged with the time taken by each step."
+        default 5000
+      end
+
+      integer :slow_message_log_size do
+        description "The number of the slowest messages processed in the last hour to show at /debug/slow-messages on the worker health server"
+        default 20
+      end
     end
 
     group :main_db do
@@ -212,6 +447,91 @@ module Postal
         description "The MariaDB prefix to add to database names"
         default "postal"
       end
+
+      integer :pool_size do
+        description "The maximum number of connections each process will open to the MariaDB server for message databases. This must be at least the number of threads which use message databases. Worker processes increase it automatically to suit the threads they run."
+        default 10
+      end
+
+      integer :pool_checkout_timeout do
+        description "The number of seconds to wait for a message database connection when all connections are in use"
+        default 5
+      end
+
+      integer :pool_idle_timeout do
+        description "The number of seconds an idle message database connection will be kept open for"
+        default 300
+      end
+
+      integer :pool_max_connection_age do
+        description "The number of seconds after which a message database connection will be closed rather than reused"
+        default 3600
+      end
+
+      integer :pool_validation_interval do
+        description "The number of seconds a message database connection can be idle before it is checked (with a ping) before use"
+        default 30
+      end
+
+      boolean :statistics_write_behind do
+        description "Collect statistics and live stats increments in memory and write them to the message databases in batches"
+        default false
+      end
+
+      integer :statistics_flush_interval do
+        description "The maximum number of seconds between writes of batched statistics"
+        default 5
+      end
+
+      integer :statistics_flush_threshold do
+        description "The number of pending statistics increments which will cause batched statistics to be written immediately"
+        default 1000
+      end
+
+      boolean :rate_tracker_enabled do
+        description "Keep an in-memory copy of each server's live stats so send volumes can be read without querying the database"
+        default false
+      end
+
+      integer :rate_tracker_refresh_interval do
+        description "The number of seconds after which in-memory live stats will be reloaded from the database"
+        default 10
+      end
+
+      boolean :deduplicate_raw_messages do
+        description "Store identical raw message bodies received on the same day once and share them between messages"
+        default false
+      end
+
+      integer :deduplicate_raw_messages_min_size do
+        description "The minimum size (in bytes) of a raw message body for it to be deduplicated"
+        default 4096
+      end
+
+      boolean :suppression_list_index do
+        description "Keep an in-memory index of each server's suppression list so that addresses which are not suppressed can be checked without querying the database"
+        default false
+      end
+
+      integer :suppression_list_index_refresh_interval do
+        description "The number of seconds after which a suppression list index will check the database for changes made by other processes"
+        default 30
+      end
+
+      integer :suppression_list_index_cache_size do
+        description "The maximum number of suppression list entries to cache for each server"
+        default 1000
+      end
+
+      boolean :subject_search_index do
+        description "Use a full-text index for message subject searches. The index must be added to all message databases first with the postal:add_message_subject_search_indexes task, which blocks new messages from being stored for each server while its index is built"
+        default false
+      end
+
+      integer :pagination_count_limit do
+        description "The maximum number of matching messages to count when listing messages (larger totals are shown as this number or more)"
+        default 10_000
+      end
     end
 
     group :logging do
@@ -313,9 +633,29 @@ module Postal
         default 14
       end
 
+      integer :data_spill_threshold do
+        description "The size (in kB) above which message data being received will be written to a temporary file rather than held in memory"
+        default 1024
+      end
+
       string :log_ip_address_exclusion_matcher do
         description "A regular expression to use to exclude connections from logging"
       end
+
+      integer :workers do
+        description "The number of SMTP server worker processes to run. When more than 1, a supervisor process will start (and restart) the workers"
+        default 1
+      end
+
+      boolean :reuse_port do
+        description "Have each SMTP server worker open its own listening socket with SO_REUSEPORT rather than sharing the supervisor's socket"
+        default false
+      end
+
+      integer :worker_shutdown_timeout do
+        description "The number of seconds to wait for SMTP server workers to finish handling their connections when shutting down"
+        default 60
+      end
     end
 
     group :dns do
@@ -377,6 +717,36 @@ module Postal
       string :dmarc_preferred_dns_entry do
         description "The preferred DMARC DNS record to check against configured domains"
       end
+
+      boolean :cache_enabled do
+        description "Cache the results of the DNS lookups made when delivering messages in each process for the TTL of the records returned (domain verification and DNS checks are never served from this cache)"
+        default true
+      end
+
+      integer :cache_max_entries do
+        description "The maximum number of DNS lookup results to cache in each process"
+        default 10_000
+      end
+
+      integer :cache_negative_ttl do
+        description "The number of seconds to cache lookups which returned no records"
+        default 60
+      end
+
+      integer :cache_max_ttl do
+        description "The maximum number of seconds to cache any DNS lookup result"
+        default 3600
+      end
+
+      integer :check_concurrency do
+        description "The number of DNS lookups and checks to run at the same time when checking the DNS records of all domains"
+        default 20
+      end
+
+      integer :check_batch_size do
+        description "The number of domains to save the DNS check results of in each transaction"
+        default 100
+      end
     end
 
     group :smtp do
@@ -550,6 +920,26 @@ module Postal
         description "The read timeout for outgoing SMTP connections"
         default 30
       end
+
+      boolean :pool_enabled do
+        description "Keep outgoing SMTP sessions open and reuse them for later messages to the same destination"
+        default false
+      end
+
+      integer :pool_max_connections_per_destination do
+        description "The maximum number of pooled SMTP sessions to each destination domain from each source IP address. This is not a hard limit: when every pooled session is in use, a new session which isn't pooled is opened straight away"
+        default 5
+      end
+
+      integer :pool_max_messages_per_session do
+        description "The number of messages after which a pooled SMTP session will be closed rather than reused"
+        default 200
+      end
+
+      integer :pool_idle_timeout do
+        description "The number of seconds an unused pooled SMTP session will be kept open for"
+        default 30
+      end
     end
 
     group :migration_waiter do
@@ -47,20 +47,22 @@ module Postal
 
       request["User-Agent"] = options[:user_agent] || "Postal/#{Postal.version}"
 
-      connection = Net::HTTP.new(uri.host, uri.port)
-
-      if uri.scheme == "https"
-        connection.use_ssl = true
-        connection.verify_mode = OpenSSL::SSL::VERIFY_PEER
-        ssl = true
-      else
-        ssl = false
-      end
+      ssl = uri.scheme == "https"
 
       begin
         timeout = options[:timeout] || 60
         Timeout.timeout(timeout) do
-          result = connection.request(request)
+          result = if options[:connection_pool]
+                     # Use a kept-alive connection from the given pool
+                     options[:connection_pool].request(uri, request)
+                   else
+                     connection = Net::HTTP.new(uri.host, uri.port)
+                     if ssl
+                       connection.use_ssl = true
+                       connection.verify_mode = OpenSSL::SSL::VERIFY_PEER
+                     end
+                     connection.request(request)
+                   end
           {
             code: result.code.to_i,
             body: result.body,
@@ -75,7 +77,7 @@ module Postal
           headers: {},
           secure: ssl
         }
-      rescue SocketError, Errno::ECONNRESET, EOFError, Errno::EINVAL, Errno::ENETUNREACH, Errno::EHOSTUNREACH, Errno::ECONNREFUSED => e
+      rescue SocketError, Errno::ECONNRESET, Errno::EPIPE, EOFError, Errno::EINVAL, Errno::ENETUNREACH, Errno::EHOSTUNREACH, Errno::ECONNREFUSED => e
         {
           code: -2,
           body: e.message,
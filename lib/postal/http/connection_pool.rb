@@ -0,0 +1,134 @@
+# frozen_string_literal: true
+
+require "net/https"
+
+module Postal
+  module HTTP
+    # A thread-safe pool of started (keep-alive) HTTP connections. Connections are keyed by the
+    # scheme, host and port of the destination and each connection is only used by one thread
+    # at a time. This allows repeated requests to the same host to avoid a new TCP connection
+    # and TLS handshake each time.
+    class ConnectionPool
+
+      Connection = Struct.new(:http, :checked_in_at)
+
+      attr_reader :idle_timeout
+      attr_reader :max_idle_per_host
+
+      # @param [Integer] idle_timeout The number of seconds an idle connection will be kept open for
+      # @param [Integer] max_idle_per_host The maximum number of idle connections to keep for each host
+      # @param [Integer, nil] open_timeout The number of seconds to wait for a new connection to open
+      # @param [Integer, nil] read_timeout The number of seconds to wait for data to be read
+      def initialize(idle_timeout:, max_idle_per_host:, open_timeout: nil, read_timeout: nil)
+        @idle_timeout = idle_timeout
+        @max_idle_per_host = max_idle_per_host
+        @open_timeout = open_timeout
+        @read_timeout = read_timeout
+        @idle = {}
+        @mutex = Mutex.new
+      end
+
+      # Send a request to the given URI using a pooled connection. If the request fails (or
+      # is interrupted) the connection is closed rather than being returned to the pool.
+      #
+      # Requests are not retried here because part of a request may already have been sent
+      # and the server may have acted on it. Before writing to a reused connection, Net::HTTP
+      # reconnects if the server has closed it, so errors which remain are passed on to the
+      # caller to retry in the usual way.
+      #
+      # @param [URI::Generic] uri
+      # @param [Net::HTTPRequest] request
+      # @return [Net::HTTPResponse]
+      def request(uri, request)
+        key = [uri.scheme, uri.host, uri.port]
+        perform(key, checkout(key, uri), request)
+      end
+
+      # Return the number of idle connections in the pool
+      #
+      # @return [Integer]
+      def idle_count
+        @mutex.synchronize { @idle.values.sum(&:size) }
+      end
+
+      # Close all idle connections
+      #
+      # @return [void]
+      def shutdown
+        connections = @mutex.synchronize do
+          all = @idle.values.flatten
+          @idle.clear
+          all
+        end
+        connections.each { |connection| finish(connection.http) }
+      end
+
+      private
+
+      def checkout(key, uri)
+        connection, expired = @mutex.synchronize do
+          cutoff = now - @idle_timeout
+          expired, fresh = (@idle[key] || []).partition { |c| c.checked_in_at < cutoff }
+          connection = fresh.pop
+          if fresh.empty?
+            @idle.delete(key)
+          else
+            @idle[key] = fresh
+          end
+          [connection, expired]
+        end
+        expired.each { |c| finish(c.http) }
+        return connection.http if connection
+
+        connect(uri)
+      end
+
+      def connect(uri)
+        http = Net::HTTP.new(uri.host, uri.port)
+        if uri.scheme == "https"
+          http.use_ssl = true
+          http.verify_mode = OpenSSL::SSL::VERIFY_PEER
+        end
+        http.keep_alive_timeout = @idle_timeout
+        http.open_timeout = @open_timeout if @open_timeout
+        http.read_timeout = @read_timeout if @read_timeout
+        http.start
+        http
+      end
+
+      def perform(key, http, request)
+        completed = false
+        response = http.request(request)
+        completed = true
+        response
+      ensure
+        completed ? checkin(key, http) : finish(http)
+      end
+
+      def checkin(key, http)
+        unless http.started?
+          finish(http)
+          return
+        end
+
+        extra = @mutex.synchronize do
+          list = (@idle[key] ||= [])
+          list << Connection.new(http, now)
+          list.shift(list.size - @max_idle_per_host) if list.size > @max_idle_per_host
+        end
+        extra&.each { |c| finish(c.http) }
+      end
+
+      def finish(http)
+        http.finish if http.started?
+      rescue StandardError
+        nil
+      end
+
+      def now
+        Process.clock_gettime(Process::CLOCK_MONOTONIC)
+      end
+
+    end
+  end
+end
@@ -2,31 +2,81 @@
 
 module Postal
   module MessageDB
+    # A process-wide pool of connections to the message database server. The pool will open at
+    # most `max_size` connections. When they are all in use, threads wait (in the order they
+    # arrived) for a connection to be checked in and give up after the checkout timeout.
+    #
+    # Connections which have been idle for longer than the idle timeout are closed, as are
+    # connections which are older than the maximum age. Connections which have been idle for a
+    # while are pinged before being handed out so that a broken connection is replaced before
+    # a query is run on it.
     class ConnectionPool
 
-      attr_reader :connections
+      extend HasPrometheusMetrics
+      include HasPrometheusMetrics
 
-      def initialize
-        @connections = []
+      class CheckoutTimeoutError < StandardError
+      end
+
+      Connection = Struct.new(:client, :created_at, :checked_in_at)
+
+      CONNECTION_ERROR_REGEX = /(lost connection|gone away|not connected)/i
+
+      attr_reader :max_size
+      attr_reader :checkout_timeout
+      attr_reader :idle_timeout
+      attr_reader :max_age
+      attr_reader :validation_interval
+
+      # @param [Integer] max_size The maximum number of connections (idle or in use)
+      # @param [Integer] checkout_timeout The number of seconds to wait for a connection when all are in use
+      # @param [Integer] idle_timeout The number of seconds an idle connection will be kept open for
+      # @param [Integer] max_age The number of seconds after which a connection will be closed rather than reused
+      # @param [Integer] validation_interval The number of seconds a connection can be idle before it is pinged on checkout
+      def initialize(max_size: Postal::Config.message_db.pool_size,
+                     checkout_timeout: Postal::Config.message_db.pool_checkout_timeout,
+                     idle_timeout: Postal::Config.message_db.pool_idle_timeout,
+                     max_age: Postal::Config.message_db.pool_max_connection_age,
+                     validation_interval: Postal::Config.message_db.pool_validation_interval)
+        @max_size = max_size
+        @checkout_timeout = checkout_timeout
+        @idle_timeout = idle_timeout
+        @max_age = max_age
+        @validation_interval = validation_interval
+        @idle = []
+        @size = 0
+        @waiters = []
+        @held = {}
         @lock = Mutex.new
+        @condition = ConditionVariable.new
       end
 
-      def use
+      # Check out a connection, yield it and check it back in again. If the block raises a
+      # connectivity error, the connection is closed and (unless retry_connection_errors is
+      # false) the block is retried once with a new connection. Nested calls from the same
+      # thread use the connection which is already held.
+      def use(retry_connection_errors: true)
+        if connection = @lock.synchronize { @held[Thread.current] }
+          return yield connection.client
+        end
+
         retried = false
-        do_not_checkin = false
         begin
+          connection = nil
           connection = checkout
-
-          yield connection
+          @lock.synchronize { @held[Thread.current] = connection }
+          yield connection.client
         rescue Mysql2::Error => e
-          if e.message =~ /(lost connection|gone away|not connected)/i
+          if connection && e.message =~ CONNECTION_ERROR_REGEX
             # If the connection has failed for a connectivity reason
             # we won't add it back in to the pool so that it'll reconnect
             # next time.
-            do_not_checkin = true
+            @lock.synchronize { @held.delete(Thread.current) }
+            close(connection, "broken")
+            connection = nil
 
             # If we haven't retried yet, we'll retry the block once more.
-            if retried == false
+            if retry_connection_errors && retried == false
               retried = true
               retry
             end
@@ -34,33 +84,195 @@ module Postal
 
           raise
         ensure
-          checkin(connection) unless do_not_checkin
+          if connection
+            @lock.synchronize { @held.delete(Thread.current) }
+            checkin(connection)
+          end
         end
       end
 
+      # Change the maximum number of connections. If the pool is made smaller, connections
+      # which are already open will stay open until they are closed for another reason.
+      #
+      # @param [Integer] max_size
+      # @return [void]
+      def max_size=(max_size)
+        @lock.synchronize do
+          @max_size = max_size
+          @condition.broadcast
+        end
+      end
+
+      # Return the clients for all idle connections
+      #
+      # @return [Array<Mysql2::Client>]
+      def connections
+        @lock.synchronize { @idle.map(&:client) }
+      end
+
+      # Return the number of open connections (idle or in use)
+      #
+      # @return [Integer]
+      def size
+        @lock.synchronize { @size }
+      end
+
+      # Close all connections which have been idle for longer than the idle timeout
+      #
+      # @return [Integer] the number of connections which were closed
+      def reap
+        expired = @lock.synchronize { remove_expired }
+        expired.each { |connection| close(connection, "idle", release: false) }
+        expired.size
+      end
+
+      # Close all idle connections. Connections which are in use will be closed when they are
+      # checked in.
+      #
+      # @return [void]
+      def disconnect
+        connections = @lock.synchronize do
+          idle = @idle
+          @idle = []
+          @size -= idle.size
+          idle
+        end
+        connections.each { |connection| close(connection, "disconnect", release: false) }
+      end
+
       private
 
       def checkout
-        @lock.synchronize do
-          return @connections.pop unless @connections.empty?
-        end
+        started_at = now
+        deadline = started_at + @checkout_timeout
+
+        loop do
+          connection, expired = @lock.synchronize { take_idle_or_reserve(deadline) }
+          expired.each { |c| close(c, "idle", release: false) }
 
-        add_new_connection
-        checkout
+          if connection.nil?
+            # We have reserved a slot for a new connection
+            begin
+              connection = Connection.new(establish_connection, now, nil)
+            rescue StandardError
+              release
+              raise
+            end
+          elsif connection.created_at < now - @max_age
+            close(connection, "age")
+            next
+          elsif connection.checked_in_at < now - @validation_interval && !alive?(connection)
+            close(connection, "validation")
+            next
+          end
+
+          observe_prometheus_histogram :postal_message_db_pool_wait_time, now - started_at
+          update_gauges
+          return connection
+        end
       end
 
       def checkin(connection)
+        if connection.created_at < now - @max_age
+          close(connection, "age")
+          return
+        end
+
         @lock.synchronize do
-          @connections << connection
+          connection.checked_in_at = now
+          @idle << connection
+          @condition.broadcast
+        end
+        update_gauges
+      end
+
+      # Return the most recently used idle connection or reserve a slot for a new connection if
+      # the pool isn't full. Threads which have to wait are served in the order they started
+      # waiting. Must be called while holding the lock.
+      #
+      # @return [Array(Connection, Array<Connection>)] the connection (or nil if a slot was reserved)
+      #   and any expired connections which should be closed by the caller
+      def take_idle_or_reserve(deadline)
+        expired = remove_expired
+        ticket = Object.new
+        loop do
+          if @waiters.empty? || @waiters.first.equal?(ticket)
+            if connection = @idle.pop
+              return [connection, expired]
+            end
+
+            if @size < @max_size
+              @size += 1
+              return [nil, expired]
+            end
+          end
+
+          @waiters << ticket unless @waiters.include?(ticket)
+
+          remaining = deadline - now
+          if remaining <= 0
+            increment_prometheus_counter :postal_message_db_pool_timeouts_total
+            raise CheckoutTimeoutError, "Timed out after #{@checkout_timeout}s waiting for a message DB connection " \
+                                        "(pool size is #{@max_size})"
+          end
+
+          set_prometheus_gauge :postal_message_db_pool_waiting, @waiters.size
+          @condition.wait(@lock, remaining)
         end
+      ensure
+        dequeue(ticket)
       end
 
-      def add_new_connection
+      # Remove a waiter from the queue and wake the others so the next one can take its turn.
+      # Must be called while holding the lock.
+      def dequeue(ticket)
+        return unless @waiters.delete(ticket)
+
+        set_prometheus_gauge :postal_message_db_pool_waiting, @waiters.size
+        @condition.broadcast
+      end
+
+      # Remove and return all idle connections which have been idle for longer than the idle
+      # timeout. The slots they used are released immediately and the caller is responsible for
+      # closing them. Must be called while holding the lock.
+      def remove_expired
+        cutoff = now - @idle_timeout
+        expired, @idle = @idle.partition { |connection| connection.checked_in_at < cutoff }
+        @size -= expired.size
+        expired
+      end
+
+      def alive?(connection)
+        connection.client.ping
+      rescue StandardError
+        false
+      end
+
+      # Close a connection and (unless it has already been released) release its slot in the pool
+      def close(connection, reason, release: true)
+        begin
+          connection.client.close
+        rescue StandardError
+          nil
+        end
+        increment_prometheus_counter :postal_message_db_pool_connections_closed_total, labels: { reason: reason }
+        self.release if release
+        update_gauges
+      end
+
+      def release
         @lock.synchronize do
-          @connections << establish_connection
+          @size -= 1
+          @condition.broadcast
         end
       end
 
+      def update_gauges
+        idle, size = @lock.synchronize { [@idle.size, @size] }
+        set_prometheus_gauge :postal_message_db_pool_connections, idle, labels: { state: "idle" }
+        set_prometheus_gauge :postal_message_db_pool_connections, size - idle, labels: { state: "in_use" }
+      end
+
       def establish_connection
         Mysql2::Client.new(
           host: Postal::Config.message_db.host,
@@ -71,6 +283,34 @@ module Postal
         )
       end
 
+      def now
+        Process.clock_gettime(Process::CLOCK_MONOTONIC)
+      end
+
+      class << self
+
+        def register_prometheus_metrics
+          register_prometheus_gauge :postal_message_db_pool_connections,
+                                    docstring: "The number of open message DB connections in this process",
+                                    labels: [:state]
+
+          register_prometheus_gauge :postal_message_db_pool_waiting,
+                                    docstring: "The number of threads waiting for a message DB connection"
+
+          register_prometheus_histogram :postal_message_db_pool_wait_time,
+                                        docstring: "The time spent waiting to check out a message DB connection (in seconds)",
+                                        buckets: [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10]
+
+          register_prometheus_counter :postal_message_db_pool_timeouts_total,
+                                      docstring: "The number of times a message DB connection could not be checked out in time"
+
+          register_prometheus_counter :postal_message_db_pool_connections_closed_total,
+                                      docstring: "The number of message DB connections which have been closed",
+                                      labels: [:reason]
+        end
+
+      end
+
     end
   end
 end
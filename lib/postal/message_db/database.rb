@@ -4,12 +4,26 @@ module Postal
   module MessageDB
     class Database
 
+      # Words shorter than this aren't included in full-text indexes (innodb_ft_min_token_size)
+      FULL_TEXT_MIN_WORD_LENGTH = 3
+
       class << self
 
         def connection_pool
           @connection_pool ||= ConnectionPool.new
         end
 
+        #
+        # Return the process-wide statistics aggregator. Returns nil if statistics
+        # should be written immediately.
+        #
+        def statistics_aggregator
+          return nil unless Postal::Config.message_db.statistics_write_behind?
+
+          @statistics_aggregator ||= StatisticsAggregator.new(flush_interval: Postal::Config.message_db.statistics_flush_interval,
+                                                              flush_threshold: Postal::Config.message_db.statistics_flush_threshold)
+        end
+
       end
 
       def initialize(organization_id, server_id, database_name: nil)
@@ -73,6 +87,13 @@ module Postal
         query("SELECT SUM(size) AS size FROM `#{database_name}`.`raw_message_sizes`").first["size"] || 0
       end
 
+      #
+      # Return the total number of bytes used to store all messages (after compression)
+      #
+      def total_stored_size
+        query("SELECT SUM(stored_size) AS size FROM `#{database_name}`.`raw_message_sizes`").first["size"] || 0
+      end
+
       #
       # Return the live stats instance
       #
@@ -116,21 +137,129 @@ module Postal
       end
 
       #
-      # Insert a new raw message into a table (creating it if needed)
+      # Insert a new raw message into a table (creating it if needed). Returns the table name,
+      # the IDs of the headers and body rows and the number of bytes stored.
+      #
+      # If deduplication is enabled and an identical body has already been stored in the same
+      # table, the existing body row will be used rather than storing another copy. Bodies are
+      # only ever shared within a single table so removing a table never affects messages which
+      # reference other tables.
       #
-      def insert_raw_message(data, date = Time.now.utc.to_date)
+      def insert_raw_message(data, date = Time.now.utc.to_date, compress: false)
         table_name = raw_table_name_for_date(date)
         begin
           headers, body = data.split(/\r?\n\r?\n/, 2)
-          headers_id = insert(table_name, data: headers)
-          body_id = insert(table_name, data: body)
+          headers_id, headers_size = insert_raw_data(table_name, headers, compress: compress)
+          body_id, body_size = insert_raw_body(table_name, body, compress: compress)
         rescue Mysql2::Error => e
           raise unless e.message =~ /doesn't exist/
 
           provisioner.create_raw_table(table_name)
           retry
         end
-        [table_name, headers_id, body_id]
+        [table_name, headers_id, body_id, headers_size + body_size]
+      end
+
+      #
+      # Insert many raw messages into the table for the given date. Returns the same as
+      # insert_raw_message for each message (in the same order).
+      #
+      # Identical bodies are deduplicated within the batch as well as against bodies which are
+      # already stored. Unlike insert_raw_message, the table won't be created if it doesn't
+      # exist (creating a table commits any open transaction) so ensure_raw_table should be
+      # called first.
+      #
+      def insert_raw_messages(messages, date = Time.now.utc.to_date, compress: false)
+        return [] if messages.empty?
+
+        table_name = raw_table_name_for_date(date)
+        # Messages created from the same data share the same String so it is only split (and its
+        # body only hashed) once
+        splits = {}.compare_by_identity
+        parts = messages.map { |data| splits[data] ||= data.split(/\r?\n\r?\n/, 2) }
+        headers_ids, headers_sizes = insert_raw_rows(table_name, parts.map { |headers, _| [headers, nil] }, compress: compress)
+
+        bodies = parts.map(&:last)
+        body_hashes = {}.compare_by_identity
+        hashes = bodies.map do |body|
+          next body_hashes[body] if body_hashes.key?(body)
+
+          body_hashes[body] = deduplicate_raw_body?(body) ? Digest::SHA256.hexdigest(body) : nil
+        end
+        existing = {}
+        if hashes.any?
+          select(table_name, where: { content_hash: hashes.compact.uniq }, fields: [:id, :content_hash]).each do |row|
+            existing[row["content_hash"]] ||= row["id"]
+          end
+        end
+
+        # Bodies which can't be reused are inserted, only once for each content hash
+        to_insert = []
+        rows_by_hash = {}
+        row_for_body = bodies.each_with_index.map do |body, index|
+          content_hash = hashes[index]
+          next if content_hash && existing[content_hash]
+          next rows_by_hash[content_hash] if content_hash && rows_by_hash[content_hash]
+
+          to_insert << [body, content_hash]
+          rows_by_hash[content_hash] = to_insert.size - 1 if content_hash
+          to_insert.size - 1
+        end
+        inserted_ids, inserted_sizes = insert_raw_rows(table_name, to_insert, compress: compress)
+
+        # The bytes stored for a shared body are only counted for the first message which uses it
+        counted_rows = Set.new
+        bodies.each_index.map do |index|
+          row = row_for_body[index]
+          if row.nil?
+            body_id = existing[hashes[index]]
+            body_size = 0
+          else
+            body_id = inserted_ids[row]
+            body_size = counted_rows.add?(row) ? inserted_sizes[row] : 0
+          end
+          [table_name, headers_ids[index], body_id, headers_sizes[index] + body_size]
+        end
+      end
+
+      #
+      # Create the raw message table for the given date if it doesn't already exist and
+      # return its name
+      #
+      def ensure_raw_table(date = Time.now.utc.to_date)
+        table_name = raw_table_name_for_date(date)
+        if query("SHOW TABLES FROM `#{database_name}` LIKE #{escape(table_name)}").none?
+          provisioner.create_raw_table(table_name)
+        end
+        table_name
+      end
+
+      #
+      # Return the (decompressed) data from a row in a raw message table
+      #
+      def raw_data(table_name, id)
+        row = select(table_name, where: { id: id }).first
+        return nil if row.nil?
+
+        RawCompression.decompress(row["data"], row["compression"])
+      end
+
+      #
+      # Replace the data in a row in a raw message table. Rows which may be shared with other
+      # messages (those with a content hash) are never changed, a new row is inserted instead.
+      # Returns the ID of the row which now contains the data.
+      #
+      def update_raw_data(table_name, id, data, compress: false)
+        stored_data, compression = compress ? RawCompression.compress(data) : [data, nil]
+        sql_query = "UPDATE `#{database_name}`.`#{table_name}` SET `data` = #{escape_binary(stored_data)}, "
+        sql_query << "`compression` = #{escape(compression)} WHERE `id` = #{id.to_i} AND `content_hash` IS NULL"
+        affected_rows = with_mysql do |mysql|
+          query_on_connection(mysql, sql_query)
+          mysql.affected_rows
+        end
+        return id if affected_rows.positive?
+
+        insert_raw_data(table_name, data, compress: compress).first
       end
 
       #
@@ -202,11 +331,67 @@ module Postal
         result
       end
 
+      #
+      # A paginated version of select which finds the records after (or before) the last
+      # record on the previous page (keyset pagination) rather than using an offset. This
+      # means that every page is as quick to load as the first as long as there is an index
+      # which can be used for the order. Accepts the same options as select as well as:
+      #
+      #   :cursor      => A cursor returned with a previous page (nil for the first page)
+      #   :per_page    => The number of items per page (defaults to 30)
+      #   :count_limit => The maximum number of records to count (defaults to the
+      #                   pagination_count_limit config option)
+      #
+      # Records are always ordered by their ID after the given order. The total is only
+      # counted up to the count limit and :total_capped will be true if there are more.
+      #
+      def select_with_cursor(table, options = {})
+        options = options.dup
+        per_page = options.delete(:per_page) || 30
+        count_limit = options.delete(:count_limit) || Postal::Config.message_db.pagination_count_limit
+        cursor = decode_cursor(options.delete(:cursor))
+        order = (options.delete(:order) || :id).to_s
+        direction = (options.delete(:direction) || "ASC").upcase
+        raise Postal::Error, "Invalid direction #{direction}" unless %w[ASC DESC].include?(direction)
+
+        # Pages before the cursor are found by reading backwards from it
+        backwards = cursor&.first == "before"
+        query_direction = backwards ^ (direction == "DESC") ? "DESC" : "ASC"
+
+        conditions = []
+        conditions << hash_to_sql(options[:where], " AND ") if options[:where].present?
+        conditions << cursor_condition(order, query_direction, cursor) if cursor
+
+        sql_query = String.new("SELECT")
+        sql_query << (options[:fields] ? " " + (options[:fields].map(&:to_s) | ["id", order]).map { |f| "`#{f}`" }.join(", ") : " *")
+        sql_query << " FROM `#{database_name}`.`#{table}`"
+        sql_query << " WHERE #{conditions.join(' AND ')}" if conditions.any?
+        sql_query << " ORDER BY "
+        sql_query << (order == "id" ? "" : "`#{order}` #{query_direction}, ")
+        sql_query << "`id` #{query_direction} LIMIT #{per_page.to_i + 1}"
+
+        records = query(sql_query).to_a
+        more = records.size > per_page
+        records = records.first(per_page)
+        records.reverse! if backwards
+
+        result = {}
+        result[:records] = records
+        result[:per_page] = per_page
+        result[:total], result[:total_capped] = count_with_limit(table, options[:where], count_limit)
+        if records.any?
+          result[:next_cursor] = encode_cursor("after", order, records.last) if backwards || more
+          result[:previous_cursor] = encode_cursor("before", order, records.first) if (backwards && more) || (!backwards && cursor)
+        end
+        result
+      end
+
       #
       # Updates a record in the database. Accepts a table name, the attributes to update
       # plus some options which are shown below:
       #
       #   :where     => The condition to apply to the query
+      #   :limit     => The maximum number of rows to update
       #
       # Will return the total number of affected rows.
       #
@@ -216,6 +401,9 @@ module Postal
         if options[:where]
           sql_query << (" " + build_where_string(options[:where]))
         end
+        if options[:limit]
+          sql_query << " LIMIT #{options[:limit].to_i}"
+        end
         with_mysql do |mysql|
           query_on_connection(mysql, sql_query)
           mysql.affected_rows
@@ -251,17 +439,96 @@ module Postal
         end
       end
 
+      #
+      # Insert multiple rows at the same time in the same query and return the IDs of the new
+      # rows (in the same order as the values provided).
+      #
+      # The IDs given to the rows of a multi-row insert aren't always consecutive (rows inserted
+      # by other connections at the same time can be given IDs in between) so the new rows are
+      # found again using the given key, which must have a different value for each row.
+      #
+      def insert_multi_with_ids(table, keys, values, key:)
+        return [] if values.empty?
+
+        key_index = keys.map(&:to_s).index(key.to_s)
+        raise ArgumentError, "#{key} must be one of the keys being inserted" if key_index.nil?
+
+        key_values = values.map { |v| v[key_index] }
+        if key_values.any?(&:nil?) || key_values.uniq.size != key_values.size
+          raise ArgumentError, "#{key} must have a different value for each row"
+        end
+
+        sql_query = "INSERT INTO `#{database_name}`.`#{table}`"
+        sql_query << (" (" + keys.map { |k| "`#{k}`" }.join(", ") + ")")
+        sql_query << " VALUES "
+        sql_query << values.map { |v| "(" + v.map { |r| escape(r) }.join(", ") + ")" }.join(", ")
+        first_id = with_mysql do |mysql|
+          query_on_connection(mysql, sql_query)
+          mysql.last_id
+        end
+
+        # The last insert ID is the lowest ID given to any of the new rows so older rows which
+        # happen to have the same key are never matched
+        ids = {}
+        select(table, where: { key => key_values, id: { greater_than_or_equal_to: first_id } }, fields: [:id, key]).each do |row|
+          raise Postal::Error, "More than one new row in #{table} has #{key} #{row[key.to_s]}" if ids.key?(row[key.to_s])
+
+          ids[row[key.to_s]] = row["id"]
+        end
+        key_values.map do |value|
+          ids[value] || raise(Postal::Error, "Could not find the new row in #{table} with #{key} #{value}")
+        end
+      end
+
+      #
+      # Run the given block within a transaction. All queries made by the block (on this
+      # thread) will use the same connection. If the block raises an error, the transaction
+      # will be rolled back and the error re-raised.
+      #
+      # Unlike other queries, the block is never retried if the connection fails because the
+      # block may have already done things (other than queries) which can't be repeated.
+      #
+      # Tables must not be created within the block because MySQL implicitly commits
+      # the transaction when a table is created.
+      #
+      def transaction
+        self.class.connection_pool.use(retry_connection_errors: false) do |mysql|
+          query_on_connection(mysql, "BEGIN")
+          committed = false
+          begin
+            result = yield
+            query_on_connection(mysql, "COMMIT")
+            committed = true
+            result
+          ensure
+            unless committed
+              begin
+                query_on_connection(mysql, "ROLLBACK")
+              rescue Mysql2::Error
+                # The connection has probably gone away in which case the transaction
+                # has already been rolled back by the server.
+                nil
+              end
+            end
+          end
+        end
+      end
+
       #
       # Deletes a in the database. Accepts a table name, and some options which
       # are shown below:
       #
       #   :where     => The condition to apply to the query
+      #   :limit     => The maximum number of rows to delete
       #
       # Will return the total number of affected rows.
       #
       def delete(table, options = {})
         sql_query = "DELETE FROM `#{database_name}`.`#{table}`"
         sql_query << (" " + build_where_string(options[:where], " AND "))
+        if options[:limit]
+          sql_query << " LIMIT #{options[:limit].to_i}"
+        end
         with_mysql do |mysql|
           query_on_connection(mysql, sql_query)
           mysql.affected_rows
@@ -321,9 +588,149 @@ module Postal
 
       private
 
+      # Return the number of records matching the given conditions, counting no more than the
+      # given limit (if there is one), and whether there are more records than the limit
+      def count_with_limit(table, where, limit)
+        return [select(table, where: where, count: true), false] if limit.nil? || limit <= 0
+
+        sql_query = "SELECT COUNT(*) AS count FROM (SELECT 1 FROM `#{database_name}`.`#{table}`"
+        sql_query << (" " + build_where_string(where, " AND ")) if where.present?
+        sql_query << " LIMIT #{limit.to_i}) AS limited"
+        count = query(sql_query).first["count"]
+        [count, count >= limit]
+      end
+
+      # Return a condition which matches the records after the position in the given cursor
+      # when reading in the given direction
+      def cursor_condition(order, direction, cursor)
+        _, value, id = cursor
+        operator = direction == "ASC" ? ">" : "<"
+        return "`id` #{operator} #{id.to_i}" if order == "id"
+
+        "(`#{order}` #{operator} #{escape(value)} OR (`#{order}` = #{escape(value)} AND `id` #{operator} #{id.to_i}))"
+      end
+
+      def encode_cursor(type, order, record)
+        value = record[order]
+        value = value.to_s("F") if value.is_a?(BigDecimal)
+        Base64.urlsafe_encode64([type, value, record["id"]].to_json, padding: false)
+      end
+
+      # Return the type, value and ID from a cursor or nil if it isn't valid
+      def decode_cursor(cursor)
+        return nil if cursor.blank?
+
+        type, value, id = JSON.parse(Base64.urlsafe_decode64(cursor.to_s))
+        return nil unless %w[after before].include?(type) && id.is_a?(Integer)
+
+        [type, value, id]
+      rescue ArgumentError, JSON::ParserError, TypeError
+        nil
+      end
+
+      # Escape the wildcard characters in a string which will be used in a LIKE condition
+      def escape_like(value)
+        value.to_s.gsub(/[\\%_]/) { |c| "\\#{c}" }
+      end
+
+      # Return a condition for a search term. Terms without a wildcard (%) must match exactly
+      # and terms with a wildcard only at the end match values which start with the term,
+      # both of which can use an index. Terms with wildcards anywhere else use LIKE which
+      # has to compare every row.
+      def search_condition(key, term)
+        if term.nil?
+          "`#{key}` IS NULL"
+        elsif !term.to_s.include?("%")
+          "`#{key}` = #{escape(term)}"
+        elsif term.to_s =~ /\A[^%]+%\z/
+          "`#{key}` LIKE #{escape(escape_like(term.to_s.chomp('%')) + '%')}"
+        else
+          "`#{key}` LIKE #{escape(term)}"
+        end
+      end
+
+      # Return a condition which matches values containing all the words in the given string.
+      # The subject full-text index is only used when it has been enabled and there are words
+      # long enough to have been indexed, otherwise the whole table has to be searched.
+      def contains_words_condition(key, value)
+        if key.to_s == "subject" && Postal::Config.message_db.subject_search_index? && (search = full_text_query(value)).present?
+          return "MATCH (`#{key}`) AGAINST (#{escape(search)} IN BOOLEAN MODE)"
+        end
+
+        words = value.to_s.split
+        return "`#{key}` LIKE #{escape('%' + escape_like(value.to_s) + '%')}" if words.empty?
+
+        "(" + words.map { |w| "`#{key}` LIKE #{escape('%' + escape_like(w) + '%')}" }.join(" AND ") + ")"
+      end
+
+      # Return a boolean mode full-text search query which matches all the words in the given
+      # string (or words which start with them). Words which are too short to have been
+      # indexed are left out.
+      def full_text_query(value)
+        words = value.to_s.scan(/[[:alnum:]]+/).select { |w| w.length >= FULL_TEXT_MIN_WORD_LENGTH }
+        words.map { |w| "+#{w}*" }.join(" ")
+      end
+
+      # Insert rows of raw data (each with an optional content hash) into a raw message table.
+      # Returns the ID of each row and the number of bytes stored for each one.
+      #
+      # Each row is inserted on its own because raw rows have no unique key which could be used
+      # to find their IDs after a multi-row insert (see insert_multi_with_ids). When called
+      # within a transaction, this still only needs one commit for all the rows.
+      def insert_raw_rows(table_name, rows, compress: false)
+        results = rows.map do |data, content_hash|
+          insert_raw_data(table_name, data, compress: compress, content_hash: content_hash)
+        end
+        [results.map(&:first), results.map(&:last)]
+      end
+
+      def insert_raw_data(table_name, data, compress: false, content_hash: nil)
+        return [insert(table_name, data: data), data.to_s.bytesize] unless compress || content_hash
+
+        data, compression = compress ? RawCompression.compress(data) : [data, nil]
+        sql_query = "INSERT INTO `#{database_name}`.`#{table_name}` (`data`, `compression`, `content_hash`)"
+        sql_query << " VALUES (#{escape_binary(data)}, #{escape(compression)}, #{escape(content_hash)})"
+        id = with_mysql do |mysql|
+          query_on_connection(mysql, sql_query)
+          mysql.last_id
+        end
+        [id, data.to_s.bytesize]
+      end
+
+      # Insert a raw message body, reusing an identical body already stored in the same table
+      # if deduplication is enabled. No bytes are stored when an existing body is reused.
+      def insert_raw_body(table_name, body, compress: false)
+        return insert_raw_data(table_name, body, compress: compress) unless deduplicate_raw_body?(body)
+
+        content_hash = Digest::SHA256.hexdigest(body)
+        if existing = select(table_name, where: { content_hash: content_hash }, fields: [:id], limit: 1).first
+          return [existing["id"], 0]
+        end
+
+        insert_raw_data(table_name, body, compress: compress, content_hash: content_hash)
+      end
+
+      def deduplicate_raw_body?(body)
+        return false unless Postal::Config.message_db.deduplicate_raw_messages?
+
+        !body.nil? && body.bytesize >= Postal::Config.message_db.deduplicate_raw_messages_min_size
+      end
+
+      # Escape a value as a binary string literal so that compressed data is not interpreted
+      # in the connection's character set
+      def escape_binary(value)
+        return "NULL" if value.nil?
+
+        with_mysql do |mysql|
+          "_binary'" + mysql.escape(value.b) + "'"
+        end
+      end
+
       def query_on_connection(connection, query)
         start_time = Time.now.to_f
-        result = connection.query(query, cast_booleans: true)
+        result = ActiveSupport::Notifications.instrument("query.message_db", query: query) do
+          connection.query(query, cast_booleans: true)
+        end
         time = Time.now.to_f - start_time
         logger.debug "  \e[4;34mMessageDB Query (#{time.round(2)}s) \e[0m  \e[33m#{query}\e[0m"
         if time > 0.05 && query =~ /\A(SELECT|UPDATE|DELETE) /
@@ -370,6 +777,12 @@ module Postal
                 sql << "`#{key}` >= #{escape(inner_value)}"
               when :like
                 sql << "`#{key}` LIKE #{escape(inner_value)}"
+              when :starts_with
+                sql << "`#{key}` LIKE #{escape(escape_like(inner_value) + '%')}"
+              when :search
+                sql << search_condition(key, inner_value)
+              when :contains_words
+                sql << contains_words_condition(key, inner_value)
               end
             end
             sql.empty? ? "1=1" : sql.join(joiner)
@@ -13,11 +13,39 @@ module Postal
       #
       def increment(type)
         time = Time.now.utc
-        type = @database.escape(type.to_s)
+        tracker = RateTracker.for(@database)
+        tracker&.increment(type, time)
+
+        if aggregator = Database.statistics_aggregator
+          aggregator.increment_live_stats(@database, type, time)
+          return
+        end
+
+        escaped_type = @database.escape(type.to_s)
         sql_query = "INSERT INTO `#{@database.database_name}`.`live_stats` (type, minute, timestamp, count)"
-        sql_query << " VALUES (#{type}, #{time.min}, #{time.to_f}, 1)"
+        sql_query << " VALUES (#{escaped_type}, #{time.min}, #{time.to_f}, 1)"
         sql_query << " ON DUPLICATE KEY UPDATE count = if(timestamp < #{time.to_f - 1800}, 1, count + 1), timestamp = #{time.to_f}"
         @database.query(sql_query)
+        tracker&.written([[type, time.min, time.to_f, 1]])
+      end
+
+      #
+      # Add multiple counts to the live stats in a single query. Accepts an array of
+      # [type, minute, timestamp, count] arrays.
+      #
+      def increment_many(rows)
+        return if rows.empty?
+
+        values = rows.map do |type, minute, timestamp, count|
+          "(#{@database.escape(type.to_s)}, #{minute.to_i}, #{timestamp.to_f}, #{count.to_i})"
+        end
+
+        sql_query = "INSERT INTO `#{@database.database_name}`.`live_stats` (type, minute, timestamp, count)"
+        sql_query << " VALUES #{values.join(', ')}"
+        sql_query << " ON DUPLICATE KEY UPDATE count = if(timestamp < VALUES(timestamp) - 1800, VALUES(count), count + VALUES(count)),"
+        sql_query << " timestamp = GREATEST(timestamp, VALUES(timestamp))"
+        @database.query(sql_query)
+        RateTracker.for(@database)&.written(rows)
       end
 
       #
@@ -31,6 +59,10 @@ module Postal
         options[:types] ||= [:incoming, :outgoing]
         raise Postal::Error, "You must provide at least one type to return" if options[:types].empty?
 
+        if tracker = RateTracker.for(@database)
+          return tracker.total(minutes, types: options[:types])
+        end
+
         time = minutes.minutes.ago.beginning_of_minute.utc.to_f
         types = options[:types].map { |t| @database.escape(t.to_s) }.join(", ")
         result = @database.query("SELECT SUM(count) as count FROM `#{@database.database_name}`.`live_stats` WHERE `type` IN (#{types}) AND timestamp > #{time}").first
@@ -26,12 +26,88 @@ module Postal
         end
       end
 
+      #
+      # Return a page of messages. If a :cursor option is provided (even if it is nil, which
+      # returns the first page) the messages are found using the cursor rather than the page
+      # number (see Database#select_with_cursor).
+      #
       def self.find_with_pagination(database, page, options = {})
-        messages = database.select_with_pagination("messages", page, options)
+        messages = if options.key?(:cursor)
+                     database.select_with_cursor("messages", options)
+                   else
+                     database.select_with_pagination("messages", page, options)
+                   end
         messages[:records] = messages[:records].map { |m| Message.new(database, m) }
         messages
       end
 
+      #
+      # Create many new messages which belong to the same database using as few queries as
+      # possible. The raw messages and the messages themselves are inserted in a single
+      # transaction (the messages using multi-row inserts). Statistics and queued messages are
+      # then added in bulk once the transaction has been committed.
+      #
+      def self.create_all(database, messages, queue: true)
+        return messages if messages.empty?
+
+        date = Time.now.utc.to_date
+        database.ensure_raw_table(date)
+        database.transaction do
+          insert_all_raw_messages(database, messages, date)
+          insert_all_messages(database, messages)
+        end
+
+        database.statistics.increment_all_many(messages.map { |m| [m.timestamp, m.scope] })
+        messages.group_by(&:scope).each do |scope, scoped_messages|
+          Statistic.update_counters(Statistic.global.id, :total_messages => scoped_messages.size,
+                                                         "total_#{scope}" => scoped_messages.size)
+        end
+        add_all_to_message_queue(database, messages) if queue
+        messages
+      end
+
+      def self.insert_all_raw_messages(database, messages, date)
+        pending = messages.filter_map do |message|
+          raw = message.take_pending_raw_message
+          raw ? [message, raw] : nil
+        end
+        return if pending.empty?
+
+        raws = pending.map(&:last)
+        results = database.insert_raw_messages(raws, date, compress: pending.first.first.compress_raw_message?)
+        pending.zip(results) do |(message, raw), (table_name, headers_id, body_id, _)|
+          message.raw_message_stored(raw, table_name, headers_id, body_id)
+        end
+        table_name = database.raw_table_name_for_date(date)
+        database.query("UPDATE `#{database.database_name}`.`raw_message_sizes` SET size = size + #{raws.sum(&:bytesize)}, stored_size = stored_size + #{results.sum(&:last)} WHERE table_name = '#{table_name}'")
+      end
+      private_class_method :insert_all_raw_messages
+
+      def self.insert_all_messages(database, messages)
+        messages.map { |m| [m, m.attributes_for_create] }.group_by { |_, attributes| attributes.keys }.each do |keys, group|
+          ids = database.insert_multi_with_ids("messages", keys, group.map { |_, attributes| attributes.values }, key: "token")
+          group.zip(ids) { |(message, _), id| message.id = id }
+        end
+      end
+      private_class_method :insert_all_messages
+
+      def self.add_all_to_message_queue(database, messages)
+        server = database.server
+        time = Time.now
+        rows = messages.map do |message|
+          queued_message = QueuedMessage.new(message: message,
+                                             server: server,
+                                             batch_key: message.batch_key,
+                                             domain: message.recipient_domain,
+                                             route_id: message.route_id)
+          queued_message.allocate_ip_address
+          queued_message.attributes.except("id").merge("created_at" => time, "updated_at" => time)
+        end
+        QueuedMessage.insert_all!(rows)
+        WorkNotifier.notify
+      end
+      private_class_method :add_all_to_message_queue
+
       attr_reader :database
 
       def initialize(database, attributes)
@@ -86,10 +162,10 @@ module Postal
       # Copy appropriate attributes from the raw message to the message itself
       #
       def copy_attributes_from_raw_message
-        return unless raw_message
+        return unless raw_message?
 
-        self.subject = headers["subject"]&.last.to_s[0, 200]
-        self.message_id = headers["message-id"]&.last
+        self.subject = header_index["subject"]&.last.to_s[0, 200]
+        self.message_id = header_index["message-id"]&.last
         return unless message_id
 
         self.message_id = message_id.gsub(/.*</, "").gsub(/>.*/, "").strip
@@ -236,7 +312,7 @@ module Postal
       #
       def raw_headers
         if raw_table
-          @raw_headers ||= @database.select(raw_table, where: { id: raw_headers_id }).first&.send(:[], "data") || ""
+          @raw_headers ||= @database.raw_data(raw_table, raw_headers_id) || ""
         else
           ""
         end
@@ -247,7 +323,7 @@ module Postal
       #
       def raw_body
         if raw_table
-          @raw ||= @database.select(raw_table, where: { id: raw_body_id }).first&.send(:[], "data") || ""
+          @raw ||= @database.raw_data(raw_table, raw_body_id) || ""
         else
           ""
         end
@@ -261,31 +337,63 @@ module Postal
       end
 
       #
-      # Set the raw message ready for saving later
+      # Set the raw message ready for saving later. This can be a string or an object which
+      # responds to `read` (such as the data received by the SMTP server) which will be read
+      # when the message is saved.
       #
       def raw_message=(raw)
-        @pending_raw_message = raw.force_encoding("BINARY")
+        @pending_raw_message = raw.respond_to?(:read) ? raw : raw.force_encoding("BINARY")
       end
 
       #
       # Save the raw message to the database as appropriate
       #
       def save_raw_message
-        return unless @pending_raw_message
+        return unless raw = take_pending_raw_message
 
-        self.size = @pending_raw_message.bytesize
         date = Time.now.utc.to_date
-        table_name, headers_id, body_id = @database.insert_raw_message(@pending_raw_message, date)
+        table_name, headers_id, body_id, stored_size = @database.insert_raw_message(raw, date, compress: compress_raw_message?)
+        raw_message_stored(raw, table_name, headers_id, body_id)
+        @database.query("UPDATE `#{@database.database_name}`.`raw_message_sizes` SET size = size + #{size}, stored_size = stored_size + #{stored_size} WHERE table_name = '#{table_name}'")
+      end
+
+      #
+      # Return the raw message which is waiting to be saved (reading it if needed) and
+      # forget it so that it will only be saved once.
+      #
+      def take_pending_raw_message
+        return nil unless @pending_raw_message
+
+        raw = @pending_raw_message
+        raw = raw.read.force_encoding("BINARY") if raw.respond_to?(:read)
+        @pending_raw_message = nil
+        raw
+      end
+
+      #
+      # Record where the given raw message has been stored and update the attributes which
+      # are copied from it
+      #
+      def raw_message_stored(raw, table_name, headers_id, body_id)
+        self.size = raw.bytesize
         self.raw_table = table_name
         self.raw_headers_id = headers_id
         self.raw_body_id = body_id
         @raw = nil
         @raw_headers = nil
+        @raw_message = nil
+        @inspection_digest = nil
         @headers = nil
+        @header_index = HeaderIndex.new(raw)
         @mail = nil
-        @pending_raw_message = nil
         copy_attributes_from_raw_message
-        @database.query("UPDATE `#{@database.database_name}`.`raw_message_sizes` SET size = size + #{size} WHERE table_name = '#{table_name}'")
+      end
+
+      #
+      # Should the raw message be compressed when it is stored?
+      #
+      def compress_raw_message?
+        !!@database.server&.compress_raw_messages?
       end
 
       #
@@ -327,17 +435,15 @@ module Postal
       # Return the headers for this message
       #
       def headers
-        @headers ||= begin
-          mail = Mail.new(raw_headers)
-          mail.header.fields.each_with_object({}) do |field, hash|
-            hash[field.name.downcase] ||= []
-            begin
-              hash[field.name.downcase] << field.decoded
-            rescue Mail::Field::IncompleteParseError
-              # Never mind, move on to the next header
-            end
-          end
-        end
+        @headers ||= header_index.to_h
+      end
+
+      #
+      # Return an index of the header fields for this message. This is built once and is much
+      # cheaper than parsing the headers with Mail.
+      #
+      def header_index
+        @header_index ||= HeaderIndex.new(raw_headers)
       end
 
       #
@@ -413,7 +519,10 @@ module Postal
       def add_outgoing_headers
         headers = []
         if domain
-          dkim = DKIMHeader.new(domain, raw_message)
+          # The body is not changed once a message has been signed so the body hash can be
+          # shared by all messages which reference the same raw body
+          dkim = DKIMHeader.new(domain, raw_message, header_index: header_index,
+                                body_hash_key: [@database.database_name, raw_table, raw_body_id])
           headers << dkim.dkim_header
         end
         headers << "X-Postal-MsgID: #{token}"
@@ -426,10 +535,12 @@ module Postal
       def append_headers(*headers)
         new_headers = headers.join("\r\n")
         new_headers = "#{new_headers}\r\n#{raw_headers}"
-        @database.update(raw_table, { data: new_headers }, where: { id: raw_headers_id })
+        headers_id = @database.update_raw_data(raw_table, raw_headers_id, new_headers, compress: compress_raw_message?)
+        update(raw_headers_id: headers_id) if headers_id != raw_headers_id
         @raw_headers = new_headers
         @raw_message = nil
         @headers = nil
+        @header_index = nil
       end
 
       #
@@ -493,6 +604,16 @@ module Postal
         token
       end
 
+      #
+      # Create links for the given URLs and tokens using a single query
+      #
+      def create_links(links)
+        timestamp = Time.now.to_f
+        database.insert_multi(:links, [:message_id, :hash, :url, :timestamp, :token], links.map do |url, token|
+          [id, Digest::SHA1.hexdigest(url.to_s), url, timestamp, token]
+        end)
+      end
+
       #
       # Return a message object that this message is a reply to
       #
@@ -530,6 +651,15 @@ module Postal
         result
       end
 
+      #
+      # Return a digest of the content of this message to key cached inspection results by. When
+      # the message has been parsed by this instance, this is the content before tracking was
+      # added.
+      #
+      def inspection_digest
+        @inspection_digest || Digest::SHA256.hexdigest(raw_message)
+      end
+
       #
       # Return all spam checks for this message
       #
@@ -550,16 +680,24 @@ module Postal
       # Parse the contents of this message
       #
       def parse_content
+        # Tracking gives each recipient different links so the content is recorded before it is
+        # added to allow the recipients of the same message to share cached inspection results.
+        @inspection_digest = Digest::SHA256.hexdigest(raw_message) if MessageInspection.cache
         parse_result = Postal::MessageParser.new(self)
         if parse_result.actioned?
           # Somethign was changed, update the raw message
-          @database.update(raw_table, { data: parse_result.new_body }, where: { id: raw_body_id })
-          @database.update(raw_table, { data: parse_result.new_headers }, where: { id: raw_headers_id })
+          body_id = @database.update_raw_data(raw_table, raw_body_id, parse_result.new_body, compress: compress_raw_message?)
+          headers_id = @database.update_raw_data(raw_table, raw_headers_id, parse_result.new_headers, compress: compress_raw_message?)
+          self.raw_body_id = body_id
+          self.raw_headers_id = headers_id
           @raw = parse_result.new_body
           @raw_headers = parse_result.new_headers
           @raw_message = nil
+          @headers = nil
+          @header_index = nil
         end
-        update("parsed" => 1, "tracked_links" => parse_result.tracked_links, "tracked_images" => parse_result.tracked_images)
+        update("parsed" => 1, "tracked_links" => parse_result.tracked_links, "tracked_images" => parse_result.tracked_images,
+               "raw_headers_id" => raw_headers_id, "raw_body_id" => raw_body_id)
       end
 
       #
@@ -576,6 +714,17 @@ module Postal
         parsed? == false && headers["x-amp"] != "skip"
       end
 
+      #
+      # Set the attributes which every new message needs (if they haven't been set already)
+      # and return the attributes which should be inserted
+      #
+      def attributes_for_create
+        self.timestamp = Time.now.to_f if timestamp.blank?
+        self.status = "Pending" if status.blank?
+        self.token = SecureRandom.alphanumeric(16) if token.blank?
+        @attributes.except("id")
+      end
+
       private
 
       def _update
@@ -583,10 +732,7 @@ module Postal
       end
 
       def _create(queue: true)
-        self.timestamp = Time.now.to_f if timestamp.blank?
-        self.status = "Pending" if status.blank?
-        self.token = SecureRandom.alphanumeric(16) if token.blank?
-        last_id = @database.insert("messages", @attributes.except(:id))
+        last_id = @database.insert("messages", attributes_for_create)
         @attributes["id"] = last_id
         @database.statistics.increment_all(timestamp, scope)
         Statistic.global.increment!(:total_messages)
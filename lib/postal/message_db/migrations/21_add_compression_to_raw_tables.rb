@@ -0,0 +1,19 @@
+# frozen_string_literal: true
+
+module Postal
+  module MessageDB
+    module Migrations
+      class AddCompressionToRawTables < Postal::MessageDB::Migration
+
+        def up
+          @database.query("ALTER TABLE `#{@database.database_name}`.`raw_message_sizes` ADD COLUMN `stored_size` bigint DEFAULT NULL")
+          @database.query("UPDATE `#{@database.database_name}`.`raw_message_sizes` SET `stored_size` = `size`")
+          @database.provisioner.raw_tables(nil).each do |table|
+            @database.query("ALTER TABLE `#{@database.database_name}`.`#{table}` ADD COLUMN `compression` varchar(10) DEFAULT NULL")
+          end
+        end
+
+      end
+    end
+  end
+end
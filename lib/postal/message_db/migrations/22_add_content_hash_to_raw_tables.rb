@@ -0,0 +1,18 @@
+# frozen_string_literal: true
+
+module Postal
+  module MessageDB
+    module Migrations
+      class AddContentHashToRawTables < Postal::MessageDB::Migration
+
+        def up
+          @database.provisioner.raw_tables(nil).each do |table|
+            @database.query("ALTER TABLE `#{@database.database_name}`.`#{table}` ADD COLUMN `content_hash` varchar(64) DEFAULT NULL, " \
+                            "ADD KEY `on_content_hash` (`content_hash`(16)) USING BTREE")
+          end
+        end
+
+      end
+    end
+  end
+end
@@ -0,0 +1,20 @@
+# frozen_string_literal: true
+
+module Postal
+  module MessageDB
+    module Migrations
+      class AddLookupHashToSuppressions < Postal::MessageDB::Migration
+
+        def up
+          @database.query("ALTER TABLE `#{@database.database_name}`.`suppressions` ADD COLUMN `lookup_hash` char(40) DEFAULT NULL")
+          @database.query("UPDATE `#{@database.database_name}`.`suppressions` SET `lookup_hash` = SHA1(LOWER(CONCAT(`type`, ':', `address`)))")
+          # Only keep the most recent entry for each address so that the unique key can be added
+          @database.query("DELETE s1 FROM `#{@database.database_name}`.`suppressions` s1 " \
+                          "JOIN `#{@database.database_name}`.`suppressions` s2 ON s1.lookup_hash = s2.lookup_hash AND s1.id < s2.id")
+          @database.query("ALTER TABLE `#{@database.database_name}`.`suppressions` ADD UNIQUE KEY `on_lookup_hash` (`lookup_hash`)")
+        end
+
+      end
+    end
+  end
+end
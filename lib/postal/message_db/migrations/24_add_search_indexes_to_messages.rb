@@ -0,0 +1,25 @@
+# frozen_string_literal: true
+
+module Postal
+  module MessageDB
+    module Migrations
+      class AddSearchIndexesToMessages < Postal::MessageDB::Migration
+
+        def up
+          # Longer prefixes mean that searching for a full address only needs to read the rows
+          # for that address rather than every address which starts with the same 12 characters.
+          # Rebuilding these indexes doesn't block writes to the table.
+          #
+          # The full-text index used for subject searches isn't added here because building the
+          # first full-text index on a table locks it against writes. It can be added with the
+          # postal:add_message_subject_search_indexes task instead.
+          @database.query("ALTER TABLE `#{@database.database_name}`.`messages` " \
+                          "DROP INDEX `on_rcpt_to`, ADD INDEX `on_rcpt_to` (`rcpt_to`(32), `timestamp`), " \
+                          "DROP INDEX `on_mail_from`, ADD INDEX `on_mail_from` (`mail_from`(32), `timestamp`), " \
+                          "ALGORITHM=INPLACE, LOCK=NONE")
+        end
+
+      end
+    end
+  end
+end
@@ -65,6 +65,22 @@ module Postal
         @database.query("DROP TABLE `#{@database.database_name}`.`#{table_name}`")
       end
 
+      #
+      # Add the full-text index used for subject searches to the messages table. Returns false
+      # if the index already exists.
+      #
+      # Building the first full-text index on a table rebuilds it and blocks writes to it
+      # until it has finished, so this isn't run as a migration.
+      #
+      def add_subject_search_index
+        exists = @database.query("SELECT 1 FROM `information_schema`.`statistics` WHERE table_schema = '#{@database.database_name}' " \
+                                 "AND table_name = 'messages' AND index_name = 'on_subject' LIMIT 1").first
+        return false if exists
+
+        @database.query("ALTER TABLE `#{@database.database_name}`.`messages` ADD FULLTEXT INDEX `on_subject` (`subject`)")
+        true
+      end
+
       #
       # Clean the database. This really only useful in development & testing
       # environment and can be quite dangerous in production.
@@ -84,9 +100,13 @@ module Postal
         @database.query(create_table_query(table, columns: {
             id: "int(11) NOT NULL AUTO_INCREMENT",
             data: "longblob DEFAULT NULL",
-            next: "int(11) DEFAULT NULL"
+            next: "int(11) DEFAULT NULL",
+            compression: "varchar(10) DEFAULT NULL",
+            content_hash: "varchar(64) DEFAULT NULL"
+          }, indexes: {
+            on_content_hash: "`content_hash`(16)"
           }))
-        @database.query("INSERT INTO `#{@database.database_name}`.`raw_message_sizes` (table_name, size) VALUES ('#{table}', 0)")
+        @database.query("INSERT INTO `#{@database.database_name}`.`raw_message_sizes` (table_name, size, stored_size) VALUES ('#{table}', 0, 0)")
       rescue Mysql2::Error => e
         # Don't worry if the table already exists, another thread has already run this code.
         raise unless e.message =~ /already exists/
@@ -111,17 +131,30 @@ module Postal
       #
       # Tidy all messages
       #
-      def remove_raw_tables_older_than(max_age = 30)
+      def remove_raw_tables_older_than(max_age = 30, **options)
         raw_tables(max_age).each do |table|
-          remove_raw_table(table)
+          remove_raw_table(table, **options)
         end
       end
 
       #
-      # Remove a raw message table
+      # Remove a raw message table. Deduplicated bodies are only shared between messages which
+      # reference the same table so all references to them are removed here too.
       #
-      def remove_raw_table(table)
-        @database.query("UPDATE `#{@database.database_name}`.`messages` SET raw_table = NULL, raw_headers_id = NULL, raw_body_id = NULL, size = NULL WHERE raw_table = '#{table}'")
+      # If a chunk size is given, messages which reference the table are updated no more than
+      # that many rows at a time (at no more than rows_per_second, if given).
+      #
+      def remove_raw_table(table, chunk_size: nil, rows_per_second: nil)
+        if chunk_size
+          loop do
+            rows = throttle(rows_per_second) do
+              @database.update(:messages, { raw_table: nil, raw_headers_id: nil, raw_body_id: nil, size: nil }, where: { raw_table: table }, limit: chunk_size)
+            end
+            break if rows < chunk_size
+          end
+        else
+          @database.query("UPDATE `#{@database.database_name}`.`messages` SET raw_table = NULL, raw_headers_id = NULL, raw_body_id = NULL, size = NULL WHERE raw_table = '#{table}'")
+        end
         @database.query("DELETE FROM `#{@database.database_name}`.`raw_message_sizes` WHERE table_name = '#{table}'")
         drop_table(table)
       end
@@ -142,21 +175,75 @@ module Postal
       end
 
       #
-      # Remove raw message tables in order order until size is under the given size (given in MB)
+      # Remove messages that are too old to retain (along with their deliveries, clicks, loads
+      # and spam checks) no more than chunk_size messages at a time so that the tables are never
+      # locked for long. If rows_per_second is given, this will pause between chunks to remove
+      # rows no faster than that.
+      #
+      # Yields the ID of the newest message removed and the number of rows removed after each
+      # chunk. Returns the total number of rows removed. If after_id is given (the last ID
+      # yielded by an earlier, interrupted call), messages up to it are assumed to have been
+      # removed already and chunks will start after it.
+      #
+      def remove_messages_in_chunks(max_age = 60, chunk_size:, rows_per_second: nil, after_id: nil)
+        time = (Time.now.utc.to_date - max_age.days).to_time.end_of_day
+        return 0 unless newest_message_to_remove = @database.select(:messages, where: { timestamp: { less_than_or_equal_to: time.to_f } }, limit: 1, order: :id, direction: "DESC", fields: [:id]).first
+
+        newest_id = newest_message_to_remove["id"]
+        total_rows = 0
+        loop do
+          id_range = { less_than_or_equal_to: newest_id }
+          id_range[:greater_than] = after_id if after_id
+          chunk = @database.select(:messages, where: { id: id_range }, limit: chunk_size, order: :id, direction: "ASC", fields: [:id])
+          break if chunk.empty?
+
+          last_id = chunk.last["id"]
+          chunk_range = { less_than_or_equal_to: last_id }
+          chunk_range[:greater_than] = after_id if after_id
+          rows = throttle(rows_per_second) do
+            [:clicks, :loads, :deliveries, :spam_checks].sum do |table|
+              @database.delete(table, where: { message_id: chunk_range })
+            end + @database.delete(:messages, where: { id: chunk_range })
+          end
+          total_rows += rows
+          after_id = last_id
+          yield last_id, rows if block_given?
+          break if chunk.size < chunk_size
+        end
+        total_rows
+      end
+
+      #
+      # Remove raw message tables in order order until the number of bytes stored on disk (after
+      # compression) is under the given size (given in bytes)
       #
-      def remove_raw_tables_until_less_than_size(size)
+      def remove_raw_tables_until_less_than_size(size, **options)
         tables = raw_tables(nil)
         tables_removed = []
-        until @database.total_size <= size
+        until @database.total_stored_size <= size
           table = tables.shift
           tables_removed << table
-          remove_raw_table(table)
+          remove_raw_table(table, **options)
         end
         tables_removed
       end
 
       private
 
+      #
+      # Run the block and then, if rows_per_second is given, sleep for long enough that the
+      # number of rows the block returns are not removed faster than that rate
+      #
+      def throttle(rows_per_second)
+        started_at = ::Process.clock_gettime(::Process::CLOCK_MONOTONIC)
+        rows = yield
+        if rows_per_second&.positive?
+          remaining = (rows.to_f / rows_per_second) - (::Process.clock_gettime(::Process::CLOCK_MONOTONIC) - started_at)
+          sleep remaining if remaining.positive?
+        end
+        rows
+      end
+
       #
       # Build a query to load a table
       #
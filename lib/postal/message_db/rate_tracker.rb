@@ -0,0 +1,155 @@
+# frozen_string_literal: true
+
+module Postal
+  module MessageDB
+    # The rate tracker keeps an in-memory copy of a server's live stats so that the number of
+    # messages sent in the last hour can be read without querying the database. It holds one
+    # bucket per minute for each type (in the same way as the live_stats table) and is updated
+    # whenever the live stats are incremented by this process.
+    #
+    # Increments made by other processes are picked up by periodically reloading all the
+    # buckets from the live_stats table with a single query. Local increments which haven't
+    # been written to the database yet (for example, because they are waiting in the
+    # statistics aggregator) are tracked separately and added back on to the reloaded buckets
+    # so that they aren't lost until the next reload.
+    class RateTracker
+
+      Bucket = Struct.new(:count, :timestamp)
+
+      TRACKERS_MUTEX = Mutex.new
+
+      attr_reader :refresh_interval
+
+      # @param [Postal::MessageDB::Database] database
+      # @param [Integer] refresh_interval The number of seconds after which buckets will be reloaded
+      def initialize(database, refresh_interval:)
+        @database = database
+        @refresh_interval = refresh_interval
+        @buckets = {}
+        @unwritten = {}
+        @refreshed_at = nil
+        @mutex = Mutex.new
+      end
+
+      #
+      # Add one to the bucket for the current minute for the given type. This mirrors the
+      # query used by LiveStats#increment.
+      #
+      def increment(type, time = Time.now)
+        time = time.utc.to_f
+        minute = Time.at(time).utc.min
+        @mutex.synchronize do
+          add_to_bucket(@buckets, type.to_s, minute, 1, time)
+          add_to_bucket(@unwritten, type.to_s, minute, 1, time)
+        end
+      end
+
+      #
+      # Record that local increments have been written to the database so they will be
+      # included when the buckets are next reloaded. Accepts an array of
+      # [type, minute, timestamp, count] arrays (as passed to LiveStats#increment_many).
+      #
+      def written(rows)
+        @mutex.synchronize do
+          rows.each do |type, minute, _timestamp, count|
+            buckets = @unwritten[type.to_s]
+            bucket = buckets&.[](minute.to_i)
+            next if bucket.nil?
+
+            bucket.count -= count.to_i
+            buckets.delete(minute.to_i) if bucket.count <= 0
+          end
+        end
+      end
+
+      #
+      # Return the total number of messages for the given types in the last number of
+      # minutes. This mirrors the query used by LiveStats#total.
+      #
+      def total(minutes, types:)
+        refresh_if_stale
+        time = minutes.minutes.ago.beginning_of_minute.utc.to_f
+        @mutex.synchronize do
+          types.sum do |type|
+            (@buckets[type.to_s] || {}).each_value.sum { |bucket| bucket.timestamp > time ? bucket.count : 0 }
+          end
+        end
+      end
+
+      #
+      # Reload all the buckets from the database, adding on any local increments which haven't
+      # been written to it yet
+      #
+      def refresh
+        since = 1.hour.ago.beginning_of_minute.utc.to_f
+        rows = @database.select(:live_stats, where: { timestamp: { greater_than: since } })
+        buckets = rows.each_with_object({}) do |row, hash|
+          (hash[row["type"]] ||= {})[row["minute"]] = Bucket.new(row["count"].to_i, row["timestamp"].to_f)
+        end
+
+        @mutex.synchronize do
+          @unwritten.each do |type, unwritten_buckets|
+            # Increments which still haven't been written after an hour are no longer needed
+            unwritten_buckets.delete_if { |_, bucket| bucket.timestamp <= since }
+            unwritten_buckets.each do |minute, bucket|
+              add_to_bucket(buckets, type, minute, bucket.count, bucket.timestamp)
+            end
+          end
+          @buckets = buckets
+          @refreshed_at = now
+        end
+      end
+
+      private
+
+      # Add a count to the bucket for the given type and minute, replacing the bucket if it
+      # holds counts from a previous hour. Must be called while holding the mutex.
+      def add_to_bucket(buckets, type, minute, count, time)
+        type_buckets = (buckets[type] ||= {})
+        bucket = type_buckets[minute]
+        if bucket.nil? || bucket.timestamp < time - 1800
+          type_buckets[minute] = Bucket.new(count, time)
+        else
+          bucket.count += count
+          bucket.timestamp = [bucket.timestamp, time].max
+        end
+      end
+
+      def refresh_if_stale
+        refreshed_at = @mutex.synchronize { @refreshed_at }
+        return if refreshed_at && refreshed_at > now - @refresh_interval
+
+        refresh
+      end
+
+      def now
+        Process.clock_gettime(Process::CLOCK_MONOTONIC)
+      end
+
+      class << self
+
+        #
+        # Return the rate tracker for the given database. Returns nil if rate tracking has been
+        # disabled.
+        #
+        def for(database)
+          return nil unless Postal::Config.message_db.rate_tracker_enabled?
+
+          TRACKERS_MUTEX.synchronize do
+            @trackers ||= {}
+            @trackers[database.database_name] ||= new(database, refresh_interval: Postal::Config.message_db.rate_tracker_refresh_interval)
+          end
+        end
+
+        #
+        # Remove all trackers
+        #
+        def reset
+          TRACKERS_MUTEX.synchronize { @trackers = {} }
+        end
+
+      end
+
+    end
+  end
+end
@@ -0,0 +1,44 @@
+# frozen_string_literal: true
+
+require "zlib"
+
+module Postal
+  module MessageDB
+    # Raw message data can be stored compressed in the raw message tables. Each row records the
+    # compression which was used in its `compression` column so that rows stored before
+    # compression was enabled (or for servers without compression) continue to be read as-is.
+    module RawCompression
+
+      ZLIB = "zlib"
+
+      #
+      # Compress the given data. Returns the data to store and the name of the compression used
+      # (or nil if the data should be stored uncompressed because compressing it did not make it
+      # any smaller).
+      #
+      def self.compress(data)
+        return [data, nil] if data.nil? || data.empty?
+
+        compressed = Zlib::Deflate.deflate(data)
+        return [data, nil] if compressed.bytesize >= data.bytesize
+
+        [compressed, ZLIB]
+      end
+
+      #
+      # Return the original data for data which was stored with the given compression
+      #
+      def self.decompress(data, compression)
+        return data if data.nil? || compression.blank?
+
+        case compression
+        when ZLIB
+          Zlib::Inflate.inflate(data)
+        else
+          raise Postal::Error, "Unknown raw message compression '#{compression}'"
+        end
+      end
+
+    end
+  end
+end
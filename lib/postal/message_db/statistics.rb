@@ -28,14 +28,58 @@ module Postal
       end
 
       #
-      # Increment all stats counters
+      # Increment all stats counters. If the statistics aggregator is enabled, the
+      # increment will be written in the background with other increments.
       #
       def increment_all(time, field)
+        if aggregator = Database.statistics_aggregator
+          aggregator.increment_statistics(@database, time, field)
+          return
+        end
+
         STATS_GAPS.each_key do |type|
           increment_one(type, field, time)
         end
       end
 
+      #
+      # Increment all stats counters for many messages at once. Accepts an array of times and
+      # fields. Without the statistics aggregator, a single query is made for each type.
+      #
+      def increment_all_many(entries)
+        if aggregator = Database.statistics_aggregator
+          entries.each { |time, field| aggregator.increment_statistics(@database, time, field) }
+          return
+        end
+
+        STATS_GAPS.each do |type, gap|
+          counts = Hash.new { |hash, time_i| hash[time_i] = Hash.new(0) }
+          entries.each do |time, field|
+            counts[time.utc.send("beginning_of_#{gap}").to_i][field.to_sym] += 1
+          end
+          increment_many(type, counts)
+        end
+      end
+
+      #
+      # Add multiple counts to multiple rows in a single query. Accepts a hash of
+      # times (the start of each period) to a hash of counters and the amount they
+      # should be increased by.
+      #
+      def increment_many(type, counts)
+        return if counts.empty?
+
+        values = counts.map do |time_i, counters|
+          "(#{time_i.to_i}, " + COUNTERS.map { |c| counters[c].to_i }.join(", ") + ")"
+        end
+
+        sql_query = "INSERT INTO `#{@database.database_name}`.`stats_#{type}` (time, #{COUNTERS.join(', ')})"
+        sql_query << " VALUES #{values.join(', ')}"
+        sql_query << " ON DUPLICATE KEY UPDATE "
+        sql_query << COUNTERS.map { |c| "#{c} = #{c} + VALUES(#{c})" }.join(", ")
+        @database.query(sql_query)
+      end
+
       #
       # Get a statistic (or statistics)
       #
@@ -0,0 +1,223 @@
+# frozen_string_literal: true
+
+module Postal
+  module MessageDB
+    # The statistics aggregator collects increments to the statistics and live stats tables in
+    # memory and writes them to the message databases in the background. All increments for the
+    # same database, table and time bucket are combined and written with a single multi-row
+    # upsert for each table rather than one query per increment.
+    #
+    # Pending increments are flushed every few seconds, as soon as the number of pending
+    # increments reaches a threshold, and when the process exits.
+    class StatisticsAggregator
+
+      extend HasPrometheusMetrics
+      include HasPrometheusMetrics
+
+      attr_reader :flush_interval
+      attr_reader :flush_threshold
+
+      # @param [Integer] flush_interval The maximum number of seconds between flushes
+      # @param [Integer] flush_threshold The number of pending increments which will trigger a flush
+      def initialize(flush_interval:, flush_threshold:)
+        @flush_interval = flush_interval
+        @flush_threshold = flush_threshold
+        @mutex = Mutex.new
+        @flush_mutex = Mutex.new
+        @condition = ConditionVariable.new
+        reset_pending
+      end
+
+      # Add one to the given statistics counter in every statistics table
+      #
+      # @param [Postal::MessageDB::Database] database
+      # @param [Time] time
+      # @param [String, Symbol] field
+      # @return [void]
+      def increment_statistics(database, time, field)
+        time = time.utc
+        add do
+          @databases[database.database_name] ||= database
+          Statistics::STATS_GAPS.each do |type, gap|
+            key = [database.database_name, type, time.send("beginning_of_#{gap}").utc.to_i]
+            @statistics[key][field.to_sym] += 1
+          end
+        end
+      end
+
+      # Add one to the live stats for the given type
+      #
+      # @param [Postal::MessageDB::Database] database
+      # @param [String, Symbol] type
+      # @param [Time] time
+      # @return [void]
+      def increment_live_stats(database, type, time = Time.now)
+        time = time.utc
+        add do
+          @databases[database.database_name] ||= database
+          key = [database.database_name, type.to_s, time.min]
+          entry = @live_stats[key]
+          entry[:count] += 1
+          entry[:timestamp] = [entry[:timestamp], time.to_f].max
+        end
+      end
+
+      # Return the number of increments waiting to be written
+      #
+      # @return [Integer]
+      def pending
+        @mutex.synchronize { @pending }
+      end
+
+      # Write all pending increments to the database. If writing fails, the increments which could
+      # not be written are kept and will be retried on the next flush.
+      #
+      # @return [Integer] the number of increments which were written
+      def flush
+        @flush_mutex.synchronize do
+          databases, statistics, live_stats, count, oldest_at = @mutex.synchronize do
+            pending = [@databases, @statistics, @live_stats, @pending, @oldest_at]
+            reset_pending
+            pending
+          end
+          return 0 if count.zero?
+
+          observe_prometheus_histogram :postal_statistics_flush_lag, now - oldest_at
+          write(databases, statistics, live_stats)
+          count
+        end
+      end
+
+      # Start a background thread which will flush pending increments periodically. Pending
+      # increments will also be flushed when the process exits.
+      #
+      # @return [void]
+      def start
+        @mutex.synchronize do
+          return if @thread&.alive? && @thread_pid == Process.pid
+
+          @stopping = false
+          @thread_pid = Process.pid
+          @thread = Thread.new { run_flush_loop }
+        end
+
+        return if @at_exit_registered
+
+        @at_exit_registered = true
+        at_exit { stop }
+      end
+
+      # Stop the background thread and flush any pending increments
+      #
+      # @return [void]
+      def stop
+        thread = @mutex.synchronize do
+          @stopping = true
+          @condition.broadcast
+          @thread
+        end
+        thread.join if thread && thread != Thread.current && @thread_pid == Process.pid
+        flush
+      end
+
+      private
+
+      def add
+        @mutex.synchronize do
+          yield
+          @pending += 1
+          @oldest_at ||= now
+          @condition.broadcast if @pending >= @flush_threshold
+        end
+        start unless @thread&.alive? && @thread_pid == Process.pid
+      end
+
+      def reset_pending
+        @databases = {}
+        @statistics = Hash.new { |h, k| h[k] = Hash.new(0) }
+        @live_stats = Hash.new { |h, k| h[k] = { count: 0, timestamp: 0 } }
+        @pending = 0
+        @oldest_at = nil
+      end
+
+      def run_flush_loop
+        loop do
+          stopping = @mutex.synchronize do
+            @condition.wait(@mutex, @flush_interval) if !@stopping && @pending < @flush_threshold
+            @stopping
+          end
+          break if stopping
+
+          flush
+        rescue StandardError => e
+          Postal.logger.error "error flushing statistics: #{e.class} (#{e.message})"
+        end
+      end
+
+      def write(databases, statistics, live_stats)
+        failed = { statistics: {}, live_stats: {} }
+
+        statistics.group_by { |(database_name, type, _), _| [database_name, type] }.each do |(database_name, type), rows|
+          databases[database_name].statistics.increment_many(type, rows.to_h { |(_, _, time), counters| [time, counters] })
+        rescue StandardError => e
+          Postal.logger.error "error writing statistics to #{database_name}: #{e.class} (#{e.message})"
+          rows.each { |key, counters| failed[:statistics][key] = counters }
+        end
+
+        live_stats.group_by { |(database_name, _, _), _| database_name }.each do |database_name, rows|
+          databases[database_name].live_stats.increment_many(rows.map { |(_, type, minute), entry| [type, minute, entry[:timestamp], entry[:count]] })
+        rescue StandardError => e
+          Postal.logger.error "error writing live stats to #{database_name}: #{e.class} (#{e.message})"
+          rows.each { |key, entry| failed[:live_stats][key] = entry }
+        end
+
+        requeue(databases, failed)
+      end
+
+      # Merge increments which could not be written back into the pending increments. The
+      # pending count goes up by the number of original increments which haven't been fully
+      # written so that it isn't inflated by each failed write.
+      def requeue(databases, failed)
+        return if failed[:statistics].empty? && failed[:live_stats].empty?
+
+        # Each statistics increment added one to a counter for every type of table, so the
+        # increments for a database are counted using the type with the most failed counts
+        counts_by_type = Hash.new(0)
+        failed[:statistics].each do |(database_name, type, _), counters|
+          counts_by_type[[database_name, type]] += counters.values.sum
+        end
+        statistics_count = counts_by_type.group_by { |(database_name, _), _| database_name }.sum do |_, counts|
+          counts.map(&:last).max
+        end
+
+        @mutex.synchronize do
+          @databases.merge!(databases) { |_, existing, _| existing }
+          failed[:statistics].each do |key, counters|
+            counters.each { |field, count| @statistics[key][field] += count }
+          end
+          @pending += statistics_count
+          failed[:live_stats].each do |key, entry|
+            @live_stats[key][:count] += entry[:count]
+            @live_stats[key][:timestamp] = [@live_stats[key][:timestamp], entry[:timestamp]].max
+            @pending += entry[:count]
+          end
+          @oldest_at ||= now
+        end
+      end
+
+      def now
+        Process.clock_gettime(Process::CLOCK_MONOTONIC)
+      end
+
+      class << self
+
+        def register_prometheus_metrics
+          register_prometheus_histogram :postal_statistics_flush_lag,
+                                        docstring: "The time between the oldest pending statistics increment and it being flushed (in seconds)"
+        end
+
+      end
+
+    end
+  end
+end
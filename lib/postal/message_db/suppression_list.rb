@@ -1,5 +1,7 @@
 # frozen_string_literal: true
 
+require "digest"
+
 module Postal
   module MessageDB
     class SuppressionList
@@ -10,17 +12,25 @@ module Postal
 
       def add(type, address, options = {})
         keep_until = (options[:days] || Postal::Config.postal.default_suppression_list_automatic_removal_days).days.from_now.to_f
-        if existing = @database.select("suppressions", where: { type: type, address: address }, limit: 1).first
-          reason = options[:reason] || existing["reason"]
-          @database.update("suppressions", { reason: reason, keep_until: keep_until }, where: { id: existing["id"] })
-        else
-          @database.insert("suppressions", { type: type, address: address, reason: options[:reason], timestamp: Time.now.to_f, keep_until: keep_until })
-        end
+        sql_query = "INSERT INTO `#{@database.database_name}`.`suppressions` (type, address, reason, timestamp, keep_until, lookup_hash)"
+        sql_query << " VALUES (#{@database.escape(type.to_s)}, #{@database.escape(address)}, #{@database.escape(options[:reason])},"
+        sql_query << " #{Time.now.to_f}, #{keep_until}, '#{self.class.lookup_hash(type, address)}')"
+        sql_query << " ON DUPLICATE KEY UPDATE reason = COALESCE(VALUES(reason), reason), keep_until = VALUES(keep_until)"
+        @database.query(sql_query)
+        index&.added(type, address)
         true
       end
 
       def get(type, address)
-        @database.select("suppressions", where: { type: type, address: address, keep_until: { greater_than_or_equal_to: Time.now.to_f } }, limit: 1).first
+        return nil if index && !index.include?(type, address)
+
+        if entry = index&.cached(type, address)
+          return entry
+        end
+
+        entry = @database.select("suppressions", where: { type: type, address: address, keep_until: { greater_than_or_equal_to: Time.now.to_f } }, limit: 1).first
+        index&.cache(type, address, entry) if entry
+        entry
       end
 
       def all_with_pagination(page)
@@ -28,11 +38,43 @@ module Postal
       end
 
       def remove(type, address)
-        @database.delete("suppressions", where: { type: type, address: address }).positive?
+        # There's no need to try to delete an address which can't be on the list
+        return false if index && !index.include?(type, address)
+
+        removed = @database.delete("suppressions", where: { type: type, address: address }).positive?
+        index&.removed(type, address)
+        removed
       end
 
       def prune
-        @database.delete("suppressions", where: { keep_until: { less_than: Time.now.to_f } }) || 0
+        removed = @database.delete("suppressions", where: { keep_until: { less_than: Time.now.to_f } }) || 0
+        index&.pruned
+        removed
+      end
+
+      private
+
+      def index
+        Index.for(@database)
+      end
+
+      class << self
+
+        #
+        # Return the key used to identify an address in the suppression list index
+        #
+        def key(type, address)
+          "#{type}:#{address}".downcase
+        end
+
+        #
+        # Return the hash which uniquely identifies an address in the suppressions table. This
+        # must match the hash generated in the AddLookupHashToSuppressions migration.
+        #
+        def lookup_hash(type, address)
+          Digest::SHA1.hexdigest(key(type, address))
+        end
+
       end
 
     end
@@ -0,0 +1,58 @@
+# frozen_string_literal: true
+
+require "digest"
+
+module Postal
+  module MessageDB
+    class SuppressionList
+      # A fixed-size bloom filter. It can say for certain that a key has not been added but may
+      # (rarely) report that a key which was never added is present. Keys cannot be removed.
+      class BloomFilter
+
+        attr_reader :capacity
+        attr_reader :bit_count
+        attr_reader :hash_count
+
+        # @param [Integer] capacity The number of keys the filter is sized for
+        # @param [Float] false_positive_rate The expected false positive rate when the filter is at capacity
+        def initialize(capacity:, false_positive_rate: 0.01)
+          @capacity = [capacity, 1].max
+          @bit_count = (-@capacity * Math.log(false_positive_rate) / (Math.log(2)**2)).ceil
+          @hash_count = [(@bit_count.to_f / @capacity * Math.log(2)).round, 1].max
+          @bits = String.new("\0" * ((@bit_count + 7) / 8), encoding: Encoding::BINARY)
+        end
+
+        # Add a key to the filter
+        #
+        # @param [String] key
+        # @return [void]
+        def add(key)
+          each_position(key) do |position|
+            @bits.setbyte(position >> 3, @bits.getbyte(position >> 3) | (1 << (position & 7)))
+          end
+        end
+
+        # Might the given key have been added to the filter?
+        #
+        # @param [String] key
+        # @return [Boolean]
+        def include?(key)
+          each_position(key) do |position|
+            return false if (@bits.getbyte(position >> 3) & (1 << (position & 7))).zero?
+          end
+          true
+        end
+
+        private
+
+        def each_position(key)
+          h1, h2 = Digest::MD5.digest(key).unpack("Q<Q<")
+          @hash_count.times do |i|
+            yield (h1 + (i * h2)) % @bit_count
+          end
+        end
+
+      end
+    end
+  end
+end
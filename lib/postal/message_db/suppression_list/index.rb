@@ -0,0 +1,186 @@
+# frozen_string_literal: true
+
+module Postal
+  module MessageDB
+    class SuppressionList
+      # An in-memory index of a server's suppression list. A bloom filter containing every
+      # suppressed address means that lookups for addresses which are not suppressed (almost
+      # all of them) can be answered without querying the database. Entries which are found
+      # are kept in a small LRU cache.
+      #
+      # The index is kept up to date with changes made by this process as they happen. Changes
+      # made by other processes are noticed by periodically comparing the highest ID and number
+      # of rows in the suppressions table (the version) with the values when the index was last
+      # loaded. New rows are added to the filter. If rows have been removed, the cache is cleared
+      # and the filter is rebuilt.
+      class Index
+
+        INDEXES_MUTEX = Mutex.new
+
+        attr_reader :refresh_interval
+        attr_reader :cache_size
+
+        # @param [Postal::MessageDB::Database] database
+        # @param [Integer] refresh_interval The number of seconds after which the version will be checked
+        # @param [Integer] cache_size The maximum number of entries to keep in the cache
+        def initialize(database, refresh_interval:, cache_size:)
+          @database = database
+          @refresh_interval = refresh_interval
+          @cache_size = cache_size
+          @filter = nil
+          @cache = {}
+          @max_id = 0
+          @count = 0
+          @refreshed_at = nil
+          @mutex = Mutex.new
+        end
+
+        #
+        # Might the given address be on the suppression list? Returns false only if the address
+        # is definitely not on the list.
+        #
+        def include?(type, address)
+          refresh_if_stale
+          @mutex.synchronize { @filter.include?(SuppressionList.key(type, address)) }
+        end
+
+        #
+        # Return the cached entry for the given address or nil if there is no cached entry
+        #
+        def cached(type, address)
+          key = SuppressionList.key(type, address)
+          @mutex.synchronize do
+            entry = @cache.delete(key)
+            return nil if entry.nil? || entry["keep_until"].to_f < Time.now.to_f
+
+            @cache[key] = entry
+          end
+        end
+
+        #
+        # Add an entry which has been found in the database to the cache
+        #
+        def cache(type, address, entry)
+          key = SuppressionList.key(type, address)
+          @mutex.synchronize do
+            @cache.delete(key)
+            @cache[key] = entry
+            @cache.shift while @cache.size > @cache_size
+          end
+        end
+
+        #
+        # Record that an address has been added to (or updated in) the suppression list
+        #
+        def added(type, address)
+          key = SuppressionList.key(type, address)
+          @mutex.synchronize do
+            @cache.delete(key)
+            @filter&.add(key)
+          end
+        end
+
+        #
+        # Record that an address has been removed from the suppression list. The filter can't
+        # have keys removed so the address will be looked up in the database until the filter
+        # is next rebuilt.
+        #
+        def removed(type, address)
+          key = SuppressionList.key(type, address)
+          @mutex.synchronize { @cache.delete(key) }
+        end
+
+        #
+        # Record that expired entries have been removed from the suppression list
+        #
+        def pruned
+          @mutex.synchronize { @cache.clear }
+        end
+
+        #
+        # Check the version of the suppression list in the database and load any changes
+        #
+        def refresh
+          version = @database.query("SELECT MAX(id) AS max_id, COUNT(id) AS count FROM `#{@database.database_name}`.`suppressions`").first
+          max_id = version["max_id"].to_i
+          count = version["count"].to_i
+
+          loaded_max_id, loaded_count, capacity = @mutex.synchronize { @filter && [@max_id, @count, @filter.capacity] }
+          if loaded_max_id == max_id && loaded_count == count
+            @mutex.synchronize { @refreshed_at = now }
+            return
+          end
+
+          if loaded_max_id && max_id >= loaded_max_id && count <= capacity
+            rows = @database.select(:suppressions, fields: [:type, :address], where: { id: { greater_than: loaded_max_id } })
+            # If nothing has been removed, we only need to add the new rows to the filter
+            incremental = loaded_count + rows.size == count
+          end
+
+          filter = build_filter(count) unless incremental
+
+          @mutex.synchronize do
+            if incremental
+              rows.each { |row| @filter.add(SuppressionList.key(row["type"], row["address"])) }
+            else
+              @filter = filter
+              @cache.clear
+            end
+            @max_id = max_id
+            @count = count
+            @refreshed_at = now
+          end
+        end
+
+        private
+
+        def refresh_if_stale
+          refreshed_at = @mutex.synchronize { @refreshed_at }
+          return if refreshed_at && refreshed_at > now - @refresh_interval
+
+          refresh
+        end
+
+        # Return a new filter containing every address on the suppression list
+        def build_filter(count)
+          filter = BloomFilter.new(capacity: [count * 2, 10_000].max)
+          @database.select(:suppressions, fields: [:type, :address]).each do |row|
+            filter.add(SuppressionList.key(row["type"], row["address"]))
+          end
+          filter
+        end
+
+        def now
+          Process.clock_gettime(Process::CLOCK_MONOTONIC)
+        end
+
+        class << self
+
+          #
+          # Return the suppression list index for the given database. Returns nil if the index
+          # has been disabled.
+          #
+          def for(database)
+            return nil unless Postal::Config.message_db.suppression_list_index?
+
+            INDEXES_MUTEX.synchronize do
+              @indexes ||= {}
+              @indexes[database.database_name] ||= new(database,
+                                                       refresh_interval: Postal::Config.message_db.suppression_list_index_refresh_interval,
+                                                       cache_size: Postal::Config.message_db.suppression_list_index_cache_size)
+            end
+          end
+
+          #
+          # Remove all indexes
+          #
+          def reset
+            INDEXES_MUTEX.synchronize { @indexes = {} }
+          end
+
+        end
+
+      end
+    end
+  end
+end
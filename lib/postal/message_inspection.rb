@@ -1,5 +1,7 @@
 # frozen_string_literal: true
 
+require "digest"
+
 module Postal
   class MessageInspection
 
@@ -10,6 +12,7 @@ module Postal
     attr_accessor :threat_message
     attr_accessor :validation_failed
     attr_accessor :validation_message
+    attr_accessor :incomplete
 
     def initialize(message, scope)
       @message = message
@@ -17,6 +20,7 @@ module Postal
       @spam_checks = []
       @threat = false
       @validation_failed = false
+      @incomplete = false
     end
 
     def spam_score
@@ -26,9 +30,115 @@ module Postal
     end
 
     def scan
-      MessageInspector.inspectors.each do |inspector|
-        inspector.inspect_message(self)
+      inspectors = MessageInspector.inspectors
+      unless Postal::Config.postal.parallel_message_inspection? || Postal::Config.postal.cache_message_inspections?
+        inspectors.each do |inspector|
+          inspector.inspect_message(self)
+        end
+        return
+      end
+
+      cacheable, uncacheable = inspectors.partition(&:cacheable?)
+      cache = self.class.cache
+      cache_key = [content_digest, @scope, cacheable.map { |i| i.class.name }] if cache
+
+      if cache && (cached = cache.get(cache_key))
+        inspectors = uncacheable
+      end
+
+      results = run(inspectors)
+
+      # Results are merged in the same order as the inspectors regardless of which finished first
+      ([cached].compact + inspectors.map { |inspector| results[inspector] }).each { |result| merge(result) }
+
+      return unless cache && cached.nil? && cacheable.any?
+
+      cacheable_results = cacheable.map { |inspector| results[inspector] }
+      return if cacheable_results.any?(&:incomplete)
+
+      cache.set(cache_key, cacheable_results.each_with_object(self.class.new(nil, @scope)) { |result, combined| combined.merge(result) })
+    end
+
+    protected
+
+    # Add the results of another inspection to this one
+    #
+    # @param [Postal::MessageInspection] other
+    # @return [void]
+    def merge(other)
+      @spam_checks.concat(other.spam_checks)
+      if other.threat_message
+        @threat = other.threat
+        @threat_message = other.threat_message
+      end
+      if other.validation_message
+        @validation_failed = other.validation_failed
+        @validation_message = other.validation_message
       end
+      @incomplete ||= other.incomplete
+    end
+
+    private
+
+    def content_digest
+      return @message.inspection_digest if @message.respond_to?(:inspection_digest)
+
+      Digest::SHA256.hexdigest(@message.raw_message)
+    end
+
+    # Run each inspector against its own inspection and return the inspections keyed by
+    # inspector. When parallel inspection is enabled, all inspectors are run at the same time
+    # and any which haven't finished by the deadline are stopped and recorded as having timed
+    # out.
+    #
+    # @param [Array<Postal::MessageInspector>] inspectors
+    # @return [Hash{Postal::MessageInspector => Postal::MessageInspection}]
+    def run(inspectors)
+      unless Postal::Config.postal.parallel_message_inspection? && inspectors.size > 1
+        return inspectors.to_h do |inspector|
+          inspection = self.class.new(@message, @scope)
+          inspector.inspect_message(inspection)
+          [inspector, inspection]
+        end
+      end
+
+      # Load the raw message now so the inspector threads don't each try to load it
+      @message.raw_message
+
+      deadline = Process.clock_gettime(Process::CLOCK_MONOTONIC) + Postal::Config.postal.message_inspection_timeout
+      threads = inspectors.to_h do |inspector|
+        inspection = self.class.new(@message, @scope)
+        thread = Thread.new do
+          # Any database connection used by the inspector is returned to the pool when the
+          # thread finishes (or is stopped) rather than being held until it is reaped
+          ActiveRecord::Base.connection_pool.with_connection { inspector.inspect_message(inspection) }
+        end
+        thread.report_on_exception = false
+        [inspector, [thread, inspection]]
+      end
+
+      threads.to_h do |inspector, (thread, inspection)|
+        remaining = deadline - Process.clock_gettime(Process::CLOCK_MONOTONIC)
+        if thread.join([remaining, 0].max).nil?
+          # Stop the inspector so that slow scanners can't build up threads (and connections)
+          # in the background. Its results would not be used anyway.
+          thread.kill
+          inspection = self.class.new(@message, @scope)
+          inspection.spam_checks << SpamCheck.new("TIMEOUT", 0, "Timed out when inspecting with #{inspector.class.name.demodulize}")
+          inspection.incomplete = true
+        end
+        [inspector, inspection]
+      rescue StandardError => e
+        logger.error "Error inspecting message with #{inspector.class.name.demodulize}: #{e.class} (#{e.message})"
+        inspection = self.class.new(@message, @scope)
+        inspection.spam_checks << SpamCheck.new("ERROR", 0, "Error when inspecting with #{inspector.class.name.demodulize}")
+        inspection.incomplete = true
+        [inspector, inspection]
+      end
+    end
+
+    def logger
+      Postal.logger
     end
 
     class << self
@@ -39,6 +149,17 @@ module Postal
         inspection
       end
 
+      # Return the process-wide cache of inspection results or nil if results should not
+      # be cached
+      #
+      # @return [Postal::MessageInspection::Cache, nil]
+      def cache
+        return nil unless Postal::Config.postal.cache_message_inspections?
+
+        @cache ||= Cache.new(ttl: Postal::Config.postal.message_inspection_cache_ttl,
+                             max_size: Postal::Config.postal.message_inspection_cache_size)
+      end
+
     end
 
   end
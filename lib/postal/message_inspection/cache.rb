@@ -0,0 +1,81 @@
+# frozen_string_literal: true
+
+module Postal
+  class MessageInspection
+    # A thread-safe, process-wide cache of inspection results. Entries are kept for a fixed
+    # TTL and the least recently used entry is evicted when the cache is full (see LRUCache).
+    class Cache
+
+      extend HasPrometheusMetrics
+      include HasPrometheusMetrics
+
+      attr_reader :ttl
+      attr_reader :max_size
+
+      # @param [Integer] ttl The number of seconds to keep each result for
+      # @param [Integer] max_size The maximum number of results to hold
+      def initialize(ttl:, max_size:)
+        @ttl = ttl
+        @max_size = max_size
+        @entries = LRUCache.new(max_size: max_size, ttl: ttl,
+                                on_evict: ->(_key) { increment_prometheus_counter :postal_message_inspection_cache_evictions })
+      end
+
+      # Return the cached inspection for the given key or nil if there isn't one
+      #
+      # @param [Array] key
+      # @return [Postal::MessageInspection, nil]
+      def get(key)
+        inspection = @entries.read(key)
+        if inspection.nil?
+          increment_prometheus_counter :postal_message_inspection_cache_misses
+          return nil
+        end
+
+        increment_prometheus_counter :postal_message_inspection_cache_hits
+        inspection
+      end
+
+      # Add an inspection to the cache, evicting the least recently used entries if the
+      # cache is full
+      #
+      # @param [Array] key
+      # @param [Postal::MessageInspection] inspection
+      # @return [void]
+      def set(key, inspection)
+        @entries.write(key, inspection)
+        nil
+      end
+
+      # Return the number of entries currently in the cache
+      #
+      # @return [Integer]
+      def size
+        @entries.size
+      end
+
+      # Remove all entries from the cache
+      #
+      # @return [void]
+      def clear
+        @entries.clear
+      end
+
+      class << self
+
+        def register_prometheus_metrics
+          register_prometheus_counter :postal_message_inspection_cache_hits,
+                                      docstring: "The number of message inspections answered from the cache"
+
+          register_prometheus_counter :postal_message_inspection_cache_misses,
+                                      docstring: "The number of message inspections which were not in the cache"
+
+          register_prometheus_counter :postal_message_inspection_cache_evictions,
+                                      docstring: "The number of message inspection cache entries evicted because the cache was full"
+        end
+
+      end
+
+    end
+  end
+end
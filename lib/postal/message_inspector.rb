@@ -12,6 +12,13 @@ module Postal
     def inspect_message(message, scope, inspection)
     end
 
+    # Can the results of this inspector be reused for other messages with
+    # the same content? Inspectors whose results depend on something other
+    # than the message content should return false.
+    def cacheable?
+      true
+    end
+
     private
 
     def logger
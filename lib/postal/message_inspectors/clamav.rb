@@ -29,15 +29,18 @@ module Postal
         else
           inspection.threat = false
           inspection.threat_message = "Could not scan message"
+          inspection.incomplete = true
         end
       rescue Timeout::Error
         inspection.threat = false
         inspection.threat_message = "Timed out scanning for threats"
+        inspection.incomplete = true
       rescue StandardError => e
         logger.error "Error talking to clamav: #{e.class} (#{e.message})"
         logger.error e.backtrace[0, 5]
         inspection.threat = false
         inspection.threat_message = "Error when scanning for threats"
+        inspection.incomplete = true
       ensure
         begin
           tcp_socket.close
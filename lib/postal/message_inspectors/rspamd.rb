@@ -9,6 +9,9 @@ module Postal
       class Error < StandardError
       end
 
+      # Connections to rspamd are kept open and shared by all inspections in this process
+      CONNECTION_POOL = Postal::HTTP::ConnectionPool.new(idle_timeout: 30, max_idle_per_host: 10, open_timeout: 10, read_timeout: 10)
+
       def inspect_message(inspection)
         response = request(inspection.message, inspection.scope)
         response = JSON.parse(response.body)
@@ -21,15 +24,13 @@ module Postal
         end
       rescue Error => e
         inspection.spam_checks << SpamCheck.new("ERROR", 0, e.message)
+        inspection.incomplete = true
       end
 
       private
 
       def request(message, scope)
-        http = Net::HTTP.new(@config.host, @config.port)
-        http.use_ssl = true if @config.ssl
-        http.read_timeout = 10
-        http.open_timeout = 10
+        uri = (@config.ssl ? URI::HTTPS : URI::HTTP).build(host: @config.host, port: @config.port)
 
         raw_message = message.raw_message
 
@@ -55,7 +56,7 @@ module Postal
 
         response = nil
         begin
-          response = http.request(request)
+          response = CONNECTION_POOL.request(uri, request)
         rescue StandardError => e
           logger.error "Error talking to rspamd: #{e.class} (#{e.message})"
           logger.error e.backtrace[0, 5]
@@ -40,10 +40,12 @@ module Postal
         end
       rescue Timeout::Error
         inspection.spam_checks << SpamCheck.new("TIMEOUT", 0, "Timed out when scanning for spam")
+        inspection.incomplete = true
       rescue StandardError => e
         logger.error "Error talking to spamd: #{e.class} (#{e.message})"
         logger.error e.backtrace[0, 5]
         inspection.spam_checks << SpamCheck.new("ERROR", 0, "Error when scanning for spam")
+        inspection.incomplete = true
       ensure
         begin
           tcp_socket.close
@@ -41,6 +41,12 @@ module Postal
         end
       end
 
+      # The result depends on the recipient's mailbox rather than the content
+      # of the message so it is always checked again.
+      def cacheable?
+        false
+      end
+
       private
 
       def extract_to_address(message)
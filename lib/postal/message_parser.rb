@@ -1,20 +1,30 @@
 # frozen_string_literal: true
 
+require "digest"
+
 module Postal
   class MessageParser
 
     URL_REGEX = /(?<url>(?<protocol>https?):\/\/(?<domain>[A-Za-z0-9\-.:]+)(?<path>\/[A-Za-z0-9.\/+?&\-_%=~:;()\[\]#]*)?+)/
 
+    # The result of rewriting a body part with placeholders in place of the link and message
+    # tokens. It can be reused for a part with the same content in any other message by
+    # replacing the placeholders with the new message's tokens.
+    Template = Struct.new(:output, :links, :message_placeholder, :actioned, :tracked_links, :tracked_images)
+
     def initialize(message)
       @message = message
       @actioned = false
       @tracked_links = 0
       @tracked_images = 0
-      @domain = @message.server.track_domains.where(domain: @message.domain, dns_status: "OK").first
+      @links = []
+      @domain = track_domain
 
       return unless @domain
 
-      @parsed_output = generate.split("\r\n\r\n", 2)
+      output = generate
+      @message.create_links(@links) if @links.any?
+      @parsed_output = output.split("\r\n\r\n", 2)
     end
 
     attr_reader :tracked_links
@@ -34,6 +44,73 @@ module Postal
 
     private
 
+    def track_domain
+      unless self.class.cache_enabled?
+        return @message.server.track_domains.where(domain_id: @message.domain_id, dns_status: "OK").first
+      end
+
+      self.class.track_domain_cache.fetch([@message.server.id, @message.domain_id]) do
+        track_domain = @message.server.track_domains.includes(:domain).where(domain_id: @message.domain_id, dns_status: "OK").first
+        # Load the excluded domains now so the cached record isn't changed once it is shared
+        track_domain&.excluded_click_domains_array
+        track_domain || false
+      end || nil
+    end
+
+    # Return the template for the given part, generating it if it isn't already cached. The
+    # key only includes the part's content and the track domain's settings (which are all
+    # covered by its updated_at) so messages with the same body but different headers (such
+    # as each recipient of a bulk send) share a template.
+    def cached_template(part, type)
+      key = [Digest::SHA256.hexdigest(part), type, @domain.id, @domain.updated_at.to_f, domain, @message.server.token]
+      self.class.template_cache.fetch(key) { generate_template(part, type) }
+    end
+
+    def generate_template(part, type)
+      state = [@links, @actioned, @tracked_links, @tracked_images]
+      @links = []
+      @actioned = false
+      @tracked_links = 0
+      @tracked_images = 0
+      @placeholders = {}
+
+      output = rewrite(part.dup, type)
+      Template.new(output.freeze, @links, @placeholders[:message], @actioned, @tracked_links, @tracked_images)
+    ensure
+      @placeholders = nil
+      @links, @actioned, @tracked_links, @tracked_images = state
+    end
+
+    def render(template)
+      @actioned ||= template.actioned
+      @tracked_links += template.tracked_links
+      @tracked_images += template.tracked_images
+
+      tokens = {}
+      template.links.each do |placeholder, url|
+        tokens[placeholder] = SecureRandom.alphanumeric(16)
+        @links << [url, tokens[placeholder]]
+      end
+      tokens[template.message_placeholder] = @message.token if template.message_placeholder
+      return template.output.dup if tokens.empty?
+
+      template.output.gsub(Regexp.union(tokens.keys), tokens)
+    end
+
+    # Return a token for a link to the given URL. Links are created once the whole message
+    # has been parsed.
+    def link_token(url)
+      token = SecureRandom.alphanumeric(16)
+      @links << (@placeholders ? [token, url] : [url, token])
+      token
+    end
+
+    def message_token
+      return @message.token unless @placeholders
+
+      @placeholders[:message] ||= SecureRandom.alphanumeric(16)
+    end
+
     def generate
       @mail = Mail.new(@message.raw_message)
       @original_message = @message.raw_message
@@ -62,6 +139,8 @@ module Postal
       @actioned = false
       @tracked_links = 0
       @tracked_images = 0
+      @links = []
+      @placeholders = nil
       @original_message
     end
 
@@ -85,6 +164,12 @@ module Postal
     end
 
     def parse(part, type = nil)
+      return rewrite(part, type) unless self.class.cache_enabled?
+
+      render(cached_template(part, type))
+    end
+
+    def rewrite(part, type = nil)
       if @domain.track_clicks?
         part = insert_links(part, type)
       end
@@ -106,7 +191,7 @@ module Postal
               theend = url.size - 2
               url = url[0..theend]
             end
-            token = @message.create_link(url)
+            token = link_token(url)
             "#{domain}/#{@message.server.token}/#{token}"
           else
             ::Regexp.last_match(0)
@@ -119,7 +204,7 @@ module Postal
           if track_domain?($~[:domain])
             @tracked_links += 1
             url = CGI.unescapeHTML($~[:url])
-            token = @message.create_link(url)
+            token = link_token(url)
             "href='#{domain}/#{@message.server.token}/#{token}'"
           else
             ::Regexp.last_match(0)
@@ -137,7 +222,7 @@ module Postal
 
     def insert_tracking_image(part)
       @tracked_images += 1
-      container = "<p class='ampimg' style='display:none;visibility:none;margin:0;padding:0;line-height:0;'><img src='#{domain}/img/#{@message.server.token}/#{@message.token}' alt=''></p>"
+      container = "<p class='ampimg' style='display:none;visibility:none;margin:0;padding:0;line-height:0;'><img src='#{domain}/img/#{@message.server.token}/#{message_token}' alt=''></p>"
       if part =~ /<\/body>/
         part.gsub("</body>", "#{container}</body>")
       else
@@ -153,5 +238,31 @@ module Postal
       !@domain.excluded_click_domains_array.include?(domain)
     end
 
+    class << self
+
+      def cache_enabled?
+        Postal::Config.postal.cache_tracking_rewrites?
+      end
+
+      # Return the process-wide cache of each server's track domains
+      #
+      # @return [Postal::MessageParser::Cache]
+      def track_domain_cache
+        @track_domain_cache ||= Cache.new(name: "track_domains",
+                                          ttl: Postal::Config.postal.track_domain_cache_ttl,
+                                          max_size: Postal::Config.postal.tracking_rewrite_cache_size)
+      end
+
+      # Return the process-wide cache of rewritten message templates
+      #
+      # @return [Postal::MessageParser::Cache]
+      def template_cache
+        @template_cache ||= Cache.new(name: "templates",
+                                      ttl: Postal::Config.postal.tracking_rewrite_cache_ttl,
+                                      max_size: Postal::Config.postal.tracking_rewrite_cache_size)
+      end
+
+    end
+
   end
 end
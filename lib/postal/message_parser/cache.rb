@@ -0,0 +1,79 @@
+# frozen_string_literal: true
+
+module Postal
+  class MessageParser
+    # A thread-safe, process-wide cache used by the message parser. Entries are kept for a
+    # fixed TTL and the least recently used entry is evicted when the cache is full (see
+    # LRUCache). Unlike most caches, nil and false are valid values and are cached like any
+    # other.
+    class Cache
+
+      extend HasPrometheusMetrics
+      include HasPrometheusMetrics
+
+      attr_reader :name
+      attr_reader :ttl
+      attr_reader :max_size
+
+      # @param [String] name A label to use for metrics
+      # @param [Integer] ttl The number of seconds to keep each value for
+      # @param [Integer] max_size The maximum number of values to hold
+      def initialize(name:, ttl:, max_size:)
+        @name = name
+        @ttl = ttl
+        @max_size = max_size
+        @entries = LRUCache.new(max_size: max_size, ttl: ttl,
+                                on_evict: ->(_key) { increment_prometheus_counter :postal_message_parser_cache_evictions, labels: { cache: @name } })
+      end
+
+      # Return the value for the given key from the cache. If it is not cached, the block
+      # will be called and its result will be cached.
+      #
+      # @param [Array] key
+      # @return [Object]
+      def fetch(key)
+        hit = true
+        value = @entries.fetch(key) do
+          hit = false
+          increment_prometheus_counter :postal_message_parser_cache_misses, labels: { cache: @name }
+          yield
+        end
+        increment_prometheus_counter :postal_message_parser_cache_hits, labels: { cache: @name } if hit
+        value
+      end
+
+      # Return the number of entries currently in the cache
+      #
+      # @return [Integer]
+      def size
+        @entries.size
+      end
+
+      # Remove all entries from the cache
+      #
+      # @return [void]
+      def clear
+        @entries.clear
+      end
+
+      class << self
+
+        def register_prometheus_metrics
+          register_prometheus_counter :postal_message_parser_cache_hits,
+                                      docstring: "The number of message parser lookups answered from the cache",
+                                      labels: [:cache]
+
+          register_prometheus_counter :postal_message_parser_cache_misses,
+                                      docstring: "The number of message parser lookups which were not in the cache",
+                                      labels: [:cache]
+
+          register_prometheus_counter :postal_message_parser_cache_evictions,
+                                      docstring: "The number of message parser cache entries evicted because the cache was full",
+                                      labels: [:cache]
+        end
+
+      end
+
+    end
+  end
+end
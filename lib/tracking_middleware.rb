@@ -32,14 +32,18 @@ class TrackingMiddleware
   private
 
   def dispatch_image_request(request, server_token, message_token)
-    message_db = get_message_db_from_server_token(server_token)
-    if message_db.nil?
+    server = find_server(server_token)
+    if server.nil?
       return [404, {}, ["Invalid Server Token"]]
     end
 
     begin
-      message = message_db.message(token: message_token)
-      message.create_load(request)
+      if self.class.write_behind?
+        self.class.event_buffer.add_load(server, message_token, request)
+      else
+        message = server.message_db.message(token: message_token)
+        message.create_load(request)
+      end
     rescue Postal::MessageDB::Message::NotFound
       # This message has been removed, we'll just continue to serve the image
     rescue StandardError => e
@@ -56,6 +60,13 @@ class TrackingMiddleware
       headers["Content-Length"] = TRACKING_PIXEL.bytesize.to_s
       [200, headers, [TRACKING_PIXEL]]
     when /\Ahttps?:\/\//
+      if self.class.image_cache_enabled?
+        headers, body = self.class.image_cache.fetch(source_image)
+        return [404, {}, ["Not found"]] if body.nil?
+
+        return [200, headers.merge("Content-Length" => body.bytesize.to_s), [body]]
+      end
+
       response = Postal::HTTP.get(source_image, timeout: 3)
       return [404, {}, ["Not found"]] unless response[:code] == 200
 
@@ -73,18 +84,21 @@ class TrackingMiddleware
   end
 
   def dispatch_redirect_request(request, server_token, link_token)
-    message_db = get_message_db_from_server_token(server_token)
-    if message_db.nil?
+    server = find_server(server_token)
+    if server.nil?
       return [404, {}, ["Invalid Server Token"]]
     end
 
-    link = message_db.select(:links, where: { token: link_token }, limit: 1).first
+    message_db = server.message_db
+    link = find_link(server, link_token)
     if link.nil?
       return [404, {}, ["Link not found"]]
     end
 
     time = Time.now.to_f
-    if link["message_id"]
+    if link["message_id"] && self.class.write_behind?
+      self.class.event_buffer.add_click(server, link, request)
+    elsif link["message_id"]
       message_db.update(:messages, { clicked: time }, where: { id: link["message_id"] })
       message_db.insert(:clicks, {
         message_id: link["message_id"],
@@ -112,10 +126,58 @@ class TrackingMiddleware
     [307, { "Location" => link["url"] }, ["Redirected to: #{link['url']}"]]
   end
 
-  def get_message_db_from_server_token(token)
-    return unless server = ::Server.find_by_token(token)
+  def find_server(token)
+    return ::Server.find_by_token(token) unless self.class.write_behind?
+
+    self.class.lookup_cache.fetch([:server, token]) { ::Server.find_by_token(token) }
+  end
+
+  def find_link(server, token)
+    unless self.class.write_behind?
+      return server.message_db.select(:links, where: { token: token }, limit: 1).first
+    end
+
+    # Links never change once they have been created so can be safely cached
+    self.class.lookup_cache.fetch([:link, server.id, token]) do
+      server.message_db.select(:links, where: { token: token }, limit: 1).first
+    end
+  end
+
+  class << self
+
+    def write_behind?
+      Postal::Config.web_server.tracking_write_behind?
+    end
+
+    def image_cache_enabled?
+      Postal::Config.web_server.tracking_image_cache?
+    end
+
+    # Return the process-wide cache of server and link lookups. Lookups which found nothing
+    # are cached too so that repeated requests for unknown tokens don't reach the database.
+    #
+    # @return [LRUCache]
+    def lookup_cache
+      @lookup_cache ||= LRUCache.new(ttl: Postal::Config.web_server.tracking_lookup_cache_ttl,
+                                     max_size: Postal::Config.web_server.tracking_lookup_cache_size)
+    end
+
+    # Return the process-wide buffer of loads and clicks waiting to be written
+    #
+    # @return [TrackingMiddleware::EventBuffer]
+    def event_buffer
+      @event_buffer ||= EventBuffer.new(flush_interval: Postal::Config.web_server.tracking_flush_interval,
+                                        batch_size: Postal::Config.web_server.tracking_flush_batch_size)
+    end
+
+    # Return the process-wide cache of proxied images
+    #
+    # @return [TrackingMiddleware::ImageCache]
+    def image_cache
+      @image_cache ||= ImageCache.new(max_size: Postal::Config.web_server.tracking_image_cache_size.megabytes,
+                                      default_ttl: Postal::Config.web_server.tracking_image_cache_ttl)
+    end
 
-    server.message_db
   end
 
 end
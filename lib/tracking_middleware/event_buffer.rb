@@ -0,0 +1,172 @@
+# frozen_string_literal: true
+
+class TrackingMiddleware
+  # Buffers the loads and clicks recorded by the tracking middleware and writes them to each
+  # server's message database in batches. This means a request only has to add an event to
+  # the buffer rather than wait for several queries to complete.
+  #
+  # The buffer is flushed by a background thread every flush interval or as soon as it holds
+  # batch size events. Each flush uses one query per server to find the messages, one to
+  # insert the loads or clicks and one to update the messages' loaded or clicked times. The
+  # loaded and clicked times are set to the earliest (for loads) or latest (for clicks) event
+  # in the batch so may differ from the exact time of each event by up to the flush interval.
+  # Webhooks are triggered for each event as they were before.
+  class EventBuffer
+
+    Load = Struct.new(:message_token, :ip_address, :user_agent, :timestamp)
+    Click = Struct.new(:link, :ip_address, :user_agent, :timestamp)
+
+    attr_reader :flush_interval
+    attr_reader :batch_size
+
+    # @param [Integer] flush_interval The maximum number of seconds to hold an event for
+    # @param [Integer] batch_size The number of events after which the buffer will be flushed
+    def initialize(flush_interval:, batch_size:)
+      @flush_interval = flush_interval
+      @batch_size = batch_size
+      @mutex = Mutex.new
+      @condition = ConditionVariable.new
+      @flush_mutex = Mutex.new
+      @events = {}
+      @size = 0
+    end
+
+    # Add a load of the message with the given token
+    #
+    # @param [Server] server
+    # @param [String] message_token
+    # @param [Rack::Request] request
+    # @return [void]
+    def add_load(server, message_token, request)
+      add(server, Load.new(message_token, request.ip, request.user_agent, Time.now.to_f))
+    end
+
+    # Add a click of the given link
+    #
+    # @param [Server] server
+    # @param [Hash] link The link's row from the links table
+    # @param [Rack::Request] request
+    # @return [void]
+    def add_click(server, link, request)
+      add(server, Click.new(link, request.ip, request.user_agent, Time.now.to_f))
+    end
+
+    # Return the number of events waiting to be written
+    #
+    # @return [Integer]
+    def size
+      @mutex.synchronize { @size }
+    end
+
+    # Write all buffered events to the database
+    #
+    # @return [void]
+    def flush
+      @flush_mutex.synchronize do
+        events = @mutex.synchronize do
+          events = @events
+          @events = {}
+          @size = 0
+          events
+        end
+
+        events.each_value do |server, server_events|
+          flush_server(server, server_events)
+        rescue StandardError => e
+          logger.error "Error writing tracking events for server #{server.id}: #{e.class} (#{e.message})"
+          Sentry.capture_exception(e) if defined?(Sentry)
+        end
+      end
+    end
+
+    private
+
+    def add(server, event)
+      @mutex.synchronize do
+        start_flush_thread
+        (@events[server.id] ||= [server, []])[1] << event
+        @size += 1
+        @condition.signal if @size >= @batch_size
+      end
+    end
+
+    # Start the thread which flushes the buffer if it isn't already running in this process.
+    # Must be called while holding the mutex.
+    def start_flush_thread
+      return if @flush_thread_pid == Process.pid
+
+      @flush_thread_pid = Process.pid
+      # Any events inherited from a parent process will be written by the parent
+      @events = {}
+      @size = 0
+      Thread.new do
+        loop do
+          @mutex.synchronize { @condition.wait(@mutex, @flush_interval) if @size < @batch_size }
+          ActiveRecord::Base.connection_pool.with_connection { flush }
+        rescue StandardError => e
+          logger.error "Error flushing tracking events: #{e.class} (#{e.message})"
+        end
+      end
+      at_exit { flush }
+    end
+
+    def flush_server(server, events)
+      loads, clicks = events.partition { |event| event.is_a?(Load) }
+      flush_loads(server, loads) if loads.any?
+      flush_clicks(server, clicks) if clicks.any?
+    end
+
+    def flush_loads(server, loads)
+      database = server.message_db
+      messages = database.messages(where: { token: loads.map(&:message_token).uniq }).index_by(&:token)
+      # Loads for messages which have since been removed are ignored
+      loads = loads.select { |load| messages[load.message_token] }
+      return if loads.empty?
+
+      database.insert_multi(:loads, [:message_id, :ip_address, :user_agent, :timestamp], loads.map do |load|
+        [messages[load.message_token].id, load.ip_address, load.user_agent, load.timestamp]
+      end)
+
+      unloaded_ids = messages.values.select { |message| message.loaded.nil? }.map(&:id)
+      database.update(:messages, { loaded: loads.map(&:timestamp).min }, where: { id: unloaded_ids }) if unloaded_ids.any?
+
+      loads.each do |load|
+        WebhookRequest.trigger(server, "MessageLoaded", {
+          message: messages[load.message_token].webhook_hash,
+          ip_address: load.ip_address,
+          user_agent: load.user_agent
+        })
+      end
+    end
+
+    def flush_clicks(server, clicks)
+      database = server.message_db
+      message_ids = clicks.map { |click| click.link["message_id"] }.uniq
+
+      database.update(:messages, { clicked: clicks.map(&:timestamp).max }, where: { id: message_ids })
+      database.insert_multi(:clicks, [:message_id, :link_id, :ip_address, :user_agent, :timestamp], clicks.map do |click|
+        [click.link["message_id"], click.link["id"], click.ip_address, click.user_agent, click.timestamp]
+      end)
+
+      # If we can't find the message that a link is associated with, we'll just ignore it
+      # and not trigger any webhooks.
+      messages = database.messages(where: { id: message_ids }).index_by(&:id)
+      clicks.each do |click|
+        next unless message = messages[click.link["message_id"]]
+
+        WebhookRequest.trigger(server, "MessageLinkClicked", {
+          message: message.webhook_hash,
+          url: click.link["url"],
+          token: click.link["token"],
+          ip_address: click.ip_address,
+          user_agent: click.user_agent
+        })
+      end
+    end
+
+    def logger
+      Postal.logger
+    end
+
+  end
+end
@@ -0,0 +1,151 @@
+# frozen_string_literal: true
+
+require "digest"
+require "tmpdir"
+
+class TrackingMiddleware
+  # A bounded, on-disk cache of the images fetched by the tracking image proxy. Images are
+  # stored in a temporary directory owned by this process and the least recently used images
+  # are removed once the total size is over the maximum.
+  #
+  # Images are served from the cache until they are no longer fresh (based on the max-age
+  # they were served with or a default TTL). After that they are revalidated with the
+  # origin using their ETag and Last-Modified values and only fetched again if they have
+  # changed.
+  class ImageCache
+
+    Entry = Struct.new(:path, :size, :headers, :fresh_until)
+
+    RESPONSE_HEADERS = {
+      "content-type" => "Content-Type",
+      "last-modified" => "Last-Modified",
+      "cache-control" => "Cache-Control",
+      "etag" => "Etag"
+    }.freeze
+
+    attr_reader :max_size
+    attr_reader :default_ttl
+
+    # @param [Integer] max_size The maximum number of bytes to store
+    # @param [Integer] default_ttl The number of seconds to consider an image fresh for if
+    #   it wasn't served with a max-age
+    def initialize(max_size:, default_ttl:)
+      @max_size = max_size
+      @default_ttl = default_ttl
+      @entries = {}
+      @total_size = 0
+      @mutex = Mutex.new
+    end
+
+    # Return the headers and body of the image at the given URL or nil if it could not be
+    # fetched
+    #
+    # @param [String] url
+    # @return [Array(Hash, String), nil]
+    def fetch(url)
+      key = Digest::SHA256.hexdigest(url)
+      entry = @mutex.synchronize do
+        entry = @entries.delete(key)
+        @entries[key] = entry if entry
+      end
+
+      if entry && entry.fresh_until > now && (body = read(entry))
+        return [entry.headers, body]
+      end
+
+      request_headers = {}
+      if entry
+        request_headers["If-None-Match"] = entry.headers["Etag"] if entry.headers["Etag"]
+        request_headers["If-Modified-Since"] = entry.headers["Last-Modified"] if entry.headers["Last-Modified"]
+      end
+
+      response = Postal::HTTP.get(url, timeout: 3, headers: request_headers)
+      if response[:code] == 304 && entry && (body = read(entry))
+        entry.fresh_until = now + ttl_for(response[:headers]["cache-control"]&.first || entry.headers["Cache-Control"])
+        return [entry.headers, body]
+      end
+
+      return nil unless response[:code] == 200
+
+      headers = RESPONSE_HEADERS.each_with_object({}) do |(name, header), hash|
+        hash[header] = response[:headers][name]&.first
+      end
+      store(key, headers, response[:body])
+      [headers, response[:body]]
+    end
+
+    # Return the number of bytes currently stored
+    #
+    # @return [Integer]
+    def total_size
+      @mutex.synchronize { @total_size }
+    end
+
+    private
+
+    def store(key, headers, body)
+      cache_control = headers["Cache-Control"].to_s
+      return if cache_control =~ /no-store/i
+      # Don't let a single image take up a large part of the cache
+      return if body.bytesize > @max_size / 10
+
+      path = File.join(directory, key)
+      temporary_path = "#{path}.#{SecureRandom.hex(4)}"
+      File.binwrite(temporary_path, body)
+      File.rename(temporary_path, path)
+
+      @mutex.synchronize do
+        if existing = @entries.delete(key)
+          @total_size -= existing.size
+        end
+        @entries[key] = Entry.new(path, body.bytesize, headers, now + ttl_for(cache_control))
+        @total_size += body.bytesize
+
+        while @total_size > @max_size
+          _, evicted = @entries.shift
+          @total_size -= evicted.size
+          File.delete(evicted.path) if File.exist?(evicted.path)
+        end
+      end
+    rescue SystemCallError => e
+      Postal.logger.error "Error caching tracking image: #{e.class} (#{e.message})"
+    end
+
+    # Return the body for the given entry or nil if it is no longer on disk
+    def read(entry)
+      File.binread(entry.path)
+    rescue SystemCallError
+      nil
+    end
+
+    def ttl_for(cache_control)
+      return 0 if cache_control =~ /no-cache/i
+
+      if cache_control =~ /max-age=(\d+)/i
+        ::Regexp.last_match(1).to_i
+      else
+        @default_ttl
+      end
+    end
+
+    def directory
+      @mutex.synchronize do
+        # Each process uses its own directory (and removes it when it exits) because the
+        # index of what is stored is only held in memory
+        if @directory_pid != Process.pid
+          @directory_pid = Process.pid
+          @entries = {}
+          @total_size = 0
+          directory = @directory = Dir.mktmpdir("postal-tracking-images")
+          at_exit { FileUtils.rm_rf(directory) }
+        end
+        @directory
+      end
+    end
+
+    def now
+      Process.clock_gettime(Process::CLOCK_MONOTONIC)
+    end
+
+  end
+end
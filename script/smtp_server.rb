@@ -10,4 +10,9 @@ HealthServer.start(
   default_port: Postal::Config.smtp_server.default_health_server_port,
   default_bind_address: Postal::Config.smtp_server.default_health_server_bind_address
 )
-SMTPServer::Server.new(debug: true).run
+
+if Postal::Config.smtp_server.workers > 1
+  SMTPServer::Supervisor.new(server_options: { debug: true }).run
+else
+  SMTPServer::Server.new(debug: true).run
+end
@@ -0,0 +1,78 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe "Legacy Messages API", type: :request do
+  describe "/api/v1/messages/list" do
+    context "when no authentication is provided" do
+      it "returns an error" do
+        post "/api/v1/messages/list"
+        expect(response.status).to eq 200
+        parsed_body = JSON.parse(response.body)
+        expect(parsed_body["status"]).to eq "error"
+        expect(parsed_body["data"]["code"]).to eq "AccessDenied"
+      end
+    end
+
+    context "when the credential is valid" do
+      let(:server) { create(:server) }
+      let(:credential) { create(:credential, server: server) }
+
+      let!(:messages) do
+        Array.new(3) do |i|
+          MessageFactory.outgoing(server) do |message|
+            message.rcpt_to = "test#{i}@example.com"
+            message.tag = i.zero? ? "welcome" : "newsletter"
+          end
+        end
+      end
+
+      def list(params = {})
+        post "/api/v1/messages/list",
+             headers: { "x-server-api-key" => credential.key,
+                        "content-type" => "application/json" },
+             params: params.to_json
+        JSON.parse(response.body)
+      end
+
+      it "returns the newest messages first" do
+        parsed_body = list
+        expect(parsed_body["status"]).to eq "success"
+        expect(parsed_body["data"]["messages"].map { |m| m["id"] }).to eq messages.reverse.map(&:id)
+        expect(parsed_body["data"]["messages"].first).to match(
+          "id" => messages.last.id,
+          "token" => messages.last.token,
+          "status" => "Pending",
+          "rcpt_to" => "test2@example.com",
+          "mail_from" => "test@example.com",
+          "subject" => "An example message",
+          "message_id" => kind_of(String),
+          "timestamp" => kind_of(Float),
+          "tag" => "newsletter"
+        )
+        expect(parsed_body["data"]["total"]).to eq 3
+        expect(parsed_body["data"]["next_cursor"]).to be nil
+      end
+
+      it "returns further pages using the cursor" do
+        first_page = list(per_page: 2)
+        expect(first_page["data"]["messages"].map { |m| m["id"] }).to eq [messages[2].id, messages[1].id]
+
+        second_page = list(per_page: 2, cursor: first_page["data"]["next_cursor"])
+        expect(second_page["data"]["messages"].map { |m| m["id"] }).to eq [messages[0].id]
+        expect(second_page["data"]["next_cursor"]).to be nil
+        expect(second_page["data"]["previous_cursor"]).to be_a String
+      end
+
+      it "filters the messages" do
+        expect(list(tag: "welcome")["data"]["messages"].map { |m| m["id"] }).to eq [messages[0].id]
+        expect(list(to: "test1@%")["data"]["messages"].map { |m| m["id"] }).to eq [messages[1].id]
+      end
+
+      it "returns an error if the direction is not valid" do
+        parsed_body = list(direction: "sideways")
+        expect(parsed_body["status"]).to eq "parameter-error"
+      end
+    end
+  end
+end
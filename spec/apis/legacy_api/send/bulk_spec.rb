@@ -0,0 +1,190 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe "Legacy Send API", type: :request do
+  describe "/api/v1/send/bulk" do
+    context "when no authentication is provided" do
+      it "returns an error" do
+        post "/api/v1/send/bulk"
+        expect(response.status).to eq 200
+        parsed_body = JSON.parse(response.body)
+        expect(parsed_body["status"]).to eq "error"
+        expect(parsed_body["data"]["code"]).to eq "AccessDenied"
+      end
+    end
+
+    context "when the credential is valid" do
+      let(:server) { create(:server) }
+      let(:credential) { create(:credential, server: server) }
+      let(:domain) { create(:domain, owner: server) }
+
+      let(:default_message) do
+        {
+          to: ["test@example.com"],
+          cc: ["cc@example.com"],
+          from: "test@#{domain.name}",
+          subject: "Test",
+          plain_body: "plain text",
+          tag: "test-tag"
+        }
+      end
+      let(:lines) { [default_message.to_json] }
+      let(:batch_size) { 100 }
+      let(:max_messages) { 10_000 }
+
+      let(:results) { JSON.parse(response.body)["data"]["results"] }
+
+      before do
+        allow(Postal::Config.postal).to receive(:bulk_send_batch_size).and_return(batch_size)
+        allow(Postal::Config.postal).to receive(:bulk_send_max_messages).and_return(max_messages)
+        post "/api/v1/send/bulk",
+             headers: { "x-server-api-key" => credential.key,
+                        "content-type" => "application/x-ndjson" },
+             params: lines.join("\n")
+      end
+
+      context "when given a single message" do
+        it "returns details of the messages created" do
+          parsed_body = JSON.parse(response.body)
+          expect(parsed_body["status"]).to eq "success"
+          expect(results).to match [
+            {
+              "line" => 1,
+              "status" => "success",
+              "message_id" => kind_of(String),
+              "messages" => {
+                "test@example.com" => { "id" => kind_of(Integer), "token" => /\A[a-zA-Z0-9]{16}\z/ },
+                "cc@example.com" => { "id" => kind_of(Integer), "token" => /\A[a-zA-Z0-9]{16}\z/ }
+              }
+            }
+          ]
+        end
+
+        it "creates appropriate message objects" do
+          ["test@example.com", "cc@example.com"].each do |rcpt_to|
+            message = server.message(results.first["messages"][rcpt_to]["id"])
+            expect(message).to have_attributes(
+              rcpt_to: rcpt_to,
+              mail_from: default_message[:from],
+              subject: "Test",
+              token: results.first["messages"][rcpt_to]["token"],
+              status: "Pending",
+              domain_id: domain.id,
+              credential_id: credential.id,
+              tag: "test-tag",
+              plain_body: "plain text"
+            )
+          end
+        end
+
+        it "queues the messages for delivery" do
+          message_ids = results.first["messages"].values.map { |m| m["id"] }
+          expect(QueuedMessage.where(server: server, message_id: message_ids).pluck(:domain)).to match_array ["example.com", "example.com"]
+        end
+      end
+
+      context "when given many messages" do
+        let(:lines) do
+          Array.new(5) { |i| default_message.merge(to: ["test#{i}@example.com"], cc: []).to_json }
+        end
+
+        it "creates a message for each line" do
+          expect(results.size).to eq 5
+          results.each_with_index do |result, index|
+            expect(result["line"]).to eq index + 1
+            expect(result["status"]).to eq "success"
+            message = server.message(result["messages"]["test#{index}@example.com"]["id"])
+            expect(message.rcpt_to).to eq "test#{index}@example.com"
+          end
+        end
+      end
+
+      context "when there are more messages than the batch size" do
+        let(:lines) do
+          Array.new(5) { |i| default_message.merge(to: ["test#{i}@example.com"], cc: []).to_json }
+        end
+        let(:batch_size) { 2 }
+
+        it "creates the messages in several batches" do
+          expect(results.map { |r| r["status"] }).to eq ["success"] * 5
+          ids = results.map { |r| r["messages"].values.first["id"] }
+          expect(ids.uniq.size).to eq 5
+          expect(server.message_db.messages(where: { id: ids }).map(&:rcpt_to)).to match_array(5.times.map { |i| "test#{i}@example.com" })
+        end
+      end
+
+      context "when a line is not valid JSON" do
+        let(:lines) { ["{invalid", default_message.to_json] }
+
+        it "returns an error for that line and creates the other messages" do
+          expect(results[0]).to include("line" => 1, "status" => "error", "code" => "InvalidJSON")
+          expect(results[1]).to include("line" => 2, "status" => "success")
+        end
+      end
+
+      context "when a message is not valid" do
+        let(:lines) { [default_message.merge(from: "test@another.com").to_json, "", default_message.to_json] }
+
+        it "returns an error for that line and creates the other messages" do
+          expect(results.size).to eq 2
+          expect(results[0]).to include("line" => 1, "status" => "error", "code" => "UnauthenticatedFromAddress",
+                                        "message" => /not authorised/)
+          expect(results[1]).to include("line" => 3, "status" => "success")
+        end
+      end
+
+      context "when messages use a shared attachment" do
+        let(:lines) do
+          [
+            { attachment: { id: "logo", name: "logo.txt", content_type: "text/plain", data: Base64.encode64("hello world") } }.to_json,
+            default_message.merge(attachments: [{ attachment_id: "logo" }]).to_json,
+            default_message.merge(attachments: [{ attachment_id: "logo" },
+                                                { name: "other.txt", content_type: "text/plain", data: Base64.encode64("other") }]).to_json
+          ]
+        end
+
+        it "adds the attachment to each message" do
+          expect(results[0]).to eq("line" => 1, "status" => "success", "attachment_id" => "logo")
+
+          message = server.message(results[1]["messages"]["test@example.com"]["id"])
+          expect(message.attachments).to match [
+            have_attributes(filename: "logo.txt", body: have_attributes(to_s: "hello world"))
+          ]
+
+          message = server.message(results[2]["messages"]["test@example.com"]["id"])
+          expect(message.attachments).to match [
+            have_attributes(filename: "logo.txt", body: have_attributes(to_s: "hello world")),
+            have_attributes(filename: "other.txt", body: have_attributes(to_s: "other"))
+          ]
+        end
+      end
+
+      context "when a message uses a shared attachment which hasn't been provided" do
+        let(:lines) { [default_message.merge(attachments: [{ attachment_id: "missing" }]).to_json] }
+
+        it "returns an error" do
+          expect(results[0]).to include("status" => "error", "code" => "AttachmentNotFound", "attachment_id" => "missing")
+        end
+      end
+
+      context "when a shared attachment is missing data" do
+        let(:lines) { [{ attachment: { id: "logo", name: "logo.txt" } }.to_json] }
+
+        it "returns an error" do
+          expect(results[0]).to include("status" => "error", "code" => "InvalidAttachment")
+        end
+      end
+
+      context "when there are more messages than the maximum" do
+        let(:lines) { Array.new(3) { default_message.to_json } }
+        let(:max_messages) { 2 }
+
+        it "returns an error for the messages over the maximum" do
+          expect(results.map { |r| r["status"] }).to eq %w[success success error]
+          expect(results[2]["code"]).to eq "TooManyMessages"
+        end
+      end
+    end
+  end
+end
@@ -0,0 +1,64 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+require "benchmark"
+
+# Compares DKIMHeader with the whole-message regular expression canonicalization which it
+# replaced. The outputs are always compared. Timings are only measured and printed when the
+# BENCHMARK environment variable is set.
+describe "DKIMHeader benchmark" do
+  # The body hash as it was calculated before the body was canonicalized in chunks
+  def reference_body_hash(message)
+    body = message.gsub(/\r?\n/, "\r\n").split(/\r\n\r\n/, 2)[1].to_s
+    body = body.gsub(/[ \t]+/, " ").gsub(/ \r\n/, "\r\n").gsub(/[ \r\n]*\z/, "") + "\r\n"
+    Base64.encode64(Digest::SHA256.digest(body)).strip
+  end
+
+  def measure(iterations, &block)
+    Benchmark.realtime { iterations.times(&block) }
+  end
+
+  examples = Dir[Rails.root.join("spec/examples/dkim_signing/*.msg")].map do |path|
+    frontmatter, email = File.read(path).split(/^---\n/m, 2)
+    [path.split("/").last, YAML.safe_load(frontmatter), email]
+  end
+
+  let(:large_email) do
+    "From: test@example.com\r\nTo: test@example.com\r\nSubject: Large\r\n\r\n" +
+      ("<p>Hello   world,\tthis is a  line of an HTML newsletter</p> \r\n" * 20_000) +
+      "\r\n\r\n"
+  end
+
+  examples.each do |name, frontmatter, email|
+    context "with #{name}" do
+      let(:domain) do
+        instance_double("Domain", dkim_status: "OK", name: frontmatter["domain"],
+                                  dkim_key: OpenSSL::PKey::RSA.new(frontmatter["private_key"]),
+                                  dkim_identifier: frontmatter["dkim_identifier"])
+      end
+
+      before { allow(Time).to receive(:now).and_return(Time.at(frontmatter["time"].to_i)) }
+
+      it "produces the same body hash and signature as before" do
+        header = DKIMHeader.new(domain, email).dkim_header
+        expect(header).to include "bh=#{reference_body_hash(email)};"
+        expect(header).to include "bh=#{frontmatter['bh']};"
+        expect(header.gsub(/\r\n\t/, "")).to include "b=#{frontmatter['b']}"
+      end
+
+      it "produces the same body hash as before for a large message" do
+        message = email.sub(/\r?\n\r?\n.*/m, "\r\n\r\n") + large_email.split("\r\n\r\n", 2).last
+        header = DKIMHeader.new(domain, message).dkim_header
+        expect(header).to include "bh=#{reference_body_hash(message)};"
+
+        if ENV["BENCHMARK"]
+          reference_time = measure(20) { reference_body_hash(message) }
+          current_time = measure(20) { DKIMHeader.new(domain, message).dkim_header }
+          cached_time = measure(20) { DKIMHeader.new(domain, message, body_hash_key: [:benchmark, name]).dkim_header }
+          puts format("\n%s: reference body hash %.3fs, DKIMHeader %.3fs, DKIMHeader with shared body hash %.3fs (20 iterations)",
+                      name, reference_time, current_time, cached_time)
+        end
+      end
+    end
+  end
+end
@@ -6,6 +6,7 @@
 #
 #  id                                 :integer          not null, primary key
 #  allow_sender                       :boolean          default(FALSE)
+#  compress_raw_messages              :boolean          default(FALSE)
 #  deleted_at                         :datetime
 #  domains_not_to_click_track         :text(65535)
 #  log_smtp_data                      :boolean          default(FALSE)
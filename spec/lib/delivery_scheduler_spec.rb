@@ -0,0 +1,117 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe DeliveryScheduler do
+  subject(:scheduler) do
+    described_class.new(max_concurrency_per_destination: 2, max_concurrency_per_ip_address: 3, backoff: 5, max_backoff: 60)
+  end
+
+  def candidate(id, domain, ip_address_id: nil, priority: 0)
+    DeliveryScheduler::Candidate.new(id, domain, ip_address_id, priority)
+  end
+
+  describe "#reserve" do
+    it "takes messages from each destination in turn" do
+      candidates = [candidate(1, "a.com"), candidate(2, "a.com"), candidate(3, "b.com"), candidate(4, "c.com")]
+      expect(scheduler.reserve(candidates, 3).map(&:id)).to eq [1, 3, 4]
+    end
+
+    it "takes messages from higher priority servers first" do
+      candidates = [candidate(1, "a.com", priority: 10), candidate(2, "b.com", priority: 0), candidate(3, "c.com", priority: 10)]
+      expect(scheduler.reserve(candidates, 2).map(&:id)).to eq [1, 3]
+    end
+
+    it "does not exceed the concurrency limit for a destination" do
+      candidates = 5.times.map { |i| candidate(i, "a.com") }
+      expect(scheduler.reserve(candidates, 5).size).to eq 2
+      expect(scheduler.reserve(candidates, 5)).to be_empty
+    end
+
+    it "does not exceed the concurrency limit for a source IP address" do
+      candidates = 5.times.map { |i| candidate(i, "#{i}.com", ip_address_id: 1) }
+      expect(scheduler.reserve(candidates, 5).size).to eq 3
+    end
+
+    it "allows more messages once earlier ones are released" do
+      candidates = 3.times.map { |i| candidate(i, "a.com") }
+      scheduler.reserve(candidates, 3)
+      scheduler.release("a.com", nil)
+      expect(scheduler.reserve(candidates.drop(2), 3).map(&:id)).to eq [2]
+    end
+  end
+
+  describe "#release" do
+    it "forgets destinations and IP addresses which have nothing left in flight" do
+      scheduler.reserve([candidate(1, "a.com", ip_address_id: 1), candidate(2, "b.com", ip_address_id: 1)], 2)
+      expect(scheduler.size).to eq 3
+      scheduler.release("a.com", 1)
+      expect(scheduler.size).to eq 2
+      scheduler.release("b.com", 1)
+      expect(scheduler.size).to eq 0
+    end
+
+    it "keeps destinations which are backing off or below the maximum limit" do
+      scheduler.reserve([candidate(1, "a.com")], 1)
+      scheduler.record("a.com", nil, :deferral, 1.0)
+      scheduler.release("a.com", nil)
+      expect(scheduler.size).to eq 1
+      expect(scheduler.unavailable_destinations).to eq ["a.com"]
+    end
+
+    it "forgets destinations once they have recovered" do
+      scheduler.reserve([candidate(1, "a.com")], 1)
+      scheduler.record("a.com", nil, :deferral, 1.0)
+      scheduler.release("a.com", nil)
+      allow(scheduler).to receive(:now).and_return(Process.clock_gettime(Process::CLOCK_MONOTONIC) + 120)
+      scheduler.reserve([candidate(2, "a.com")], 1)
+      scheduler.record("a.com", nil, :success, 1.0)
+      scheduler.release("a.com", nil)
+      expect(scheduler.size).to eq 0
+    end
+
+    it "limits the number of destinations given their own metric labels" do
+      stub_const("DeliveryScheduler::METRIC_DESTINATIONS", 2)
+      labels = []
+      allow(scheduler).to receive(:set_prometheus_gauge) { |_name, _value, **options| labels << options[:labels][:destination] }
+      scheduler.reserve(%w[a.com b.com c.com d.com].each_with_index.map { |domain, i| candidate(i, domain) }, 4)
+      %w[a.com b.com c.com d.com].each { |domain| scheduler.release(domain, nil) }
+      expect(labels.uniq).to contain_exactly("a.com", "b.com", "(other)")
+    end
+  end
+
+  describe "#unavailable_destinations" do
+    it "returns destinations which have as many messages in flight as they are allowed" do
+      scheduler.reserve([candidate(1, "a.com"), candidate(2, "a.com"), candidate(3, "b.com")], 3)
+      expect(scheduler.unavailable_destinations).to eq ["a.com"]
+    end
+
+    it "returns destinations which are backing off" do
+      scheduler.record("a.com", nil, :deferral, 1.0)
+      expect(scheduler.unavailable_destinations).to eq ["a.com"]
+    end
+  end
+
+  describe "#record" do
+    it "halves the limit and backs off the destination after a deferral" do
+      scheduler.record("a.com", nil, :deferral, 1.0)
+      expect(scheduler.destination("a.com").limit).to eq 1
+      expect(scheduler.reserve([candidate(1, "a.com")], 1)).to be_empty
+    end
+
+    it "doubles the backoff for each deferral up to the maximum" do
+      3.times { scheduler.record("a.com", nil, :deferral, 1.0) }
+      destination = scheduler.destination("a.com")
+      expect(destination.backoff_until - Process.clock_gettime(Process::CLOCK_MONOTONIC)).to be_within(1).of(20)
+    end
+
+    it "raises the limit again after successful deliveries" do
+      scheduler.record("a.com", nil, :deferral, 1.0)
+      3.times { scheduler.record("a.com", nil, :success, 1.0) }
+      destination = scheduler.destination("a.com")
+      expect(destination.limit).to eq 2
+      expect(destination.backoff_until).to be nil
+      expect(destination.latency).to eq 1.0
+    end
+  end
+end
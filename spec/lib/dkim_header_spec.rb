@@ -31,4 +31,37 @@ describe DKIMHeader do
       expect(header.dkim_header).to eq expectation
     end
   end
+
+  describe ".private_key" do
+    let(:pem) { OpenSSL::PKey::RSA.new(1024).to_s }
+
+    it "returns the same parsed key for the same owner and PEM" do
+      key = described_class.private_key(1, pem)
+      expect(key).to be_a OpenSSL::PKey::RSA
+      expect(described_class.private_key(1, pem)).to be key
+    end
+
+    it "parses the key again when the PEM changes" do
+      key = described_class.private_key(1, pem)
+      expect(described_class.private_key(1, OpenSSL::PKey::RSA.new(1024).to_s)).to_not be key
+    end
+  end
+
+  context "with a body hash key" do
+    let(:domain) { create(:domain) }
+
+    before { described_class::BODY_HASH_CACHE.clear }
+
+    it "shares the body hash between messages with the same key" do
+      first = described_class.new(domain, "Subject: One\r\n\r\nHello", body_hash_key: [:test, 1])
+      second = described_class.new(domain, "Subject: Two\r\n\r\nChanged", body_hash_key: [:test, 1])
+      expect(second.dkim_header[/bh=[^;]+/]).to eq first.dkim_header[/bh=[^;]+/]
+    end
+
+    it "does not share the body hash between messages with different keys" do
+      first = described_class.new(domain, "Subject: One\r\n\r\nHello", body_hash_key: [:test, 1])
+      second = described_class.new(domain, "Subject: Two\r\n\r\nChanged", body_hash_key: [:test, 2])
+      expect(second.dkim_header[/bh=[^;]+/]).to_not eq first.dkim_header[/bh=[^;]+/]
+    end
+  end
 end
@@ -0,0 +1,71 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe DNSResolver::Cache do
+  subject(:cache) { described_class.new(max_entries: 2, negative_ttl: 60, max_ttl: 3600) }
+
+  let(:record) { double("resource", ttl: 300) }
+
+  describe "#fetch" do
+    it "calls the block and returns the result when the key is not cached" do
+      expect(cache.fetch(["example.com"]) { [record] }).to eq [record]
+    end
+
+    it "returns the cached result without calling the block again" do
+      cache.fetch(["example.com"]) { [record] }
+      expect { |b| cache.fetch(["example.com"], &b) }.to_not yield_control
+      expect(cache.fetch(["example.com"]) { [] }).to eq [record]
+    end
+
+    it "looks up the key again once the TTL has expired" do
+      cache.fetch(["example.com"]) { [record] }
+      allow_any_instance_of(LRUCache).to receive(:now).and_return(Process.clock_gettime(Process::CLOCK_MONOTONIC) + 301)
+      expect(cache.fetch(["example.com"]) { [] }).to eq []
+    end
+
+    it "caches empty results for the negative TTL" do
+      cache.fetch(["example.com"]) { [] }
+      expect(cache.fetch(["example.com"]) { [record] }).to eq []
+
+      allow_any_instance_of(LRUCache).to receive(:now).and_return(Process.clock_gettime(Process::CLOCK_MONOTONIC) + 61)
+      expect(cache.fetch(["example.com"]) { [record] }).to eq [record]
+    end
+
+    it "caps the TTL at the maximum TTL" do
+      cache.fetch(["example.com"]) { [double("resource", ttl: 86_400)] }
+      allow_any_instance_of(LRUCache).to receive(:now).and_return(Process.clock_gettime(Process::CLOCK_MONOTONIC) + 3601)
+      expect(cache.fetch(["example.com"]) { [record] }).to eq [record]
+    end
+
+    it "does not cache errors" do
+      expect { cache.fetch(["example.com"]) { raise Resolv::ResolvError, "DNS resolv timeout" } }.to raise_error(Resolv::ResolvError)
+      expect(cache.fetch(["example.com"]) { [record] }).to eq [record]
+    end
+
+    it "evicts the least recently used entry when full" do
+      cache.fetch(["a.example.com"]) { [record] }
+      cache.fetch(["b.example.com"]) { [record] }
+      cache.fetch(["a.example.com"]) { [] }
+      cache.fetch(["c.example.com"]) { [record] }
+      expect(cache.size).to eq 2
+      expect(cache.fetch(["a.example.com"]) { [] }).to eq [record]
+      expect(cache.fetch(["b.example.com"]) { [] }).to eq []
+    end
+
+    it "only performs one lookup when many threads request the same key" do
+      calls = 0
+      threads = 5.times.map do
+        Thread.new do
+          cache.fetch(["example.com"]) do
+            calls += 1
+            sleep 0.1
+            [record]
+          end
+        end
+      end
+      expect(threads.map(&:value)).to all eq [record]
+      expect(calls).to eq 1
+    end
+  end
+end
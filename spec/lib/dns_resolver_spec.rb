@@ -5,6 +5,10 @@ require "rails_helper"
 RSpec.describe DNSResolver do
   subject(:resolver) { described_class.local }
 
+  before do
+    described_class.cache&.clear
+  end
+
   # Now, we could mock everything in here which would give us some comfort
   # but I do think that we'll benefit more from having a full E2E test here
   # so we'll test this using values which we know to be fairly static and
@@ -208,6 +212,47 @@ RSpec.describe DNSResolver do
       resolver = described_class.for_domain("dnstest.postalserver.io")
       expect(resolver.nameservers.sort).to eq ["151.252.1.100", "151.252.2.100"]
     end
+
+    it "uses the given cache for its own lookups and the returned resolver's lookups", skip: ENV["CI"] do
+      cache = DNSResolver::Cache.new(max_entries: 100, negative_ttl: 60, max_ttl: 3600)
+      resolver = described_class.for_domain("dnstest.postalserver.io", cache: cache)
+      expect(cache.size).to be > 0
+      expect { resolver.a("www.dnstest.postalserver.io") }.to change { cache.size }.by(1)
+    end
+  end
+
+  context "when not given a cache" do
+    subject(:resolver) { described_class.new(["1.2.3.4"]) }
+
+    it "does not use the process-wide cache" do
+      allow(Postal::Config.dns).to receive(:cache_enabled?).and_return(true)
+      allow_any_instance_of(Resolv::DNS).to receive(:getresources).and_return([])
+      resolver.a("www.example.com")
+      expect(described_class.cache.size).to eq 0
+    end
+  end
+
+  context "when given the process-wide cache" do
+    subject(:resolver) { described_class.new(["1.2.3.4"], cache: :process) }
+
+    it "stores lookups in the process-wide cache" do
+      allow(Postal::Config.dns).to receive(:cache_enabled?).and_return(true)
+      allow_any_instance_of(Resolv::DNS).to receive(:getresources).and_return([])
+      resolver.a("www.example.com")
+      expect(described_class.cache.size).to eq 1
+    end
+  end
+
+  context "when given a cache" do
+    let(:cache) { DNSResolver::Cache.new(max_entries: 100, negative_ttl: 60, max_ttl: 3600) }
+
+    subject(:resolver) { described_class.local(cache: cache) }
+
+    it "stores lookups in the given cache rather than the process-wide cache", skip: ENV["CI"] do
+      resolver.a("www.dnstest.postalserver.io")
+      expect(cache.size).to eq 1
+      expect(described_class.cache&.size || 0).to eq 0
+    end
   end
 
   describe ".local" do
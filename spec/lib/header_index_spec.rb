@@ -0,0 +1,72 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+describe HeaderIndex do
+  let(:raw) do
+    "Received: from example.com\r\n" \
+      "\tby mx.example.com\r\n" \
+      "Subject: =?UTF-8?B?SGVsbG8gd29ybGQ=?=\r\n" \
+      "From: Test <test@example.com>\r\n" \
+      "Received: from other.com\r\n" \
+      "\r\n" \
+      "Hello world\r\n"
+  end
+
+  subject(:index) { described_class.new(raw) }
+
+  describe "#[]" do
+    it "returns unfolded values for all fields with the name" do
+      expect(index["received"]).to eq ["from example.com\tby mx.example.com", "from other.com"]
+    end
+
+    it "decodes encoded words" do
+      expect(index["subject"]).to eq ["Hello world"]
+    end
+
+    it "is case insensitive" do
+      expect(index["FROM"]).to eq ["Test <test@example.com>"]
+    end
+
+    it "returns nil for missing fields" do
+      expect(index["cc"]).to be nil
+    end
+  end
+
+  describe "#fields" do
+    it "records the byte offsets of each field" do
+      field = index.fields.first
+      expect(field.name).to eq "received"
+      expect(index.raw_field(field)).to eq "Received: from example.com\r\n\tby mx.example.com"
+    end
+  end
+
+  describe "#raw_headers and #raw_body" do
+    it "splits the buffer at the first blank line" do
+      expect(index.raw_headers).to eq raw.split("\r\n\r\n").first + "\r\n"
+      expect(index.raw_body).to eq "Hello world\r\n"
+    end
+
+    it "supports LF line endings" do
+      index = described_class.new("Subject: Test\n  folded\n\nBody")
+      expect(index["subject"]).to eq ["Test  folded"]
+      expect(index.raw_body).to eq "Body"
+    end
+
+    it "has no body when there is no blank line" do
+      index = described_class.new("Subject: Test")
+      expect(index.raw_body).to be nil
+      expect(index.raw_headers).to eq "Subject: Test"
+    end
+  end
+
+  describe "#to_h" do
+    it "returns all values keyed by lowercase name" do
+      expect(index.to_h).to eq({
+        "received" => ["from example.com\tby mx.example.com", "from other.com"],
+        "subject" => ["Hello world"],
+        "from" => ["Test <test@example.com>"]
+      })
+    end
+  end
+end
@@ -87,6 +87,30 @@ module MessageDequeuer
       end
     end
 
+    context "when given a pre-claimed batch of messages" do
+      let(:batch_message) { create(:queued_message, :locked, message: MessageFactory.incoming(server, route: route)) }
+
+      subject(:processor) { described_class.new(queued_message, logger: logger, batch: [batch_message]) }
+
+      it "calls the single message processor for the initial message and the batch" do
+        [queued_message, batch_message].each do |msg|
+          expect(SingleMessageProcessor).to receive(:process).with(msg,
+                                                                   logger: logger,
+                                                                   state: processor.state)
+        end
+        processor.process
+      end
+
+      context "when processing stops before the batch is processed" do
+        let(:queued_message) { create(:queued_message, :locked, message: message, retry_after: 1.hour.from_now) }
+
+        it "unlocks the messages in the batch" do
+          processor.process
+          expect(batch_message.reload).to_not be_locked
+        end
+      end
+    end
+
     context "when an error occurs while finding batchable messages" do
       before do
         allow(queued_message).to receive(:batchable_messages) { 1 / 0 }
@@ -452,6 +452,29 @@ module MessageDequeuer
         expect { processor.process }.to change { server.message_db.live_stats.total(60) }.from(0).to(1)
       end
 
+      context "when processing takes longer than the slow message threshold" do
+        before do
+          allow(Postal::Config.worker).to receive(:slow_message_threshold).and_return(0)
+        end
+
+        it "logs the time taken by each step" do
+          processor.process
+          expect(logger).to have_logged(/slow message processing .*check_domain=.*send_message_to_sender=.*finish_processing=/)
+        end
+      end
+
+      context "when stage timings are disabled" do
+        before do
+          allow(Postal::Config.worker).to receive(:stage_timings?).and_return(false)
+          allow(Postal::Config.worker).to receive(:slow_message_threshold).and_return(0)
+        end
+
+        it "does not log the time taken by each step" do
+          processor.process
+          expect(logger).to_not have_logged(/slow message processing/)
+        end
+      end
+
       context "when there is an IP address assigned to the queued message" do
         let(:ip) { create(:ip_address) }
         let(:queued_message) { create(:queued_message, :locked, message: message, ip_address: ip) }
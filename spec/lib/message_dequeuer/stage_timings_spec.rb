@@ -0,0 +1,96 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+module MessageDequeuer
+
+  RSpec.describe StageTimings do
+    let(:server) { create(:server) }
+    let(:logger) { TestLogger.new }
+    let(:queued_message) { create(:queued_message, server: server) }
+
+    subject(:timings) { described_class.new("outgoing") }
+
+    before do
+      described_class.instance_variable_set("@slow_messages", [])
+    end
+
+    describe "#measure" do
+      it "returns the result of the block" do
+        expect(timings.measure(:example) { 1234 }).to eq 1234
+      end
+
+      it "records the time taken by the step" do
+        timings.measure(:example) { sleep 0.01 }
+        expect(timings.stages.first).to have_attributes(name: :example, duration: be >= 0.01)
+      end
+
+      it "counts queries made to the main database and the message database" do
+        message_db = server.message_db
+        timings.measure(:example) do
+          Server.where(id: server.id).first
+          message_db.messages(where: { id: 1 })
+        end
+        expect(timings.stages.first).to have_attributes(main_db_queries: 1, message_db_queries: 1)
+      end
+
+      it "records the step when it stops processing" do
+        expect { timings.measure(:example) { raise Base::StopProcessing } }.to raise_error(Base::StopProcessing)
+        expect(timings.stages.map(&:name)).to eq [:example]
+      end
+    end
+
+    describe "#finish" do
+      before do
+        timings.measure(:check_domain) { nil }
+        timings.measure(:send_message_to_sender) { nil }
+      end
+
+      context "when processing took less time than the slow message threshold" do
+        before do
+          allow(Postal::Config.worker).to receive(:slow_message_threshold).and_return(10_000)
+        end
+
+        it "does not log or remember the message" do
+          timings.finish(queued_message, logger: logger)
+          expect(logger).to_not have_logged(/slow message processing/)
+          expect(described_class.slow_messages).to be_empty
+        end
+      end
+
+      context "when processing took longer than the slow message threshold" do
+        before do
+          allow(Postal::Config.worker).to receive(:slow_message_threshold).and_return(0)
+        end
+
+        it "logs a breakdown of each step" do
+          timings.finish(queued_message, logger: logger)
+          expect(logger).to have_logged(/slow message processing \(\d+ms\): check_domain=[\d.]+ms\/0q send_message_to_sender=/)
+        end
+
+        it "remembers the message" do
+          timings.finish(queued_message, logger: logger)
+          expect(described_class.slow_messages).to match [
+            hash_including(message_id: queued_message.message_id,
+                           scope: "outgoing",
+                           stages: [hash_including(name: :check_domain), hash_including(name: :send_message_to_sender)]),
+          ]
+        end
+      end
+    end
+
+    describe ".add_slow_message" do
+      before do
+        allow(Postal::Config.worker).to receive(:slow_message_log_size).and_return(2)
+      end
+
+      it "keeps only the slowest messages, slowest first" do
+        described_class.add_slow_message(message_id: 1, duration_ms: 100)
+        described_class.add_slow_message(message_id: 2, duration_ms: 300)
+        described_class.add_slow_message(message_id: 3, duration_ms: 200)
+        expect(described_class.slow_messages.map { |m| m[:message_id] }).to eq [2, 3]
+      end
+    end
+  end
+
+end
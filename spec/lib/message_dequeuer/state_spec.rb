@@ -37,6 +37,69 @@ module MessageDequeuer
         state.finished
       end
     end
+
+    context "when SMTP sender pooling is enabled" do
+      let(:pool) { SMTPSender::Pool.new(max_connections_per_destination: 2, max_messages_per_session: 10, idle_timeout: 30) }
+      let(:smtp_sender) { instance_double(SMTPSender, start: true, connected?: true, messages_sent: 1, reset: true, finish: nil) }
+
+      before do
+        allow(SMTPSender).to receive(:pool).and_return(pool)
+        allow(SMTPSender).to receive(:new).and_return(smtp_sender)
+      end
+
+      it "checks out outgoing SMTP senders from the pool" do
+        expect(state.sender_for(SMTPSender, "example.com", nil)).to be smtp_sender
+        expect(pool.open_count(["example.com", nil])).to eq 1
+      end
+
+      it "returns pooled senders to the pool rather than finishing them" do
+        state.sender_for(SMTPSender, "example.com", nil)
+        state.finished
+        expect(smtp_sender).to_not have_received(:finish)
+        expect(pool.idle_count).to eq 1
+      end
+
+      it "reuses senders from the pool in later states" do
+        state.sender_for(SMTPSender, "example.com", nil)
+        state.finished
+        expect(described_class.new.sender_for(SMTPSender, "example.com", nil)).to be smtp_sender
+        expect(SMTPSender).to have_received(:new).once
+      end
+
+      it "uses a sender which isn't pooled straight away when the destination's sessions are all in use" do
+        2.times { described_class.new.sender_for(SMTPSender, "example.com", nil) }
+        started_at = Process.clock_gettime(Process::CLOCK_MONOTONIC)
+        expect(state.sender_for(SMTPSender, "example.com", nil)).to be smtp_sender
+        expect(Process.clock_gettime(Process::CLOCK_MONOTONIC) - started_at).to be < 0.5
+        expect(pool.open_count(["example.com", nil])).to eq 2
+        state.finished
+        expect(smtp_sender).to have_received(:finish)
+        expect(pool.idle_count).to eq 0
+      end
+
+      it "uses a sender which isn't pooled when the destination has no sessions available" do
+        allow(pool).to receive(:checkout).and_raise(SMTPSender::Pool::ConnectionLimitReachedError)
+        expect(state.sender_for(SMTPSender, "example.com", nil)).to be smtp_sender
+        state.finished
+        expect(smtp_sender).to have_received(:finish)
+        expect(pool.idle_count).to eq 0
+      end
+
+      it "returns pooled senders to the pool between messages" do
+        state.sender_for(SMTPSender, "example.com", nil)
+        state.release_pooled_senders
+        expect(pool.idle_count).to eq 1
+        expect(state.sender_for(SMTPSender, "example.com", nil)).to be smtp_sender
+        expect(pool.idle_count).to eq 0
+      end
+
+      it "does not pool SMTP senders which are given specific servers" do
+        state.sender_for(SMTPSender, "example.com", nil, servers: [])
+        state.finished
+        expect(smtp_sender).to have_received(:finish)
+        expect(pool.idle_count).to eq 0
+      end
+    end
   end
 
 end
@@ -0,0 +1,28 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+require "net/smtp"
+
+module Postal
+  module BenchmarkSuite
+
+    RSpec.describe SinkSMTPServer do
+      let(:received) { Queue.new }
+
+      subject(:server) { described_class.new { |data| received << data }.start }
+
+      after { server.stop }
+
+      it "accepts messages and passes their data to the block" do
+        Net::SMTP.start("127.0.0.1", server.port, helo: "test.example.com", starttls: false) do |smtp|
+          smtp.send_message("Subject: Test\r\n\r\nHello\r\n.. world\r\n", "sender@example.com", ["rcpt@example.com"])
+          smtp.send_message("Subject: Second\r\n\r\nHello again\r\n", "sender@example.com", ["rcpt@example.com"])
+        end
+
+        expect(received.pop).to eq "Subject: Test\r\n\r\nHello\r\n.. world\r\n"
+        expect(received.pop).to eq "Subject: Second\r\n\r\nHello again\r\n"
+      end
+    end
+
+  end
+end
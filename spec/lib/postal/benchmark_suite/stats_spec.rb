@@ -0,0 +1,39 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+module Postal
+  module BenchmarkSuite
+
+    RSpec.describe Stats do
+      describe ".percentile" do
+        it "returns the nearest-rank percentile" do
+          values = (1..100).map(&:to_f)
+          expect(described_class.percentile(values, 50)).to eq 50.0
+          expect(described_class.percentile(values, 95)).to eq 95.0
+          expect(described_class.percentile(values, 99)).to eq 99.0
+        end
+
+        it "returns the only value when there is one" do
+          expect(described_class.percentile([0.5], 99)).to eq 0.5
+        end
+
+        it "returns nil when there are no values" do
+          expect(described_class.percentile([], 50)).to be nil
+        end
+      end
+
+      describe ".summarize" do
+        it "returns the count, mean and percentiles in milliseconds" do
+          summary = described_class.summarize([0.3, 0.1, 0.2, 0.4])
+          expect(summary).to eq(count: 4, mean: 250.0, min: 100.0, p50: 200.0, p95: 400.0, p99: 400.0, max: 400.0)
+        end
+
+        it "returns just the count when there are no values" do
+          expect(described_class.summarize([])).to eq(count: 0)
+        end
+      end
+    end
+
+  end
+end
@@ -0,0 +1,36 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe Postal::HTTP::ConnectionPool do
+  subject(:pool) { described_class.new(idle_timeout: 30, max_idle_per_host: 2) }
+
+  let(:uri) { URI.parse("https://example.com/webhook") }
+  let(:request) { Net::HTTP::Post.new(uri) }
+  let(:response) { instance_double(Net::HTTPOK) }
+  let(:http) { instance_double(Net::HTTP, started?: true, finish: nil) }
+
+  before do
+    allow(pool).to receive(:connect).and_return(http)
+  end
+
+  describe "#request" do
+    it "reuses connections for requests to the same host" do
+      allow(http).to receive(:request).and_return(response)
+      2.times { expect(pool.request(uri, request)).to be response }
+      expect(pool).to have_received(:connect).once
+      expect(pool.idle_count).to eq 1
+    end
+
+    it "does not send the request again if it fails on a reused connection" do
+      allow(http).to receive(:request).and_return(response)
+      pool.request(uri, request)
+
+      allow(http).to receive(:request).and_raise(Errno::ECONNRESET)
+      expect { pool.request(uri, request) }.to raise_error(Errno::ECONNRESET)
+      expect(http).to have_received(:request).twice
+      expect(http).to have_received(:finish)
+      expect(pool.idle_count).to eq 0
+    end
+  end
+end
@@ -3,7 +3,9 @@
 require "rails_helper"
 
 describe Postal::MessageDB::ConnectionPool do
-  subject(:pool) { described_class.new }
+  subject(:pool) { described_class.new(**options) }
+
+  let(:options) { {} }
 
   describe "#use" do
     it "yields a connection" do
@@ -52,5 +54,106 @@ describe Postal::MessageDB::ConnectionPool do
       end.to raise_error Mysql2::Error
       expect(clients_seen.uniq.size).to eq 2
     end
+
+    it "does not retry the block if retrying connection errors is disabled" do
+      calls = 0
+      expect do
+        pool.use(retry_connection_errors: false) do
+          calls += 1
+          raise Mysql2::Error, "lost connection to server"
+        end
+      end.to raise_error Mysql2::Error
+      expect(calls).to eq 1
+    end
+
+    it "uses the same connection for nested calls on the same thread" do
+      pool.use do |outer|
+        pool.use do |inner|
+          expect(inner).to be outer
+        end
+      end
+      expect(pool.size).to eq 1
+    end
+
+    context "when all connections are in use" do
+      let(:options) { { max_size: 1, checkout_timeout: 0.2 } }
+
+      it "raises an error if no connection is checked in within the checkout timeout" do
+        pool.use do
+          thread = Thread.new { pool.use { nil } }
+          expect { thread.join }.to raise_error described_class::CheckoutTimeoutError
+        end
+        expect(pool.size).to eq 1
+      end
+
+      it "waits for a connection to be checked in" do
+        checked_out = Queue.new
+        release = Queue.new
+        thread = Thread.new do
+          pool.use do
+            checked_out << true
+            release.pop
+          end
+        end
+        checked_out.pop
+        waiter = Thread.new { pool.use { |connection| connection } }
+        sleep 0.05
+        release << true
+        thread.join
+        expect(waiter.value).to be_a Mysql2::Client
+        expect(pool.size).to eq 1
+      end
+    end
+
+    context "when a connection is older than the maximum age" do
+      let(:options) { { max_age: 0 } }
+
+      it "closes the connection rather than checking it in" do
+        pool.use { nil }
+        expect(pool.connections).to eq []
+        expect(pool.size).to eq 0
+      end
+    end
+
+    context "when an idle connection fails validation" do
+      let(:options) { { validation_interval: 0 } }
+
+      it "replaces it with a new connection" do
+        first = nil
+        pool.use { |c| first = c }
+        allow(first).to receive(:ping).and_return(false)
+        pool.use do |c|
+          expect(c).not_to be first
+        end
+        expect(pool.size).to eq 1
+      end
+    end
+  end
+
+  describe "#reap" do
+    let(:options) { { idle_timeout: 0 } }
+
+    it "closes idle connections which have been idle for longer than the idle timeout" do
+      pool.use { nil }
+      sleep 0.01
+      expect(pool.reap).to eq 1
+      expect(pool.connections).to eq []
+      expect(pool.size).to eq 0
+    end
+  end
+
+  describe "#max_size=" do
+    let(:options) { { max_size: 1, checkout_timeout: 1 } }
+
+    it "allows a thread waiting for a connection to open a new one" do
+      pool.use do
+        waiter = Thread.new { pool.use { |connection| connection } }
+        sleep 0.05
+        pool.max_size = 2
+        expect(waiter.value).to be_a Mysql2::Client
+      end
+      expect(pool.max_size).to eq 2
+      expect(pool.size).to eq 2
+    end
   end
 end
@@ -14,5 +14,262 @@ describe Postal::MessageDB::Database do
     it "should return the current schema version" do
       expect(database.schema_version).to be_a Integer
     end
+
+    describe "#insert_raw_message" do
+      let(:raw_message) { "Subject: Test\r\nFrom: test@example.com\r\n\r\n#{'Hello world! ' * 500}" }
+
+      it "stores the headers and body uncompressed by default" do
+        table_name, headers_id, body_id, stored_size = database.insert_raw_message(raw_message)
+        expect(database.select(table_name, where: { id: headers_id }).first["compression"]).to be nil
+        expect(database.raw_data(table_name, headers_id)).to eq "Subject: Test\r\nFrom: test@example.com"
+        expect(database.raw_data(table_name, body_id)).to eq "Hello world! " * 500
+        expect(stored_size).to eq raw_message.bytesize - 4
+      end
+
+      it "stores the body compressed when requested" do
+        table_name, headers_id, body_id, stored_size = database.insert_raw_message(raw_message, compress: true)
+        expect(database.select(table_name, where: { id: body_id }).first["compression"]).to eq "zlib"
+        expect(database.raw_data(table_name, headers_id)).to eq "Subject: Test\r\nFrom: test@example.com"
+        expect(database.raw_data(table_name, body_id)).to eq "Hello world! " * 500
+        expect(stored_size).to be < raw_message.bytesize / 10
+      end
+
+      context "when deduplication is enabled" do
+        before do
+          allow(Postal::Config.message_db).to receive(:deduplicate_raw_messages?).and_return(true)
+          allow(Postal::Config.message_db).to receive(:deduplicate_raw_messages_min_size).and_return(1024)
+        end
+
+        it "stores identical bodies once" do
+          table_name, headers_id1, body_id1, = database.insert_raw_message(raw_message)
+          _, headers_id2, body_id2, stored_size = database.insert_raw_message(raw_message.sub("Test", "Other"))
+          expect(body_id2).to eq body_id1
+          expect(headers_id2).to_not eq headers_id1
+          expect(stored_size).to eq "Subject: Other\r\nFrom: test@example.com".bytesize
+          expect(database.raw_data(table_name, headers_id2)).to eq "Subject: Other\r\nFrom: test@example.com"
+        end
+
+        it "does not deduplicate bodies smaller than the minimum size" do
+          _, _, body_id1, = database.insert_raw_message("Subject: Test\r\n\r\nHello")
+          _, _, body_id2, = database.insert_raw_message("Subject: Test\r\n\r\nHello")
+          expect(body_id2).to_not eq body_id1
+        end
+      end
+    end
+
+    describe "#insert_raw_messages" do
+      let(:raw_messages) do
+        Array.new(3) { |i| "Subject: Test #{i}\r\nFrom: test@example.com\r\n\r\nHello world #{i}! #{'a' * 2000}" }
+      end
+
+      before { database.ensure_raw_table }
+
+      it "stores the headers and body of each message" do
+        results = database.insert_raw_messages(raw_messages)
+        expect(results.size).to eq 3
+        results.each_with_index do |(table_name, headers_id, body_id, stored_size), i|
+          expect(database.raw_data(table_name, headers_id)).to eq "Subject: Test #{i}\r\nFrom: test@example.com"
+          expect(database.raw_data(table_name, body_id)).to eq "Hello world #{i}! #{'a' * 2000}"
+          expect(stored_size).to eq raw_messages[i].bytesize - 4
+        end
+      end
+
+      it "stores the bodies compressed when requested" do
+        results = database.insert_raw_messages(raw_messages, compress: true)
+        table_name, _, body_id, stored_size = results.first
+        expect(database.select(table_name, where: { id: body_id }).first["compression"]).to eq "zlib"
+        expect(database.raw_data(table_name, body_id)).to eq "Hello world 0! #{'a' * 2000}"
+        expect(stored_size).to be < raw_messages.first.bytesize / 2
+      end
+
+      context "when deduplication is enabled" do
+        before do
+          allow(Postal::Config.message_db).to receive(:deduplicate_raw_messages?).and_return(true)
+          allow(Postal::Config.message_db).to receive(:deduplicate_raw_messages_min_size).and_return(1024)
+        end
+
+        it "stores identical bodies in the batch once" do
+          raw_messages = Array.new(3) { |i| "Subject: Test #{i}\r\n\r\n#{'a' * 2000}" }
+          results = database.insert_raw_messages(raw_messages)
+          expect(results.map { |r| r[2] }.uniq.size).to eq 1
+          expect(results.map { |r| r[1] }.uniq.size).to eq 3
+          expect(results.map(&:last)).to eq ["Subject: Test 0".bytesize + 2000, "Subject: Test 1".bytesize, "Subject: Test 2".bytesize]
+        end
+
+        it "reuses bodies which have already been stored" do
+          _, _, body_id, = database.insert_raw_message("Subject: Test\r\n\r\n#{'a' * 2000}")
+          results = database.insert_raw_messages(["Subject: Other\r\n\r\n#{'a' * 2000}"])
+          expect(results.first[2]).to eq body_id
+          expect(results.first[3]).to eq "Subject: Other".bytesize
+        end
+      end
+    end
+
+    describe "#select_with_cursor" do
+      before do
+        # Two of the messages have the same timestamp so the ID is needed to order them
+        [100, 200, 200, 300, 400].each_with_index do |timestamp, i|
+          database.insert(:messages, { scope: "outgoing", rcpt_to: "test#{i}@example.com", timestamp: timestamp })
+        end
+      end
+
+      let(:options) { { order: :timestamp, direction: "desc", per_page: 2 } }
+
+      it "returns the first page and a cursor for the next page" do
+        result = database.select_with_cursor(:messages, options)
+        expect(result[:records].map { |r| r["rcpt_to"] }).to eq ["test4@example.com", "test3@example.com"]
+        expect(result[:total]).to eq 5
+        expect(result[:total_capped]).to be false
+        expect(result[:next_cursor]).to be_a String
+        expect(result[:previous_cursor]).to be nil
+      end
+
+      it "returns each page in turn using the cursors" do
+        pages = []
+        cursor = nil
+        loop do
+          result = database.select_with_cursor(:messages, options.merge(cursor: cursor))
+          pages << result[:records].map { |r| r["rcpt_to"] }
+          break unless cursor = result[:next_cursor]
+        end
+        expect(pages).to eq [["test4@example.com", "test3@example.com"],
+                             ["test2@example.com", "test1@example.com"],
+                             ["test0@example.com"]]
+      end
+
+      it "returns the previous page using the previous cursor" do
+        second_page = database.select_with_cursor(:messages, options.merge(cursor: database.select_with_cursor(:messages, options)[:next_cursor]))
+        third_page = database.select_with_cursor(:messages, options.merge(cursor: second_page[:next_cursor]))
+        result = database.select_with_cursor(:messages, options.merge(cursor: third_page[:previous_cursor]))
+        expect(result[:records].map { |r| r["rcpt_to"] }).to eq ["test2@example.com", "test1@example.com"]
+        expect(result[:previous_cursor]).to be_a String
+        expect(result[:next_cursor]).to be_a String
+      end
+
+      it "returns the first page if the cursor is not valid" do
+        result = database.select_with_cursor(:messages, options.merge(cursor: "invalid"))
+        expect(result[:records].map { |r| r["rcpt_to"] }).to eq ["test4@example.com", "test3@example.com"]
+      end
+
+      it "caps the total at the count limit" do
+        result = database.select_with_cursor(:messages, options.merge(count_limit: 3))
+        expect(result[:total]).to eq 3
+        expect(result[:total_capped]).to be true
+      end
+    end
+
+    describe "#select" do
+      before do
+        database.insert(:messages, { rcpt_to: "rachel@example.com", subject: "Your invoice for March", tag: "billing_2024" })
+        database.insert(:messages, { rcpt_to: "rachel@example.org", subject: "Password reset", tag: "billing-2024" })
+        database.insert(:messages, { rcpt_to: "tom@example.com", subject: "Your weekly invoice", tag: "welcome" })
+      end
+
+      def rcpt_tos(where)
+        database.select(:messages, where: where).map { |m| m["rcpt_to"] }
+      end
+
+      it "finds exact matches with a search condition without a wildcard" do
+        expect(rcpt_tos(rcpt_to: { search: "rachel@example.com" })).to eq ["rachel@example.com"]
+      end
+
+      it "finds values starting with the term with a search condition ending with a wildcard" do
+        expect(rcpt_tos(rcpt_to: { search: "rachel@%" })).to eq ["rachel@example.com", "rachel@example.org"]
+      end
+
+      it "does not treat other characters as wildcards when searching for values starting with the term" do
+        expect(rcpt_tos(tag: { search: "billing_%" })).to eq ["rachel@example.com"]
+      end
+
+      it "finds values containing the term with a search condition with other wildcards" do
+        expect(rcpt_tos(rcpt_to: { search: "%@example.com" })).to eq ["rachel@example.com", "tom@example.com"]
+      end
+
+      it "finds values containing all the words with a contains words condition" do
+        expect(rcpt_tos(subject: { contains_words: "invoice" })).to match_array ["rachel@example.com", "tom@example.com"]
+        expect(rcpt_tos(subject: { contains_words: "your invoice march" })).to eq ["rachel@example.com"]
+      end
+
+      context "when the subject search index is enabled" do
+        before do
+          database.provisioner.add_subject_search_index
+          allow(Postal::Config.message_db).to receive(:subject_search_index?).and_return(true)
+        end
+
+        it "finds values containing all the words using the full-text index" do
+          expect(rcpt_tos(subject: { contains_words: "invoice" })).to match_array ["rachel@example.com", "tom@example.com"]
+          expect(rcpt_tos(subject: { contains_words: "your invoice march" })).to eq ["rachel@example.com"]
+        end
+      end
+    end
+
+    describe "#insert_multi_with_ids" do
+      it "returns the IDs of the new rows in the order they were given" do
+        database.insert(:messages, { token: "older", rcpt_to: "older@example.com" })
+        ids = database.insert_multi_with_ids(:messages, [:token, :rcpt_to], [["aaa", "a@example.com"], ["bbb", "b@example.com"]], key: :token)
+        expect(ids.map { |id| database.select(:messages, where: { id: id }).first["rcpt_to"] }).to eq ["a@example.com", "b@example.com"]
+      end
+
+      it "ignores older rows with the same key" do
+        older_id = database.insert(:messages, { token: "aaa" })
+        ids = database.insert_multi_with_ids(:messages, [:token], [["aaa"]], key: :token)
+        expect(ids.first).to be > older_id
+      end
+
+      it "raises an error if the key is not unique for each row" do
+        expect do
+          database.insert_multi_with_ids(:messages, [:token], [["aaa"], ["aaa"]], key: :token)
+        end.to raise_error ArgumentError
+      end
+    end
+
+    describe "#transaction" do
+      it "rolls back any changes if an error is raised" do
+        expect do
+          database.transaction do
+            database.insert(:links, { message_id: 1, url: "https://example.com", token: "abc", timestamp: Time.now.to_f })
+            raise ArgumentError
+          end
+        end.to raise_error(ArgumentError)
+        expect(database.select(:links, count: true)).to eq 0
+      end
+
+      it "does not retry the block if the connection fails" do
+        calls = 0
+        expect do
+          database.transaction do
+            calls += 1
+            raise Mysql2::Error, "lost connection to server"
+          end
+        end.to raise_error(Mysql2::Error)
+        expect(calls).to eq 1
+      end
+    end
+
+    describe "#update_raw_data" do
+      it "replaces compressed data with uncompressed data" do
+        table_name, _, body_id = database.insert_raw_message("Subject: Test\r\n\r\n#{'a' * 1000}", compress: true)
+        database.update_raw_data(table_name, body_id, "b" * 1000)
+        expect(database.select(table_name, where: { id: body_id }).first["compression"]).to be nil
+        expect(database.raw_data(table_name, body_id)).to eq "b" * 1000
+      end
+
+      it "replaces uncompressed data with compressed data" do
+        table_name, _, body_id = database.insert_raw_message("Subject: Test\r\n\r\n#{'a' * 1000}")
+        database.update_raw_data(table_name, body_id, "b" * 1000, compress: true)
+        expect(database.select(table_name, where: { id: body_id }).first["compression"]).to eq "zlib"
+        expect(database.raw_data(table_name, body_id)).to eq "b" * 1000
+      end
+
+      it "does not change bodies which may be shared with other messages" do
+        allow(Postal::Config.message_db).to receive(:deduplicate_raw_messages?).and_return(true)
+        allow(Postal::Config.message_db).to receive(:deduplicate_raw_messages_min_size).and_return(0)
+        table_name, _, body_id = database.insert_raw_message("Subject: Test\r\n\r\n#{'a' * 1000}")
+        new_body_id = database.update_raw_data(table_name, body_id, "b" * 1000)
+        expect(new_body_id).to_not eq body_id
+        expect(database.raw_data(table_name, body_id)).to eq "a" * 1000
+        expect(database.raw_data(table_name, new_body_id)).to eq "b" * 1000
+      end
+    end
   end
 end
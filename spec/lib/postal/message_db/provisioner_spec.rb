@@ -0,0 +1,53 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+describe Postal::MessageDB::Provisioner do
+  let(:server) { create(:server) }
+  let(:provisioner) { server.message_db.provisioner }
+
+  def create_message(age)
+    message = create_plain_text_message(server, "Hello world!")
+    message.update(timestamp: age.ago.to_f)
+    message
+  end
+
+  describe "#remove_messages_in_chunks" do
+    it "removes messages older than the given age no more than chunk_size at a time" do
+      old_messages = 5.times.map { create_message(40.days) }
+      new_message = create_message(1.day)
+
+      chunks = []
+      provisioner.remove_messages_in_chunks(30, chunk_size: 2) { |last_id, _rows| chunks << last_id }
+
+      expect(chunks).to eq [old_messages[1].id, old_messages[3].id, old_messages[4].id]
+      expect(server.message_db.select(:messages, fields: [:id]).map { |m| m["id"] }).to eq [new_message.id]
+    end
+
+    it "starts after the given ID" do
+      old_messages = 3.times.map { create_message(40.days) }
+      provisioner.remove_messages_in_chunks(30, chunk_size: 2, after_id: old_messages[0].id)
+      expect(server.message_db.select(:messages, fields: [:id]).map { |m| m["id"] }).to eq [old_messages[0].id]
+    end
+
+    it "returns zero when there are no messages to remove" do
+      create_message(1.day)
+      expect(provisioner.remove_messages_in_chunks(30, chunk_size: 2)).to eq 0
+    end
+
+    it "sleeps between chunks to stay within the rows per second limit" do
+      2.times { create_message(40.days) }
+      expect(provisioner).to receive(:sleep).with(a_value > 0)
+      provisioner.remove_messages_in_chunks(30, chunk_size: 2, rows_per_second: 1)
+    end
+  end
+
+  describe "#add_subject_search_index" do
+    it "adds the full-text index to the messages table once" do
+      expect(provisioner.add_subject_search_index).to be true
+      expect(provisioner.add_subject_search_index).to be false
+      indexes = server.message_db.query("SHOW INDEX FROM `#{server.message_db.database_name}`.`messages` WHERE Key_name = 'on_subject'")
+      expect(indexes.first["Index_type"]).to eq "FULLTEXT"
+    end
+  end
+end
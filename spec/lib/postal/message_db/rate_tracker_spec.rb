@@ -0,0 +1,86 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+describe Postal::MessageDB::RateTracker do
+  let(:server) { create(:server) }
+  let(:database) { server.message_db }
+
+  subject(:tracker) { described_class.new(database, refresh_interval: 60) }
+
+  describe "#total" do
+    it "loads the current live stats from the database" do
+      3.times { database.live_stats.increment("outgoing") }
+      database.live_stats.increment("incoming")
+      expect(tracker.total(60, types: [:outgoing])).to eq 3
+      expect(tracker.total(60, types: [:incoming, :outgoing])).to eq 4
+    end
+
+    it "includes local increments without querying the database again" do
+      tracker.total(60, types: [:outgoing])
+      expect(database).to_not receive(:select)
+      2.times { tracker.increment("outgoing") }
+      expect(tracker.total(60, types: [:outgoing])).to eq 2
+    end
+
+    it "does not include increments outside the requested window" do
+      tracker.total(60, types: [:outgoing])
+      tracker.increment("outgoing", 30.minutes.ago)
+      tracker.increment("outgoing")
+      expect(tracker.total(10, types: [:outgoing])).to eq 1
+      expect(tracker.total(60, types: [:outgoing])).to eq 2
+    end
+
+    it "reloads from the database once the refresh interval has passed" do
+      tracker.total(60, types: [:outgoing])
+      database.live_stats.increment("outgoing")
+      expect(tracker.total(60, types: [:outgoing])).to eq 0
+      allow(tracker).to receive(:now).and_return(Process.clock_gettime(Process::CLOCK_MONOTONIC) + 61)
+      expect(tracker.total(60, types: [:outgoing])).to eq 1
+    end
+
+    it "keeps local increments which haven't been written to the database when reloading" do
+      tracker.increment("outgoing")
+      tracker.refresh
+      expect(tracker.total(60, types: [:outgoing])).to eq 1
+    end
+
+    it "does not count local increments twice once they have been written to the database" do
+      time = Time.now.utc
+      tracker.increment("outgoing", time)
+      database.live_stats.increment_many([["outgoing", time.min, time.to_f, 1]])
+      tracker.written([["outgoing", time.min, time.to_f, 1]])
+      tracker.refresh
+      expect(tracker.total(60, types: [:outgoing])).to eq 1
+    end
+  end
+
+  context "when rate tracking is enabled" do
+    before do
+      allow(described_class).to receive(:for).and_return(tracker)
+    end
+
+    it "is used for live stats totals" do
+      tracker.increment("outgoing")
+      allow(tracker).to receive(:refresh)
+      expect(database.live_stats.total(60, types: [:outgoing])).to eq 1
+    end
+
+    it "is incremented when live stats are incremented" do
+      tracker.total(60, types: [:outgoing])
+      database.live_stats.increment("outgoing")
+      expect(tracker.total(60, types: [:outgoing])).to eq 1
+    end
+
+    it "does not lose increments waiting in the statistics aggregator when reloading" do
+      aggregator = Postal::MessageDB::StatisticsAggregator.new(flush_interval: 60, flush_threshold: 100)
+      allow(Postal::MessageDB::Database).to receive(:statistics_aggregator).and_return(aggregator)
+      database.live_stats.increment("outgoing")
+      tracker.refresh
+      expect(tracker.total(60, types: [:outgoing])).to eq 1
+      aggregator.flush
+      tracker.refresh
+      expect(tracker.total(60, types: [:outgoing])).to eq 1
+    end
+  end
+end
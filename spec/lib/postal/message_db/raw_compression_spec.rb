@@ -0,0 +1,37 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+describe Postal::MessageDB::RawCompression do
+  describe ".compress" do
+    it "compresses data which gets smaller" do
+      data, compression = described_class.compress("Hello world! " * 100)
+      expect(compression).to eq "zlib"
+      expect(data.bytesize).to be < 100
+    end
+
+    it "does not compress data which would not get smaller" do
+      expect(described_class.compress("Hi")).to eq ["Hi", nil]
+    end
+
+    it "does not compress nil or empty data" do
+      expect(described_class.compress(nil)).to eq [nil, nil]
+      expect(described_class.compress("")).to eq ["", nil]
+    end
+  end
+
+  describe ".decompress" do
+    it "returns uncompressed data as-is" do
+      expect(described_class.decompress("Hello", nil)).to eq "Hello"
+    end
+
+    it "decompresses zlib data" do
+      data, compression = described_class.compress("Hello world! " * 100)
+      expect(described_class.decompress(data, compression)).to eq "Hello world! " * 100
+    end
+
+    it "raises an error for unknown compression" do
+      expect { described_class.decompress("Hello", "lz4") }.to raise_error(Postal::Error, /unknown raw message compression/i)
+    end
+  end
+end
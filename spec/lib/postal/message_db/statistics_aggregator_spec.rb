@@ -0,0 +1,86 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+describe Postal::MessageDB::StatisticsAggregator do
+  let(:server) { create(:server) }
+  let(:database) { server.message_db }
+
+  subject(:aggregator) { described_class.new(flush_interval: 60, flush_threshold: 1000) }
+
+  after { aggregator.stop }
+
+  describe "#increment_statistics" do
+    it "does not write to the database until flushed" do
+      aggregator.increment_statistics(database, Time.now, :outgoing)
+      expect(aggregator.pending).to eq 1
+      expect(database.statistics.get(:daily, [:outgoing], Time.now, 1).first.last[:outgoing]).to eq 0
+    end
+
+    it "writes all increments to every statistics table when flushed" do
+      3.times { aggregator.increment_statistics(database, Time.now, :outgoing) }
+      aggregator.increment_statistics(database, Time.now, :bounces)
+      expect(aggregator.flush).to eq 4
+      expect(aggregator.pending).to eq 0
+
+      [:hourly, :daily, :monthly, :yearly].each do |type|
+        stats = database.statistics.get(type, [:outgoing, :bounces], Time.now, 1).first.last
+        expect(stats).to eq(outgoing: 3, bounces: 1)
+      end
+    end
+
+    it "adds to existing statistics" do
+      database.statistics.increment_one(:daily, :incoming)
+      aggregator.increment_statistics(database, Time.now, :incoming)
+      aggregator.flush
+      expect(database.statistics.get(:daily, [:incoming], Time.now, 1).first.last[:incoming]).to eq 2
+    end
+  end
+
+  describe "#increment_live_stats" do
+    it "writes all increments when flushed" do
+      2.times { aggregator.increment_live_stats(database, "outgoing") }
+      aggregator.increment_live_stats(database, "incoming")
+      aggregator.flush
+      expect(database.live_stats.total(5, types: [:outgoing])).to eq 2
+      expect(database.live_stats.total(5, types: [:incoming])).to eq 1
+    end
+  end
+
+  describe "#flush" do
+    it "keeps increments which could not be written" do
+      allow(database.statistics).to receive(:increment_many).and_raise(Mysql2::Error, "failed")
+      aggregator.increment_statistics(database, Time.now, :outgoing)
+      aggregator.flush
+      expect(aggregator.pending).to be_positive
+    end
+
+    it "counts each increment which could not be written once" do
+      allow(database.statistics).to receive(:increment_many).and_raise(Mysql2::Error, "failed")
+      allow(database.live_stats).to receive(:increment_many).and_raise(Mysql2::Error, "failed")
+      2.times { aggregator.increment_statistics(database, Time.now, :outgoing) }
+      aggregator.increment_statistics(database, Time.now, :incoming)
+      aggregator.increment_live_stats(database, "outgoing")
+      aggregator.flush
+      expect(aggregator.pending).to eq 4
+      aggregator.flush
+      expect(aggregator.pending).to eq 4
+    end
+  end
+
+  context "when write behind is enabled" do
+    before do
+      allow(Postal::MessageDB::Database).to receive(:statistics_aggregator).and_return(aggregator)
+    end
+
+    it "sends statistics increments to the aggregator" do
+      database.statistics.increment_all(Time.now, "outgoing")
+      expect(aggregator.pending).to eq 1
+    end
+
+    it "sends live stats increments to the aggregator" do
+      database.live_stats.increment("outgoing")
+      expect(aggregator.pending).to eq 1
+    end
+  end
+end
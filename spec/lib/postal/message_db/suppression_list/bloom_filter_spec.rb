@@ -0,0 +1,19 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+describe Postal::MessageDB::SuppressionList::BloomFilter do
+  subject(:filter) { described_class.new(capacity: 1000) }
+
+  it "includes every key which has been added" do
+    keys = Array.new(1000) { |i| "recipient:user#{i}@example.com" }
+    keys.each { |key| filter.add(key) }
+    expect(keys).to all(satisfy { |key| filter.include?(key) })
+  end
+
+  it "rarely includes keys which have not been added" do
+    1000.times { |i| filter.add("recipient:user#{i}@example.com") }
+    false_positives = Array.new(1000) { |i| "recipient:other#{i}@example.com" }.count { |key| filter.include?(key) }
+    expect(false_positives).to be < 50
+  end
+end
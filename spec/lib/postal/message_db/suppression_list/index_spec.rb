@@ -0,0 +1,61 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+describe Postal::MessageDB::SuppressionList::Index do
+  let(:server) { create(:server) }
+  let(:database) { server.message_db }
+
+  subject(:index) { described_class.new(database, refresh_interval: 60, cache_size: 2) }
+
+  def insert(address)
+    database.insert(:suppressions, type: "recipient", address: address, keep_until: 1.day.from_now.to_f,
+                                   lookup_hash: Postal::MessageDB::SuppressionList.lookup_hash(:recipient, address))
+  end
+
+  describe "#include?" do
+    it "returns true for addresses in the database" do
+      insert("test@example.com")
+      expect(index.include?(:recipient, "test@example.com")).to be true
+      expect(index.include?(:recipient, "TEST@example.com")).to be true
+    end
+
+    it "returns false for addresses which are not in the database" do
+      insert("test@example.com")
+      expect(index.include?(:recipient, "other@example.com")).to be false
+    end
+
+    it "picks up addresses added by other processes once the refresh interval has passed" do
+      index.include?(:recipient, "test@example.com")
+      insert("test@example.com")
+      expect(index.include?(:recipient, "test@example.com")).to be false
+      allow(index).to receive(:now).and_return(Process.clock_gettime(Process::CLOCK_MONOTONIC) + 61)
+      expect(index.include?(:recipient, "test@example.com")).to be true
+    end
+
+    it "rebuilds the filter when addresses have been removed by other processes" do
+      insert("test@example.com")
+      index.include?(:recipient, "test@example.com")
+      database.delete(:suppressions, where: { address: "test@example.com" })
+      index.refresh
+      expect(index.include?(:recipient, "test@example.com")).to be false
+    end
+  end
+
+  describe "#cache" do
+    it "keeps the most recently used entries" do
+      index.cache(:recipient, "a@example.com", { "keep_until" => 1.day.from_now.to_f })
+      index.cache(:recipient, "b@example.com", { "keep_until" => 1.day.from_now.to_f })
+      index.cached(:recipient, "a@example.com")
+      index.cache(:recipient, "c@example.com", { "keep_until" => 1.day.from_now.to_f })
+      expect(index.cached(:recipient, "a@example.com")).to be_present
+      expect(index.cached(:recipient, "b@example.com")).to be nil
+      expect(index.cached(:recipient, "c@example.com")).to be_present
+    end
+
+    it "does not return entries which have expired" do
+      index.cache(:recipient, "a@example.com", { "keep_until" => 1.minute.ago.to_f })
+      expect(index.cached(:recipient, "a@example.com")).to be nil
+    end
+  end
+end
@@ -0,0 +1,86 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+describe Postal::MessageDB::SuppressionList do
+  let(:server) { create(:server) }
+  let(:database) { server.message_db }
+
+  subject(:list) { database.suppression_list }
+
+  before { Postal::MessageDB::SuppressionList::Index.reset }
+
+  describe "#add" do
+    it "adds the address to the list" do
+      list.add(:recipient, "test@example.com", reason: "testing")
+      expect(list.get(:recipient, "test@example.com")).to include("reason" => "testing")
+    end
+
+    it "updates an existing entry rather than adding another" do
+      list.add(:recipient, "test@example.com", reason: "testing", days: 1)
+      list.add(:recipient, "test@example.com", days: 10)
+      expect(database.select(:suppressions, count: true)).to eq 1
+      entry = list.get(:recipient, "test@example.com")
+      expect(entry["reason"]).to eq "testing"
+      expect(entry["keep_until"].to_f).to be > 9.days.from_now.to_f
+    end
+  end
+
+  describe "#get" do
+    it "returns nil for addresses which are not on the list" do
+      expect(list.get(:recipient, "test@example.com")).to be nil
+    end
+
+    it "returns nil for entries which have expired" do
+      list.add(:recipient, "test@example.com", days: -1)
+      expect(list.get(:recipient, "test@example.com")).to be nil
+    end
+  end
+
+  describe "#remove" do
+    it "removes the address from the list" do
+      list.add(:recipient, "test@example.com")
+      expect(list.remove(:recipient, "test@example.com")).to be true
+      expect(list.get(:recipient, "test@example.com")).to be nil
+    end
+
+    it "returns false if the address was not on the list" do
+      expect(list.remove(:recipient, "test@example.com")).to be false
+    end
+  end
+
+  context "when the suppression list index is enabled" do
+    before do
+      allow(Postal::Config.message_db).to receive(:suppression_list_index?).and_return(true)
+    end
+
+    it "does not query the database for addresses which are not on the list" do
+      list.add(:recipient, "suppressed@example.com")
+      list.get(:recipient, "other@example.com")
+      expect(database).to_not receive(:select)
+      expect(database).to_not receive(:delete)
+      expect(list.get(:recipient, "test@example.com")).to be nil
+      expect(list.remove(:recipient, "test@example.com")).to be false
+    end
+
+    it "returns addresses which have been added" do
+      list.get(:recipient, "test@example.com")
+      list.add(:recipient, "test@example.com", reason: "testing")
+      expect(list.get(:recipient, "test@example.com")).to include("reason" => "testing")
+    end
+
+    it "caches entries which have been found" do
+      list.add(:recipient, "test@example.com", reason: "testing")
+      list.get(:recipient, "test@example.com")
+      expect(database).to_not receive(:select)
+      expect(list.get(:recipient, "test@example.com")).to include("reason" => "testing")
+    end
+
+    it "does not return addresses which have been removed" do
+      list.add(:recipient, "test@example.com")
+      list.get(:recipient, "test@example.com")
+      list.remove(:recipient, "test@example.com")
+      expect(list.get(:recipient, "test@example.com")).to be nil
+    end
+  end
+end
@@ -0,0 +1,44 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe Postal::MessageInspection::Cache do
+  subject(:cache) { described_class.new(ttl: 300, max_size: 2) }
+
+  let(:inspection) { Postal::MessageInspection.new(nil, :incoming) }
+
+  describe "#get" do
+    it "returns nil when the key is not cached" do
+      expect(cache.get(["abc", :incoming])).to be nil
+    end
+
+    it "returns the cached inspection" do
+      cache.set(["abc", :incoming], inspection)
+      expect(cache.get(["abc", :incoming])).to be inspection
+    end
+
+    it "returns nil once the TTL has expired" do
+      cache.set(["abc", :incoming], inspection)
+      allow_any_instance_of(LRUCache).to receive(:now).and_return(Process.clock_gettime(Process::CLOCK_MONOTONIC) + 301)
+      expect(cache.get(["abc", :incoming])).to be nil
+    end
+  end
+
+  describe "#set" do
+    it "evicts the least recently used entry when full" do
+      cache.set(["a"], inspection)
+      cache.set(["b"], inspection)
+      cache.get(["a"])
+      cache.set(["c"], inspection)
+      expect(cache.size).to eq 2
+      expect(cache.get(["a"])).to be inspection
+      expect(cache.get(["b"])).to be nil
+    end
+
+    it "does not cache anything when the TTL is zero" do
+      cache = described_class.new(ttl: 0, max_size: 2)
+      cache.set(["a"], inspection)
+      expect(cache.size).to eq 0
+    end
+  end
+end
@@ -0,0 +1,180 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe Postal::MessageInspection do
+  # A local stand-in for a scanner which records how many times it has been called
+  # and adds a single spam check after an optional delay.
+  let(:stub_scanner) do
+    Class.new(Postal::MessageInspector) do
+      attr_reader :calls
+
+      def initialize(code, score: 1, delay: 0, cacheable: true)
+        super(nil)
+        @code = code
+        @score = score
+        @delay = delay
+        @cacheable = cacheable
+        @calls = 0
+      end
+
+      def inspect_message(inspection)
+        @calls += 1
+        sleep @delay
+        inspection.spam_checks << Postal::SpamCheck.new(@code, @score, "Checked by #{@code}")
+      end
+
+      def cacheable?
+        @cacheable
+      end
+    end
+  end
+
+  let(:raw_message) { "Subject: Hello\r\n\r\nHello world" }
+  let(:message) { double("Message", raw_message: raw_message) }
+  let(:inspectors) { [stub_scanner.new("FIRST", delay: 0.2), stub_scanner.new("SECOND", delay: 0.2)] }
+
+  before do
+    allow(Postal::MessageInspector).to receive(:inspectors).and_return(inspectors)
+    allow(Postal::Config.postal).to receive(:parallel_message_inspection?).and_return(parallel)
+    allow(Postal::Config.postal).to receive(:message_inspection_timeout).and_return(1)
+    allow(Postal::Config.postal).to receive(:cache_message_inspections?).and_return(cache)
+    described_class.instance_variable_set(:@cache, nil)
+  end
+
+  after { described_class.instance_variable_set(:@cache, nil) }
+
+  describe ".scan" do
+    context "when parallel inspection and caching are disabled" do
+      let(:parallel) { false }
+      let(:cache) { false }
+
+      it "runs each inspector in turn" do
+        result = described_class.scan(message, :incoming)
+        expect(result.spam_checks.map(&:code)).to eq %w[FIRST SECOND]
+        expect(result.spam_score).to eq 2
+      end
+    end
+
+    context "when parallel inspection is enabled" do
+      let(:parallel) { true }
+      let(:cache) { false }
+
+      it "runs the inspectors at the same time and keeps their results in order" do
+        started = Process.clock_gettime(Process::CLOCK_MONOTONIC)
+        result = described_class.scan(message, :incoming)
+        expect(Process.clock_gettime(Process::CLOCK_MONOTONIC) - started).to be < 0.35
+        expect(result.spam_checks.map(&:code)).to eq %w[FIRST SECOND]
+      end
+
+      it "records a timeout for inspectors which do not finish before the deadline" do
+        inspectors << stub_scanner.new("SLOW", delay: 2)
+        result = described_class.scan(message, :incoming)
+        expect(result.spam_checks.map(&:code)).to eq %w[FIRST SECOND TIMEOUT]
+        expect(result.incomplete).to be true
+      end
+
+      it "stops inspectors which do not finish before the deadline" do
+        threads = []
+        allow(Thread).to receive(:new).and_wrap_original { |m, &block| m.call(&block).tap { |t| threads << t } }
+        inspectors << stub_scanner.new("SLOW", delay: 2)
+        started = Process.clock_gettime(Process::CLOCK_MONOTONIC)
+        described_class.scan(message, :incoming)
+        expect(threads.last.join(0.5)).to_not be nil
+        expect(Process.clock_gettime(Process::CLOCK_MONOTONIC) - started).to be < 2
+      end
+
+      it "runs each inspector with its own database connection" do
+        expect(ActiveRecord::Base.connection_pool).to receive(:with_connection).twice.and_call_original
+        described_class.scan(message, :incoming)
+      end
+
+      it "records an error for inspectors which raise an error" do
+        broken = stub_scanner.new("BROKEN")
+        allow(broken).to receive(:inspect_message).and_raise(StandardError, "connection refused")
+        inspectors << broken
+        result = described_class.scan(message, :incoming)
+        expect(result.spam_checks.map(&:code)).to eq %w[FIRST SECOND ERROR]
+      end
+    end
+
+    context "when caching is enabled" do
+      let(:parallel) { false }
+      let(:cache) { true }
+
+      before do
+        allow(Postal::Config.postal).to receive(:message_inspection_cache_ttl).and_return(300)
+        allow(Postal::Config.postal).to receive(:message_inspection_cache_size).and_return(10)
+      end
+
+      it "reuses the results for messages with the same content and scope" do
+        described_class.scan(message, :incoming)
+        result = described_class.scan(double("Message", raw_message: raw_message.dup), :incoming)
+        expect(result.spam_checks.map(&:code)).to eq %w[FIRST SECOND]
+        expect(inspectors.map(&:calls)).to eq [1, 1]
+      end
+
+      it "does not reuse results for a different scope" do
+        described_class.scan(message, :incoming)
+        described_class.scan(message, :outgoing)
+        expect(inspectors.map(&:calls)).to eq [2, 2]
+      end
+
+      it "does not reuse results for different content" do
+        described_class.scan(message, :incoming)
+        described_class.scan(double("Message", raw_message: "#{raw_message}!"), :incoming)
+        expect(inspectors.map(&:calls)).to eq [2, 2]
+      end
+
+      it "always runs inspectors which are not cacheable" do
+        inspectors << stub_scanner.new("RECIPIENT", cacheable: false)
+        described_class.scan(message, :incoming)
+        result = described_class.scan(message, :incoming)
+        expect(result.spam_checks.map(&:code)).to eq %w[FIRST SECOND RECIPIENT]
+        expect(inspectors.map(&:calls)).to eq [1, 1, 2]
+      end
+
+      it "does not cache incomplete results" do
+        failing = stub_scanner.new("FAILING")
+        allow(failing).to receive(:inspect_message) { |inspection| inspection.incomplete = true }
+        inspectors << failing
+        described_class.scan(message, :incoming)
+        described_class.scan(message, :incoming)
+        expect(inspectors.first.calls).to eq 2
+      end
+
+      context "with outgoing messages which have had tracking added" do
+        let(:server) { create(:server) }
+        let(:domain) { create(:domain, owner: server) }
+        let(:messages) do
+          prototype = OutgoingMessagePrototype.new(server, "127.0.0.1", "testsuite", {
+            from: "test@#{domain.name}",
+            to: ["one@example.com", "two@example.com"],
+            subject: "Test Message",
+            plain_body: "Hello world! http://github.com/atech/postal"
+          })
+          prototype.create_messages.values.map { |m| server.message_db.message(m[:id]) }
+        end
+
+        before do
+          create(:track_domain, server: server, domain: domain)
+          messages.each(&:parse_content)
+        end
+
+        it "reuses the results for each recipient of the same message" do
+          expect(messages[0].raw_message).to_not eq messages[1].raw_message
+          described_class.scan(messages[0], :outgoing)
+          result = described_class.scan(messages[1], :outgoing)
+          expect(result.spam_checks.map(&:code)).to eq %w[FIRST SECOND]
+          expect(inspectors.map(&:calls)).to eq [1, 1]
+        end
+
+        it "does not reuse the results once the tracked message has been reloaded" do
+          described_class.scan(messages[0], :outgoing)
+          described_class.scan(server.message_db.message(messages[1].id), :outgoing)
+          expect(inspectors.map(&:calls)).to eq [2, 2]
+        end
+      end
+    end
+  end
+end
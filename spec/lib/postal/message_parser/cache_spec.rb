@@ -0,0 +1,39 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe Postal::MessageParser::Cache do
+  subject(:cache) { described_class.new(name: "test", ttl: 300, max_size: 2) }
+
+  describe "#fetch" do
+    it "calls the block and returns the result when the key is not cached" do
+      expect(cache.fetch(["a"]) { "value" }).to eq "value"
+    end
+
+    it "returns the cached value without calling the block again" do
+      cache.fetch(["a"]) { "value" }
+      expect { |b| cache.fetch(["a"], &b) }.to_not yield_control
+    end
+
+    it "caches false values" do
+      cache.fetch(["a"]) { false }
+      expect(cache.fetch(["a"]) { "value" }).to be false
+    end
+
+    it "calls the block again once the TTL has expired" do
+      cache.fetch(["a"]) { "value" }
+      allow_any_instance_of(LRUCache).to receive(:now).and_return(Process.clock_gettime(Process::CLOCK_MONOTONIC) + 301)
+      expect(cache.fetch(["a"]) { "new value" }).to eq "new value"
+    end
+
+    it "evicts the least recently used entry when full" do
+      cache.fetch(["a"]) { "a" }
+      cache.fetch(["b"]) { "b" }
+      cache.fetch(["a"]) { "x" }
+      cache.fetch(["c"]) { "c" }
+      expect(cache.size).to eq 2
+      expect(cache.fetch(["a"]) { "x" }).to eq "a"
+      expect(cache.fetch(["b"]) { "x" }).to eq "x"
+    end
+  end
+end
@@ -22,4 +22,67 @@ describe Postal::MessageParser do
     expect(parser.new_body).to match(/^Hello world! https:\/\/click\.#{message.domain.name}/)
     expect(parser.tracked_links).to eq 1
   end
+
+  it "should create all links in a single query" do
+    message = create_plain_text_message(server, "Hello! http://github.com/atech/postal http://example.org/page", "test@example.com")
+    create(:track_domain, server: server, domain: message.domain)
+    expect(message.database).to receive(:insert_multi).with(:links, anything, satisfy { |rows| rows.size == 2 }).and_call_original
+    expect(message.database).to_not receive(:insert).with(:links, anything)
+    parser = Postal::MessageParser.new(message)
+    expect(parser.tracked_links).to eq 2
+  end
+
+  context "when tracking rewrites are cached" do
+    let(:domain) { create(:domain, owner: server) }
+    let(:messages) do
+      %w[one@example.com two@example.com].map do |to|
+        prototype = OutgoingMessagePrototype.new(server, "127.0.0.1", "testsuite", {
+          from: "test@#{domain.name}",
+          to: to,
+          subject: "Test Message",
+          plain_body: "Hello world! http://github.com/atech/postal"
+        })
+        server.message_db.message(prototype.create_message(to)[:id])
+      end
+    end
+
+    before do
+      allow(Postal::Config.postal).to receive(:cache_tracking_rewrites?).and_return(true)
+      Postal::MessageParser.instance_variable_set(:@track_domain_cache, nil)
+      Postal::MessageParser.instance_variable_set(:@template_cache, nil)
+      create(:track_domain, server: server, domain: domain)
+    end
+
+    after do
+      Postal::MessageParser.instance_variable_set(:@track_domain_cache, nil)
+      Postal::MessageParser.instance_variable_set(:@template_cache, nil)
+    end
+
+    it "reuses the rewrite for messages with the same body but different headers" do
+      first = Postal::MessageParser.new(messages[0])
+      expect(Postal::MessageParser.template_cache.size).to eq 1
+      expect_any_instance_of(Postal::MessageParser).to_not receive(:rewrite)
+      second = Postal::MessageParser.new(messages[1])
+      expect(Postal::MessageParser.template_cache.size).to eq 1
+      expect(second.actioned?).to be true
+      expect(second.tracked_links).to eq 1
+      expect(second.new_headers).to include "To: two@example.com"
+      expect(second.new_body).to match(/^Hello world! https:\/\/click\.#{domain.name}\/#{server.token}\/[A-Za-z0-9]{16}/)
+      expect(second.new_body).to_not eq first.new_body
+    end
+
+    it "creates new links for each message" do
+      messages.each { |message| Postal::MessageParser.new(message) }
+      links = messages.map { |message| message.database.select(:links, where: { message_id: message.id }) }
+      expect(links.map(&:size)).to eq [1, 1]
+      expect(links.flatten.map { |link| link["url"] }).to all eq "http://github.com/atech/postal"
+      expect(links.flatten.map { |link| link["token"] }.uniq.size).to eq 2
+    end
+
+    it "does not look up the track domain for every message" do
+      Postal::MessageParser.new(messages[0])
+      expect(messages[1].server).to_not receive(:track_domains)
+      Postal::MessageParser.new(messages[1])
+    end
+  end
 end
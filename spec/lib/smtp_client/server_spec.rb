@@ -61,6 +61,21 @@ module SMTPClient
           ]
         end
       end
+
+      context "when the hostname is an IP address" do
+        let(:hostname) { "127.0.0.1" }
+
+        before do
+          allow(DNSResolver.local).to receive(:a)
+          allow(DNSResolver.local).to receive(:aaaa)
+        end
+
+        it "returns an endpoint for the address without resolving it" do
+          expect(server.endpoints).to match [have_attributes(ip_address: "127.0.0.1")]
+          expect(DNSResolver.local).to_not have_received(:a)
+          expect(DNSResolver.local).to_not have_received(:aaaa)
+        end
+      end
     end
   end
 
@@ -74,7 +74,7 @@ module SMTPServer
             client.handle("")
             client.handle("This is some content for the message.")
             client.handle("It will keep going.")
-            expect(client.instance_variable_get("@data")).to eq <<~DATA
+            expect(client.instance_variable_get("@data").read).to eq <<~DATA
               Received: from test.example.com (1.2.3.4 [1.2.3.4]) by #{Postal::Config.postal.smtp_hostname} with SMTP; #{Time.now.utc.rfc2822}\r
               Subject: Test\r
               \r
@@ -83,6 +83,18 @@ module SMTPServer
             DATA
           end
         end
+
+        it "writes content to a temporary file once it is larger than the spill threshold" do
+          allow(Postal::Config.smtp_server).to receive(:data_spill_threshold).and_return(1)
+          client.handle("DATA")
+          client.handle("Subject: Test")
+          client.handle("")
+          line = "a" * 100
+          20.times { client.handle(line) }
+          data = client.instance_variable_get("@data")
+          expect(data).to be_spilled
+          expect(data.read).to end_with("#{line}\r\n" * 20)
+        end
       end
     end
   end
@@ -112,6 +112,21 @@ module SMTPServer
             raw_message: kind_of(String)
           )
         end
+
+        it "stores the raw message once for all of the recipients" do
+          client.handle("RCPT TO: other@example.org")
+          client.handle("DATA")
+          client.handle("Subject: Test")
+          client.handle("")
+          client.handle("This is a test message")
+          client.handle("\r")
+          expect_any_instance_of(Postal::MessageDB::Database).to receive(:insert_raw_messages).once.and_call_original
+          expect_any_instance_of(Postal::MessageDB::Database).to_not receive(:insert_raw_message)
+          expect(client.handle(".\r")).to eq "250 OK"
+          messages = QueuedMessage.order(:id).map { |queued_message| server.message(queued_message.message_id) }
+          expect(messages.map(&:rcpt_to)).to eq [rcpt_to, "other@example.org"]
+          expect(messages.map(&:raw_message).uniq.size).to eq 1
+        end
       end
 
       context "when sending a bounce message" do
@@ -0,0 +1,58 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+module SMTPServer
+
+  describe DataSink do
+    subject(:sink) { described_class.new(spill_threshold: 16, limit: 64) }
+
+    after { sink.close }
+
+    it "keeps data in memory until it is larger than the spill threshold" do
+      sink << "Subject: Test\r\n"
+      expect(sink).not_to be_spilled
+      expect(sink.read).to eq "Subject: Test\r\n"
+    end
+
+    it "moves data into a temporary file once it is larger than the spill threshold" do
+      sink << "Subject: Test\r\n"
+      sink << "\r\n"
+      sink << "Hello world\r\n"
+      expect(sink).to be_spilled
+      expect(sink.read).to eq "Subject: Test\r\n\r\nHello world\r\n"
+      expect(sink.bytesize).to eq 30
+    end
+
+    it "can be read more than once" do
+      sink << ("a" * 20)
+      expect(sink.read).to eq "a" * 20
+      sink << "b"
+      expect(sink.read).to eq "#{'a' * 20}b"
+    end
+
+    it "only reads the temporary file once until more data is added" do
+      sink << ("a" * 20)
+      first = sink.read
+      expect(sink.instance_variable_get("@file")).to_not receive(:read)
+      expect(sink.read).to be first
+    end
+
+    it "stops storing data once the limit has been reached but continues counting it" do
+      sink << ("a" * 60)
+      sink << ("b" * 10)
+      sink << ("c" * 10)
+      expect(sink.read).to eq "#{'a' * 60}bbbb"
+      expect(sink.bytesize).to eq 80
+      expect(sink).to be_overflowed
+    end
+
+    it "removes the temporary file when closed" do
+      sink << ("a" * 20)
+      path = sink.instance_variable_get("@file").path
+      sink.close
+      expect(File.exist?(path)).to be false
+    end
+  end
+
+end
@@ -0,0 +1,49 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+module SMTPServer
+
+  describe LineBuffer do
+    subject(:buffer) { described_class.new }
+
+    describe "#shift_line" do
+      it "returns nil when there is no complete line" do
+        buffer << "HELO example"
+        expect(buffer.shift_line).to be nil
+      end
+
+      it "returns each complete line in turn" do
+        buffer << "HELO example.com\r\nMAIL FROM: test@example.com\r\nRCPT"
+        expect(buffer.shift_line).to eq "HELO example.com\r"
+        expect(buffer.shift_line).to eq "MAIL FROM: test@example.com\r"
+        expect(buffer.shift_line).to be nil
+        expect(buffer.bytesize).to eq 4
+      end
+
+      it "returns lines which arrive across several chunks" do
+        buffer << "RCPT TO: "
+        expect(buffer.shift_line).to be nil
+        buffer << "test@example.com"
+        expect(buffer.shift_line).to be nil
+        buffer << "\r\nDATA\r\n"
+        expect(buffer.shift_line).to eq "RCPT TO: test@example.com\r"
+        expect(buffer.shift_line).to eq "DATA\r"
+        expect(buffer.shift_line).to be nil
+        expect(buffer.bytesize).to eq 0
+      end
+
+      it "returns empty lines" do
+        buffer << "\r\n\n"
+        expect(buffer.shift_line).to eq "\r"
+        expect(buffer.shift_line).to eq ""
+      end
+
+      it "returns binary strings" do
+        buffer << "Subject: caf\xC3\xA9\r\n".b
+        expect(buffer.shift_line.encoding).to eq Encoding::BINARY
+      end
+    end
+  end
+
+end
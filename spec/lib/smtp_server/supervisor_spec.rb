@@ -0,0 +1,136 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+module SMTPServer
+
+  RSpec.describe Supervisor do
+    subject(:supervisor) { described_class.new(worker_count: 2, reuse_port: false, shutdown_timeout: 10) }
+
+    let(:listener) { instance_double(TCPServer) }
+    let(:trap_handlers) { {} }
+    let(:pids) { [101, 102, 103, 104] }
+    let(:fork_blocks) { [] }
+    let(:exits) { [] }
+    let(:killed) { [] }
+
+    def exit_status(code)
+      instance_double(Process::Status, exitstatus: code, termsig: nil)
+    end
+
+    before do
+      allow(Prometheus::Client).to receive(:registry).and_return(Prometheus::Client::Registry.new)
+      allow(Server).to receive(:open_listener).and_return(listener)
+      allow(supervisor).to receive(:trap) { |signal, &block| trap_handlers[signal] = block }
+      allow(supervisor).to receive(:sleep)
+      allow(supervisor).to receive(:fork) do |&block|
+        fork_blocks << block
+        pids.shift
+      end
+      allow(Process).to receive(:wait2) { exits.shift }
+      allow(Process).to receive(:kill) do |signal, pid|
+        killed << [signal, pid]
+        # Workers exit once they have been asked to stop
+        exits << [pid, exit_status(0)] if %w[TERM KILL].include?(signal)
+      end
+      allow($stdout).to receive(:puts)
+    end
+
+    # Request a shutdown once the given number of workers have been started
+    def stop_after_workers(count)
+      allow(supervisor).to receive(:fork) do |&block|
+        fork_blocks << block
+        trap_handlers["TERM"].call if fork_blocks.size == count
+        pids.shift
+      end
+    end
+
+    describe "#run" do
+      it "starts the configured number of workers" do
+        stop_after_workers(2)
+        supervisor.run
+        expect(fork_blocks.size).to eq 2
+      end
+
+      it "runs a server in each worker using the shared listener" do
+        # Running the worker sets the labels for its metrics so they must be put back afterwards
+        original_labels = HasPrometheusMetrics.preset_labels
+        stop_after_workers(2)
+        supervisor.run
+
+        server = instance_double(Server, run: nil)
+        allow(HealthServer).to receive(:start)
+        allow(Server).to receive(:new).and_return(server)
+        fork_blocks.first.call
+        expect(Server).to have_received(:new).with(hash_including(listener: listener, reuse_port: false, worker: 1))
+        expect(server).to have_received(:run)
+      ensure
+        HasPrometheusMetrics.preset_labels = original_labels
+      end
+
+      context "when reuse_port is enabled" do
+        subject(:supervisor) { described_class.new(worker_count: 2, reuse_port: true, shutdown_timeout: 10) }
+
+        it "does not open a listener for the workers" do
+          stop_after_workers(2)
+          supervisor.run
+          expect(Server).to_not have_received(:open_listener)
+        end
+      end
+
+      it "restarts workers which exit unexpectedly" do
+        stop_after_workers(3)
+        exits << [101, exit_status(1)]
+        supervisor.run
+        expect(fork_blocks.size).to eq 3
+        expect(supervisor).to have_received(:sleep).with(described_class::RESTART_DELAY)
+      end
+
+      it "passes TERM on to the workers and waits for them to stop" do
+        stop_after_workers(2)
+        supervisor.run
+        expect(killed).to eq [["TERM", 101], ["TERM", 102]]
+      end
+
+      it "passes INT on to the workers as TERM" do
+        allow(supervisor).to receive(:fork) do |&block|
+          fork_blocks << block
+          trap_handlers["INT"].call if fork_blocks.size == 2
+          pids.shift
+        end
+        supervisor.run
+        expect(killed).to eq [["TERM", 101], ["TERM", 102]]
+      end
+
+      context "when workers do not stop within the shutdown timeout" do
+        subject(:supervisor) { described_class.new(worker_count: 2, reuse_port: false, shutdown_timeout: 0) }
+
+        it "kills them" do
+          stop_after_workers(2)
+          allow(Process).to receive(:kill) do |signal, pid|
+            killed << [signal, pid]
+            exits << [pid, exit_status(0)] if signal == "KILL"
+          end
+          supervisor.run
+          expect(killed).to eq [["TERM", 101], ["TERM", 102], ["KILL", 101], ["KILL", 102]]
+        end
+      end
+
+      it "passes the profiler signal on to the workers" do
+        allow(Postal::Config.postal).to receive(:profiler_signal).and_return("USR2")
+        signalled = false
+        allow(Process).to receive(:wait2) do
+          unless signalled
+            signalled = true
+            trap_handlers["USR2"].call
+            trap_handlers["TERM"].call
+          end
+          exits.shift
+        end
+        supervisor.run
+        expect(killed.first(2)).to eq [["USR2", 101], ["USR2", 102]]
+      end
+    end
+  end
+
+end
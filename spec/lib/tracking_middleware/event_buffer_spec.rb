@@ -0,0 +1,39 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe TrackingMiddleware::EventBuffer do
+  subject(:buffer) { described_class.new(flush_interval: 60, batch_size: 100) }
+
+  let(:server) { create(:server) }
+  let(:message) { create_plain_text_message(server, "Hello world!") }
+  let(:request) { double("Request", ip: "127.0.0.1", user_agent: "Test") }
+
+  describe "#flush" do
+    it "writes buffered loads and sets the message's loaded time" do
+      2.times { buffer.add_load(server, message.token, request) }
+      buffer.flush
+      loads = server.message_db.select(:loads, where: { message_id: message.id })
+      expect(loads.size).to eq 2
+      expect(server.message_db.message(message.id).loaded).to_not be nil
+      expect(buffer.size).to eq 0
+    end
+
+    it "ignores loads for messages which do not exist" do
+      buffer.add_load(server, "missing", request)
+      buffer.flush
+      expect(server.message_db.select(:loads, count: true)).to eq 0
+    end
+
+    it "writes buffered clicks and sets the message's clicked time" do
+      token = message.create_link("https://example.com")
+      link = server.message_db.select(:links, where: { token: token }).first
+      buffer.add_click(server, link, request)
+      buffer.flush
+      clicks = server.message_db.select(:clicks, where: { message_id: message.id })
+      expect(clicks.size).to eq 1
+      expect(clicks.first["link_id"]).to eq link["id"]
+      expect(server.message_db.message(message.id).clicked).to_not be nil
+    end
+  end
+end
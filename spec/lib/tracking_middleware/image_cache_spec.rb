@@ -0,0 +1,53 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe TrackingMiddleware::ImageCache do
+  subject(:cache) { described_class.new(max_size: 1000, default_ttl: 60) }
+
+  let(:url) { "https://example.com/logo.png" }
+
+  def response(code, body: "", headers: {})
+    { code: code, body: body, headers: headers.transform_values { |v| [v] }, secure: true }
+  end
+
+  describe "#fetch" do
+    it "fetches the image and returns its headers and body" do
+      allow(Postal::HTTP).to receive(:get).and_return(response(200, body: "image", headers: { "content-type" => "image/png" }))
+      headers, body = cache.fetch(url)
+      expect(body).to eq "image"
+      expect(headers["Content-Type"]).to eq "image/png"
+    end
+
+    it "returns nil if the image cannot be fetched" do
+      allow(Postal::HTTP).to receive(:get).and_return(response(404))
+      expect(cache.fetch(url)).to be nil
+    end
+
+    it "serves fresh images from the cache" do
+      expect(Postal::HTTP).to receive(:get).once.and_return(response(200, body: "image"))
+      cache.fetch(url)
+      expect(cache.fetch(url)[1]).to eq "image"
+    end
+
+    it "revalidates stale images using their etag" do
+      allow(Postal::HTTP).to receive(:get).and_return(response(200, body: "image", headers: { "etag" => "\"abc\"", "cache-control" => "max-age=0" }))
+      cache.fetch(url)
+
+      expect(Postal::HTTP).to receive(:get).with(url, hash_including(headers: { "If-None-Match" => "\"abc\"" })).and_return(response(304))
+      expect(cache.fetch(url)[1]).to eq "image"
+    end
+
+    it "does not cache images served with no-store" do
+      expect(Postal::HTTP).to receive(:get).twice.and_return(response(200, body: "image", headers: { "cache-control" => "no-store" }))
+      2.times { cache.fetch(url) }
+      expect(cache.total_size).to eq 0
+    end
+
+    it "removes the least recently used images when the cache is full" do
+      allow(Postal::HTTP).to receive(:get).and_return(response(200, body: "x" * 90))
+      12.times { |i| cache.fetch("https://example.com/#{i}.png") }
+      expect(cache.total_size).to be <= 1000
+    end
+  end
+end
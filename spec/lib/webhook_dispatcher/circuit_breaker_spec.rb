@@ -0,0 +1,66 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe WebhookDispatcher::CircuitBreaker do
+  subject(:breaker) { described_class.new(threshold: 3, cooldown: 60) }
+
+  let(:endpoint) { "https://example.com/webhook" }
+
+  it "allows requests to endpoints which have not failed" do
+    expect(breaker.allow?(endpoint)).to be true
+  end
+
+  it "allows requests until the threshold of consecutive failures is reached" do
+    2.times { breaker.record(endpoint, success: false) }
+    expect(breaker.allow?(endpoint)).to be true
+    breaker.record(endpoint, success: false)
+    expect(breaker.allow?(endpoint)).to be false
+  end
+
+  it "resets the failure count after a success" do
+    2.times { breaker.record(endpoint, success: false) }
+    breaker.record(endpoint, success: true)
+    2.times { breaker.record(endpoint, success: false) }
+    expect(breaker.allow?(endpoint)).to be true
+  end
+
+  it "does not affect other endpoints" do
+    3.times { breaker.record(endpoint, success: false) }
+    expect(breaker.allow?("https://example.org/webhook")).to be true
+  end
+
+  context "when the circuit is open" do
+    before { 3.times { breaker.record(endpoint, success: false) } }
+
+    it "returns the end of the cooldown as the retry time" do
+      Timecop.freeze do
+        expect(breaker.retry_at(endpoint)).to be_within(1).of(60.seconds.from_now)
+      end
+    end
+
+    it "allows a single trial request once the cooldown has passed" do
+      Timecop.travel(61.seconds.from_now) do
+        expect(breaker.allow?(endpoint)).to be true
+        expect(breaker.allow?(endpoint)).to be false
+      end
+    end
+
+    it "closes the circuit if the trial request succeeds" do
+      Timecop.travel(61.seconds.from_now) do
+        breaker.allow?(endpoint)
+        breaker.record(endpoint, success: true)
+        expect(breaker.allow?(endpoint)).to be true
+        expect(breaker.allow?(endpoint)).to be true
+      end
+    end
+
+    it "re-opens the circuit if the trial request fails" do
+      Timecop.travel(61.seconds.from_now) do
+        breaker.allow?(endpoint)
+        breaker.record(endpoint, success: false)
+        expect(breaker.allow?(endpoint)).to be false
+      end
+    end
+  end
+end
@@ -0,0 +1,92 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe WebhookDispatcher do
+  subject(:dispatcher) do
+    described_class.new(concurrency: 4,
+                        max_concurrency_per_endpoint: 2,
+                        circuit_breaker: circuit_breaker,
+                        connection_pool: connection_pool)
+  end
+
+  let(:circuit_breaker) { WebhookDispatcher::CircuitBreaker.new(threshold: 2, cooldown: 60) }
+  let(:connection_pool) { Postal::HTTP::ConnectionPool.new(idle_timeout: 30, max_idle_per_host: 2) }
+
+  let(:delivered) { Queue.new }
+  let(:success) { true }
+
+  before do
+    allow(WebhookDeliveryService).to receive(:new) do |webhook_request:, http_connection_pool:|
+      service = double("Service", success?: success, attempted?: true)
+      allow(service).to receive(:call) { delivered << [webhook_request, http_connection_pool] }
+      service
+    end
+  end
+
+  def webhook_request(id, url = "https://example.com/webhook")
+    double("WebhookRequest", id: id, url: url)
+  end
+
+  describe "#dispatch" do
+    it "delivers every request using the connection pool" do
+      requests = Array.new(6) { |i| webhook_request(i, "https://example.com/#{i % 2}") }
+      dispatcher.dispatch(requests)
+      results = Array.new(delivered.size) { delivered.pop }
+      expect(results.map(&:first)).to match_array requests
+      expect(results.map(&:last).uniq).to eq [connection_pool]
+    end
+
+    it "does not send more than the maximum number of requests to an endpoint at once" do
+      in_flight = 0
+      max_in_flight = 0
+      mutex = Mutex.new
+      allow(WebhookDeliveryService).to receive(:new) do
+        service = double("Service", success?: true, attempted?: true)
+        allow(service).to receive(:call) do
+          mutex.synchronize { max_in_flight = [max_in_flight, in_flight += 1].max }
+          sleep 0.01
+          mutex.synchronize { in_flight -= 1 }
+        end
+        service
+      end
+      dispatcher.dispatch(Array.new(8) { |i| webhook_request(i) })
+      expect(max_in_flight).to eq 2
+    end
+
+    context "when an endpoint keeps failing" do
+      let(:success) { false }
+
+      it "opens the circuit for the endpoint" do
+        dispatcher.dispatch([webhook_request(1), webhook_request(2)])
+        expect(circuit_breaker.allow?("https://example.com/webhook")).to be false
+      end
+    end
+
+    context "when delivering a request raises an error before it is sent" do
+      before do
+        allow(WebhookDeliveryService).to receive(:new) do
+          service = double("Service", success?: false, attempted?: false)
+          allow(service).to receive(:call).and_raise(ActiveRecord::ConnectionTimeoutError)
+          service
+        end
+      end
+
+      it "does not count the error against the endpoint" do
+        dispatcher.dispatch([webhook_request(1), webhook_request(2), webhook_request(3)])
+        expect(circuit_breaker.allow?("https://example.com/webhook")).to be true
+      end
+    end
+
+    context "when an endpoint's circuit is open" do
+      it "defers its requests without delivering them" do
+        2.times { circuit_breaker.record("https://example.com/webhook", success: false) }
+        request = webhook_request(1)
+        allow(request).to receive(:update_columns)
+        dispatcher.dispatch([request])
+        expect(delivered).to be_empty
+        expect(request).to have_received(:update_columns).with(locked_by: nil, locked_at: nil, retry_after: kind_of(Time))
+      end
+    end
+  end
+end
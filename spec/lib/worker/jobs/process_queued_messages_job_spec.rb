@@ -102,6 +102,119 @@ module Worker
             expect(queued_message.reload.locked?).to be false
           end
         end
+
+        context "when batch claiming is enabled" do
+          before do
+            allow(Postal::Config.postal).to receive(:batch_claim_queued_messages?).and_return(true)
+            allow(Postal::Config.postal).to receive(:batch_claim_queued_messages_limit).and_return(2)
+          end
+
+          [true, false].each do |skip_locked|
+            context "when skip locked support is #{skip_locked}" do
+              before do
+                allow(described_class).to receive(:skip_locked_supported?).and_return(skip_locked)
+              end
+
+              it "claims up to the configured limit of messages" do
+                server = create(:server)
+                queued_messages = 3.times.map { create(:queued_message, server: server, ip_address: nil) }
+                job.call
+                expect(queued_messages[0].reload.locked?).to be true
+                expect(queued_messages[1].reload.locked?).to be true
+                expect(queued_messages[2].reload.locked?).to be false
+                expect(queued_messages[0].locked_by).to match(/\A#{Postal.locker_name} [a-f0-9]{16}\z/)
+              end
+
+              it "claims messages from higher priority servers first" do
+                low = create(:queued_message, server: create(:server, priority: 0), ip_address: nil)
+                high = create(:queued_message, server: create(:server, priority: 10), ip_address: nil)
+                allow(Postal::Config.postal).to receive(:batch_claim_queued_messages_limit).and_return(1)
+                job.call
+                expect(high.reload.locked?).to be true
+                expect(low.reload.locked?).to be false
+              end
+            end
+          end
+
+          it "does not claim messages which are already locked" do
+            queued_message = create(:queued_message, :locked, ip_address: nil)
+            job.call
+            expect(MessageDequeuer).to_not have_received(:process)
+            expect(queued_message.reload.locked_by).to eq "worker1"
+          end
+
+          it "passes messages with the same batch key to the dequeuer together" do
+            server = create(:server)
+            message1 = create(:queued_message, server: server, ip_address: nil, batch_key: "outgoing-example.com")
+            message2 = create(:queued_message, server: server, ip_address: nil, batch_key: "outgoing-example.com")
+            job.call
+            expect(MessageDequeuer).to have_received(:process).once.with(message1, logger: kind_of(Klogger::Logger), batch: [message2])
+          end
+
+          it "passes messages with different batch keys to the dequeuer separately" do
+            server = create(:server)
+            message1 = create(:queued_message, server: server, ip_address: nil, batch_key: "outgoing-example.com")
+            message2 = create(:queued_message, server: server, ip_address: nil, batch_key: "outgoing-example.org")
+            job.call
+            expect(MessageDequeuer).to have_received(:process).with(message1, logger: kind_of(Klogger::Logger), batch: [])
+            expect(MessageDequeuer).to have_received(:process).with(message2, logger: kind_of(Klogger::Logger), batch: [])
+          end
+
+          it "passes messages without a batch key to the dequeuer separately" do
+            server = create(:server)
+            message1 = create(:queued_message, server: server, ip_address: nil, batch_key: nil)
+            message2 = create(:queued_message, server: server, ip_address: nil, batch_key: nil)
+            job.call
+            expect(MessageDequeuer).to have_received(:process).with(message1, logger: kind_of(Klogger::Logger), batch: [])
+            expect(MessageDequeuer).to have_received(:process).with(message2, logger: kind_of(Klogger::Logger), batch: [])
+          end
+
+          context "when fair delivery scheduling is enabled" do
+            let(:scheduler) do
+              DeliveryScheduler.new(max_concurrency_per_destination: 10, max_concurrency_per_ip_address: 50,
+                                    backoff: 5, max_backoff: 300)
+            end
+
+            before do
+              allow(Postal::Config.postal).to receive(:fair_delivery_scheduling?).and_return(true)
+              allow(DeliveryScheduler).to receive(:instance).and_return(scheduler)
+            end
+
+            it "shares the claim between destination domains" do
+              server = create(:server)
+              busy = 3.times.map { create(:queued_message, server: server, ip_address: nil, domain: "busy.example.com") }
+              quiet = create(:queued_message, server: server, ip_address: nil, domain: "quiet.example.com")
+              job.call
+              expect(busy[0].reload.locked?).to be true
+              expect(busy[1].reload.locked?).to be false
+              expect(quiet.reload.locked?).to be true
+            end
+
+            it "does not claim messages for destinations which are backing off" do
+              scheduler.record("example.com", nil, :deferral, 1.0)
+              queued_message = create(:queued_message, ip_address: nil, domain: "example.com")
+              job.call
+              expect(queued_message.reload.locked?).to be false
+            end
+
+            it "claims messages for other destinations when a backlog for a busy destination is larger than the window" do
+              allow(Postal::Config.postal).to receive(:batch_claim_queued_messages_limit).and_return(2)
+              allow(Postal::Config.postal).to receive(:fair_delivery_candidate_multiplier).and_return(2)
+              scheduler.record("busy.example.com", nil, :deferral, 1.0)
+              server = create(:server)
+              5.times { create(:queued_message, server: server, ip_address: nil, domain: "busy.example.com") }
+              quiet = create(:queued_message, server: server, ip_address: nil, domain: "quiet.example.com")
+              job.call
+              expect(quiet.reload.locked?).to be true
+            end
+
+            it "releases claimed messages once they have been processed" do
+              create(:queued_message, ip_address: nil, domain: "example.com")
+              job.call
+              expect(scheduler.destination("example.com").in_flight).to eq 0
+            end
+          end
+        end
       end
     end
 
@@ -55,6 +55,30 @@ module Worker
           expect(job.work_completed?).to be false
         end
       end
+
+      context "when concurrent webhook delivery is enabled" do
+        let(:dispatcher) { instance_double(WebhookDispatcher, dispatch: nil) }
+
+        before do
+          allow(Postal::Config.postal).to receive(:concurrent_webhook_delivery?).and_return(true)
+          allow(Postal::Config.postal).to receive(:webhook_delivery_batch_size).and_return(2)
+          allow(WebhookDispatcher).to receive(:instance).and_return(dispatcher)
+        end
+
+        it "does nothing when there are no requests to process" do
+          job.call
+          expect(dispatcher).not_to have_received(:dispatch)
+          expect(job.work_completed?).to be false
+        end
+
+        it "dispatches a batch of ready requests" do
+          requests = create_list(:webhook_request, 3)
+          create(:webhook_request, retry_after: 1.minute.from_now)
+          job.call
+          expect(dispatcher).to have_received(:dispatch).with(requests.first(2))
+          expect(job.work_completed?).to be true
+        end
+      end
     end
 
   end
@@ -304,17 +304,46 @@ describe Domain do
         allow(Postal::Config.postal).to receive(:use_local_ns_for_domain_verification?).and_return(true)
       end
 
-      it "uses the local DNS" do
-        expect(domain.resolver).to eq DNSResolver.local
+      it "uses the local DNS without the process-wide cache" do
+        expect(domain.resolver.nameservers).to eq DNSResolver.local.nameservers
+        expect(domain.resolver.instance_variable_get(:@cache)).to be nil
       end
     end
 
     context "when local nameservers should not be used" do
       it "uses the a resolver for this domain" do
-        allow(DNSResolver).to receive(:for_domain).with(domain.name).and_return(DNSResolver.new(["1.2.3.4"]))
+        allow(DNSResolver).to receive(:for_domain).with(domain.name, cache: nil).and_return(DNSResolver.new(["1.2.3.4"]))
         expect(domain.resolver).to be_a DNSResolver
         expect(domain.resolver.nameservers).to eq ["1.2.3.4"]
       end
+
+      it "uses the domain's DNS cache if one has been set" do
+        cache = DNSResolver::Cache.new(max_entries: 100, negative_ttl: 60, max_ttl: 3600)
+        domain.dns_cache = cache
+        allow(DNSResolver).to receive(:for_domain).with(domain.name, cache: cache).and_return(DNSResolver.new(["1.2.3.4"], cache: cache))
+        expect(domain.resolver.nameservers).to eq ["1.2.3.4"]
+      end
+    end
+  end
+
+  describe "#check_dns" do
+    let(:domain) { create(:domain) }
+
+    it "sees records which have changed since an earlier check" do
+      allow(Postal::Config.dns).to receive(:cache_enabled?).and_return(true)
+      txt_records = []
+      allow_any_instance_of(Resolv::DNS).to receive(:getresources) do |_dns, name, type|
+        next [] unless type == Resolv::DNS::Resource::IN::TXT && name == domain.name
+
+        txt_records.map { |data| Resolv::DNS::Resource::IN::TXT.new(data) }
+      end
+
+      domain.check_dns(:manual)
+      expect(domain.spf_status).to eq "Missing"
+
+      txt_records << "v=spf1 include:#{Postal::Config.dns.spf_include} ~all"
+      domain.check_dns(:manual)
+      expect(domain.spf_status).to eq "OK"
     end
   end
 
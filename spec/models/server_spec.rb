@@ -6,6 +6,7 @@
 #
 #  id                                 :integer          not null, primary key
 #  allow_sender                       :boolean          default(FALSE)
+#  compress_raw_messages              :boolean          default(FALSE)
 #  deleted_at                         :datetime
 #  domains_not_to_click_track         :text(65535)
 #  log_smtp_data                      :boolean          default(FALSE)
@@ -338,6 +339,57 @@ describe Server do
     end
   end
 
+  describe "#record_send_limit_status" do
+    let(:server) { create(:server, send_limit: 1000) }
+
+    context "when the limit is exceeded" do
+      it "sets the exceeded time and clears the approaching time" do
+        server.update_columns(send_limit_approaching_at: 5.minutes.ago)
+        server.record_send_limit_status(:exceeded)
+        server.reload
+        expect(server.send_limit_exceeded_at).to be_within(1.second).of(Time.now)
+        expect(server.send_limit_approaching_at).to be_nil
+      end
+
+      it "does not update the server if the exceeded time was recorded in the last minute" do
+        server.update_columns(send_limit_exceeded_at: 30.seconds.ago)
+        expect(server).to_not receive(:update_columns)
+        server.record_send_limit_status(:exceeded)
+      end
+
+      it "updates the exceeded time if it was recorded more than a minute ago" do
+        server.update_columns(send_limit_exceeded_at: 2.minutes.ago)
+        server.record_send_limit_status(:exceeded)
+        expect(server.reload.send_limit_exceeded_at).to be_within(1.second).of(Time.now)
+      end
+    end
+
+    context "when the limit is being approached" do
+      it "sets the approaching time and clears the exceeded time" do
+        server.update_columns(send_limit_exceeded_at: 5.minutes.ago)
+        server.record_send_limit_status(:approaching)
+        server.reload
+        expect(server.send_limit_approaching_at).to be_within(1.second).of(Time.now)
+        expect(server.send_limit_exceeded_at).to be_nil
+      end
+    end
+
+    context "when the limit is not being approached or exceeded" do
+      it "does not update the server if nothing is set" do
+        expect(server).to_not receive(:update_columns)
+        server.record_send_limit_status(nil)
+      end
+
+      it "clears both times" do
+        server.update_columns(send_limit_exceeded_at: 5.minutes.ago, send_limit_approaching_at: 5.minutes.ago)
+        server.record_send_limit_status(nil)
+        server.reload
+        expect(server.send_limit_exceeded_at).to be_nil
+        expect(server.send_limit_approaching_at).to be_nil
+      end
+    end
+  end
+
   describe "#send_limit_warning" do
     let(:server) { create(:server, send_limit: 1000) }
 
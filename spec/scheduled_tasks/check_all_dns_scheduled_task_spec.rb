@@ -0,0 +1,78 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe CheckAllDNSScheduledTask do
+  let(:logger) { TestLogger.new }
+  let(:resolver) { DNSResolver.new(["1.2.3.4"]) }
+
+  subject(:task) { described_class.new(logger: logger) }
+
+  before do
+    allow(Postal::Config.dns).to receive(:check_concurrency).and_return(2)
+    allow(Postal::Config.dns).to receive(:check_batch_size).and_return(2)
+    allow(DNSResolver).to receive(:for_domain).and_return(resolver)
+    allow(resolver).to receive(:txt).and_return([])
+    allow(resolver).to receive(:cname).and_return([])
+    allow(resolver).to receive(:mx).and_return([])
+  end
+
+  describe "#call" do
+    it "checks and saves the DNS records of domains which were last checked over an hour ago" do
+      domains = Array.new(3) { create(:domain, dns_checked_at: 2.hours.ago) }
+      allow(resolver).to receive(:txt).with(domains[1].name).and_return(["v=spf1 include:#{Postal::Config.dns.spf_include} ~all"])
+      task.call
+      expect(domains.map { |d| d.reload.spf_status }).to eq %w[Missing OK Missing]
+      expect(domains.map(&:dns_checked_at)).to all be > 1.minute.ago
+      expect(logger).to have_logged(/checked DNS for domain: #{domains[1].name}/)
+    end
+
+    it "does not check domains which have never been checked or were checked recently" do
+      never_checked = create(:domain, dns_checked_at: nil)
+      recently_checked = create(:domain, dns_checked_at: 10.minutes.ago)
+      task.call
+      expect(never_checked.reload.spf_status).to be nil
+      expect(recently_checked.reload.spf_status).to be nil
+    end
+
+    it "checks track domains" do
+      track_domain = create(:track_domain, dns_checked_at: nil, dns_status: "Missing")
+      allow(resolver).to receive(:cname).with(track_domain.full_name).and_return([Postal::Config.dns.track_domain])
+      task.call
+      expect(track_domain.reload.dns_status).to eq "OK"
+      expect(track_domain.dns_checked_at).to be_present
+    end
+
+    it "shares a DNS cache between all the domains in a run" do
+      domains = Array.new(2) { create(:domain, dns_checked_at: 2.hours.ago) }
+      caches = []
+      allow(DNSResolver).to receive(:for_domain) do |_name, cache:|
+        caches << cache
+        resolver
+      end
+      task.call
+      expect(caches.size).to eq 2
+      expect(caches.uniq.size).to eq 1
+      expect(caches.first).to be_a DNSResolver::Cache
+      expect(domains.map { |d| d.reload.mx_status }).to eq %w[Missing Missing]
+    end
+
+    it "triggers a webhook for server domains with problems" do
+      server = create(:server)
+      domain = create(:domain, owner: server, dns_checked_at: 2.hours.ago)
+      allow(WebhookRequest).to receive(:trigger)
+      task.call
+      expect(WebhookRequest).to have_received(:trigger).with(server, "DomainDNSError", hash_including(domain: domain.name))
+    end
+
+    it "saves the results for other domains and raises the first error" do
+      good_domain = create(:domain, dns_checked_at: 2.hours.ago)
+      bad_domain = create(:domain, dns_checked_at: 2.hours.ago)
+      allow(resolver).to receive(:mx).with(bad_domain.name).and_raise(Resolv::ResolvError, "broken")
+      expect { task.call }.to raise_error(Resolv::ResolvError, "broken")
+      expect(good_domain.reload.mx_status).to eq "Missing"
+      expect(bad_domain.reload.mx_status).to be nil
+      expect(logger).to have_logged(/error checking DNS for domain: #{bad_domain.name}/)
+    end
+  end
+end
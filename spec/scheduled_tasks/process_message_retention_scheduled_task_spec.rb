@@ -0,0 +1,65 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe ProcessMessageRetentionScheduledTask do
+  let(:logger) { TestLogger.new }
+  let(:server) { create(:server, message_retention_days: 30) }
+
+  subject(:task) { described_class.new(logger: logger) }
+
+  before do
+    allow(Postal::Config.postal).to receive(:message_retention_chunk_size).and_return(2)
+    allow(Postal::Config.postal).to receive(:message_retention_rows_per_second).and_return(0)
+  end
+
+  def create_message(age)
+    message = create_plain_text_message(server, "Hello world!")
+    message.update(timestamp: age.ago.to_f)
+    message
+  end
+
+  describe "#call" do
+    it "removes messages older than the retention period" do
+      old_messages = 5.times.map { create_message(40.days) }
+      new_message = create_message(1.day)
+      task.call
+      remaining_ids = server.message_db.select(:messages, fields: [:id]).map { |m| m["id"] }
+      expect(remaining_ids).to eq [new_message.id]
+      expect(old_messages.map(&:id) & remaining_ids).to be_empty
+      expect(logger).to have_logged(/Tidying messages for #{server.permalink}/)
+    end
+
+    it "skips servers which were completed by an earlier, interrupted run" do
+      create_message(40.days)
+      ScheduledTask.create!(name: described_class.name, next_run_after: 1.hour.ago,
+                            checkpoint: { "date" => Time.now.utc.to_date.iso8601, "completed_server_ids" => [server.id], "last_message_ids" => {} })
+      task.call
+      expect(server.message_db.select(:messages, count: true)).to eq 1
+    end
+
+    it "continues after the last message removed by an earlier, interrupted run" do
+      old_messages = 3.times.map { create_message(40.days) }
+      ScheduledTask.create!(name: described_class.name, next_run_after: 1.hour.ago,
+                            checkpoint: { "date" => Time.now.utc.to_date.iso8601, "completed_server_ids" => [], "last_message_ids" => { server.id => old_messages[1].id } })
+      task.call
+      expect(server.message_db.select(:messages, fields: [:id]).map { |m| m["id"] }).to eq old_messages.first(2).map(&:id)
+      expect(logger).to have_logged(/Resuming after message #{old_messages[1].id}/)
+    end
+
+    it "ignores checkpoints left by a run on an earlier day" do
+      create_message(40.days)
+      ScheduledTask.create!(name: described_class.name, next_run_after: 1.hour.ago,
+                            checkpoint: { "date" => 1.day.ago.utc.to_date.iso8601, "completed_server_ids" => [server.id], "last_message_ids" => {} })
+      task.call
+      expect(server.message_db.select(:messages, count: true)).to eq 0
+    end
+
+    it "clears the checkpoint once all servers have been tidied" do
+      scheduled_task = ScheduledTask.create!(name: described_class.name, next_run_after: 1.hour.ago)
+      create_message(40.days)
+      task.call
+      expect(scheduled_task.reload.checkpoint).to be_blank
+    end
+  end
+end
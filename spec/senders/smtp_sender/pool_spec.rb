@@ -0,0 +1,116 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe SMTPSender::Pool do
+  subject(:pool) do
+    described_class.new(max_connections_per_destination: 2,
+                        max_messages_per_session: 10,
+                        idle_timeout: 30)
+  end
+
+  let(:key) { ["example.com", nil] }
+
+  def build_sender(connected: true, messages_sent: 0, reset: true)
+    instance_double(SMTPSender, connected?: connected, messages_sent: messages_sent, reset: reset, finish: nil)
+  end
+
+  describe "#checkout" do
+    it "creates a new sender when there are no idle senders" do
+      sender = build_sender
+      expect(pool.checkout(key) { sender }).to be sender
+      expect(pool.open_count(key)).to eq 1
+    end
+
+    it "returns an idle sender after resetting it" do
+      sender = build_sender
+      pool.checkin(key, pool.checkout(key) { sender })
+      expect(pool.checkout(key) { build_sender }).to be sender
+      expect(sender).to have_received(:reset)
+      expect(pool.open_count(key)).to eq 1
+    end
+
+    it "closes an idle sender which cannot be reset and creates a new one" do
+      sender = build_sender(reset: false)
+      pool.checkin(key, pool.checkout(key) { sender })
+      new_sender = build_sender
+      expect(pool.checkout(key) { new_sender }).to be new_sender
+      expect(sender).to have_received(:finish)
+      expect(pool.open_count(key)).to eq 1
+    end
+
+    it "does not return senders which have been idle for longer than the idle timeout" do
+      sender = build_sender
+      pool.checkin(key, pool.checkout(key) { sender })
+      allow(pool).to receive(:now).and_return(Process.clock_gettime(Process::CLOCK_MONOTONIC) + 31)
+      new_sender = build_sender
+      expect(pool.checkout(key) { new_sender }).to be new_sender
+      expect(sender).to have_received(:finish)
+    end
+
+    it "does not share senders between keys" do
+      sender = build_sender
+      pool.checkin(key, pool.checkout(key) { sender })
+      other_sender = build_sender
+      expect(pool.checkout(["example.org", nil]) { other_sender }).to be other_sender
+    end
+
+    it "raises an error without waiting when the connection limit is reached" do
+      pool.checkout(key) { build_sender }
+      pool.checkout(key) { build_sender }
+      expect { pool.checkout(key) { build_sender } }.to raise_error(described_class::ConnectionLimitReachedError)
+      expect(pool.open_count(key)).to eq 2
+    end
+
+    it "returns a sender which has been checked in once the connection limit has been reached" do
+      sender = pool.checkout(key) { build_sender }
+      pool.checkout(key) { build_sender }
+      pool.checkin(key, sender)
+      expect(pool.checkout(key) { build_sender }).to be sender
+    end
+
+    it "releases the slot if creating the sender fails" do
+      expect { pool.checkout(key) { raise "failed" } }.to raise_error("failed")
+      expect(pool.open_count(key)).to eq 0
+    end
+  end
+
+  describe "#checkin" do
+    it "closes senders which are not connected" do
+      sender = build_sender(connected: false)
+      pool.checkin(key, pool.checkout(key) { sender })
+      expect(sender).to have_received(:finish)
+      expect(pool.idle_count).to eq 0
+      expect(pool.open_count(key)).to eq 0
+    end
+
+    it "closes senders which have reached the maximum number of messages" do
+      sender = build_sender(messages_sent: 10)
+      pool.checkin(key, pool.checkout(key) { sender })
+      expect(sender).to have_received(:finish)
+      expect(pool.idle_count).to eq 0
+    end
+  end
+
+  describe "#reap" do
+    it "closes senders which have been idle for longer than the idle timeout" do
+      sender = build_sender
+      pool.checkin(key, pool.checkout(key) { sender })
+      expect(pool.reap).to eq 0
+      allow(pool).to receive(:now).and_return(Process.clock_gettime(Process::CLOCK_MONOTONIC) + 31)
+      expect(pool.reap).to eq 1
+      expect(sender).to have_received(:finish)
+      expect(pool.open_count(key)).to eq 0
+    end
+  end
+
+  describe "#shutdown" do
+    it "closes all idle senders" do
+      sender = build_sender
+      pool.checkin(key, pool.checkout(key) { sender })
+      pool.shutdown
+      expect(sender).to have_received(:finish)
+      expect(pool.idle_count).to eq 0
+    end
+  end
+end
@@ -117,4 +117,17 @@ RSpec.describe WebhookDeliveryService do
       end
     end
   end
+
+  describe "#attempted?" do
+    it "is false before the request has been sent" do
+      expect(service.attempted?).to be false
+    end
+
+    it "is true once a response has been received even if it was not successful" do
+      stub_request(:post, webhook.url).to_return(status: 500, body: "internal server error!")
+      service.call
+      expect(service.attempted?).to be true
+      expect(service.success?).to be false
+    end
+  end
 end
@@ -0,0 +1,45 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe HasPrometheusMetrics do
+  subject(:component) do
+    Class.new do
+      include HasPrometheusMetrics
+    end.new
+  end
+
+  let(:registry) { Prometheus::Client::Registry.new }
+
+  before do
+    allow(Prometheus::Client).to receive(:registry).and_return(registry)
+  end
+
+  after do
+    described_class.preset_labels = {}
+  end
+
+  context "when there are no preset labels" do
+    it "registers metrics with only their own labels" do
+      component.register_prometheus_counter :test_counter, docstring: "Test", labels: [:status]
+      expect(registry.get(:test_counter).labels).to eq [:status]
+    end
+  end
+
+  context "when there are preset labels" do
+    before do
+      described_class.preset_labels = { worker: "2" }
+    end
+
+    it "adds the preset labels to each metric" do
+      component.register_prometheus_counter :test_counter, docstring: "Test", labels: [:status]
+      expect(registry.get(:test_counter).labels).to eq [:status, :worker]
+    end
+
+    it "includes the preset label values when metrics are updated" do
+      component.register_prometheus_counter :test_counter, docstring: "Test", labels: [:status]
+      component.increment_prometheus_counter :test_counter, labels: { status: "ok" }
+      expect(registry.get(:test_counter).values).to eq({ { status: "ok", worker: "2" } => 1.0 })
+    end
+  end
+end
@@ -0,0 +1,88 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe LRUCache do
+  subject(:cache) { described_class.new(max_size: 2, ttl: 60) }
+
+  def later(seconds)
+    allow(cache).to receive(:now).and_return(Process.clock_gettime(Process::CLOCK_MONOTONIC) + seconds)
+  end
+
+  describe "#fetch" do
+    it "calls the block and returns the result when the key is not cached" do
+      expect(cache.fetch(:a) { 1 }).to eq 1
+    end
+
+    it "returns the cached value without calling the block again" do
+      cache.fetch(:a) { 1 }
+      expect { |b| cache.fetch(:a, &b) }.to_not yield_control
+      expect(cache.fetch(:a) { 2 }).to eq 1
+    end
+
+    it "caches nil and false" do
+      cache.fetch(:a) { nil }
+      cache.fetch(:b) { false }
+      expect(cache.fetch(:a) { 1 }).to be nil
+      expect(cache.fetch(:b) { 1 }).to be false
+    end
+
+    it "calls the block again once the TTL has expired" do
+      cache.fetch(:a) { 1 }
+      later(61)
+      expect(cache.fetch(:a) { 2 }).to eq 2
+    end
+
+    it "uses the TTL given for the value" do
+      cache.fetch(:a, ttl: 300) { 1 }
+      later(61)
+      expect(cache.fetch(:a) { 2 }).to eq 1
+    end
+
+    it "does not cache errors" do
+      expect { cache.fetch(:a) { raise "broken" } }.to raise_error("broken")
+      expect(cache.fetch(:a) { 1 }).to eq 1
+    end
+  end
+
+  describe "#write" do
+    it "evicts the least recently used entry when full" do
+      evicted = []
+      cache = described_class.new(max_size: 2, on_evict: ->(key) { evicted << key })
+      cache.write(:a, 1)
+      cache.write(:b, 2)
+      cache.read(:a)
+      cache.write(:c, 3)
+      expect(cache.size).to eq 2
+      expect(cache.lookup(:b)).to eq [false, nil]
+      expect(cache.read(:a)).to eq 1
+      expect(evicted).to eq [:b]
+    end
+
+    it "keeps entries without a TTL until they are evicted" do
+      cache = described_class.new(max_size: 2)
+      cache.write(:a, 1)
+      allow(cache).to receive(:now).and_return(Process.clock_gettime(Process::CLOCK_MONOTONIC) + 86_400)
+      expect(cache.read(:a)).to eq 1
+    end
+
+    it "does not store values with a TTL of zero" do
+      cache.write(:a, 1, ttl: 0)
+      expect(cache.size).to eq 0
+    end
+
+    it "does not store anything when the maximum size is zero" do
+      cache = described_class.new(max_size: 0)
+      cache.write(:a, 1)
+      expect(cache.size).to eq 0
+    end
+  end
+
+  describe "#delete" do
+    it "removes the entry" do
+      cache.write(:a, 1)
+      cache.delete(:a)
+      expect(cache.lookup(:a)).to eq [false, nil]
+    end
+  end
+end
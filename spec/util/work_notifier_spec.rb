@@ -0,0 +1,51 @@
+# frozen_string_literal: true
+
+require "rails_helper"
+
+RSpec.describe WorkNotifier do
+  before do
+    allow(Postal::Config.worker).to receive(:wakeup_notification_address).and_return("127.0.0.1")
+    allow(Postal::Config.worker).to receive(:wakeup_notification_port).and_return(29_095)
+  end
+
+  describe ".notify" do
+    context "when notifications are disabled" do
+      before do
+        allow(Postal::Config.worker).to receive(:wakeup_notifications_enabled?).and_return(false)
+      end
+
+      it "returns false" do
+        expect(described_class.notify).to be false
+      end
+    end
+
+    context "when notifications are enabled" do
+      before do
+        allow(Postal::Config.worker).to receive(:wakeup_notifications_enabled?).and_return(true)
+      end
+
+      it "sends a notification which can be received by a listener" do
+        socket = described_class.open_listener_socket
+        expect(described_class.notify).to be true
+        expect(socket.wait_readable(1)).to be_truthy
+        expect(described_class.drain(socket)).to eq 1
+      ensure
+        socket&.close
+      end
+
+      it "is sent when a queued message is created" do
+        expect(described_class).to receive(:notify).at_least(:once)
+        create(:queued_message)
+      end
+    end
+  end
+
+  describe ".drain" do
+    it "returns zero when nothing is waiting" do
+      socket = described_class.open_listener_socket
+      expect(described_class.drain(socket)).to eq 0
+    ensure
+      socket&.close
+    end
+  end
+end